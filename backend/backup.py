@@ -0,0 +1,545 @@
+"""
+增量备份模块
+使用SQLite在线备份API生成数据库快照，文件内容按哈希去重存储，支持按时间点还原
+
+备份目录结构（BACKUP_PATH）：
+    catalog.db                  备份目录（快照、文件清单、已备份内容）
+    snapshots/<快照ID>.db.gz    数据库快照
+    objects/<哈希前2位>/<哈希>  文件内容（相同内容只存一份）
+
+每次备份以数据库快照中的files表为准逐条比对，只复制新增或变化的内容，不需要遍历整个存储目录。
+已分块存储的文件（见chunkstore.py）按拼接后的完整内容备份，还原到原路径后为普通文件。
+
+用法：
+    python backup.py run                        # 执行一次备份
+    python backup.py list                       # 列出快照
+    python backup.py restore 20240101_030000    # 还原数据库和文件
+    python backup.py restore 20240101_030000 --files-target /mnt/restore --db-target /tmp/restore.db
+
+还原到其他位置（--files-target）时，只配置了默认卷的文件还原到 <目标目录>/<用户ID>/...；
+配置了多个存储卷时每个卷还原到 <目标目录>/<卷名>/<用户ID>/...，不会写入任何卷的原路径。
+"""
+
+import gzip
+import hashlib
+import os
+import shutil
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from models import engine
+from config import settings
+from maintenance import scheduler
+from chunkstore import ChunkStore, ChunkedFile, read_manifest
+from volumes import volumes
+
+
+# 每批处理的记录数
+BATCH_SIZE = 500
+
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id TEXT PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    file_count INTEGER DEFAULT 0,
+    total_bytes INTEGER DEFAULT 0,
+    new_blobs INTEGER DEFAULT 0,
+    new_bytes INTEGER DEFAULT 0,
+    missing_files INTEGER DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS snapshot_files (
+    snapshot_id TEXT NOT NULL,
+    file_id INTEGER NOT NULL,
+    owner_id INTEGER NOT NULL,
+    file_path TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_snapshot_files_snapshot ON snapshot_files(snapshot_id);
+CREATE INDEX IF NOT EXISTS idx_snapshot_files_hash ON snapshot_files(hash);
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS file_state (
+    file_id INTEGER PRIMARY KEY,
+    file_path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    hash TEXT NOT NULL
+);
+"""
+
+
+def get_sqlite_path() -> Path:
+    """获取当前SQLite数据库文件路径"""
+    if engine.url.get_backend_name() != "sqlite" or not engine.url.database:
+        raise ValueError("增量备份目前只支持SQLite数据库")
+    return Path(engine.url.database).resolve()
+
+
+class BackupEngine:
+    """增量备份引擎"""
+    
+    def __init__(self, backup_root: Optional[str] = None):
+        self.root = Path(backup_root or settings.BACKUP_PATH)
+        self.objects_dir = self.root / "objects"
+        self.snapshots_dir = self.root / "snapshots"
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.snapshots_dir.mkdir(parents=True, exist_ok=True)
+        
+        self.catalog = sqlite3.connect(str(self.root / "catalog.db"))
+        self.catalog.executescript(CATALOG_SCHEMA)
+    
+    def close(self):
+        self.catalog.close()
+    
+    def blob_path(self, content_hash: str) -> Path:
+        """获取内容对象的存储路径"""
+        return self.objects_dir / content_hash[:2] / content_hash
+    
+    # ==================== 备份 ====================
+    
+    def snapshot_database(self, snapshot_id: str) -> Path:
+        """
+        使用SQLite在线备份API生成数据库快照
+        
+        在线备份按页复制并在批次间让出锁，不会像cp那样复制到写入一半的文件。
+        
+        Args:
+            snapshot_id: 快照ID
+        
+        Returns:
+            未压缩的快照文件路径
+        """
+        db_path = get_sqlite_path()
+        snapshot_path = self.snapshots_dir / f"{snapshot_id}.db"
+        
+        source = sqlite3.connect(str(db_path))
+        target = sqlite3.connect(str(snapshot_path))
+        try:
+            source.backup(target, pages=1024, sleep=0.05)
+        finally:
+            target.close()
+            source.close()
+        
+        return snapshot_path
+    
+    def _store_blob(self, source: Path, is_chunked: bool = False) -> tuple:
+        """
+        复制文件内容到对象目录（边复制边计算哈希）
+        
+        Returns:
+            (哈希, 大小, 是否为新对象)
+        """
+        tmp_path = self.objects_dir / f".tmp-{os.getpid()}"
+        md5_hash = hashlib.md5()
+        size = 0
+        
+        with _open_source(source, is_chunked) as src, open(tmp_path, "wb") as dst:
+            while chunk := src.read(1024 * 1024):
+                md5_hash.update(chunk)
+                dst.write(chunk)
+                size += len(chunk)
+        
+        content_hash = md5_hash.hexdigest()
+        blob_path = self.blob_path(content_hash)
+        
+        if blob_path.exists():
+            tmp_path.unlink()
+            return content_hash, size, False
+        
+        blob_path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(tmp_path, blob_path)
+        return content_hash, size, True
+    
+    def _blob_size(self, content_hash: Optional[str]) -> Optional[int]:
+        if not content_hash:
+            return None
+        row = self.catalog.execute("SELECT size FROM blobs WHERE hash = ?", (content_hash,)).fetchone()
+        return row[0] if row else None
+    
+    def _new_snapshot_id(self) -> str:
+        """生成快照ID（按时间命名，同一秒内多次备份时追加序号）"""
+        base_id = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
+        snapshot_id = base_id
+        counter = 1
+        while self.catalog.execute("SELECT 1 FROM snapshots WHERE id = ?", (snapshot_id,)).fetchone():
+            snapshot_id = f"{base_id}_{counter}"
+            counter += 1
+        return snapshot_id
+    
+    def run(self) -> dict:
+        """
+        执行一次增量备份
+        
+        Returns:
+            统计信息
+        """
+        snapshot_id = self._new_snapshot_id()
+        snapshot_path = self.snapshot_database(snapshot_id)
+        
+        stats = {
+            "snapshot_id": snapshot_id,
+            "file_count": 0,
+            "total_bytes": 0,
+            "new_blobs": 0,
+            "new_bytes": 0,
+            "missing_files": 0,
+        }
+        
+        # 以快照中的files表为准，保证文件清单与数据库快照是同一时间点
+        snapshot_db = sqlite3.connect(str(snapshot_path))
+        try:
+            # 升级前的数据库没有is_chunked列
+            columns = {row[1] for row in snapshot_db.execute("PRAGMA table_info(files)")}
+            chunked_column = "is_chunked" if "is_chunked" in columns else "0"
+            last_id = 0
+            while True:
+                rows = snapshot_db.execute(
+                    f"SELECT id, owner_id, file_path, size, md5_hash, {chunked_column} FROM files "
+                    "WHERE id > ? AND is_folder = 0 ORDER BY id LIMIT ?",
+                    (last_id, BATCH_SIZE)
+                ).fetchall()
+                if not rows:
+                    break
+                self._backup_rows(snapshot_id, rows, stats)
+                last_id = rows[-1][0]
+                self.catalog.commit()
+        finally:
+            snapshot_db.close()
+        
+        # 压缩数据库快照
+        with open(snapshot_path, "rb") as src, gzip.open(f"{snapshot_path}.gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        snapshot_path.unlink()
+        
+        self.catalog.execute(
+            "INSERT INTO snapshots (id, created_at, file_count, total_bytes, new_blobs, new_bytes, missing_files) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (snapshot_id, datetime.utcnow().isoformat(), stats["file_count"], stats["total_bytes"],
+             stats["new_blobs"], stats["new_bytes"], stats["missing_files"])
+        )
+        self.catalog.commit()
+        
+        stats["pruned_snapshots"] = self.prune(settings.BACKUP_KEEP_SNAPSHOTS)
+        return stats
+    
+    def _backup_rows(self, snapshot_id: str, rows: List[tuple], stats: dict):
+        """备份一批文件记录"""
+        now = datetime.utcnow().isoformat()
+        manifest = []
+        
+        for file_id, owner_id, file_path, size, md5_hash, is_chunked in rows:
+            path = Path(file_path)
+            try:
+                stat = path.stat()
+            except OSError:
+                stats["missing_files"] += 1
+                continue
+            
+            # 已分块文件磁盘上只有清单，内容大小以记录为准
+            content_size = size if is_chunked else stat.st_size
+            
+            state = self.catalog.execute(
+                "SELECT file_path, size, mtime_ns, hash FROM file_state WHERE file_id = ?", (file_id,)
+            ).fetchone()
+            
+            content_hash = None
+            if state and state[0] == file_path and state[1] == stat.st_size and state[2] == stat.st_mtime_ns:
+                # 自上次备份以来未变化
+                content_hash = state[3]
+            elif not state and self._blob_size(md5_hash) == content_size:
+                # 新记录，但相同内容已备份过（去重）
+                content_hash = md5_hash
+            
+            if content_hash is None or not self.blob_path(content_hash).exists():
+                try:
+                    content_hash, stored_size, is_new = self._store_blob(path, bool(is_chunked))
+                except OSError as e:
+                    print(f"[BACKUP] 复制文件失败 {path}: {e}")
+                    stats["missing_files"] += 1
+                    continue
+                if is_new:
+                    stats["new_blobs"] += 1
+                    stats["new_bytes"] += stored_size
+                self.catalog.execute(
+                    "INSERT OR IGNORE INTO blobs (hash, size, created_at) VALUES (?, ?, ?)",
+                    (content_hash, stored_size, now)
+                )
+            
+            self.catalog.execute(
+                "INSERT OR REPLACE INTO file_state (file_id, file_path, size, mtime_ns, hash) VALUES (?, ?, ?, ?, ?)",
+                (file_id, file_path, stat.st_size, stat.st_mtime_ns, content_hash)
+            )
+            manifest.append((snapshot_id, file_id, owner_id, file_path, content_hash, content_size))
+            stats["file_count"] += 1
+            stats["total_bytes"] += content_size
+        
+        self.catalog.executemany(
+            "INSERT INTO snapshot_files (snapshot_id, file_id, owner_id, file_path, hash, size) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            manifest
+        )
+    
+    # ==================== 快照管理 ====================
+    
+    def list_snapshots(self) -> List[Dict]:
+        """列出所有快照（新的在前）"""
+        rows = self.catalog.execute(
+            "SELECT id, created_at, file_count, total_bytes, new_blobs, new_bytes, missing_files "
+            "FROM snapshots ORDER BY id DESC"
+        ).fetchall()
+        keys = ("id", "created_at", "file_count", "total_bytes", "new_blobs", "new_bytes", "missing_files")
+        return [dict(zip(keys, row)) for row in rows]
+    
+    def prune(self, keep: int) -> int:
+        """
+        删除旧快照，并回收不再被任何快照引用的内容对象
+        
+        Args:
+            keep: 保留的快照数
+        
+        Returns:
+            删除的快照数
+        """
+        old_ids = [
+            row[0] for row in self.catalog.execute(
+                "SELECT id FROM snapshots ORDER BY id DESC LIMIT -1 OFFSET ?", (keep,)
+            ).fetchall()
+        ]
+        
+        for snapshot_id in old_ids:
+            self.catalog.execute("DELETE FROM snapshot_files WHERE snapshot_id = ?", (snapshot_id,))
+            self.catalog.execute("DELETE FROM snapshots WHERE id = ?", (snapshot_id,))
+            (self.snapshots_dir / f"{snapshot_id}.db.gz").unlink(missing_ok=True)
+        self.catalog.commit()
+        
+        if old_ids:
+            self._collect_garbage()
+        
+        return len(old_ids)
+    
+    def _collect_garbage(self):
+        """删除不再被引用的内容对象"""
+        while True:
+            rows = self.catalog.execute(
+                "SELECT hash FROM blobs WHERE NOT EXISTS "
+                "(SELECT 1 FROM snapshot_files WHERE snapshot_files.hash = blobs.hash) LIMIT ?",
+                (BATCH_SIZE,)
+            ).fetchall()
+            if not rows:
+                break
+            for (content_hash,) in rows:
+                self.blob_path(content_hash).unlink(missing_ok=True)
+            self.catalog.executemany("DELETE FROM blobs WHERE hash = ?", rows)
+            self.catalog.executemany("DELETE FROM file_state WHERE hash = ?", rows)
+            self.catalog.commit()
+    
+    # ==================== 还原 ====================
+    
+    def restore(
+        self,
+        snapshot_id: str,
+        db_target: Optional[str] = None,
+        files_target: Optional[str] = None,
+        restore_db: bool = True,
+        restore_files: bool = True,
+        owner_id: Optional[int] = None
+    ) -> dict:
+        """
+        还原到指定快照的时间点
+        
+        Args:
+            snapshot_id: 快照ID
+            db_target: 数据库还原位置（默认覆盖当前数据库，需先停止服务）
+            files_target: 文件还原根目录（默认还原到原路径；指定时见_restore_destination）
+            restore_db: 是否还原数据库
+            restore_files: 是否还原文件
+            owner_id: 只还原指定用户的文件
+        
+        Returns:
+            统计信息
+        """
+        snapshot = self.catalog.execute("SELECT id FROM snapshots WHERE id = ?", (snapshot_id,)).fetchone()
+        if not snapshot:
+            raise ValueError(f"快照不存在: {snapshot_id}")
+        
+        stats = {"database": None, "files_restored": 0, "files_unchanged": 0, "files_missing_blob": 0,
+                 "files_outside_volumes": 0}
+        
+        if restore_db:
+            target = Path(db_target) if db_target else get_sqlite_path()
+            tmp_target = target.with_name(f".{target.name}.restoring")
+            with gzip.open(self.snapshots_dir / f"{snapshot_id}.db.gz", "rb") as src, open(tmp_target, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.replace(tmp_target, target)
+            stats["database"] = str(target)
+        
+        if restore_files:
+            query = "SELECT rowid, file_path, hash, size FROM snapshot_files WHERE snapshot_id = ? AND rowid > ?"
+            params: list = [snapshot_id]
+            if owner_id is not None:
+                query += " AND owner_id = ?"
+                params.append(owner_id)
+            query += " ORDER BY rowid LIMIT ?"
+            
+            last_rowid = 0
+            while True:
+                rows = self.catalog.execute(query, (params[0], last_rowid, *params[1:], BATCH_SIZE)).fetchall()
+                if not rows:
+                    break
+                for _, file_path, content_hash, size in rows:
+                    dest = _restore_destination(file_path, files_target)
+                    if dest is None:
+                        # 不在任何已配置卷上的文件无法映射到目标目录，不能写回原路径
+                        print(f"[BACKUP] 文件不在任何存储卷上，跳过: {file_path}")
+                        stats["files_outside_volumes"] += 1
+                        continue
+                    self._restore_file(dest, content_hash, size, stats)
+                last_rowid = rows[-1][0]
+        
+        if restore_db and restore_files and not files_target:
+            # 文件以完整内容还原到原路径，不再是分块清单；
+            # 还原到其他目录时原路径上仍是分块清单，数据库中的分块标记必须保留
+            _clear_chunked_flags(Path(stats["database"]), owner_id)
+        
+        return stats
+    
+    def _restore_file(self, dest: Path, content_hash: str, size: int, stats: dict):
+        """从内容对象还原单个文件"""
+        blob = self.blob_path(content_hash)
+        if not blob.exists():
+            stats["files_missing_blob"] += 1
+            return
+        
+        if dest.exists() and dest.stat().st_size == size:
+            existing_hash = hashlib.md5()
+            with open(dest, "rb") as f:
+                while chunk := f.read(1024 * 1024):
+                    existing_hash.update(chunk)
+            if existing_hash.hexdigest() == content_hash:
+                stats["files_unchanged"] += 1
+                return
+        
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        tmp_dest = dest.with_name(f".{dest.name}.restoring")
+        shutil.copyfile(blob, tmp_dest)
+        os.replace(tmp_dest, dest)
+        stats["files_restored"] += 1
+
+
+def _restore_destination(file_path: str, files_target: Optional[str]) -> Optional[Path]:
+    """
+    计算文件的还原位置
+    
+    Args:
+        file_path: 快照中的文件路径
+        files_target: 还原根目录（为空时还原到原路径）
+    
+    Returns:
+        还原路径；指定了还原根目录但文件不在任何已配置的卷上时返回None
+    """
+    if not files_target:
+        return Path(file_path)
+    
+    matches = [v for v in volumes.volumes if v.contains(file_path)]
+    if not matches:
+        return None
+    volume = max(matches, key=lambda v: len(str(v.root)))
+    relative = os.path.relpath(file_path, str(volume.root))
+    
+    if len(volumes.volumes) == 1:
+        return Path(files_target) / relative
+    return Path(files_target) / volume.name / relative
+
+
+def _open_source(path: Path, is_chunked: bool):
+    """打开待备份的文件（已分块的文件按清单拼接）"""
+    manifest = read_manifest(path) if is_chunked else None
+    if manifest is None:
+        return open(path, "rb")
+    return ChunkedFile(ChunkStore(), manifest)
+
+
+def _clear_chunked_flags(db_path: Path, owner_id: Optional[int]):
+    """清除还原后数据库中的分块标记"""
+    conn = sqlite3.connect(str(db_path))
+    try:
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(files)")}
+        if "is_chunked" not in columns:
+            return
+        if owner_id is None:
+            conn.execute("UPDATE files SET is_chunked = 0 WHERE is_chunked = 1")
+        else:
+            conn.execute("UPDATE files SET is_chunked = 0 WHERE is_chunked = 1 AND owner_id = ?", (owner_id,))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def run_backup(db: Session = None) -> dict:
+    """
+    执行一次增量备份（可作为后台维护任务注册）
+    
+    Returns:
+        统计信息
+    """
+    backup_engine = BackupEngine()
+    try:
+        return backup_engine.run()
+    finally:
+        backup_engine.close()
+
+
+if settings.BACKUP_ENABLED:
+    scheduler.register("backup", settings.BACKUP_INTERVAL, run_backup)
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    
+    parser = argparse.ArgumentParser(description="RaspberryCloud 增量备份")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    subparsers.add_parser("run", help="执行一次备份")
+    subparsers.add_parser("list", help="列出快照")
+    
+    restore_parser = subparsers.add_parser("restore", help="还原到指定快照")
+    restore_parser.add_argument("snapshot_id", help="快照ID")
+    restore_parser.add_argument("--db-target", help="数据库还原位置（默认覆盖当前数据库，请先停止服务）")
+    restore_parser.add_argument("--files-target", help="文件还原根目录（默认还原到原路径；多个存储卷时按卷名分目录）")
+    restore_parser.add_argument("--db-only", action="store_true", help="只还原数据库")
+    restore_parser.add_argument("--files-only", action="store_true", help="只还原文件")
+    restore_parser.add_argument("--user-id", type=int, help="只还原指定用户的文件")
+    
+    args = parser.parse_args()
+    backup_engine = BackupEngine()
+    
+    try:
+        if args.command == "run":
+            print(f"✅ 备份完成: {json.dumps(backup_engine.run(), ensure_ascii=False)}")
+        elif args.command == "list":
+            for snapshot in backup_engine.list_snapshots():
+                print(json.dumps(snapshot, ensure_ascii=False))
+        elif args.command == "restore":
+            result = backup_engine.restore(
+                args.snapshot_id,
+                db_target=args.db_target,
+                files_target=args.files_target,
+                restore_db=not args.files_only,
+                restore_files=not args.db_only,
+                owner_id=args.user_id
+            )
+            print(f"✅ 还原完成: {json.dumps(result, ensure_ascii=False)}")
+    except ValueError as e:
+        print(f"❌ {e}")
+        raise SystemExit(1)
+    finally:
+        backup_engine.close()
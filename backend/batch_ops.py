@@ -0,0 +1,551 @@
+"""
+批量操作模块
+一次请求删除、移动、复制或重命名成百上千个条目：
+按ID批量校验所有权，数据库修改在同一个事务中批量执行并一次提交，返回每个条目的结果。
+
+物理文件操作无法纳入数据库事务：移动/重命名在提交失败时按相反顺序撤销，
+复制先完成物理复制再写入记录，失败时删除已复制的文件；
+复制按选中的条目逐项提交（大型复制可能持续很久，不能一直占用数据库写锁），
+超过阈值的复制由copy_jobs模块在后台执行。
+"""
+
+import shutil
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, status
+from pydantic import BaseModel
+from sqlalchemy.orm import Session
+
+from models import User, File
+from config import settings
+from file_handler import FileService, FileManager, chunked
+from volumes import volumes
+from chunkstore import ChunkStore, read_manifest
+from changes import record_changes
+
+
+class BatchIdsRequest(BaseModel):
+    """批量删除请求"""
+    file_ids: List[int]
+
+
+class BatchTargetRequest(BaseModel):
+    """批量移动/复制请求"""
+    file_ids: List[int]
+    target_parent_id: Optional[int] = None  # null表示根目录
+
+
+class BatchRenameItem(BaseModel):
+    id: int
+    new_name: str
+
+
+class BatchRenameRequest(BaseModel):
+    """批量重命名请求"""
+    items: List[BatchRenameItem]
+
+
+class BatchResult:
+    """逐条记录批量操作结果"""
+    
+    def __init__(self):
+        self._results: Dict[int, dict] = {}
+    
+    def ok(self, file_id: int, **extra):
+        self._results[file_id] = {"id": file_id, "success": True, **extra}
+    
+    def fail(self, file_id: int, error: str):
+        self._results[file_id] = {"id": file_id, "success": False, "error": error}
+    
+    def to_dict(self, order: List[int]) -> dict:
+        results = [self._results[file_id] for file_id in order]
+        failed = sum(1 for r in results if not r["success"])
+        return {
+            "success": failed == 0,
+            "succeeded": len(results) - failed,
+            "failed": failed,
+            "results": results,
+        }
+
+
+def _unique_ids(file_ids: List[int]) -> List[int]:
+    """去重并保持原顺序"""
+    return list(dict.fromkeys(file_ids))
+
+
+class BatchService:
+    """批量操作服务"""
+    
+    def __init__(self, db: Session):
+        self.db = db
+        self.file_service = FileService(db)
+    
+    def _check_count(self, count: int):
+        if count == 0:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="未选择任何文件"
+            )
+        if count > settings.BATCH_MAX_ITEMS:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"单次最多操作{settings.BATCH_MAX_ITEMS}个条目"
+            )
+    
+    def _load_owned(self, user: User, file_ids: List[int]) -> Dict[int, File]:
+        """按ID批量读取属于该用户且未删除的条目"""
+        files = {}
+        for batch in chunked(file_ids):
+            for file in self.db.query(File).filter(
+                File.id.in_(batch),
+                File.owner_id == user.id,
+                File.is_deleted == False
+            ).all():
+                files[file.id] = file
+        return files
+    
+    def _resolve_target(self, user: User, target_parent_id: Optional[int]) -> Tuple[Path, set]:
+        """
+        校验目标文件夹
+        
+        Returns:
+            (目标目录, 目标文件夹及其所有上级文件夹的ID集合)
+        """
+        if target_parent_id is None:
+            return settings.get_user_storage_path(user.id), set()
+        
+        target = self.db.query(File).filter(
+            File.id == target_parent_id,
+            File.owner_id == user.id,
+            File.is_folder == True,
+            File.is_deleted == False
+        ).first()
+        if not target:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="目标文件夹不存在"
+            )
+        
+        ancestors = {target.id}
+        parent_id = target.parent_id
+        while parent_id is not None and parent_id not in ancestors:
+            ancestors.add(parent_id)
+            parent_id = self.db.query(File.parent_id).filter(File.id == parent_id).scalar()
+        
+        return Path(target.file_path), ancestors
+    
+    def delete(self, user: User, file_ids: List[int]) -> dict:
+        """
+        批量删除（移入回收站）
+        
+        Args:
+            user: 用户对象
+            file_ids: 文件ID列表
+        
+        Returns:
+            批量操作结果
+        """
+        ids = _unique_ids(file_ids)
+        self._check_count(len(ids))
+        files = self._load_owned(user, ids)
+        results = BatchResult()
+        
+        all_ids = []
+        for file_id in ids:
+            file = files.get(file_id)
+            if file is None:
+                results.fail(file_id, "文件不存在")
+                continue
+            all_ids.append(file_id)
+            if file.is_folder:
+                all_ids += self.file_service.get_descendant_ids(file_id, File.is_deleted == False)
+            results.ok(file_id)
+        
+        # 选中的条目可能位于同时选中的文件夹中
+        all_ids = _unique_ids(all_ids)
+        if all_ids:
+            freed = self.file_service.sum_file_sizes(all_ids, File.is_deleted == False)
+            deleted_at = datetime.utcnow()
+            
+            for batch in chunked(all_ids):
+                self.db.query(File).filter(
+                    File.id.in_(batch),
+                    File.is_deleted == False
+                ).update(
+                    {File.is_deleted: True, File.deleted_at: deleted_at},
+                    synchronize_session=False
+                )
+            
+            record_changes(self.db, user.id, all_ids, "deleted")
+            user.used_space = max(0, user.used_space - freed)
+            self.db.commit()
+        
+        return results.to_dict(ids)
+    
+    def move(self, user: User, file_ids: List[int], target_parent_id: Optional[int]) -> dict:
+        """
+        批量移动到同一个文件夹
+        
+        Args:
+            user: 用户对象
+            file_ids: 文件ID列表
+            target_parent_id: 目标文件夹ID（None表示根目录）
+        
+        Returns:
+            批量操作结果
+        """
+        ids = _unique_ids(file_ids)
+        self._check_count(len(ids))
+        target_dir, ancestors = self._resolve_target(user, target_parent_id)
+        files = self._load_owned(user, ids)
+        results = BatchResult()
+        
+        # 先移动文件，再由深到浅移动文件夹，同时选中的父子条目互不影响
+        pending = [files[i] for i in ids if i in files]
+        pending.sort(key=lambda f: (f.is_folder, -len(Path(f.file_path).parts)))
+        
+        for file_id in ids:
+            if file_id not in files:
+                results.fail(file_id, "文件不存在")
+        
+        moved: List[Tuple[File, Path, Path]] = []
+        old_parents: Dict[int, Optional[int]] = {}
+        try:
+            for file in pending:
+                if file.parent_id == target_parent_id:
+                    results.ok(file.id)
+                    continue
+                if file.id in ancestors:
+                    results.fail(file.id, "不能将文件夹移动到其自身或子文件夹中")
+                    continue
+                
+                old_path = Path(file.file_path)
+                new_path = volumes.path_on(volumes.volume_for_path(old_path), target_dir) / file.filename
+                if volumes.exists_anywhere(new_path):
+                    results.fail(file.id, "目标位置已存在同名文件")
+                    continue
+                
+                try:
+                    if file.is_folder:
+                        volumes.move_tree(old_path, new_path)
+                    else:
+                        new_path.parent.mkdir(parents=True, exist_ok=True)
+                        shutil.move(str(old_path), str(new_path))
+                except OSError as e:
+                    results.fail(file.id, f"移动失败: {e}")
+                    continue
+                moved.append((file, old_path, new_path))
+                
+                old_parents[file.id] = file.parent_id
+                file.parent_id = target_parent_id
+                file.file_path = str(new_path)
+                file.updated_at = datetime.utcnow()
+                if file.is_folder:
+                    self.db.flush()
+                    self.file_service._rebase_descendants(file, old_path, new_path)
+                    self.db.flush()
+                results.ok(file.id, parent_id=target_parent_id)
+            
+            record_changes(self.db, user.id, [f.id for f, _, _ in moved], "moved",
+                           from_parent_ids=old_parents)
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            _undo_moves(moved)
+            raise
+        
+        return results.to_dict(ids)
+    
+    def rename(self, user: User, items: List[Tuple[int, str]]) -> dict:
+        """
+        批量重命名
+        
+        Args:
+            user: 用户对象
+            items: [(文件ID, 新文件名), ...]
+        
+        Returns:
+            批量操作结果
+        """
+        names = dict(items)
+        ids = list(names)
+        self._check_count(len(ids))
+        files = self._load_owned(user, ids)
+        results = BatchResult()
+        
+        renamed: List[Tuple[File, Path, Path]] = []
+        try:
+            for file_id in ids:
+                file = files.get(file_id)
+                if file is None:
+                    results.fail(file_id, "文件不存在")
+                    continue
+                
+                safe_name = FileManager.get_safe_filename(names[file_id]).strip()
+                if not safe_name:
+                    results.fail(file_id, "文件名不能为空")
+                    continue
+                
+                old_path = Path(file.file_path)
+                new_path = old_path.parent / safe_name
+                if new_path == old_path:
+                    results.ok(file_id, filename=file.filename)
+                    continue
+                if volumes.exists_anywhere(new_path):
+                    results.fail(file_id, "文件名已存在")
+                    continue
+                
+                try:
+                    if file.is_folder:
+                        volumes.move_tree(old_path, new_path)
+                    else:
+                        old_path.rename(new_path)
+                except OSError as e:
+                    results.fail(file_id, f"重命名失败: {e}")
+                    continue
+                renamed.append((file, old_path, new_path))
+                
+                file.filename = safe_name
+                file.file_path = str(new_path)
+                file.updated_at = datetime.utcnow()
+                if file.is_folder:
+                    self.db.flush()
+                    self.file_service._rebase_descendants(file, old_path, new_path)
+                    self.db.flush()
+                results.ok(file_id, filename=safe_name)
+            
+            record_changes(self.db, user.id, [f.id for f, _, _ in renamed], "updated")
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            _undo_moves(renamed)
+            raise
+        
+        return results.to_dict(ids)
+    
+    def measure(self, files: List[File]) -> Tuple[int, int]:
+        """
+        统计复制一组条目（含文件夹的全部子孙条目）涉及的条目数和文件总大小
+        
+        Args:
+            files: 选中的条目
+        
+        Returns:
+            (条目数, 总字节数)
+        """
+        all_ids = []
+        for file in files:
+            all_ids.append(file.id)
+            if file.is_folder:
+                all_ids += self.file_service.get_descendant_ids(file.id, File.is_deleted == False)
+        all_ids = _unique_ids(all_ids)
+        return len(all_ids), self.file_service.sum_file_sizes(all_ids, File.is_deleted == False)
+    
+    def copy(self, user: User, file_ids: List[int], target_parent_id: Optional[int],
+             progress: Optional[Callable[[int, int], None]] = None) -> dict:
+        """
+        批量复制到同一个文件夹（文件夹连同子孙条目一起复制，重名时自动编号）
+        
+        每个选中的条目复制完成后单独提交，复制物理文件期间不占用数据库写锁；
+        提交前按用户当前的已用空间重新检查配额（复制期间可能有其他上传）。
+        
+        Args:
+            user: 用户对象
+            file_ids: 文件ID列表
+            target_parent_id: 目标文件夹ID（None表示根目录）
+            progress: 进度回调，参数为新复制的字节数和条目数
+        
+        Returns:
+            批量操作结果（methods为各复制方式使用的次数）
+        """
+        ids = _unique_ids(file_ids)
+        self._check_count(len(ids))
+        target_dir, ancestors = self._resolve_target(user, target_parent_id)
+        files = self._load_owned(user, ids)
+        results = BatchResult()
+        
+        selected = []
+        for file_id in ids:
+            file = files.get(file_id)
+            if file is None:
+                results.fail(file_id, "文件不存在")
+            elif file.id in ancestors:
+                results.fail(file_id, "不能将文件夹复制到其自身或子文件夹中")
+            else:
+                selected.append(file)
+        
+        _, total_size = self.measure(selected)
+        if not user.has_space_for(total_size):
+            raise HTTPException(
+                status_code=status.HTTP_507_INSUFFICIENT_STORAGE,
+                detail="存储空间不足"
+            )
+        
+        methods: Dict[str, int] = {}
+        for file in selected:
+            file_id = file.id
+            tree = self._load_tree(file)
+            item_size = sum(f.size or 0 for f in tree if not f.is_folder)
+            item_paths: List[Path] = []
+            try:
+                plan = self._copy_tree(user, tree, target_dir, item_paths, methods, progress)
+            except OSError as e:
+                _remove_paths(item_paths)
+                results.fail(file_id, f"复制失败: {e}")
+                continue
+            
+            try:
+                self.db.refresh(user)
+                if not user.has_space_for(item_size):
+                    _remove_paths(item_paths)
+                    results.fail(file_id, "存储空间不足")
+                    continue
+                
+                top = self._insert_copies(user, plan, target_parent_id)
+                record_changes(self.db, user.id, [row.id for _, row in plan], "created")
+                user.used_space += item_size
+                self.db.commit()
+            except Exception:
+                self.db.rollback()
+                _remove_paths(item_paths)
+                raise
+            results.ok(file_id, new_id=top.id, filename=top.filename)
+        
+        return {**results.to_dict(ids), "methods": methods}
+    
+    def _load_tree(self, root: File) -> List[File]:
+        """读取条目及其未删除的子孙条目（父条目在前）"""
+        tree = [root]
+        frontier = [root.id] if root.is_folder else []
+        while frontier:
+            next_frontier = []
+            for batch in chunked(frontier):
+                for child in self.db.query(File).filter(
+                    File.parent_id.in_(batch),
+                    File.is_deleted == False
+                ).order_by(File.id).all():
+                    tree.append(child)
+                    if child.is_folder:
+                        next_frontier.append(child.id)
+            frontier = next_frontier
+        return tree
+    
+    def _copy_tree(self, user: User, tree: List[File], target_dir: Path, created: List[Path],
+                   methods: Dict[str, int],
+                   progress: Optional[Callable[[int, int], None]]) -> List[Tuple[File, File]]:
+        """
+        复制物理文件，返回（源条目, 新条目）列表（新条目尚未写入数据库）
+        
+        分块存储的文件只复制清单（写入数据库时增加分块引用），其他文件用FileManager.clone_file复制。
+        
+        Args:
+            user: 用户对象
+            tree: 源条目列表（父条目在前）
+            target_dir: 目标目录
+            created: 已创建的路径（出错时由调用方删除）
+            methods: 各复制方式的使用次数（累加）
+            progress: 进度回调
+        """
+        report = progress or (lambda copied, count: None)
+        root = tree[0]
+        new_dirs: Dict[int, Path] = {}
+        plan = []
+        
+        for source in tree:
+            if source is root:
+                parent_dir = target_dir
+                name = volumes.get_unique_filename(target_dir, source.filename)
+            else:
+                parent_dir = new_dirs[source.parent_id]
+                name = source.filename
+            
+            source_path = Path(source.file_path)
+            if source.is_folder:
+                new_path = volumes.path_on(volumes.volume_for_path(target_dir), parent_dir) / name
+                new_path.mkdir(parents=True, exist_ok=False)
+                created.append(new_path)
+                new_dirs[source.id] = new_path
+                report(0, 1)
+            else:
+                volume = volumes.volume_for_path(source_path)
+                if not volume.online or not volume.has_space_for(source.size or 0):
+                    volume = volumes.choose(user, source.size or 0)
+                new_path = volumes.path_on(volume, parent_dir) / name
+                new_path.parent.mkdir(parents=True, exist_ok=True)
+                if new_path.exists():
+                    raise FileExistsError(f"目标文件已存在: {new_path}")
+                created.append(new_path)
+                if source.is_chunked:
+                    FileManager.clone_file(source_path, new_path)
+                    method = "dedup"
+                    report(source.size or 0, 0)
+                else:
+                    method = FileManager.clone_file(
+                        source_path, new_path, lambda copied: report(copied, 0)
+                    )
+                methods[method] = methods.get(method, 0) + 1
+                report(0, 1)
+            
+            plan.append((source, File(
+                filename=name,
+                original_filename=source.original_filename,
+                file_path=str(new_path),
+                size=source.size,
+                mime_type=source.mime_type,
+                category=source.category,
+                md5_hash=source.md5_hash,
+                is_folder=source.is_folder,
+                is_chunked=bool(source.is_chunked),
+                owner_id=user.id,
+                volume=volumes.volume_for_path(new_path).name
+            )))
+        
+        return plan
+    
+    def _insert_copies(self, user: User, plan: List[Tuple[File, File]],
+                       target_parent_id: Optional[int]) -> File:
+        """按层级写入复制出的条目（不提交事务），返回顶层新条目"""
+        new_ids: Dict[int, int] = {}
+        store = None
+        
+        for source, row in plan:
+            row.parent_id = target_parent_id if source is plan[0][0] else new_ids[source.parent_id]
+            self.db.add(row)
+            if source.is_folder:
+                self.db.flush()
+                new_ids[source.id] = row.id
+            elif source.is_chunked:
+                # 分块存储的文件只复制了清单，分块引用次数加一
+                manifest = read_manifest(Path(row.file_path))
+                if manifest is not None:
+                    store = store or ChunkStore()
+                    store.add_refs(self.db, manifest["chunks"])
+        
+        self.db.flush()
+        return plan[0][1]
+
+
+def _undo_moves(moves: List[Tuple[File, Path, Path]]):
+    """提交失败时按相反顺序把物理文件移回原位置"""
+    for file, old_path, new_path in reversed(moves):
+        try:
+            if file.is_folder:
+                volumes.move_tree(new_path, old_path)
+            else:
+                shutil.move(str(new_path), str(old_path))
+        except OSError as e:
+            print(f"[BATCH] 撤销移动失败: {new_path} -> {old_path}: {e}")
+
+
+def _remove_paths(paths: List[Path]):
+    """删除复制失败或未提交的物理文件/目录"""
+    for path in reversed(paths):
+        try:
+            if path.is_dir():
+                shutil.rmtree(path)
+            else:
+                path.unlink(missing_ok=True)
+        except OSError as e:
+            print(f"[BATCH] 清理复制文件失败: {path}: {e}")
@@ -0,0 +1,103 @@
+"""
+首屏数据模块
+登录后页面需要的数据（用户信息、统计、根目录第一页、分享数）由一个请求返回：
+通过内网穿透访问时每个往返需要80-150ms，分开请求还要各自校验token、查询用户。
+所有查询共用同一个请求的数据库会话。
+"""
+
+from typing import Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from models import User, File, Share
+from auth import UserResponse
+from file_handler import FileService
+from listing import DEFAULT_FIELDS, select_rows
+
+
+# 首屏返回的根目录条目数（超过时客户端再请求完整列表）
+BOOTSTRAP_PAGE_SIZE = 200
+
+FILE_CATEGORIES = ("image", "video", "audio", "document", "other")
+
+
+def user_stats(db: Session, user: User) -> dict:
+    """
+    用户存储和文件统计（一次分组查询）
+    
+    Args:
+        db: 数据库会话
+        user: 用户对象
+    
+    Returns:
+        {"user": 空间信息, "files": 文件数统计}
+    """
+    rows = db.query(File.is_folder, File.category, func.count(File.id)).filter(
+        File.owner_id == user.id,
+        File.is_deleted == False
+    ).group_by(File.is_folder, File.category).all()
+    
+    files_by_category = dict.fromkeys(FILE_CATEGORIES, 0)
+    total_files = total_folders = 0
+    for is_folder, category, count in rows:
+        if is_folder:
+            total_folders += count
+        else:
+            total_files += count
+        if category in files_by_category:
+            files_by_category[category] += count
+    
+    return {
+        "user": {
+            "username": user.username,
+            "quota": user.quota,
+            "used_space": user.used_space,
+            "available_space": user.quota - user.used_space,
+            "usage_percentage": (user.used_space / user.quota * 100) if user.quota > 0 else 0
+        },
+        "files": {
+            "total": total_files,
+            "folders": total_folders,
+            "by_category": files_by_category
+        }
+    }
+
+
+class BootstrapService:
+    """首屏数据服务"""
+    
+    def __init__(self, db: Session):
+        self.db = db
+    
+    def load(self, user: User, limit: Optional[int] = None) -> dict:
+        """
+        汇总首屏数据
+        
+        Args:
+            user: 用户对象
+            limit: 根目录返回的条目数
+        
+        Returns:
+            {"user", "stats", "files": {"files", "has_more"}, "shares": {"active"}}；
+            files.has_more为True时客户端需要再请求 /api/files/list 获取完整列表
+        """
+        limit = limit or BOOTSTRAP_PAGE_SIZE
+        query = FileService(self.db).list_query(user).limit(limit + 1)
+        files = [dict(zip(DEFAULT_FIELDS, row)) for row in select_rows(query, DEFAULT_FIELDS)]
+        
+        active_shares = self.db.query(func.count(Share.id)).filter(
+            Share.owner_id == user.id,
+            Share.is_active == True
+        ).scalar()
+        
+        return {
+            "user": UserResponse.model_validate(user).model_dump(mode="json"),
+            "stats": user_stats(self.db, user),
+            "files": {
+                "parent_id": None,
+                "files": files[:limit],
+                "has_more": len(files) > limit
+            },
+            "shares": {"active": active_shares}
+        }
@@ -0,0 +1,293 @@
+"""
+变更记录模块
+文件的创建、修改、移动、删除都会在同一事务中写入一条同步记录（SyncRecord），
+记录ID单调递增，作为客户端增量同步的游标。
+
+客户端同步流程：
+1. 首次同步 GET /api/sync/changes?since=0，分页获取全部文件，保存返回的cursor
+2. 之后用 since=<cursor> 获取变更，has_more为true时继续请求
+3. 返回 reset=true 时说明所需的记录已被清理，需要从 since=0 全量同步并删除本地多余的条目
+
+每条变更返回的是文件的当前状态而不是事件内容，因此同一文件的旧记录可以随时合并
+（只保留最新一条），不影响任何游标的正确性；只有彻底删除（清理回收站）会删除
+文件的最后一条记录，此时提高用户的sync_horizon，游标更早的客户端需要全量同步。
+
+全量同步的中间页返回字符串游标（"f<记录ID>.<开始时的sync_horizon>"），原样传回即可。
+全量同步从当前状态开始，不需要此前被清理的记录，因此中间页的位置不与sync_horizon比较
+（否则清理过回收站的用户永远无法完成全量同步），最后一页返回的游标不小于sync_horizon；
+同步期间sync_horizon提高（已返回的条目可能被彻底删除）时返回reset=true，重新全量同步。
+"""
+
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from fastapi import HTTPException, status
+from sqlalchemy import exists, insert, func, select, literal
+from sqlalchemy.orm import Session, aliased
+
+from models import User, File, SyncRecord
+from config import settings
+from maintenance import scheduler, batched_delete
+
+
+# 单条SQL中IN (...)参数的最大数量（与file_handler.SQL_IN_BATCH_SIZE一致，
+# 本模块被file_handler导入，不能反向导入）
+IN_BATCH_SIZE = 500
+
+# 全量同步中间页游标的前缀
+FULL_SYNC_CURSOR_PREFIX = "f"
+
+# 变更列表中每条记录的字段
+CHANGE_COLUMNS = ["id", "parent_id", "filename", "is_folder", "size", "md5_hash", "updated_at", "deleted"]
+
+
+def record_change(db: Session, user_id: int, file_id: int, action: str, device_id: Optional[str] = None,
+                  from_parent_id: Optional[int] = None):
+    """
+    写入一条变更记录（不提交事务，由调用方与文件修改一起提交）
+    
+    Args:
+        db: 数据库会话
+        user_id: 用户ID
+        file_id: 文件ID
+        action: created / updated / moved / deleted / restored
+        device_id: 客户端设备ID
+        from_parent_id: 移动前的父文件夹ID（moved记录）
+    """
+    db.add(SyncRecord(user_id=user_id, file_id=file_id, action=action, device_id=device_id,
+                      from_parent_id=from_parent_id))
+
+
+def record_changes(db: Session, user_id: int, file_ids: Iterable[int], action: str,
+                   device_id: Optional[str] = None,
+                   from_parent_ids: Optional[Dict[int, Optional[int]]] = None):
+    """
+    批量写入变更记录（例如删除或还原整个文件夹，不提交事务）
+    
+    Args:
+        db: 数据库会话
+        user_id: 用户ID
+        file_ids: 文件ID列表
+        action: 操作类型
+        device_id: 客户端设备ID
+        from_parent_ids: 各文件移动前的父文件夹ID（moved记录）
+    """
+    now = datetime.utcnow()
+    from_parent_ids = from_parent_ids or {}
+    rows = [
+        {"user_id": user_id, "file_id": file_id, "action": action,
+         "device_id": device_id, "from_parent_id": from_parent_ids.get(file_id), "synced_at": now}
+        for file_id in file_ids
+    ]
+    if rows:
+        db.execute(insert(SyncRecord), rows)
+
+
+def raise_sync_horizon(db: Session, file_ids: List[int]):
+    """
+    删除文件的变更记录之前调用：提高相关用户的sync_horizon（不提交事务）
+    
+    Args:
+        db: 数据库会话
+        file_ids: 即将删除记录的文件ID列表
+    """
+    rows = db.query(SyncRecord.user_id, func.max(SyncRecord.id)).filter(
+        SyncRecord.file_id.in_(file_ids)
+    ).group_by(SyncRecord.user_id).all()
+    
+    for user_id, max_id in rows:
+        db.query(User).filter(
+            User.id == user_id,
+            func.coalesce(User.sync_horizon, 0) < max_id
+        ).update({User.sync_horizon: max_id}, synchronize_session=False)
+
+
+def parse_cursor(cursor: Union[int, str]) -> Tuple[int, Optional[int]]:
+    """
+    解析客户端传回的游标
+    
+    Args:
+        cursor: 记录ID（0表示开始全量同步），或全量同步中间页的游标
+    
+    Returns:
+        (记录ID, 全量同步开始时的sync_horizon)；不是全量同步中间页时后者为None
+    """
+    value = str(cursor)
+    try:
+        if value.startswith(FULL_SYNC_CURSOR_PREFIX):
+            position, _, horizon = value[len(FULL_SYNC_CURSOR_PREFIX):].partition(".")
+            result = (int(position), int(horizon))
+        else:
+            result = (int(value), None)
+    except ValueError:
+        result = (-1, None)
+    
+    if result[0] < 0 or (result[1] is not None and result[1] < 0):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"无效的同步游标: {value}"
+        )
+    return result
+
+
+def full_sync_cursor(position: int, horizon: int) -> str:
+    """全量同步中间页的游标（记录位置和开始时的sync_horizon）"""
+    return f"{FULL_SYNC_CURSOR_PREFIX}{position}.{horizon}"
+
+
+class ChangeFeedService:
+    """变更列表服务"""
+    
+    def __init__(self, db: Session):
+        self.db = db
+    
+    def list_changes(self, user: User, since: Union[int, str] = 0, limit: int = 1000) -> dict:
+        """
+        获取游标之后的变更
+        
+        同一页中同一文件的多条记录只返回一次；条目按记录顺序返回，
+        父文件夹可能出现在子条目之后（例如文件夹在子条目创建后被重命名），客户端需要按页整体应用。
+        
+        Args:
+            user: 用户对象
+            since: 上次同步返回的游标（0表示全量同步，字符串为全量同步中间页的游标）
+            limit: 每页最多读取的记录数
+        
+        Returns:
+            {"cursor", "has_more", "reset", "columns", "changes"}
+        """
+        horizon = user.sync_horizon or 0
+        after, start_horizon = parse_cursor(since)
+        full_sync = after == 0 or start_horizon is not None
+        if start_horizon is None:
+            start_horizon = horizon
+        
+        # 增量同步：游标之后的记录已被清理；全量同步：开始后有条目被彻底删除，已返回的可能已不存在
+        if (not full_sync and after < horizon) or horizon > start_horizon:
+            return {
+                "cursor": 0,
+                "has_more": False,
+                "reset": True,
+                "columns": CHANGE_COLUMNS,
+                "changes": [],
+            }
+        
+        rows = self.db.query(SyncRecord.id, SyncRecord.file_id).filter(
+            SyncRecord.user_id == user.id,
+            SyncRecord.id > after
+        ).order_by(SyncRecord.id).limit(limit + 1).all()
+        
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if not rows:
+            return {
+                "cursor": max(after, horizon) if full_sync else after,
+                "has_more": False,
+                "reset": False,
+                "columns": CHANGE_COLUMNS,
+                "changes": [],
+            }
+        
+        # 同一文件只保留本页中最后一条记录的位置
+        order = {}
+        for record_id, file_id in rows:
+            order.pop(file_id, None)
+            order[file_id] = record_id
+        
+        files = {}
+        file_ids = list(order)
+        for start in range(0, len(file_ids), IN_BATCH_SIZE):
+            batch = file_ids[start:start + IN_BATCH_SIZE]
+            for row in self.db.query(
+                File.id, File.parent_id, File.filename, File.is_folder,
+                File.size, File.md5_hash, File.updated_at, File.is_deleted
+            ).filter(
+                File.id.in_(batch),
+                File.owner_id == user.id
+            ).all():
+                files[row[0]] = row
+        
+        changes = []
+        for file_id in order:
+            row = files.get(file_id)
+            if row is None or row.is_deleted:
+                # 全量同步的第一页客户端本地没有任何条目，无需返回删除；
+                # 之后的页需要返回，前面的页已返回的条目可能在同步期间被删除
+                if after:
+                    changes.append([file_id, None, None, None, None, None, None, True])
+                continue
+            changes.append([
+                row.id, row.parent_id, row.filename, bool(row.is_folder), row.size or 0,
+                row.md5_hash, row.updated_at.isoformat() if row.updated_at else None, False
+            ])
+        
+        cursor = rows[-1][0]
+        if full_sync:
+            cursor = full_sync_cursor(cursor, start_horizon) if has_more else max(cursor, horizon)
+        
+        return {
+            "cursor": cursor,
+            "has_more": has_more,
+            "reset": False,
+            "columns": CHANGE_COLUMNS,
+            "changes": changes,
+        }
+
+
+def backfill_changes(db: Session, user_id: Optional[int] = None) -> int:
+    """
+    为没有任何变更记录的文件补写created记录
+    
+    用于升级前已存在的文件，以及批量导入等未逐条写记录的场景，
+    保证 since=0 能返回全部文件。
+    
+    Args:
+        db: 数据库会话
+        user_id: 只处理指定用户（为空时处理所有用户）
+    
+    Returns:
+        补写的记录数
+    """
+    query = select(
+        File.owner_id, File.id, literal("created"), func.coalesce(File.created_at, datetime.utcnow())
+    ).where(
+        File.is_deleted == False,
+        ~exists().where(SyncRecord.file_id == File.id)
+    ).order_by(File.id)
+    if user_id is not None:
+        query = query.where(File.owner_id == user_id)
+    
+    result = db.execute(
+        insert(SyncRecord).from_select(["user_id", "file_id", "action", "synced_at"], query)
+    )
+    db.commit()
+    
+    return result.rowcount or 0
+
+
+def compact_changes(db: Session) -> dict:
+    """
+    变更记录合并后台任务
+    
+    删除同一文件被更新记录取代的旧记录，每个文件最终只保留最新一条；
+    同时为缺少记录的文件补写created记录。
+    
+    Args:
+        db: 数据库会话
+    
+    Returns:
+        统计信息
+    """
+    newer = aliased(SyncRecord)
+    superseded = exists().where(
+        newer.file_id == SyncRecord.file_id,
+        newer.id > SyncRecord.id
+    )
+    
+    return {
+        "backfilled": backfill_changes(db),
+        "compacted": batched_delete(db, SyncRecord, superseded),
+    }
+
+
+scheduler.register("change_compaction", settings.SYNC_COMPACTION_INTERVAL, compact_changes)
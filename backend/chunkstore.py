@@ -0,0 +1,763 @@
+"""
+分块去重存储模块
+对经常小幅修改后重新上传的大文件（虚拟机镜像、Excel工作簿等）做内容定义分块（FastCDC），
+相同的分块只存储一份，文件本身只保存分块清单
+
+- 分块文件按SHA-256存放在 CHUNK_STORE_PATH/<前两位>/<哈希>
+- chunks表记录每个分块的大小和引用次数（清单中每出现一次计一次）
+- 文件记录的file_path处保存分块清单，重命名、移动、回收站等逻辑无需区分
+- 读取时按清单顺序拼接分块，支持HTTP Range
+
+分块转换由后台任务完成；文件彻底删除时由回收站清理任务释放引用，
+引用数为0的分块由本模块的后台任务回收（与转换在同一任务中执行，避免并发回收正在复用的分块）。
+
+分块边界优先使用pyfastcdc（原生实现，GB/s级别）计算，未安装时使用本模块的纯Python实现，
+只有几MB/s（树莓派上更慢），每次后台转换受 CHUNK_STORE_MAX_BYTES_PER_RUN / CHUNK_STORE_MAX_SECONDS_PER_RUN 限制。
+两种实现的Gear表不同，分块边界也不同：清单中记录了每个分块，读取不受影响，
+但切换实现后新转换的文件与之前的文件之间基本无法去重，建议在启用前安装好pyfastcdc。
+
+用法：
+    python chunkstore.py benchmark /mnt/usb1/vm-images    # 评估去重率、分块速度和读取开销（不修改任何数据）
+"""
+
+import bisect
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote
+
+from fastapi import HTTPException, Request, status
+from fastapi.responses import FileResponse, StreamingResponse
+from sqlalchemy.orm import Session
+
+from models import File, ChunkRecord
+from config import settings
+from maintenance import scheduler
+
+try:
+    from pyfastcdc.cy import FastCDC
+except ImportError:  # 可选依赖，未安装（或没有编译好的扩展）时使用纯Python分块
+    FastCDC = None
+
+
+# 分块清单文件头
+MANIFEST_MAGIC = b"RCCHUNKS1\n"
+
+# 转换过程中的临时清单文件前缀（以“.”开头，一致性检查和列表都会忽略）
+TEMP_PREFIX = ".chunking-"
+
+# 读取源文件的块大小
+READ_BLOCK_SIZE = 8 * 1024 * 1024
+
+# 每批回收的分块数
+GC_BATCH_SIZE = 500
+
+# 基准测试中测量分块速度使用的最大数据量
+BENCHMARK_CDC_SAMPLE_BYTES = 64 * 1024 * 1024
+
+_MASK64 = (1 << 64) - 1
+
+# Gear哈希表：由字节值确定性生成，保证不同进程/版本的分块边界一致
+_GEAR = [
+    int.from_bytes(hashlib.sha256(bytes([i])).digest()[:8], "big")
+    for i in range(256)
+]
+
+
+def _high_bits_mask(bits: int) -> int:
+    """生成取哈希高位的掩码"""
+    return ((1 << bits) - 1) << (64 - bits)
+
+
+def _native_chunker(min_size: int, avg_size: int, max_size: int):
+    """
+    创建原生FastCDC分块器（归一化级别2，与纯Python实现的掩码一致）
+    
+    Returns:
+        分块器，pyfastcdc未安装或参数超出其支持范围时返回None
+    """
+    if FastCDC is None:
+        return None
+    try:
+        return FastCDC(avg_size, min_size=min_size, max_size=max_size, normalized_chunking=2)
+    except ValueError:
+        return None
+
+
+def chunker_name(min_size: Optional[int] = None, avg_size: Optional[int] = None,
+                 max_size: Optional[int] = None) -> str:
+    """当前配置下使用的分块实现（pyfastcdc / python）"""
+    native = _native_chunker(min_size or settings.CHUNK_MIN_SIZE,
+                             avg_size or settings.CHUNK_AVG_SIZE,
+                             max_size or settings.CHUNK_MAX_SIZE)
+    return "pyfastcdc" if native is not None else "python"
+
+
+def iter_chunks(
+    stream: BinaryIO,
+    min_size: Optional[int] = None,
+    avg_size: Optional[int] = None,
+    max_size: Optional[int] = None
+) -> Iterator[bytes]:
+    """
+    按内容定义分块（FastCDC，归一化分块）
+    
+    平均分块大小之前使用更严格的掩码、之后使用更宽松的掩码，使分块大小集中在平均值附近；
+    文件中间插入或删除内容只影响附近的一两个分块。
+    安装了pyfastcdc时由其计算分块边界，否则使用纯Python实现。
+    
+    Args:
+        stream: 二进制输入流
+        min_size: 最小分块大小
+        avg_size: 平均分块大小
+        max_size: 最大分块大小
+    
+    Returns:
+        分块数据迭代器
+    """
+    min_size = min_size or settings.CHUNK_MIN_SIZE
+    avg_size = avg_size or settings.CHUNK_AVG_SIZE
+    max_size = max_size or settings.CHUNK_MAX_SIZE
+    
+    native = _native_chunker(min_size, avg_size, max_size)
+    if native is not None:
+        # cut_stream返回的数据只在生成下一个分块前有效，需要复制
+        for chunk in native.cut_stream(stream):
+            yield bytes(chunk.data)
+        return
+    
+    bits = max(1, avg_size.bit_length() - 1)
+    mask_s = _high_bits_mask(bits + 2)
+    mask_l = _high_bits_mask(max(1, bits - 2))
+    
+    data = b""
+    pos = 0
+    eof = False
+    
+    while True:
+        if not eof and len(data) - pos < max_size:
+            block = stream.read(READ_BLOCK_SIZE)
+            if block:
+                data = data[pos:] + block
+                pos = 0
+                continue
+            eof = True
+        
+        remaining = len(data) - pos
+        if remaining == 0:
+            return
+        
+        cut = _cut_point(data, pos, remaining, min_size, avg_size, max_size, mask_s, mask_l)
+        yield data[pos:cut]
+        pos = cut
+
+
+def _cut_point(data: bytes, start: int, length: int, min_size: int, avg_size: int,
+               max_size: int, mask_s: int, mask_l: int) -> int:
+    """查找下一个分块边界（返回绝对位置）"""
+    if length <= min_size:
+        return start + length
+    
+    normal = start + min(avg_size, length)
+    limit = start + min(max_size, length)
+    gear = _GEAR
+    h = 0
+    
+    i = start + min_size
+    for byte in data[i:normal]:
+        h = ((h << 1) + gear[byte]) & _MASK64
+        i += 1
+        if not h & mask_s:
+            return i
+    
+    for byte in data[i:limit]:
+        h = ((h << 1) + gear[byte]) & _MASK64
+        i += 1
+        if not h & mask_l:
+            return i
+    
+    return limit
+
+
+class ChunkStore:
+    """分块存储"""
+    
+    def __init__(self, root: Optional[str] = None):
+        self.root = Path(root or settings.CHUNK_STORE_PATH)
+    
+    def chunk_path(self, chunk_hash: str) -> Path:
+        """分块文件路径"""
+        return self.root / chunk_hash[:2] / chunk_hash
+    
+    def write_chunk(self, data: bytes) -> Tuple[str, bool]:
+        """
+        写入分块（已存在时跳过）
+        
+        Returns:
+            (分块哈希, 是否为新分块)
+        """
+        chunk_hash = hashlib.sha256(data).hexdigest()
+        path = self.chunk_path(chunk_hash)
+        if path.exists():
+            return chunk_hash, False
+        
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".tmp-{os.getpid()}-{chunk_hash}")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return chunk_hash, True
+    
+    def add_refs(self, db: Session, chunks: List[List]):
+        """
+        增加清单中分块的引用次数（不提交事务）
+        
+        Args:
+            db: 数据库会话
+            chunks: 清单中的分块列表 [[哈希, 大小], ...]
+        """
+        counts: Dict[str, Tuple[int, int]] = {}
+        for chunk_hash, size in chunks:
+            count, _ = counts.get(chunk_hash, (0, size))
+            counts[chunk_hash] = (count + 1, size)
+        
+        for chunk_hash, (count, size) in counts.items():
+            updated = db.query(ChunkRecord).filter(ChunkRecord.hash == chunk_hash).update(
+                {ChunkRecord.ref_count: ChunkRecord.ref_count + count},
+                synchronize_session=False
+            )
+            if not updated:
+                db.add(ChunkRecord(hash=chunk_hash, size=size, ref_count=count))
+    
+    def release_refs(self, db: Session, chunks: List[List]):
+        """
+        减少清单中分块的引用次数（不提交事务，分块文件由回收任务删除）
+        
+        Args:
+            db: 数据库会话
+            chunks: 清单中的分块列表 [[哈希, 大小], ...]
+        """
+        counts: Dict[str, int] = {}
+        for chunk_hash, _ in chunks:
+            counts[chunk_hash] = counts.get(chunk_hash, 0) + 1
+        
+        for chunk_hash, count in counts.items():
+            db.query(ChunkRecord).filter(ChunkRecord.hash == chunk_hash).update(
+                {ChunkRecord.ref_count: ChunkRecord.ref_count - count},
+                synchronize_session=False
+            )
+    
+    def collect_garbage(self, db: Session) -> Dict[str, int]:
+        """
+        回收引用数为0的分块
+        
+        Returns:
+            统计信息
+        """
+        stats = {"chunks_removed": 0, "bytes_reclaimed": 0}
+        
+        while True:
+            rows = db.query(ChunkRecord).filter(
+                ChunkRecord.ref_count <= 0
+            ).limit(GC_BATCH_SIZE).all()
+            if not rows:
+                break
+            
+            for row in rows:
+                try:
+                    self.chunk_path(row.hash).unlink()
+                except FileNotFoundError:
+                    pass
+                stats["chunks_removed"] += 1
+                stats["bytes_reclaimed"] += row.size
+                db.delete(row)
+            db.commit()
+        
+        return stats
+
+
+def read_manifest(path: Path) -> Optional[dict]:
+    """
+    读取分块清单
+    
+    Returns:
+        清单字典（size/md5/chunks），文件不是分块清单时返回None
+    """
+    try:
+        with open(path, "rb") as f:
+            if f.read(len(MANIFEST_MAGIC)) != MANIFEST_MAGIC:
+                return None
+            return json.loads(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+def write_manifest(path: Path, manifest: dict):
+    """写入分块清单并落盘"""
+    with open(path, "wb") as f:
+        f.write(MANIFEST_MAGIC)
+        f.write(json.dumps(manifest, separators=(",", ":")).encode("utf-8"))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class ChunkedFile(io.RawIOBase):
+    """按清单拼接分块的只读文件对象（支持seek）"""
+    
+    def __init__(self, store: ChunkStore, manifest: dict):
+        super().__init__()
+        self._store = store
+        self._chunks = manifest["chunks"]
+        self._offsets = []
+        offset = 0
+        for _, size in self._chunks:
+            self._offsets.append(offset)
+            offset += size
+        self.size = offset
+        self._pos = 0
+        self._current_index = -1
+        self._current = None
+    
+    def readable(self) -> bool:
+        return True
+    
+    def seekable(self) -> bool:
+        return True
+    
+    def tell(self) -> int:
+        return self._pos
+    
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        elif whence == io.SEEK_END:
+            self._pos = self.size + offset
+        self._pos = max(0, self._pos)
+        return self._pos
+    
+    def readinto(self, buffer) -> int:
+        if self._pos >= self.size:
+            return 0
+        
+        index = bisect.bisect_right(self._offsets, self._pos) - 1
+        if index != self._current_index:
+            if self._current:
+                self._current.close()
+            self._current = open(self._store.chunk_path(self._chunks[index][0]), "rb")
+            self._current_index = index
+        
+        chunk_offset = self._pos - self._offsets[index]
+        chunk_remaining = self._chunks[index][1] - chunk_offset
+        view = memoryview(buffer)[:min(len(buffer), chunk_remaining)]
+        
+        self._current.seek(chunk_offset)
+        count = self._current.readinto(view)
+        if not count:
+            raise IOError(f"分块数据不完整: {self._chunks[index][0]}")
+        self._pos += count
+        return count
+    
+    def close(self):
+        if self._current:
+            self._current.close()
+            self._current = None
+        super().close()
+
+
+def open_stored_file(file: File) -> BinaryIO:
+    """
+    打开文件内容（已分块的文件按清单拼接）
+    
+    Args:
+        file: 文件对象
+    
+    Returns:
+        二进制只读文件对象
+    """
+    path = Path(file.file_path)
+    manifest = read_manifest(path) if file.is_chunked else None
+    if manifest is None:
+        return open(path, "rb")
+    return io.BufferedReader(ChunkedFile(ChunkStore(), manifest), buffer_size=1024 * 1024)
+
+
+def _parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    解析单段Range请求头
+    
+    Returns:
+        (起始位置, 结束位置)，没有Range时返回None
+    """
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    
+    start_text, _, end_text = range_header[len("bytes="):].strip().partition("-")
+    try:
+        if start_text:
+            start = int(start_text)
+            end = int(end_text) if end_text else size - 1
+        else:
+            start = max(0, size - int(end_text))
+            end = size - 1
+    except ValueError:
+        return None
+    
+    if start >= size or start > end:
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            detail="请求的范围无效",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    return start, min(end, size - 1)
+
+
+def _iter_range(manifest: dict, start: int, end: int) -> Iterator[bytes]:
+    """按范围流式读取分块内容"""
+    with ChunkedFile(ChunkStore(), manifest) as reader:
+        reader.seek(start)
+        remaining = end - start + 1
+        buffer = bytearray(1024 * 1024)
+        while remaining > 0:
+            count = reader.readinto(memoryview(buffer)[:min(len(buffer), remaining)])
+            if not count:
+                break
+            remaining -= count
+            yield bytes(buffer[:count])
+
+
+def stored_file_response(
+    file: File,
+    request: Request,
+    filename: Optional[str] = None,
+    media_type: Optional[str] = None
+):
+    """
+    返回文件内容的响应（已分块的文件流式拼接并支持Range，其余文件直接返回）
+    
+    Args:
+        file: 文件对象
+        request: 请求对象（读取Range请求头）
+        filename: 下载文件名（为空时不设置Content-Disposition）
+        media_type: 内容类型（默认使用文件记录的MIME类型）
+    
+    Returns:
+        FileResponse或StreamingResponse
+    """
+    media_type = media_type or file.mime_type or "application/octet-stream"
+    path = Path(file.file_path)
+    manifest = read_manifest(path) if file.is_chunked else None
+    
+    if manifest is None:
+        return FileResponse(path=path, filename=filename, media_type=media_type)
+    
+    size = manifest["size"]
+    byte_range = _parse_range(request.headers.get("range"), size)
+    start, end = byte_range or (0, size - 1)
+    
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Length": str(end - start + 1),
+    }
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    if filename:
+        headers["Content-Disposition"] = f"attachment; filename*=utf-8''{quote(filename)}"
+    
+    return StreamingResponse(
+        _iter_range(manifest, start, end),
+        status_code=status.HTTP_206_PARTIAL_CONTENT if byte_range else status.HTTP_200_OK,
+        media_type=media_type,
+        headers=headers
+    )
+
+
+def build_manifest(store: ChunkStore, path: Path) -> Tuple[dict, Dict[str, int]]:
+    """
+    将文件切分为分块写入分块存储并生成清单
+    
+    Returns:
+        (清单, 统计信息)
+    """
+    md5_hash = hashlib.md5()
+    chunks = []
+    size = 0
+    stats = {"chunks": 0, "new_chunks": 0, "new_bytes": 0}
+    
+    with open(path, "rb") as f:
+        for data in iter_chunks(f):
+            md5_hash.update(data)
+            chunk_hash, is_new = store.write_chunk(data)
+            chunks.append([chunk_hash, len(data)])
+            size += len(data)
+            stats["chunks"] += 1
+            if is_new:
+                stats["new_chunks"] += 1
+                stats["new_bytes"] += len(data)
+    
+    return {"size": size, "md5": md5_hash.hexdigest(), "chunks": chunks}, stats
+
+
+def convert_file(db: Session, store: ChunkStore, file: File) -> Optional[Dict[str, int]]:
+    """
+    将文件转换为分块存储
+    
+    先写入分块和临时清单，再按原路径条件更新记录并提交，最后用清单替换原文件。
+    转换期间文件被修改、移动或删除时放弃转换。
+    
+    Args:
+        db: 数据库会话
+        store: 分块存储
+        file: 文件对象
+    
+    Returns:
+        统计信息，放弃转换时返回None
+    """
+    path = Path(file.file_path)
+    try:
+        before = path.stat()
+    except OSError:
+        return None
+    
+    manifest, stats = build_manifest(store, path)
+    if file.md5_hash and manifest["md5"] != file.md5_hash:
+        print(f"[CHUNKSTORE] 内容与记录不一致，跳过: {path}")
+        return None
+    
+    temp_path = path.with_name(f"{TEMP_PREFIX}{path.name}")
+    write_manifest(temp_path, manifest)
+    
+    try:
+        after = path.stat()
+    except OSError:
+        after = None
+    if after is None or (after.st_size, after.st_mtime_ns) != (before.st_size, before.st_mtime_ns):
+        temp_path.unlink(missing_ok=True)
+        return None
+    
+    store.add_refs(db, manifest["chunks"])
+    updated = db.query(File).filter(
+        File.id == file.id,
+        File.file_path == str(path),
+        File.is_chunked == False
+    ).update(
+        {File.is_chunked: True, File.updated_at: File.updated_at},
+        synchronize_session=False
+    )
+    if not updated:
+        db.rollback()
+        temp_path.unlink(missing_ok=True)
+        return None
+    
+    # 先提交再替换：中途异常时记录为已分块但文件仍是原始内容，读取时会按原始文件处理
+    db.commit()
+    os.replace(temp_path, path)
+    
+    return stats
+
+
+def release_stored_file(db: Session, path: Path):
+    """
+    释放分块清单引用的分块（文件彻底删除前调用，不提交事务）
+    
+    Args:
+        db: 数据库会话
+        path: 分块清单路径
+    """
+    manifest = read_manifest(path)
+    if manifest is not None:
+        ChunkStore().release_refs(db, manifest["chunks"])
+
+
+def run_chunk_store(db: Session) -> dict:
+    """
+    分块存储后台任务：回收无引用的分块，并将符合条件的大文件转换为分块存储
+    
+    每次转换的数据量和时间有上限（转换期间任务锁一直被占用），超过时剩余文件留到下次；
+    超过数据量上限的单个文件不会被转换。
+    
+    Args:
+        db: 数据库会话
+    
+    Returns:
+        统计信息
+    """
+    store = ChunkStore()
+    stats = store.collect_garbage(db)
+    stats.update({"files_converted": 0, "bytes_converted": 0, "new_bytes": 0, "skipped": 0,
+                  "deferred": 0, "chunker": chunker_name()})
+    
+    if not settings.CHUNK_STORE_ENABLED:
+        return stats
+    
+    max_bytes = settings.CHUNK_STORE_MAX_BYTES_PER_RUN
+    categories = [c.strip() for c in settings.CHUNK_STORE_CATEGORIES.split(",") if c.strip()]
+    files = db.query(File).filter(
+        File.is_folder == False,
+        File.is_deleted == False,
+        File.is_chunked == False,
+        File.size >= settings.CHUNK_STORE_MIN_FILE_SIZE,
+        File.size <= max_bytes,
+        File.category.in_(categories)
+    ).order_by(File.id).limit(settings.CHUNK_STORE_BATCH_SIZE).all()
+    
+    started = time.monotonic()
+    processed_bytes = 0
+    
+    for index, file in enumerate(files):
+        size = file.size or 0
+        elapsed = time.monotonic() - started
+        # 按本次已处理文件的速度估计，放不进剩余时间预算的文件留到下次（每次至少处理一个文件）
+        projected = elapsed + size * elapsed / processed_bytes if processed_bytes else elapsed
+        if index > 0 and (processed_bytes + size > max_bytes
+                          or projected > settings.CHUNK_STORE_MAX_SECONDS_PER_RUN):
+            stats["deferred"] = len(files) - index
+            break
+        
+        result = convert_file(db, store, file)
+        processed_bytes += size
+        if result is None:
+            stats["skipped"] += 1
+            continue
+        stats["files_converted"] += 1
+        stats["bytes_converted"] += size
+        stats["new_bytes"] += result["new_bytes"]
+    
+    return stats
+
+
+scheduler.register("chunk_store", settings.CHUNK_STORE_INTERVAL, run_chunk_store)
+
+
+# ==================== 基准测试 ====================
+
+def _read_throughput(open_func, size: int) -> float:
+    """顺序读取并返回吞吐量（MB/s）"""
+    started = time.perf_counter()
+    with open_func() as f:
+        while f.read(1024 * 1024):
+            pass
+    elapsed = max(time.perf_counter() - started, 1e-9)
+    return size / 1024 / 1024 / elapsed
+
+
+def _cdc_throughput(paths: List[str]) -> float:
+    """只计算分块边界（不哈希、不写入）的速度（MB/s），最多读取BENCHMARK_CDC_SAMPLE_BYTES"""
+    total = 0
+    elapsed = 0.0
+    for path in paths:
+        with open(path, "rb") as f:
+            sample = io.BytesIO(f.read(BENCHMARK_CDC_SAMPLE_BYTES - total))
+        started = time.perf_counter()
+        for _ in iter_chunks(sample):
+            pass
+        elapsed += time.perf_counter() - started
+        total += len(sample.getbuffer())
+        if total >= BENCHMARK_CDC_SAMPLE_BYTES:
+            break
+    return total / 1024 / 1024 / max(elapsed, 1e-9)
+
+
+def benchmark(paths: List[str]) -> dict:
+    """
+    在临时分块存储中评估去重效果、分块速度和读取开销（不修改任何数据）
+    
+    chunking_mb_s为完整转换（分块、SHA-256、写入分块文件）的速度，cdc_mb_s只计算分块边界；
+    max_run_seconds为按该速度转换CHUNK_STORE_MAX_BYTES_PER_RUN所需的时间（后台任务期间一直占用任务锁）。
+    
+    Args:
+        paths: 文件或目录列表
+    
+    Returns:
+        基准测试结果
+    """
+    files = []
+    for item in paths:
+        if os.path.isdir(item):
+            for dir_path, _, names in os.walk(item):
+                files.extend(os.path.join(dir_path, name) for name in sorted(names))
+        elif os.path.isfile(item):
+            files.append(item)
+    
+    result = {
+        "files": 0,
+        "total_bytes": 0,
+        "chunks": 0,
+        "unique_chunks": 0,
+        "stored_bytes": 0,
+        "chunker": chunker_name(),
+        "chunking_mb_s": 0.0,
+        "cdc_mb_s": 0.0,
+        "max_run_seconds": None,
+        "raw_read_mb_s": 0.0,
+        "chunked_read_mb_s": 0.0,
+    }
+    
+    temp_root = tempfile.mkdtemp(prefix=".chunk-bench-", dir=settings.TEMP_PATH)
+    try:
+        store = ChunkStore(temp_root)
+        manifests = []
+        chunk_seconds = 0.0
+        
+        for path in files:
+            started = time.perf_counter()
+            manifest, stats = build_manifest(store, Path(path))
+            chunk_seconds += time.perf_counter() - started
+            manifests.append((path, manifest))
+            result["files"] += 1
+            result["total_bytes"] += manifest["size"]
+            result["chunks"] += stats["chunks"]
+            result["unique_chunks"] += stats["new_chunks"]
+            result["stored_bytes"] += stats["new_bytes"]
+        
+        total_mb = result["total_bytes"] / 1024 / 1024
+        raw_seconds = 0.0
+        chunked_seconds = 0.0
+        for path, manifest in manifests:
+            size_mb = manifest["size"] / 1024 / 1024
+            raw_seconds += size_mb / _read_throughput(lambda: open(path, "rb"), manifest["size"])
+            chunked_seconds += size_mb / _read_throughput(
+                lambda: io.BufferedReader(ChunkedFile(store, manifest), buffer_size=1024 * 1024),
+                manifest["size"]
+            )
+        
+        if result["total_bytes"]:
+            result["dedup_ratio"] = round(result["total_bytes"] / max(result["stored_bytes"], 1), 3)
+            result["space_saved_percent"] = round(100 - 100 * result["stored_bytes"] / result["total_bytes"], 1)
+            result["chunking_mb_s"] = round(total_mb / max(chunk_seconds, 1e-9), 1)
+            result["cdc_mb_s"] = round(_cdc_throughput(files), 1)
+            result["max_run_seconds"] = round(
+                settings.CHUNK_STORE_MAX_BYTES_PER_RUN / 1024 / 1024 / max(result["chunking_mb_s"], 0.1)
+            )
+            result["raw_read_mb_s"] = round(total_mb / max(raw_seconds, 1e-9), 1)
+            result["chunked_read_mb_s"] = round(total_mb / max(chunked_seconds, 1e-9), 1)
+            result["avg_chunk_size"] = result["total_bytes"] // max(result["chunks"], 1)
+    finally:
+        shutil.rmtree(temp_root, ignore_errors=True)
+    
+    return result
+
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="RaspberryCloud分块去重存储")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    bench_parser = subparsers.add_parser("benchmark", help="评估去重率、分块速度和读取开销（不修改数据）")
+    bench_parser.add_argument("paths", nargs="+", help="文件或目录")
+    
+    args = parser.parse_args()
+    
+    if args.command == "benchmark":
+        report = benchmark(args.paths)
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        if report["chunker"] == "python":
+            print("提示: 未安装pyfastcdc，正在使用纯Python分块；启用分块存储前建议执行 pip install pyfastcdc")
@@ -32,6 +32,40 @@ class Settings(BaseSettings):
     TEMP_PATH: str = "/opt/raspberrycloud/storage/temp"
     BACKUP_PATH: str = "/opt/raspberrycloud/storage/backups"
     
+    # 多存储卷配置
+    # STORAGE_PATH为默认卷；额外的卷格式为“名称=路径”，逗号分隔，例如
+    # usb1=/mnt/usb1/users,usb2=/mnt/usb2/users（未挂载的卷不会被使用）
+    STORAGE_VOLUMES: str = ""
+    STORAGE_PLACEMENT_POLICY: str = "free_space"  # free_space / round_robin / pinned
+    VOLUME_RESERVED_BYTES: int = 1 * 1024 * 1024 * 1024  # 每个卷保留1GB剩余空间
+    
+    # 冷热分层配置
+    # COLD_VOLUMES中的卷为冷存储（如USB机械硬盘），其余为热存储（SD卡/SSD）
+    COLD_VOLUMES: str = ""
+    TIERING_ENABLED: bool = False
+    TIERING_INTERVAL: int = 3600  # 分层迁移间隔（秒）
+    TIERING_COLD_AFTER_DAYS: int = 30  # 超过该天数未访问的大文件降级到冷存储
+    TIERING_COLD_MIN_SIZE: int = 64 * 1024 * 1024  # 降级的最小文件大小（64MB）
+    TIERING_HOT_WINDOW_DAYS: int = 7  # 该天数内被频繁访问的文件升级到热存储
+    TIERING_PROMOTE_MIN_ACCESSES: int = 3  # 升级所需的最少访问次数
+    TIERING_HOT_MAX_SIZE: int = 256 * 1024 * 1024  # 升级的最大文件大小（256MB）
+    TIERING_BATCH_SIZE: int = 50  # 每次最多迁移的文件数（升级、降级各计）
+    TIERING_MAX_BYTES_PER_RUN: int = 20 * 1024 * 1024 * 1024  # 每次最多迁移20GB
+    ACCESS_FLUSH_INTERVAL: int = 60  # 访问计数写入数据库的间隔（秒）
+    
+    # 分块去重存储（内容定义分块，适合经常小幅修改后重新上传的大文件）
+    CHUNK_STORE_ENABLED: bool = False
+    CHUNK_STORE_PATH: str = "/opt/raspberrycloud/storage/chunks"
+    CHUNK_STORE_INTERVAL: int = 3600  # 后台分块转换间隔（秒）
+    CHUNK_STORE_MIN_FILE_SIZE: int = 64 * 1024 * 1024  # 只转换64MB以上的文件
+    CHUNK_STORE_CATEGORIES: str = "document,other"  # 参与分块的文件类别，逗号分隔
+    CHUNK_STORE_BATCH_SIZE: int = 20  # 每次最多转换的文件数
+    CHUNK_STORE_MAX_BYTES_PER_RUN: int = 4 * 1024 * 1024 * 1024  # 每次最多转换4GB（更大的文件不转换）
+    CHUNK_STORE_MAX_SECONDS_PER_RUN: int = 900  # 每次转换的时间预算（秒），超过后留到下次
+    CHUNK_MIN_SIZE: int = 256 * 1024  # 最小分块256KB
+    CHUNK_AVG_SIZE: int = 1024 * 1024  # 平均分块1MB
+    CHUNK_MAX_SIZE: int = 4 * 1024 * 1024  # 最大分块4MB
+    
     # 文件限制
     MAX_FILE_SIZE: int = 10 * 1024 * 1024 * 1024  # 10GB
     MAX_UPLOAD_THREADS: int = 5
@@ -67,13 +101,97 @@ class Settings(BaseSettings):
     THUMBNAIL_SIZE: tuple = (200, 200)
     PREVIEW_SIZE: tuple = (1920, 1080)
     
+    # 文件列表缓存（按文件夹版本号缓存编码后的列表，文件夹内容变化后自动失效）
+    LISTING_CACHE_MAX_BYTES: int = 16 * 1024 * 1024
+    
+    # 派生文件缓存（缩略图、视频封面按内容MD5存放，所有用户共用，相同内容只生成一次）
+    DERIVATIVE_CACHE_PATH: str = "/opt/raspberrycloud/storage/derivatives"
+    DERIVATIVE_CACHE_MAX_BYTES: int = 2 * 1024 * 1024 * 1024  # 磁盘预算（2GB），超过后淘汰最久未访问的
+    DERIVATIVE_CACHE_INTERVAL: int = 600  # 淘汰检查间隔（秒）
+    
+    # 图片缩放配置（请求的宽高向上取整到以下尺寸之一，质量取最接近的一档）
+    IMAGE_RESIZE_SIZES: str = "64,128,256,320,480,640,800,1024,1280,1600,1920,2560"
+    IMAGE_RESIZE_QUALITIES: str = "60,75,85,95"
+    IMAGE_RESIZE_WORKERS: int = 2  # 缩放线程数（树莓派上建议不超过CPU核数）
+    
+    # 媒体处理配置（视频快速启动副本和封面，需要安装ffmpeg）
+    MEDIA_PROCESSING_ENABLED: bool = True
+    FFMPEG_PATH: str = "ffmpeg"
+    MEDIA_PROCESSING_INTERVAL: int = 600  # 秒
+    MEDIA_BATCH_SIZE: int = 20  # 每次最多处理的视频数
+    MEDIA_FFMPEG_TIMEOUT: int = 1800  # 单次ffmpeg调用的超时时间（秒）
+    
+    # 文档预览配置（PDF需要poppler-utils的pdftoppm，Office文档还需要LibreOffice，未安装时跳过）
+    PDFTOPPM_PATH: str = "pdftoppm"
+    OFFICE_CONVERTER_PATH: str = "soffice"
+    DOCUMENT_PREVIEW_PAGES: int = 3  # 渲染前几页
+    DOCUMENT_PREVIEW_SIZE: int = 1024  # 页面图片长边像素
+    DOCUMENT_PREVIEW_MAX_SIZE: int = 100 * 1024 * 1024  # 超过该大小的文档不生成预览
+    DOCUMENT_PREVIEW_TIMEOUT: int = 300  # 单次转换的超时时间（秒）
+    
+    # 全文搜索配置（.txt/.pdf/.docx，PDF需要poppler-utils的pdftotext）
+    CONTENT_INDEX_ENABLED: bool = True
+    PDFTOTEXT_PATH: str = "pdftotext"
+    CONTENT_INDEX_INTERVAL: int = 600  # 秒
+    CONTENT_INDEX_BATCH_SIZE: int = 50  # 每次最多索引的文档数
+    CONTENT_INDEX_MAX_FILE_SIZE: int = 50 * 1024 * 1024  # 超过该大小的文档不索引
+    CONTENT_INDEX_MAX_CHARS: int = 1_000_000  # 每个文档最多索引的字符数（超过部分截断）
+    CONTENT_INDEX_TIMEOUT: int = 120  # 单个PDF提取文本的超时时间（秒）
+    
+    # 照片时间线配置（从EXIF提取拍摄时间、尺寸、相机和GPS）
+    PHOTO_METADATA_INTERVAL: int = 300  # 为导入、同步等途径新增的图片补充元数据的间隔（秒）
+    PHOTO_METADATA_BATCH_SIZE: int = 1000  # 每次最多处理的图片数
+    
+    # HLS转码配置（默认关闭，开启后用户可为单个视频发起转码）
+    HLS_ENABLED: bool = False
+    HLS_ENCODER: str = "ffmpeg"  # ffmpeg / stub（测试用，不转码）
+    HLS_RENDITIONS: str = "480p,720p"  # 可选: 360p, 480p, 720p, 1080p
+    HLS_THREADS: int = 2  # 转码使用的线程数
+    HLS_INTERVAL: int = 300  # 检查转码队列的间隔（秒）
+    HLS_TIMEOUT: int = 6 * 3600  # 单个版本的转码超时时间（秒）
+    
+    # 批量操作配置
+    BATCH_MAX_ITEMS: int = 5000  # 单次批量操作的最大条目数
+    COPY_BACKGROUND_MIN_BYTES: int = 256 * 1024 * 1024  # 复制总大小超过此值时转为后台任务
+    COPY_BACKGROUND_MIN_ITEMS: int = 500  # 复制条目数超过此值时转为后台任务
+    COPY_PROGRESS_INTERVAL: float = 1.0  # 后台复制写入进度的最小间隔（秒）
+    COPY_JOB_RETENTION_DAYS: int = 7  # 已结束的复制任务记录保留天数
+    
     # 同步配置
     SYNC_INTERVAL: int = 60  # 秒
+    DELTA_BLOCK_SIZE: int = 64 * 1024  # 增量同步默认分块大小
+    SYNC_COMPACTION_INTERVAL: int = 3600  # 变更记录合并间隔（秒）
+    SYNC_CHANGES_PAGE_SIZE: int = 1000  # 变更列表每页默认记录数
+    MANIFEST_MAX_BYTES: int = 256 * 1024 * 1024  # 清单比对：解压后的最大大小
+    MANIFEST_MAX_ENTRIES: int = 1_000_000  # 清单比对：最大条目数
+    
+    # WebSocket变更推送配置
+    WS_POLL_INTERVAL: float = 1.0  # 每个工作进程轮询变更记录的间隔（秒）
+    WS_MAX_CONNECTIONS_PER_USER: int = 10
+    
+    # 后台维护配置
+    MAINTENANCE_ENABLED: bool = True
+    MAINTENANCE_INTERVAL: int = 3600  # 秒
+    MAINTENANCE_BATCH_SIZE: int = 500  # 每批删除的行数
+    UPLOAD_SESSION_EXPIRE_HOURS: int = 24  # 未完成上传会话的保留时间
+    TEMP_FILE_EXPIRE_HOURS: int = 24  # 临时文件的保留时间
+    MAINTENANCE_HISTORY_KEEP: int = 100  # 每个任务保留的执行记录条数
+    
+    # 回收站配置
+    TRASH_RETENTION_DAYS: int = 30  # 回收站保留天数，超过后物理删除
+    TRASH_PURGE_INTERVAL: int = 600  # 清理任务执行间隔（秒）
+    TRASH_PURGE_BATCH_SIZE: int = 50  # 每批物理删除的条目数
+    TRASH_PURGE_BATCH_PAUSE: float = 0.5  # 批次之间的暂停（秒），避免占满SD卡I/O
+    
+    # 增量备份配置（也可以通过 scripts/backup.sh 由cron触发）
+    BACKUP_ENABLED: bool = False  # 是否由后台任务定期备份
+    BACKUP_INTERVAL: int = 86400  # 秒
+    BACKUP_KEEP_SNAPSHOTS: int = 7  # 保留的快照数
     
     class Config:
         env_file = ".env"
         case_sensitive = True
-
+    
     def ensure_directories(self):
         """确保所有必要的目录存在"""
         directories = [
@@ -0,0 +1,497 @@
+"""
+存储一致性检查模块
+比对files表与所有存储卷下的实际文件，发现并（可选）修复不一致
+
+检查项：
+- missing_blob: 记录存在但物理文件缺失
+- orphan: 物理文件存在但没有任何记录引用
+- stale_path: 记录路径失效（如文件夹重命名后子条目路径未更新），但按父级推导的路径存在
+- size_mismatch: 记录大小与实际文件大小不一致
+- type_mismatch: 记录为文件夹但实际是文件（或相反）
+- used_space_mismatch: 用户已用空间与文件大小总和不一致
+
+位于未挂载存储卷上的记录只计数（scanned.offline_rows），不做任何判断和修复。
+
+用法：
+    python consistency.py                      # 只检查
+    python consistency.py --repair paths,sizes,quota --output report.jsonl
+"""
+
+import json
+import os
+import sqlite3
+import tempfile
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from models import File, User, PurgeItem, SessionLocal
+from config import settings
+from volumes import volumes
+from changes import record_change
+
+
+# 可选修复动作
+REPAIR_ACTIONS = {"paths", "sizes", "quota", "missing"}
+
+# 每批处理的记录数
+SCAN_BATCH_SIZE = 1000
+
+
+class ScanIndex:
+    """
+    磁盘扫描结果索引
+    
+    扫描结果写入临时SQLite数据库而不是内存，保证百万级文件时内存占用有界。
+    """
+    
+    def __init__(self, directory: str):
+        fd, self.path = tempfile.mkstemp(prefix=".consistency-", suffix=".db", dir=directory)
+        os.close(fd)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=OFF")
+        self.conn.execute("PRAGMA synchronous=OFF")
+        self.conn.execute(
+            "CREATE TABLE entries ("
+            "path TEXT PRIMARY KEY, is_dir INTEGER, size INTEGER, seen INTEGER DEFAULT 0"
+            ") WITHOUT ROWID"
+        )
+        self._pending_seen: List[Tuple[str]] = []
+    
+    def add_many(self, entries: Iterable[Tuple[str, int, int]]):
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO entries (path, is_dir, size) VALUES (?, ?, ?)",
+            entries
+        )
+    
+    def lookup(self, path: str) -> Optional[Tuple[int, int]]:
+        """返回(is_dir, size)，不存在返回None"""
+        return self.conn.execute(
+            "SELECT is_dir, size FROM entries WHERE path = ?", (path,)
+        ).fetchone()
+    
+    def mark_seen(self, path: str):
+        self._pending_seen.append((path,))
+        if len(self._pending_seen) >= SCAN_BATCH_SIZE:
+            self.flush()
+    
+    def flush(self):
+        if self._pending_seen:
+            self.conn.executemany("UPDATE entries SET seen = 1 WHERE path = ?", self._pending_seen)
+            self._pending_seen.clear()
+        self.conn.commit()
+    
+    def iter_unseen(self) -> Iterable[Tuple[str, int, int]]:
+        self.flush()
+        cursor = self.conn.execute("SELECT path, is_dir, size FROM entries WHERE seen = 0 ORDER BY path")
+        while rows := cursor.fetchmany(SCAN_BATCH_SIZE):
+            yield from rows
+    
+    def count(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+    
+    def close(self):
+        self.conn.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+class ConsistencyReport:
+    """
+    检查报告
+    
+    只保存每类问题的计数和有限数量的样例，完整明细可选写入JSONL文件。
+    """
+    
+    def __init__(self, max_samples: int = 100, output_path: Optional[str] = None):
+        self.max_samples = max_samples
+        self.counts: Dict[str, int] = {}
+        self.samples: Dict[str, List[dict]] = {}
+        self.repaired: Dict[str, int] = {}
+        self.scanned = {"disk_entries": 0, "db_rows": 0, "offline_rows": 0}
+        self._output = open(output_path, "w", encoding="utf-8") if output_path else None
+    
+    def add(self, kind: str, **detail):
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+        samples = self.samples.setdefault(kind, [])
+        if len(samples) < self.max_samples:
+            samples.append(detail)
+        if self._output:
+            self._output.write(json.dumps({"kind": kind, **detail}, ensure_ascii=False) + "\n")
+    
+    def add_repaired(self, kind: str, count: int = 1):
+        self.repaired[kind] = self.repaired.get(kind, 0) + count
+    
+    def close(self):
+        if self._output:
+            self._output.close()
+            self._output = None
+    
+    def to_dict(self) -> dict:
+        return {
+            "scanned": self.scanned,
+            "issues": self.counts,
+            "repaired": self.repaired,
+            "samples": self.samples,
+        }
+
+
+def _scan_directory(path: str) -> Tuple[List[Tuple[str, int, int]], List[str]]:
+    """
+    扫描单个目录（在工作线程中执行）
+    
+    以“.”开头的条目（如.media视频派生文件目录）属于派生数据，不参与比对。
+    
+    Returns:
+        (条目列表[(路径, 是否目录, 大小)], 子目录列表)
+    """
+    entries = []
+    subdirs = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.name.startswith("."):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        entries.append((entry.path, 1, 0))
+                        subdirs.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        entries.append((entry.path, 0, entry.stat(follow_symlinks=False).st_size))
+                except OSError:
+                    continue
+    except OSError as e:
+        print(f"[CONSISTENCY] 无法读取目录 {path}: {e}")
+    return entries, subdirs
+
+
+def scan_storage(index: ScanIndex, root: str, workers: int = 4) -> int:
+    """
+    多线程扫描存储目录，结果写入扫描索引
+    
+    目录扫描在线程池中并行执行，结果由当前线程统一写入索引。
+    同时进行中的目录数受限，避免目录树很大时待处理任务无限增长。
+    
+    Args:
+        index: 扫描索引
+        root: 根目录
+        workers: 工作线程数
+    
+    Returns:
+        扫描到的条目数
+    """
+    if not os.path.isdir(root):
+        return 0
+    
+    total = 0
+    pending_dirs = deque()
+    max_in_flight = workers * 4
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # 用户根目录本身不是files表中的条目，只作为扫描起点
+        _, user_dirs = _scan_directory(root)
+        pending_dirs.extend(user_dirs)
+        in_flight = set()
+        
+        while pending_dirs or in_flight:
+            while pending_dirs and len(in_flight) < max_in_flight:
+                directory = pending_dirs.popleft()
+                in_flight.add(executor.submit(_scan_directory, directory))
+            
+            if not in_flight:
+                continue
+            
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                entries, subdirs = future.result()
+                index.add_many(entries)
+                total += len(entries)
+                pending_dirs.extend(subdirs)
+    
+    index.flush()
+    return total
+
+
+class _FolderPathCache:
+    """文件夹实际路径的LRU缓存（容量有界，未命中时回查数据库）"""
+    
+    def __init__(self, capacity: int = 10000):
+        self.capacity = capacity
+        self._data: "OrderedDict[int, str]" = OrderedDict()
+    
+    def get(self, folder_id: int) -> Optional[str]:
+        path = self._data.get(folder_id)
+        if path is not None:
+            self._data.move_to_end(folder_id)
+        return path
+    
+    def put(self, folder_id: int, path: str):
+        self._data[folder_id] = path
+        self._data.move_to_end(folder_id)
+        if len(self._data) > self.capacity:
+            self._data.popitem(last=False)
+
+
+class ConsistencyChecker:
+    """存储一致性检查器"""
+    
+    def __init__(
+        self,
+        db: Session,
+        repair: Optional[Set[str]] = None,
+        workers: int = 4,
+        output_path: Optional[str] = None,
+        max_samples: int = 100
+    ):
+        self.db = db
+        self.repair = set(repair or ())
+        unknown = self.repair - REPAIR_ACTIONS
+        if unknown:
+            raise ValueError(f"未知的修复动作: {', '.join(sorted(unknown))}")
+        self.workers = workers
+        self.report = ConsistencyReport(max_samples=max_samples, output_path=output_path)
+        self._folder_paths = _FolderPathCache()
+        self._index: Optional[ScanIndex] = None
+    
+    def run(self) -> dict:
+        """
+        执行一次完整检查
+        
+        Returns:
+            检查报告字典
+        """
+        self._index = ScanIndex(settings.TEMP_PATH)
+        try:
+            self.report.scanned["disk_entries"] = 0
+            for volume in volumes.volumes:
+                if volume.online:
+                    self.report.scanned["disk_entries"] += scan_storage(
+                        self._index, str(volume.root), self.workers
+                    )
+            owner_sizes = self._check_rows()
+            self._check_orphans()
+            self._check_used_space(owner_sizes)
+            self.db.commit()
+        finally:
+            self._index.close()
+            self._index = None
+            self.report.close()
+        
+        return self.report.to_dict()
+    
+    def _resolve_path(self, file_id: int, stored_path: str, parent_id: Optional[int],
+                      owner_id: int, filename: str) -> Tuple[str, Optional[Tuple[int, int]]]:
+        """
+        推导条目的实际路径
+        
+        记录路径存在时直接使用；否则按“父级实际路径/文件名”推导（保持记录所在的存储卷），
+        推导路径存在则视为路径失效。
+        
+        Returns:
+            (实际路径, 磁盘条目信息或None)
+        """
+        found = self._index.lookup(stored_path)
+        if found is not None:
+            return stored_path, found
+        
+        volume = volumes.volume_for_path(stored_path)
+        if parent_id is None:
+            parent_path = str(volume.root / str(owner_id))
+        else:
+            parent_path = self._folder_path(parent_id)
+        if parent_path is None:
+            return stored_path, None
+        
+        expected = os.path.join(str(volumes.path_on(volume, parent_path)), filename)
+        found = self._index.lookup(expected)
+        if found is not None:
+            return expected, found
+        return stored_path, None
+    
+    def _folder_path(self, folder_id: int) -> Optional[str]:
+        """获取文件夹的实际路径（缓存未命中时回查数据库并递归推导）"""
+        path = self._folder_paths.get(folder_id)
+        if path is not None:
+            return path
+        
+        row = self.db.query(
+            File.file_path, File.parent_id, File.owner_id, File.filename
+        ).filter(File.id == folder_id).first()
+        if row is None:
+            return None
+        
+        path, _ = self._resolve_path(folder_id, row[0], row[1], row[2], row[3])
+        self._folder_paths.put(folder_id, path)
+        return path
+    
+    def _check_rows(self) -> Dict[int, int]:
+        """
+        按ID顺序分批读取files表并与扫描索引比对
+        
+        Returns:
+            每个用户未删除文件的大小总和
+        """
+        owner_sizes: Dict[int, int] = {}
+        last_id = 0
+        
+        while True:
+            rows = self.db.query(
+                File.id, File.file_path, File.parent_id, File.owner_id, File.filename,
+                File.size, File.is_folder, File.is_deleted, File.is_chunked
+            ).filter(File.id > last_id).order_by(File.id).limit(SCAN_BATCH_SIZE).all()
+            if not rows:
+                break
+            
+            for file_id, stored_path, parent_id, owner_id, filename, size, is_folder, is_deleted, is_chunked in rows:
+                self.report.scanned["db_rows"] += 1
+                if not volumes.volume_for_path(stored_path).online:
+                    self.report.scanned["offline_rows"] += 1
+                    if not is_folder and not is_deleted:
+                        owner_sizes[owner_id] = owner_sizes.get(owner_id, 0) + (size or 0)
+                    continue
+                
+                actual_path, found = self._resolve_path(file_id, stored_path, parent_id, owner_id, filename)
+                
+                if is_folder:
+                    self._folder_paths.put(file_id, actual_path)
+                    self._mark_mirrors_seen(actual_path)
+                
+                if found is None:
+                    if not is_deleted:
+                        self.report.add("missing_blob", id=file_id, path=stored_path)
+                        if "missing" in self.repair:
+                            self._mark_missing(file_id, owner_id)
+                        elif not is_folder:
+                            owner_sizes[owner_id] = owner_sizes.get(owner_id, 0) + (size or 0)
+                    continue
+                
+                self._index.mark_seen(actual_path)
+                found_is_dir, found_size = found
+                
+                if actual_path != stored_path:
+                    self.report.add("stale_path", id=file_id, path=stored_path, actual_path=actual_path)
+                    if "paths" in self.repair:
+                        self.db.query(File).filter(File.id == file_id).update(
+                            {File.file_path: actual_path}, synchronize_session=False
+                        )
+                        self.report.add_repaired("stale_path")
+                
+                if bool(found_is_dir) != bool(is_folder):
+                    self.report.add("type_mismatch", id=file_id, path=actual_path, is_folder=bool(is_folder))
+                    if not is_folder and not is_deleted:
+                        owner_sizes[owner_id] = owner_sizes.get(owner_id, 0) + (size or 0)
+                    continue
+                
+                # 已分块文件的磁盘上只有分块清单，大小不可比较
+                if not is_folder and not is_chunked and found_size != size:
+                    self.report.add("size_mismatch", id=file_id, path=actual_path, size=size, actual_size=found_size)
+                    if "sizes" in self.repair:
+                        self.db.query(File).filter(File.id == file_id).update(
+                            {File.size: found_size}, synchronize_session=False
+                        )
+                        self.report.add_repaired("size_mismatch")
+                        size = found_size
+                
+                if not is_folder and not is_deleted:
+                    owner_sizes[owner_id] = owner_sizes.get(owner_id, 0) + (size or 0)
+            
+            last_id = rows[-1][0]
+            if self.repair:
+                self.db.commit()
+        
+        return owner_sizes
+    
+    def _mark_mirrors_seen(self, folder_path: str):
+        """文件夹在其他存储卷上的镜像目录不算孤立条目"""
+        for volume in volumes.volumes:
+            self._index.mark_seen(str(volumes.path_on(volume, folder_path)))
+    
+    def _mark_missing(self, file_id: int, owner_id: int):
+        """将物理文件缺失的记录移入回收站"""
+        self.db.query(File).filter(File.id == file_id).update(
+            {File.is_deleted: True, File.deleted_at: datetime.utcnow()},
+            synchronize_session=False
+        )
+        record_change(self.db, owner_id, file_id, "deleted")
+        self.report.add_repaired("missing_blob")
+    
+    def _check_orphans(self):
+        """扫描索引中未被任何记录引用的条目即为孤立文件"""
+        # 已在清理队列中等待删除的文件不算孤立文件
+        last_id = 0
+        while True:
+            rows = self.db.query(PurgeItem.id, PurgeItem.file_path).filter(
+                PurgeItem.id > last_id
+            ).order_by(PurgeItem.id).limit(SCAN_BATCH_SIZE).all()
+            if not rows:
+                break
+            for _, path in rows:
+                self._mark_mirrors_seen(path)
+            last_id = rows[-1][0]
+        
+        for path, is_dir, size in self._index.iter_unseen():
+            self.report.add("orphan", path=path, is_dir=bool(is_dir), size=size)
+    
+    def _check_used_space(self, owner_sizes: Dict[int, int]):
+        """比对用户已用空间"""
+        for user in self.db.query(User).all():
+            expected = owner_sizes.get(user.id, 0)
+            if user.used_space != expected:
+                self.report.add(
+                    "used_space_mismatch",
+                    user_id=user.id, used_space=user.used_space, actual=expected
+                )
+                if "quota" in self.repair:
+                    user.used_space = expected
+                    self.report.add_repaired("used_space_mismatch")
+
+
+def run_consistency_check(
+    db: Session,
+    repair: Optional[Set[str]] = None,
+    workers: int = 4,
+    output_path: Optional[str] = None
+) -> dict:
+    """
+    执行一致性检查
+    
+    Args:
+        db: 数据库会话
+        repair: 修复动作集合（paths/sizes/quota/missing）
+        workers: 扫描线程数
+        output_path: 完整明细输出路径（JSONL，可选）
+    
+    Returns:
+        检查报告字典
+    """
+    checker = ConsistencyChecker(db, repair=repair, workers=workers, output_path=output_path)
+    return checker.run()
+
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="检查数据库与存储目录的一致性")
+    parser.add_argument("--repair", type=str, default="",
+                        help="修复动作，逗号分隔：paths,sizes,quota,missing")
+    parser.add_argument("--workers", type=int, default=4, help="扫描线程数")
+    parser.add_argument("--output", type=str, help="完整明细输出文件（JSONL）")
+    args = parser.parse_args()
+    
+    repair_actions = {a.strip() for a in args.repair.split(",") if a.strip()}
+    
+    db = SessionLocal()
+    try:
+        result = run_consistency_check(db, repair_actions, args.workers, args.output)
+    finally:
+        db.close()
+    
+    print(json.dumps(
+        {k: v for k, v in result.items() if k != "samples"},
+        ensure_ascii=False, indent=2
+    ))
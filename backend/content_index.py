@@ -0,0 +1,412 @@
+"""
+全文搜索模块
+后台提取 .txt / .pdf / .docx 的文本写入SQLite FTS5索引，按内容搜索文档：
+
+- 按内容MD5去重：相同内容只提取一次；文件内容变化（MD5变化）后作为新内容索引，
+  不再被任何文件使用的旧内容由后台任务删除
+- 提取全程流式读取：文本文件按块解码，docx按XML事件解析，PDF读取pdftotext的输出流，
+  达到CONTENT_INDEX_MAX_CHARS后停止，不会把大文件整个读入内存
+- 中日韩文字没有空格分词，索引时在每个字前后插入零宽空格（FTS5按分隔符处理），
+  查询时按短语匹配连续的字，相当于子串搜索
+
+索引结果记录在content_documents表：
+- indexed: 已索引
+- empty: 没有可提取的文本（如扫描版PDF）
+- skipped: 超过CONTENT_INDEX_MAX_FILE_SIZE，不索引
+- failed: 提取失败
+"""
+
+import codecs
+import html
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import zipfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List, Optional
+from xml.etree import ElementTree
+
+from fastapi import HTTPException, status
+from sqlalchemy import func, or_, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from models import User, File, ContentDocument
+from config import settings
+from chunkstore import open_stored_file
+from file_handler import chunked
+from maintenance import scheduler, run_task
+
+
+# 读取文本和命令输出的块大小
+READ_CHUNK_SIZE = 64 * 1024
+
+# 中日韩文字（汉字、假名、谚文）
+CJK_PATTERN = re.compile("([\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3040-\u30ff\uac00-\ud7af])")
+
+# 插入在中日韩文字两侧的分隔符（零宽空格，FTS5的unicode61分词器视为分隔符）
+CJK_SEPARATOR = "\u200b"
+
+# 摘要中标记命中词的占位符（HTML转义后替换为<mark>）
+MARK_OPEN, MARK_CLOSE = "\ue000", "\ue001"
+
+# 摘要包含的词数（中日韩文字每个字算一个词）
+SNIPPET_TOKENS = 24
+
+WORD_NAMESPACE = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+
+def _prepare(value: str) -> str:
+    """在中日韩文字两侧插入分隔符"""
+    return CJK_PATTERN.sub(f"{CJK_SEPARATOR}\\1{CJK_SEPARATOR}", value)
+
+
+def build_match_query(query: str) -> Optional[str]:
+    """
+    把用户输入转换为FTS5查询：按空白拆分为多个词，每个词作为短语前缀匹配，词之间为AND
+    
+    Args:
+        query: 用户输入的关键词
+    
+    Returns:
+        FTS5 MATCH表达式，没有有效关键词时返回None
+    """
+    terms = []
+    for term in query.split():
+        # 只保留字母数字，其余字符在分词时本来就是分隔符；双引号需要转义
+        if not any(ch.isalnum() for ch in term):
+            continue
+        terms.append('"{}"*'.format(_prepare(term).replace('"', '""')))
+    return " ".join(terms) if terms else None
+
+
+class _TextBuffer:
+    """累积提取的文本，达到字符上限后拒绝继续写入"""
+    
+    def __init__(self, max_chars: int):
+        self.max_chars = max_chars
+        self.parts: List[str] = []
+        self.length = 0
+        self.truncated = False
+    
+    def add(self, value: str) -> bool:
+        """
+        追加文本
+        
+        Returns:
+            还能继续写入时返回True
+        """
+        remaining = self.max_chars - self.length
+        if len(value) >= remaining:
+            self.truncated = len(value) > remaining
+            value = value[:remaining]
+        self.parts.append(value)
+        self.length += len(value)
+        return self.length < self.max_chars
+    
+    def text(self) -> str:
+        return "".join(self.parts)
+
+
+def _detect_encoding(sample: bytes) -> str:
+    """根据开头部分判断文本编码（UTF-8失败时按GB18030处理，兼容GBK/GB2312）"""
+    if sample.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    if sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "utf-16"
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        return "gb18030"
+
+
+def extract_txt(stream, buffer: _TextBuffer):
+    """按块解码文本文件"""
+    sample = stream.read(READ_CHUNK_SIZE)
+    decoder = codecs.getincrementaldecoder(_detect_encoding(sample))(errors="replace")
+    chunk = sample
+    while chunk:
+        if not buffer.add(decoder.decode(chunk)):
+            return
+        chunk = stream.read(READ_CHUNK_SIZE)
+    buffer.add(decoder.decode(b"", final=True))
+
+
+def extract_docx(stream, buffer: _TextBuffer):
+    """按XML事件解析docx正文（word/document.xml），每个段落一行"""
+    with zipfile.ZipFile(stream) as archive, archive.open("word/document.xml") as document:
+        for _, element in ElementTree.iterparse(document, events=("end",)):
+            if element.tag == f"{WORD_NAMESPACE}t" and element.text:
+                if not buffer.add(element.text):
+                    return
+            elif element.tag == f"{WORD_NAMESPACE}tab":
+                buffer.add("\t")
+            elif element.tag == f"{WORD_NAMESPACE}p":
+                if not buffer.add("\n"):
+                    return
+                # 已处理的段落从树中清除，内存占用与文档大小无关
+                element.clear()
+
+
+@contextmanager
+def _local_copy(file: File) -> Iterator[Path]:
+    """外部命令需要文件路径：普通文件直接使用原路径，分块存储的文件拼接到临时文件"""
+    if not file.is_chunked:
+        yield Path(file.file_path)
+        return
+    
+    workdir = Path(tempfile.mkdtemp(prefix="content-", dir=settings.TEMP_PATH))
+    try:
+        path = workdir / f"document{Path(file.filename).suffix.lower()}"
+        with open_stored_file(file) as src, open(path, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        yield path
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def extract_pdf(pdftotext: str, file: File, buffer: _TextBuffer):
+    """读取pdftotext的输出流，达到字符上限后结束进程"""
+    with _local_copy(file) as path:
+        process = subprocess.Popen(
+            [pdftotext, "-enc", "UTF-8", "-nopgbrk", str(path), "-"],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            preexec_fn=(lambda: os.nice(10)) if hasattr(os, "nice") else None
+        )
+        watchdog = threading.Timer(settings.CONTENT_INDEX_TIMEOUT, process.kill)
+        watchdog.start()
+        try:
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            complete = True
+            while chunk := process.stdout.read(READ_CHUNK_SIZE):
+                if not buffer.add(decoder.decode(chunk)):
+                    complete = False
+                    process.kill()
+                    break
+            stderr = process.stderr.read()
+            returncode = process.wait()
+        finally:
+            watchdog.cancel()
+            process.stdout.close()
+            process.stderr.close()
+        
+        if complete and returncode != 0:
+            message = stderr.decode(errors="replace").strip()
+            raise RuntimeError(message or f"pdftotext退出码 {returncode}")
+
+
+def _extractors() -> dict:
+    """当前可用的提取方式（没有pdftotext时不处理PDF，PDF保持待索引）"""
+    extractors = {
+        ".txt": lambda file, buffer: _with_stream(file, buffer, extract_txt),
+        ".docx": lambda file, buffer: _with_stream(file, buffer, extract_docx),
+    }
+    pdftotext = shutil.which(settings.PDFTOTEXT_PATH)
+    if pdftotext:
+        extractors[".pdf"] = lambda file, buffer: extract_pdf(pdftotext, file, buffer)
+    return extractors
+
+
+def _with_stream(file: File, buffer: _TextBuffer, extract):
+    with open_stored_file(file) as stream:
+        extract(stream, buffer)
+
+
+def index_file(db: Session, file: File, extract) -> ContentDocument:
+    """
+    提取一个文档的文本并写入索引（调用方提交事务）
+    
+    Args:
+        db: 数据库会话
+        file: 文档文件对象
+        extract: 对应格式的提取函数
+    
+    Returns:
+        索引记录
+    """
+    document = ContentDocument(content_hash=file.md5_hash, status="indexed")
+    buffer = _TextBuffer(settings.CONTENT_INDEX_MAX_CHARS)
+    
+    if (file.size or 0) > settings.CONTENT_INDEX_MAX_FILE_SIZE:
+        document.status = "skipped"
+    else:
+        try:
+            extract(file, buffer)
+        except (OSError, RuntimeError, ValueError, KeyError,
+                zipfile.BadZipFile, ElementTree.ParseError, subprocess.SubprocessError) as e:
+            document.status = "failed"
+            document.error = str(e)[:500]
+            print(f"[SEARCH] 提取文本失败 {file.file_path}: {e}")
+    
+    body = buffer.text() if document.status == "indexed" else ""
+    if document.status == "indexed" and not body.strip():
+        document.status = "empty"
+    
+    document.text_length = len(body) if document.status == "indexed" else 0
+    document.truncated = buffer.truncated
+    db.add(document)
+    db.flush()
+    
+    if document.status == "indexed":
+        db.execute(
+            text("INSERT INTO content_fts (rowid, body) VALUES (:id, :body)"),
+            {"id": document.id, "body": _prepare(body)}
+        )
+    return document
+
+
+def _remove_documents(db: Session, document_ids: List[int]):
+    for batch in chunked(document_ids):
+        params = {f"id{i}": document_id for i, document_id in enumerate(batch)}
+        placeholders = ", ".join(f":{name}" for name in params)
+        db.execute(text(f"DELETE FROM content_fts WHERE rowid IN ({placeholders})"), params)
+        db.query(ContentDocument).filter(ContentDocument.id.in_(batch)).delete(synchronize_session=False)
+
+
+def run_content_index(db: Session) -> dict:
+    """
+    全文索引后台任务
+    
+    1. 删除已没有任何文件使用的内容（文件被删除或内容已变化）
+    2. 为尚未索引的内容提取文本，每个文档处理后立即提交
+    
+    Args:
+        db: 数据库会话
+    
+    Returns:
+        统计信息
+    """
+    stats = {"removed": 0, "indexed": 0, "empty": 0, "skipped": 0, "failed": 0}
+    
+    stale_ids = [document_id for (document_id,) in db.query(ContentDocument.id).filter(
+        ~db.query(File.id).filter(File.md5_hash == ContentDocument.content_hash).exists()
+    ).all()]
+    if stale_ids:
+        _remove_documents(db, stale_ids)
+        db.commit()
+        stats["removed"] = len(stale_ids)
+    
+    extractors = _extractors()
+    pending = db.query(func.min(File.id)).filter(
+        File.category == "document",
+        File.is_folder == False,
+        File.is_deleted == False,
+        File.md5_hash != None,
+        or_(*[File.filename.ilike(f"%{extension}") for extension in sorted(extractors)]),
+        ~db.query(ContentDocument.id).filter(ContentDocument.content_hash == File.md5_hash).exists()
+    ).group_by(File.md5_hash).limit(settings.CONTENT_INDEX_BATCH_SIZE).all()
+    
+    for (file_id,) in pending:
+        file = db.query(File).filter(File.id == file_id).first()
+        extract = extractors.get(Path(file.filename).suffix.lower())
+        if extract is None:
+            continue
+        document = index_file(db, file, extract)
+        db.commit()
+        stats[document.status] += 1
+    
+    return stats
+
+
+def trigger_content_index():
+    """立即执行一次全文索引（上传文档后调用，使新文档尽快可以搜索）"""
+    if settings.CONTENT_INDEX_ENABLED:
+        run_task("content_index", run_content_index)
+
+
+class ContentSearchService:
+    """全文搜索服务"""
+    
+    def __init__(self, db: Session):
+        self.db = db
+    
+    def search(self, user: User, query: str, limit: int = 20, offset: int = 0) -> dict:
+        """
+        按内容搜索用户的文档（按BM25相关度排序）
+        
+        Args:
+            user: 用户对象
+            query: 关键词（空格分隔的多个词需要同时出现）
+            limit: 每页结果数（按内容计算，内容相同的多个文件都会返回）
+            offset: 跳过的结果数
+        
+        Returns:
+            {"results": [...], "has_more": bool}；snippet为HTML（已转义，命中词用<mark>标记）
+        """
+        match = build_match_query(query)
+        if match is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="请输入搜索关键词"
+            )
+        
+        try:
+            rows = self.db.execute(text("""
+                SELECT d.content_hash,
+                       bm25(content_fts) AS score,
+                       snippet(content_fts, 0, :mark_open, :mark_close, '…', :tokens) AS snippet
+                FROM content_fts
+                JOIN content_documents d ON d.id = content_fts.rowid
+                WHERE content_fts MATCH :match
+                  AND d.content_hash IN (
+                      SELECT md5_hash FROM files
+                      WHERE owner_id = :owner_id AND is_deleted = 0 AND is_folder = 0
+                  )
+                ORDER BY score
+                LIMIT :limit OFFSET :offset
+            """), {
+                "match": match,
+                "mark_open": MARK_OPEN,
+                "mark_close": MARK_CLOSE,
+                "tokens": SNIPPET_TOKENS,
+                "owner_id": user.id,
+                "limit": limit + 1,
+                "offset": offset,
+            }).all()
+        except OperationalError as e:
+            print(f"[SEARCH] 全文搜索失败: {e}")
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="全文搜索不可用"
+            )
+        
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        
+        files_by_hash = {}
+        for batch in chunked([row.content_hash for row in rows]):
+            for file in self.db.query(File).filter(
+                File.owner_id == user.id,
+                File.md5_hash.in_(batch),
+                File.is_deleted == False,
+                File.is_folder == False
+            ).order_by(File.id).all():
+                files_by_hash.setdefault(file.md5_hash, []).append(file)
+        
+        results = []
+        for row in rows:
+            snippet = html.escape(row.snippet.replace(CJK_SEPARATOR, ""))
+            snippet = snippet.replace(MARK_OPEN, "<mark>").replace(MARK_CLOSE, "</mark>")
+            for file in files_by_hash.get(row.content_hash, []):
+                results.append({
+                    "file_id": file.id,
+                    "filename": file.original_filename or file.filename,
+                    "parent_id": file.parent_id,
+                    "size": file.size,
+                    "updated_at": file.updated_at.isoformat() if file.updated_at else None,
+                    "score": round(-row.score, 4),
+                    "snippet": snippet,
+                })
+        
+        return {"results": results, "has_more": has_more}
+
+
+if settings.CONTENT_INDEX_ENABLED:
+    scheduler.register("content_index", settings.CONTENT_INDEX_INTERVAL, run_content_index)
@@ -0,0 +1,264 @@
+"""
+服务器端复制任务模块
+复制在服务器上完成，客户端无需下载再上传：
+- 分块存储的文件只复制清单并增加分块引用（去重引用，不复制数据）
+- 其他文件优先使用reflink（btrfs/XFS写时复制，瞬间完成且不占额外空间），
+  其次是copy_file_range/sendfile（内核内复制，数据不经过用户态），见FileManager.clone_file
+
+总大小或条目数超过阈值的复制转为后台任务：进度按间隔写入copy_jobs表，
+客户端轮询 GET /api/files/copy-jobs/{id}；较小的复制直接在请求中完成。
+"""
+
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from fastapi import HTTPException, status
+from sqlalchemy.orm import Session
+
+from models import User, CopyJob, SessionLocal
+from config import settings
+from batch_ops import BatchService, _unique_ids
+from maintenance import scheduler, batched_delete
+
+
+# 未结束的任务状态
+ACTIVE_STATUSES = ("pending", "running")
+
+# 任务创建后超过此时间仍未开始执行，视为已丢失（例如服务在执行前重启）
+PENDING_TIMEOUT = timedelta(hours=1)
+
+
+class _JobProgress:
+    """累计复制进度，按间隔写入数据库（使用独立会话，不影响复制所用的会话）"""
+    
+    def __init__(self, job_id: int):
+        self.job_id = job_id
+        self.copied_bytes = 0
+        self.copied_files = 0
+        self._last_write = time.monotonic()
+    
+    def __call__(self, copied_bytes: int, copied_files: int):
+        self.copied_bytes += copied_bytes
+        self.copied_files += copied_files
+        if time.monotonic() - self._last_write >= settings.COPY_PROGRESS_INTERVAL:
+            self.flush()
+    
+    def flush(self):
+        self._last_write = time.monotonic()
+        db = SessionLocal()
+        try:
+            db.query(CopyJob).filter(CopyJob.id == self.job_id).update({
+                CopyJob.copied_bytes: self.copied_bytes,
+                CopyJob.copied_files: self.copied_files,
+            }, synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"[COPY] 写入任务 {self.job_id} 进度失败: {e}")
+        finally:
+            db.close()
+
+
+class CopyJobService:
+    """复制任务服务"""
+    
+    def __init__(self, db: Session):
+        self.db = db
+        self.batch_service = BatchService(db)
+    
+    def create_if_large(self, user: User, file_ids: List[int],
+                        target_parent_id: Optional[int]) -> Optional[CopyJob]:
+        """
+        估算复制量，超过阈值时创建后台任务
+        
+        参数错误、目标文件夹不存在、空间不足等问题在这里直接返回错误，不会进入后台。
+        
+        Args:
+            user: 用户对象
+            file_ids: 文件ID列表
+            target_parent_id: 目标文件夹ID（None表示根目录）
+        
+        Returns:
+            新建的任务；复制量较小时返回None，由调用方直接复制
+        """
+        ids = _unique_ids(file_ids)
+        self.batch_service._check_count(len(ids))
+        self.batch_service._resolve_target(user, target_parent_id)
+        files = self.batch_service._load_owned(user, ids)
+        
+        total_files, total_bytes = self.batch_service.measure(list(files.values()))
+        if not user.has_space_for(total_bytes):
+            raise HTTPException(
+                status_code=status.HTTP_507_INSUFFICIENT_STORAGE,
+                detail="存储空间不足"
+            )
+        if total_bytes < settings.COPY_BACKGROUND_MIN_BYTES and total_files < settings.COPY_BACKGROUND_MIN_ITEMS:
+            return None
+        
+        active = self.db.query(CopyJob.id).filter(
+            CopyJob.user_id == user.id,
+            CopyJob.status.in_(ACTIVE_STATUSES)
+        ).first()
+        if active:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="已有复制任务正在进行，请等待完成后再试"
+            )
+        
+        job = CopyJob(
+            user_id=user.id,
+            file_ids=json.dumps(ids),
+            target_parent_id=target_parent_id,
+            total_files=total_files,
+            total_bytes=total_bytes
+        )
+        self.db.add(job)
+        self.db.commit()
+        self.db.refresh(job)
+        
+        print(f"[COPY] 用户 {user.id} 创建复制任务 {job.id}: {total_files}个条目, {total_bytes}字节")
+        return job
+    
+    def get_job(self, user: User, job_id: int) -> CopyJob:
+        """
+        获取用户的复制任务
+        
+        Args:
+            user: 用户对象
+            job_id: 任务ID
+        
+        Returns:
+            任务对象
+        """
+        job = self.db.query(CopyJob).filter(
+            CopyJob.id == job_id,
+            CopyJob.user_id == user.id
+        ).first()
+        if not job:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="复制任务不存在"
+            )
+        return job
+    
+    @staticmethod
+    def to_dict(job: CopyJob) -> dict:
+        return {
+            "job_id": job.id,
+            "status": job.status,
+            "total_files": job.total_files or 0,
+            "total_bytes": job.total_bytes or 0,
+            "copied_files": job.copied_files or 0,
+            "copied_bytes": job.copied_bytes or 0,
+            "progress": round(job.get_progress(), 1),
+            "result": json.loads(job.result) if job.result else None,
+            "error": job.error,
+            "created_at": job.created_at.isoformat() if job.created_at else None,
+            "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        }
+
+
+def run_copy_job(job_id: int):
+    """
+    执行复制任务（由BackgroundTasks在线程池中调用）
+    
+    Args:
+        job_id: 任务ID
+    """
+    db = SessionLocal()
+    try:
+        # 条件更新，保证任务只被执行一次
+        claimed = db.query(CopyJob).filter(
+            CopyJob.id == job_id,
+            CopyJob.status == "pending"
+        ).update({
+            CopyJob.status: "running",
+            CopyJob.started_at: datetime.utcnow(),
+            CopyJob.worker_pid: os.getpid(),
+        }, synchronize_session=False)
+        db.commit()
+        if not claimed:
+            return
+        
+        job = db.query(CopyJob).filter(CopyJob.id == job_id).first()
+        user = db.query(User).filter(User.id == job.user_id).first()
+        
+        progress = _JobProgress(job_id)
+        start = time.monotonic()
+        try:
+            result = BatchService(db).copy(user, json.loads(job.file_ids), job.target_parent_id, progress)
+            values = {CopyJob.status: "completed", CopyJob.result: json.dumps(result, ensure_ascii=False)}
+            print(f"[COPY] 复制任务 {job_id} 完成: {progress.copied_files}个文件, "
+                  f"{progress.copied_bytes}字节, 耗时{time.monotonic() - start:.1f}秒, 方式 {result['methods']}")
+        except HTTPException as e:
+            db.rollback()
+            values = {CopyJob.status: "failed", CopyJob.error: str(e.detail)}
+        except Exception as e:
+            db.rollback()
+            values = {CopyJob.status: "failed", CopyJob.error: str(e)}
+            print(f"[COPY] 复制任务 {job_id} 失败: {e}")
+        
+        values.update({
+            CopyJob.copied_bytes: progress.copied_bytes,
+            CopyJob.copied_files: progress.copied_files,
+            CopyJob.finished_at: datetime.utcnow(),
+        })
+        db.query(CopyJob).filter(CopyJob.id == job_id).update(values, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def _process_alive(pid: Optional[int]) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def sweep_copy_jobs(db: Session) -> dict:
+    """
+    复制任务清理后台任务
+    
+    执行进程已退出（服务重启）或一直未开始的任务标记为失败（已逐项提交的条目保留），
+    已结束超过保留天数的任务记录删除。
+    
+    Args:
+        db: 数据库会话
+    
+    Returns:
+        统计信息
+    """
+    now = datetime.utcnow()
+    interrupted = 0
+    
+    for job in db.query(CopyJob).filter(CopyJob.status.in_(ACTIVE_STATUSES)).all():
+        if job.status == "running" and _process_alive(job.worker_pid):
+            continue
+        if job.status == "pending" and job.created_at and job.created_at > now - PENDING_TIMEOUT:
+            continue
+        job.status = "failed"
+        job.error = "服务重启，复制已中断"
+        job.finished_at = now
+        interrupted += 1
+    db.commit()
+    
+    cutoff = now - timedelta(days=settings.COPY_JOB_RETENTION_DAYS)
+    deleted = batched_delete(
+        db, CopyJob,
+        CopyJob.status.notin_(ACTIVE_STATUSES),
+        CopyJob.finished_at < cutoff
+    )
+    
+    return {"interrupted": interrupted, "deleted": deleted}
+
+
+scheduler.register("copy_jobs", settings.MAINTENANCE_INTERVAL, sweep_copy_jobs)
@@ -13,6 +13,8 @@ CREATE TABLE IF NOT EXISTS users (
     is_admin BOOLEAN DEFAULT 0,
     quota BIGINT DEFAULT 107374182400,  -- 100GB
     used_space BIGINT DEFAULT 0,
+    volume VARCHAR(50),  -- 固定存储卷（pinned策略）
+    sync_horizon INTEGER DEFAULT 0,  -- 已清理变更记录的最大游标
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     last_login TIMESTAMP
@@ -28,6 +30,11 @@ CREATE TABLE IF NOT EXISTS files (
     mime_type VARCHAR(100),
     category VARCHAR(20),
     md5_hash VARCHAR(32),
+    volume VARCHAR(50),  -- 所在存储卷（为空表示默认卷）
+    access_count INTEGER DEFAULT 0,  -- 访问次数（冷热分层迁移后清零）
+    last_accessed_at TIMESTAMP,
+    is_chunked BOOLEAN DEFAULT 0,  -- file_path处为分块清单
+    media_status VARCHAR(20),  -- 媒体处理状态：optimized, original, skipped, failed（为空表示待处理）
     is_folder BOOLEAN DEFAULT 0,
     parent_id INTEGER,
     owner_id INTEGER NOT NULL,
@@ -79,19 +86,157 @@ CREATE TABLE IF NOT EXISTS sync_records (
     file_id INTEGER NOT NULL,
     action VARCHAR(20),
     device_id VARCHAR(100),
+    from_parent_id INTEGER,  -- 移动前的父文件夹ID（仅moved记录）
     synced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
     FOREIGN KEY (file_id) REFERENCES files(id) ON DELETE CASCADE
 );
 
+-- 物理清理队列（回收站清空或超期后待删除的文件）
+CREATE TABLE IF NOT EXISTS purge_queue (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    owner_id INTEGER NOT NULL,
+    file_path VARCHAR(500) NOT NULL,
+    is_folder BOOLEAN DEFAULT 0,
+    size BIGINT DEFAULT 0,
+    md5_hash VARCHAR(32),
+    is_chunked BOOLEAN DEFAULT 0,
+    attempts INTEGER DEFAULT 0,  -- 删除失败的次数
+    queued_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (owner_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
+-- 后台维护任务执行记录表
+CREATE TABLE IF NOT EXISTS maintenance_runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    task VARCHAR(50) NOT NULL,
+    success BOOLEAN DEFAULT 1,
+    stats TEXT,
+    error TEXT,
+    started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+-- 服务器端复制任务表
+CREATE TABLE IF NOT EXISTS copy_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    file_ids TEXT NOT NULL,  -- JSON数组
+    target_parent_id INTEGER,
+    status VARCHAR(20) DEFAULT 'pending',  -- pending, running, completed, failed
+    total_files INTEGER DEFAULT 0,
+    total_bytes BIGINT DEFAULT 0,
+    copied_files INTEGER DEFAULT 0,
+    copied_bytes BIGINT DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    worker_pid INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
+-- HLS转码任务表
+CREATE TABLE IF NOT EXISTS transcode_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    owner_id INTEGER NOT NULL,
+    file_id INTEGER NOT NULL,
+    md5_hash VARCHAR(32) NOT NULL,
+    rendition VARCHAR(20) NOT NULL,  -- 480p, 720p ...
+    status VARCHAR(20) DEFAULT 'queued',  -- queued, running, completed, failed
+    error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP,
+    FOREIGN KEY (owner_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
+-- 分块存储索引表
+CREATE TABLE IF NOT EXISTS chunks (
+    hash VARCHAR(64) PRIMARY KEY,  -- SHA-256
+    size INTEGER NOT NULL,
+    ref_count INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 派生文件缓存索引表（缩略图、视频封面，所有用户共用）
+CREATE TABLE IF NOT EXISTS derivatives (
+    content_hash VARCHAR(32) NOT NULL,  -- 源内容MD5
+    rendition VARCHAR(50) NOT NULL,  -- thumb-200x200.jpg, poster-640.jpg ...
+    size BIGINT DEFAULT 0,
+    hits INTEGER DEFAULT 0,
+    generations INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_accessed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (content_hash, rendition)
+);
+
+-- 全文索引文档表（按内容MD5去重）
+CREATE TABLE IF NOT EXISTS content_documents (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    content_hash VARCHAR(32) NOT NULL UNIQUE,
+    status VARCHAR(20) DEFAULT 'indexed',  -- indexed, empty, skipped, failed
+    text_length INTEGER DEFAULT 0,
+    truncated BOOLEAN DEFAULT 0,
+    error TEXT,
+    indexed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 全文索引（rowid与content_documents.id相同；中日韩文字逐字分隔后索引，按短语匹配）
+CREATE VIRTUAL TABLE IF NOT EXISTS content_fts USING fts5(body);
+
+-- 照片元数据表（时间线按 owner_id, taken_at 范围查询）
+CREATE TABLE IF NOT EXISTS media_metadata (
+    file_id INTEGER PRIMARY KEY,
+    owner_id INTEGER NOT NULL,
+    content_hash VARCHAR(32),
+    taken_at TIMESTAMP NOT NULL,
+    time_source VARCHAR(10) DEFAULT 'exif',  -- exif, upload
+    width INTEGER,
+    height INTEGER,
+    camera_make VARCHAR(100),
+    camera_model VARCHAR(100),
+    latitude FLOAT,
+    longitude FLOAT,
+    extracted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (file_id) REFERENCES files(id),
+    FOREIGN KEY (owner_id) REFERENCES users(id)
+);
+
+-- 文件夹列表版本号（根目录的folder_id为0；由files表上的触发器在同一事务中递增，
+-- 触发器在启动时由 models.create_folder_version_triggers() 创建）
+CREATE TABLE IF NOT EXISTS folder_versions (
+    owner_id INTEGER NOT NULL,
+    folder_id INTEGER NOT NULL,
+    version BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (owner_id, folder_id)
+);
+
 -- 创建索引
 CREATE INDEX IF NOT EXISTS idx_users_username ON users(username);
 CREATE INDEX IF NOT EXISTS idx_users_email ON users(email);
 CREATE INDEX IF NOT EXISTS idx_files_owner ON files(owner_id);
 CREATE INDEX IF NOT EXISTS idx_files_parent ON files(parent_id);
 CREATE INDEX IF NOT EXISTS idx_files_md5 ON files(md5_hash);
+CREATE INDEX IF NOT EXISTS idx_files_deleted_at ON files(deleted_at);
+CREATE INDEX IF NOT EXISTS idx_files_volume ON files(volume);
+CREATE INDEX IF NOT EXISTS idx_files_last_accessed_at ON files(last_accessed_at);
+CREATE INDEX IF NOT EXISTS idx_files_media_status ON files(media_status);
 CREATE INDEX IF NOT EXISTS idx_shares_code ON shares(share_code);
 CREATE INDEX IF NOT EXISTS idx_upload_session ON upload_sessions(session_id);
+CREATE INDEX IF NOT EXISTS idx_shares_expire_at ON shares(expire_at);
+CREATE INDEX IF NOT EXISTS idx_upload_sessions_updated_at ON upload_sessions(updated_at);
+CREATE INDEX IF NOT EXISTS idx_maintenance_runs_task ON maintenance_runs(task);
+CREATE INDEX IF NOT EXISTS idx_chunks_ref_count ON chunks(ref_count);
+CREATE INDEX IF NOT EXISTS idx_copy_jobs_user ON copy_jobs(user_id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_transcode_jobs_content ON transcode_jobs(owner_id, md5_hash, rendition);
+CREATE INDEX IF NOT EXISTS idx_transcode_jobs_status ON transcode_jobs(status);
+CREATE INDEX IF NOT EXISTS idx_derivatives_last_accessed_at ON derivatives(last_accessed_at);
+CREATE INDEX IF NOT EXISTS idx_sync_records_user_cursor ON sync_records(user_id, id);
+CREATE INDEX IF NOT EXISTS idx_sync_records_file ON sync_records(file_id, id);
+CREATE INDEX IF NOT EXISTS idx_media_metadata_owner_taken ON media_metadata(owner_id, taken_at, file_id);
+CREATE INDEX IF NOT EXISTS idx_media_metadata_content_hash ON media_metadata(content_hash);
 
 -- 插入默认管理员账户
 -- 密码: RaspberryCloud2024!
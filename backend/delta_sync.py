@@ -0,0 +1,459 @@
+"""
+增量同步模块
+rsync风格的增量上传：修改过的文件只上传变化的部分
+
+协议：
+1. 客户端获取服务器上当前版本的分块签名
+   GET /api/sync/files/{file_id}/signature?block_size=65536
+   返回 {"size", "md5", "block_size", "blocks": [[弱校验, 强校验], ...]}
+   - 弱校验为rsync滚动校验和：a = Σx mod 2^16，b = Σ(n-i)·x_i mod 2^16，值为 a + (b << 16)
+   - 强校验为分块的MD5（十六进制）
+2. 客户端用滚动校验和在新文件中查找与旧分块相同的内容，生成指令列表：
+   ["copy", 起始块号, 块数] 复制旧版本中连续的若干块
+   ["data", 长度]          从上传的数据中按顺序读取若干字节
+3. 客户端上传指令和新数据
+   POST /api/sync/files/{file_id}/delta（base_md5必须等于当前版本的MD5，防止覆盖他人的修改）
+4. 服务器在同一目录下生成新版本并校验MD5，然后原子替换旧文件
+
+参考实现见 compute_delta()。
+"""
+
+import hashlib
+import io
+import itertools
+import json
+import os
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from typing import BinaryIO, Iterator, List, Optional
+
+from fastapi import HTTPException, status
+from sqlalchemy.orm import Session
+
+from models import User, File
+from config import settings
+from file_handler import FileService, FileManager
+from chunkstore import open_stored_file, read_manifest, ChunkStore
+from changes import record_change
+from photo_timeline import record_photo_metadata
+
+
+# 新版本临时文件前缀（以“.”开头，一致性检查和列表都会忽略）
+TEMP_PREFIX = ".delta-"
+
+# 分块大小范围
+MIN_BLOCK_SIZE = 1024
+MAX_BLOCK_SIZE = 8 * 1024 * 1024
+
+# 单次提交允许的最大指令数
+MAX_INSTRUCTIONS = 1_000_000
+
+# 复制时的读写块大小
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def weak_checksum(data: bytes) -> int:
+    """
+    计算rsync弱校验和
+    
+    Args:
+        data: 分块数据
+    
+    Returns:
+        a + (b << 16)
+    """
+    a = sum(data) & 0xFFFF
+    b = sum(itertools.accumulate(data)) & 0xFFFF
+    return a | (b << 16)
+
+
+def _iter_blocks(stream: BinaryIO, block_size: int) -> Iterator[bytes]:
+    while block := stream.read(block_size):
+        yield block
+
+
+class DeltaSyncService:
+    """增量同步服务"""
+    
+    def __init__(self, db: Session):
+        self.db = db
+        self.file_service = FileService(db)
+    
+    def _get_regular_file(self, user: User, file_id: int) -> File:
+        file = self.file_service.get_file(user, file_id)
+        if file.is_folder:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="文件夹不支持增量同步"
+            )
+        if not Path(file.file_path).exists():
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="文件不存在"
+            )
+        return file
+    
+    @staticmethod
+    def _check_block_size(block_size: int):
+        if not MIN_BLOCK_SIZE <= block_size <= MAX_BLOCK_SIZE:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"分块大小必须在{MIN_BLOCK_SIZE}到{MAX_BLOCK_SIZE}字节之间"
+            )
+    
+    def get_signature(self, user: User, file_id: int, block_size: Optional[int] = None) -> dict:
+        """
+        获取文件当前版本的分块签名
+        
+        签名按（内容MD5，分块大小）缓存在临时目录中，由临时文件清理任务过期删除。
+        
+        Args:
+            user: 用户对象
+            file_id: 文件ID
+            block_size: 分块大小
+        
+        Returns:
+            签名字典
+        """
+        block_size = block_size or settings.DELTA_BLOCK_SIZE
+        self._check_block_size(block_size)
+        file = self._get_regular_file(user, file_id)
+        
+        cache_path = None
+        if file.md5_hash:
+            cache_path = Path(settings.TEMP_PATH) / "signatures" / f"{file.md5_hash}-{block_size}.json"
+            try:
+                with open(cache_path, "r", encoding="utf-8") as f:
+                    blocks = json.load(f)
+                return self._signature_response(file, block_size, blocks)
+            except (OSError, ValueError):
+                pass
+        
+        blocks = []
+        with open_stored_file(file) as stream:
+            for block in _iter_blocks(stream, block_size):
+                blocks.append([weak_checksum(block), hashlib.md5(block).hexdigest()])
+        
+        if cache_path is not None:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = cache_path.with_name(f".{cache_path.name}.{os.getpid()}")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(blocks, f, separators=(",", ":"))
+            os.replace(tmp_path, cache_path)
+        
+        return self._signature_response(file, block_size, blocks)
+    
+    @staticmethod
+    def _signature_response(file: File, block_size: int, blocks: List[list]) -> dict:
+        return {
+            "file_id": file.id,
+            "size": file.size,
+            "md5": file.md5_hash,
+            "block_size": block_size,
+            "blocks": blocks,
+        }
+    
+    def apply_delta(
+        self,
+        user: User,
+        file_id: int,
+        base_md5: str,
+        block_size: int,
+        instructions: List[list],
+        data: Optional[BinaryIO],
+        target_md5: Optional[str] = None,
+        device_id: Optional[str] = None
+    ) -> File:
+        """
+        按增量指令生成文件新版本并原子替换
+        
+        Args:
+            user: 用户对象
+            file_id: 文件ID
+            base_md5: 客户端计算增量时所基于的版本MD5
+            block_size: 签名分块大小
+            instructions: 指令列表
+            data: 新数据流（按data指令顺序读取）
+            target_md5: 新版本的MD5（提供时校验）
+            device_id: 客户端设备ID
+        
+        Returns:
+            更新后的File对象
+        """
+        self._check_block_size(block_size)
+        file = self._get_regular_file(user, file_id)
+        
+        if base_md5 != file.md5_hash:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="文件已被修改，请重新获取签名"
+            )
+        
+        new_size = self._validate_instructions(instructions, block_size, file.size)
+        if new_size > settings.MAX_FILE_SIZE:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"文件大小超过限制（最大{settings.MAX_FILE_SIZE / 1024 / 1024 / 1024}GB）"
+            )
+        if new_size > file.size and not user.has_space_for(new_size - file.size):
+            raise HTTPException(
+                status_code=status.HTTP_507_INSUFFICIENT_STORAGE,
+                detail="存储空间不足"
+            )
+        
+        # 每个请求使用独立的临时文件，同一文件的并发增量上传不会互相截断或交错写入
+        path = Path(file.file_path)
+        fd, temp_name = tempfile.mkstemp(prefix=TEMP_PREFIX, dir=path.parent)
+        os.close(fd)
+        temp_path = Path(temp_name)
+        try:
+            # mkstemp创建的文件权限为0600，保持与旧版本一致
+            os.chmod(temp_path, path.stat().st_mode & 0o777)
+            md5_hash = self._build_new_version(file, temp_path, block_size, instructions, data)
+            if target_md5 and md5_hash != target_md5:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="新版本校验失败，请重新同步"
+                )
+            return self._commit_new_version(user, file, temp_path, md5_hash, new_size, device_id)
+        finally:
+            temp_path.unlink(missing_ok=True)
+    
+    @staticmethod
+    def _validate_instructions(instructions: List[list], block_size: int, base_size: int) -> int:
+        """
+        校验指令并计算新版本大小
+        
+        Returns:
+            新版本大小（字节）
+        """
+        if not isinstance(instructions, list) or len(instructions) > MAX_INSTRUCTIONS:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="增量指令格式错误"
+            )
+        
+        block_count = (base_size + block_size - 1) // block_size
+        new_size = 0
+        
+        for instruction in instructions:
+            if (
+                isinstance(instruction, list) and len(instruction) == 3 and instruction[0] == "copy"
+                and all(isinstance(v, int) for v in instruction[1:])
+                and instruction[1] >= 0 and instruction[2] > 0
+                and instruction[1] + instruction[2] <= block_count
+            ):
+                start = instruction[1] * block_size
+                new_size += min(instruction[2] * block_size, base_size - start)
+            elif (
+                isinstance(instruction, list) and len(instruction) == 2 and instruction[0] == "data"
+                and isinstance(instruction[1], int) and instruction[1] > 0
+            ):
+                new_size += instruction[1]
+            else:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"无效的增量指令: {instruction}"
+                )
+        
+        return new_size
+    
+    @staticmethod
+    def _build_new_version(file: File, temp_path: Path, block_size: int,
+                           instructions: List[list], data: Optional[BinaryIO]) -> str:
+        """
+        按指令生成新版本临时文件
+        
+        Returns:
+            新版本MD5
+        """
+        md5_hash = hashlib.md5()
+        empty = io.BytesIO()
+        
+        with open_stored_file(file) as base, open(temp_path, "wb") as out:
+            for instruction in instructions:
+                if instruction[0] == "copy":
+                    base.seek(instruction[1] * block_size)
+                    remaining = instruction[2] * block_size
+                    source = base
+                else:
+                    remaining = instruction[1]
+                    source = data or empty
+                
+                while remaining > 0:
+                    chunk = source.read(min(COPY_CHUNK_SIZE, remaining))
+                    if not chunk:
+                        if source is base:
+                            break  # 最后一块可能不足block_size
+                        raise HTTPException(
+                            status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="上传的数据长度与指令不符"
+                        )
+                    md5_hash.update(chunk)
+                    out.write(chunk)
+                    remaining -= len(chunk)
+            
+            if data is not None and data.read(1):
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="上传的数据长度与指令不符"
+                )
+            
+            out.flush()
+            os.fsync(out.fileno())
+        
+        return md5_hash.hexdigest()
+    
+    def _commit_new_version(self, user: User, file: File, temp_path: Path, md5_hash: str,
+                            new_size: int, device_id: Optional[str]) -> File:
+        """
+        按原路径和MD5条件更新记录，并用新版本原子替换旧文件
+        
+        条件UPDATE取得数据库写锁后才替换文件，直到提交前其他请求的条件UPDATE都会等待，
+        之后因MD5已变化而失败（409），所以同一时刻只有一个新版本能替换成功。
+        提交失败时恢复旧文件，文件内容与记录的大小、MD5始终一致。
+        """
+        path = Path(file.file_path)
+        old_size = file.size or 0
+        old_manifest = read_manifest(path) if file.is_chunked else None
+        
+        updated = self.db.query(File).filter(
+            File.id == file.id,
+            File.file_path == str(path),
+            File.md5_hash == file.md5_hash
+        ).update(
+            {
+                File.size: new_size,
+                File.md5_hash: md5_hash,
+                File.is_chunked: False,
+                File.media_status: None,
+                File.updated_at: datetime.utcnow(),
+            },
+            synchronize_session=False
+        )
+        if not updated:
+            self.db.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="文件已被修改，请重新获取签名"
+            )
+        
+        # 旧版本如果是分块清单，释放其引用的分块
+        if old_manifest is not None:
+            ChunkStore().release_refs(self.db, old_manifest["chunks"])
+        
+        user.used_space = max(0, user.used_space + new_size - old_size)
+        record_change(self.db, user.id, file.id, "updated", device_id)
+        
+        backup_path = None
+        try:
+            backup_path = self._keep_old_version(path)
+            os.replace(temp_path, path)
+            self.db.commit()
+        except BaseException:
+            self.db.rollback()
+            if backup_path is not None:
+                os.replace(backup_path, path)
+            raise
+        finally:
+            if backup_path is not None:
+                backup_path.unlink(missing_ok=True)
+        
+        self.db.refresh(file)
+        
+        if file.category == "image":
+            FileManager.ensure_thumbnail(path, md5_hash)
+            record_photo_metadata(self.db, file)
+            self.db.commit()
+        
+        return file
+    
+    @staticmethod
+    def _keep_old_version(path: Path) -> Path:
+        """
+        在替换前保留旧版本（硬链接；文件系统不支持时改为重命名），提交失败时用于恢复
+        
+        Returns:
+            旧版本的临时路径
+        """
+        fd, backup_name = tempfile.mkstemp(prefix=TEMP_PREFIX, dir=path.parent)
+        os.close(fd)
+        backup_path = Path(backup_name)
+        backup_path.unlink()
+        try:
+            os.link(path, backup_path)
+        except OSError:
+            # exFAT等不支持硬链接的文件系统：替换前的一瞬间原路径不存在
+            os.replace(path, backup_path)
+        return backup_path
+
+
+def compute_delta(signature: dict, stream: BinaryIO) -> tuple:
+    """
+    客户端参考实现：根据服务器签名计算新文件的增量指令
+    
+    Args:
+        signature: get_signature()返回的签名
+        stream: 新文件内容
+    
+    Returns:
+        (指令列表, 需要上传的数据)
+    """
+    block_size = signature["block_size"]
+    index = {}
+    for number, (weak, strong) in enumerate(signature["blocks"]):
+        index.setdefault(weak, {}).setdefault(strong, number)
+    
+    content = stream.read()
+    instructions: List[list] = []
+    literal = bytearray()
+    pending = bytearray()
+    
+    def emit_copy(number: int):
+        if pending:
+            instructions.append(["data", len(pending)])
+            literal.extend(pending)
+            pending.clear()
+        last = instructions[-1] if instructions else None
+        if last and last[0] == "copy" and last[1] + last[2] == number:
+            last[2] += 1
+        else:
+            instructions.append(["copy", number, 1])
+    
+    pos = 0
+    length = len(content)
+    window = content[pos:pos + block_size]
+    a = sum(window) & 0xFFFF
+    b = sum(itertools.accumulate(window)) & 0xFFFF
+    
+    while pos < length:
+        size = min(block_size, length - pos)
+        weak = a | (b << 16)
+        candidates = index.get(weak)
+        if candidates:
+            number = candidates.get(hashlib.md5(content[pos:pos + size]).hexdigest())
+            if number is not None:
+                emit_copy(number)
+                pos += size
+                window = content[pos:pos + block_size]
+                a = sum(window) & 0xFFFF
+                b = sum(itertools.accumulate(window)) & 0xFFFF
+                continue
+        
+        # 窗口向后滚动一个字节
+        out_byte = content[pos]
+        pending.append(out_byte)
+        a = (a - out_byte) & 0xFFFF
+        b = (b - size * out_byte) & 0xFFFF
+        if pos + block_size < length:
+            in_byte = content[pos + block_size]
+            a = (a + in_byte) & 0xFFFF
+            b = (b + a) & 0xFFFF
+        pos += 1
+    
+    if pending:
+        instructions.append(["data", len(pending)])
+        literal.extend(pending)
+    
+    return instructions, bytes(literal)
@@ -0,0 +1,460 @@
+"""
+派生文件缓存模块
+缩略图、视频封面等派生文件按（内容MD5, 版本）存放在所有用户共用的缓存目录中：
+两个家庭成员上传同一张照片只生成一次缩略图。
+
+- 路径: DERIVATIVE_CACHE_PATH/<MD5前两位>/<MD5>/<版本>，版本名包含格式和尺寸（如 thumb-200x200.jpg），
+  尺寸配置变化后自动使用新的派生文件
+- 索引: derivatives表记录每个派生文件的大小、命中次数、生成次数和最后访问时间
+- 淘汰: 总大小超过DERIVATIVE_CACHE_MAX_BYTES时，按最后访问时间从旧到新删除（LRU），
+  直到降到预算的90%；源内容已不存在的派生文件随回收站清理删除，淘汰任务也会兜底清理
+- 缺失时重新生成: get_or_create在缓存未命中（从未生成或已被淘汰）时调用生成函数
+
+命中只在内存中累计，按间隔批量写入数据库（与文件访问统计相同，避免每次预览都写SD卡）；
+生成的派生文件立即写入索引，保证占用统计准确。
+"""
+
+import os
+import re
+import shutil
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import File, DerivativeEntry, SessionLocal
+from config import settings
+from maintenance import scheduler
+
+
+# 淘汰时降到预算的比例（留出余量，避免每次新生成都触发淘汰）
+EVICTION_LOW_WATERMARK = 0.9
+
+# 每批淘汰/清理的条目数
+EVICTION_BATCH_SIZE = 500
+
+CONTENT_HASH_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+RENDITION_PATTERN = re.compile(r"^[a-z0-9][a-z0-9._-]{0,49}$")
+
+# 图片缩略图（列表、网格视图使用）
+THUMBNAIL_RENDITION = "thumb-{}x{}.jpg".format(*settings.THUMBNAIL_SIZE)
+
+# 旧版本按用户存放的缩略图目录（淘汰任务会把其中的文件迁入共享缓存）
+LEGACY_THUMBNAIL_DIR = ".thumbnails"
+
+
+class DerivativeCache:
+    """共享派生文件缓存"""
+    
+    def __init__(self, root: str, max_bytes: int, flush_interval: int):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pending: Dict[Tuple[str, str], Tuple[int, datetime]] = {}
+        self._last_flush = time.monotonic()
+        self._metrics = {"hits": 0, "misses": 0, "generated": 0, "failed": 0}
+    
+    def path(self, content_hash: str, rendition: str) -> Path:
+        """
+        派生文件路径
+        
+        Args:
+            content_hash: 源内容MD5
+            rendition: 版本名（如 thumb-200x200.jpg）
+        
+        Returns:
+            缓存中的路径
+        """
+        if not CONTENT_HASH_PATTERN.match(content_hash or "") or not RENDITION_PATTERN.match(rendition):
+            raise ValueError(f"无效的派生文件标识: {content_hash}/{rendition}")
+        return self.root / content_hash[:2] / content_hash / rendition
+    
+    def _count(self, metric: str):
+        with self._lock:
+            self._metrics[metric] += 1
+    
+    def lookup(self, content_hash: str, rendition: str) -> Optional[Path]:
+        """
+        查找已生成的派生文件（记录命中/未命中）
+        
+        Args:
+            content_hash: 源内容MD5
+            rendition: 版本名
+        
+        Returns:
+            派生文件路径，不存在时返回None
+        """
+        path = self.path(content_hash, rendition)
+        if not path.exists():
+            self._count("misses")
+            return None
+        
+        now = datetime.utcnow()
+        with self._lock:
+            self._metrics["hits"] += 1
+            count, _ = self._pending.get((content_hash, rendition), (0, now))
+            self._pending[(content_hash, rendition)] = (count + 1, now)
+            due = time.monotonic() - self._last_flush >= self.flush_interval
+            if due:
+                self._last_flush = time.monotonic()
+        
+        if due:
+            self.flush()
+        return path
+    
+    def write(self, content_hash: str, rendition: str, generate: Callable[[Path], Optional[bool]]) -> bool:
+        """
+        生成派生文件（只写文件，不写索引；进程池中的工作进程使用，由主进程调用register）
+        
+        生成函数写入临时文件，成功后原子替换到缓存路径，多个进程同时生成同一文件也不会读到半个文件。
+        
+        Args:
+            content_hash: 源内容MD5
+            rendition: 版本名
+            generate: 生成函数，参数为要写入的路径；返回False或抛出异常表示失败
+        
+        Returns:
+            是否成功
+        """
+        path = self.path(content_hash, rendition)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_name(f".tmp-{os.getpid()}-{threading.get_ident()}-{rendition}")
+        try:
+            if generate(temp_path) is False or not temp_path.exists():
+                self._count("failed")
+                return False
+            os.replace(temp_path, path)
+        except Exception:
+            self._count("failed")
+            raise
+        finally:
+            temp_path.unlink(missing_ok=True)
+        
+        self._count("generated")
+        return True
+    
+    def register(self, content_hash: str, rendition: str):
+        """
+        把已生成的派生文件写入索引（重新生成时累加生成次数）
+        
+        Args:
+            content_hash: 源内容MD5
+            rendition: 版本名
+        """
+        path = self.path(content_hash, rendition)
+        try:
+            size = path.stat().st_size
+        except FileNotFoundError:
+            return
+        
+        now = datetime.utcnow()
+        db = SessionLocal()
+        try:
+            values = {
+                DerivativeEntry.size: size,
+                DerivativeEntry.generations: func.coalesce(DerivativeEntry.generations, 0) + 1,
+                DerivativeEntry.last_accessed_at: now,
+            }
+            updated = db.query(DerivativeEntry).filter(
+                DerivativeEntry.content_hash == content_hash,
+                DerivativeEntry.rendition == rendition
+            ).update(values, synchronize_session=False)
+            if not updated:
+                db.add(DerivativeEntry(
+                    content_hash=content_hash,
+                    rendition=rendition,
+                    size=size,
+                    generations=1,
+                    created_at=now,
+                    last_accessed_at=now
+                ))
+            try:
+                db.commit()
+            except IntegrityError:
+                # 另一个进程同时生成并插入了同一条目
+                db.rollback()
+                db.query(DerivativeEntry).filter(
+                    DerivativeEntry.content_hash == content_hash,
+                    DerivativeEntry.rendition == rendition
+                ).update(values, synchronize_session=False)
+                db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"[CACHE] 写入派生文件索引失败 {content_hash}/{rendition}: {e}")
+        finally:
+            db.close()
+    
+    def get_or_create(self, content_hash: str, rendition: str,
+                      generate: Callable[[Path], Optional[bool]]) -> Optional[Path]:
+        """
+        获取派生文件，缓存中没有（或已被淘汰）时重新生成
+        
+        Args:
+            content_hash: 源内容MD5
+            rendition: 版本名
+            generate: 生成函数（见write）
+        
+        Returns:
+            派生文件路径，生成失败时返回None
+        """
+        path = self.lookup(content_hash, rendition)
+        if path is not None:
+            return path
+        
+        if not self.write(content_hash, rendition, generate):
+            return None
+        self.register(content_hash, rendition)
+        return self.path(content_hash, rendition)
+    
+    def flush(self) -> int:
+        """
+        将累计的命中统计写入数据库
+        
+        Returns:
+            更新的条目数
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        
+        if not pending:
+            return 0
+        
+        db = SessionLocal()
+        try:
+            for (content_hash, rendition), (count, last_accessed_at) in pending.items():
+                db.query(DerivativeEntry).filter(
+                    DerivativeEntry.content_hash == content_hash,
+                    DerivativeEntry.rendition == rendition
+                ).update({
+                    DerivativeEntry.hits: func.coalesce(DerivativeEntry.hits, 0) + count,
+                    DerivativeEntry.last_accessed_at: last_accessed_at,
+                }, synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"[CACHE] 写入派生文件命中统计失败: {e}")
+            return 0
+        finally:
+            db.close()
+        
+        return len(pending)
+    
+    def remove(self, db: Session, content_hashes: Iterable[str]) -> int:
+        """
+        删除内容的全部派生文件及索引（调用方提交事务）
+        
+        Args:
+            db: 数据库会话
+            content_hashes: 源内容MD5列表
+        
+        Returns:
+            删除的索引条目数
+        """
+        hashes = [h for h in set(content_hashes) if h and CONTENT_HASH_PATTERN.match(h)]
+        if not hashes:
+            return 0
+        
+        for content_hash in hashes:
+            shutil.rmtree(self.root / content_hash[:2] / content_hash, ignore_errors=True)
+        
+        deleted = 0
+        for start in range(0, len(hashes), EVICTION_BATCH_SIZE):
+            deleted += db.query(DerivativeEntry).filter(
+                DerivativeEntry.content_hash.in_(hashes[start:start + EVICTION_BATCH_SIZE])
+            ).delete(synchronize_session=False)
+        return deleted
+    
+    def _remove_entry(self, entry: DerivativeEntry) -> bool:
+        """删除单个派生文件（同一内容没有其他派生文件时一并删除目录）"""
+        path = self.path(entry.content_hash, entry.rendition)
+        try:
+            path.unlink(missing_ok=True)
+        except OSError as e:
+            print(f"[CACHE] 删除派生文件失败 {path}: {e}")
+            return False
+        
+        for directory in (path.parent, path.parent.parent):
+            try:
+                directory.rmdir()
+            except OSError:
+                break
+        return True
+    
+    def metrics(self) -> dict:
+        """本进程启动以来的命中统计"""
+        with self._lock:
+            metrics = dict(self._metrics)
+        lookups = metrics["hits"] + metrics["misses"]
+        metrics["hit_ratio"] = round(metrics["hits"] / lookups, 4) if lookups else None
+        return metrics
+    
+    def status(self, db: Session) -> dict:
+        """
+        缓存占用与命中统计
+        
+        Args:
+            db: 数据库会话
+        
+        Returns:
+            统计信息（process为本进程的统计，其余来自索引）
+        """
+        self.flush()
+        
+        total_entries, total_bytes, total_hits, total_generations = db.query(
+            func.count(DerivativeEntry.content_hash),
+            func.coalesce(func.sum(DerivativeEntry.size), 0),
+            func.coalesce(func.sum(DerivativeEntry.hits), 0),
+            func.coalesce(func.sum(DerivativeEntry.generations), 0)
+        ).one()
+        
+        renditions = {
+            rendition: {"entries": entries, "bytes": size or 0}
+            for rendition, entries, size in db.query(
+                DerivativeEntry.rendition,
+                func.count(DerivativeEntry.content_hash),
+                func.sum(DerivativeEntry.size)
+            ).group_by(DerivativeEntry.rendition).all()
+        }
+        
+        return {
+            "path": str(self.root),
+            "max_bytes": self.max_bytes,
+            "used_bytes": total_bytes,
+            "entries": total_entries,
+            "hits": total_hits,
+            "generations": total_generations,
+            "renditions": renditions,
+            "process": self.metrics(),
+        }
+
+
+# 全局派生文件缓存实例
+derivative_cache = DerivativeCache(
+    settings.DERIVATIVE_CACHE_PATH,
+    settings.DERIVATIVE_CACHE_MAX_BYTES,
+    settings.ACCESS_FLUSH_INTERVAL
+)
+
+
+def _migrate_legacy_thumbnails(db: Session) -> Dict[str, int]:
+    """
+    把旧版本用户目录下的 .thumbnails/<MD5>.jpg 迁入共享缓存
+    
+    图片缩略图作为thumb版本，视频封面作为poster版本；已没有对应文件的直接删除。
+    """
+    # 避免在模块加载时导入media（media依赖file_handler，file_handler依赖本模块）
+    from media import POSTER_RENDITION
+    
+    stats = {"legacy_migrated": 0, "legacy_removed": 0}
+    storage_root = Path(settings.STORAGE_PATH)
+    if not storage_root.is_dir():
+        return stats
+    
+    for legacy_dir in storage_root.glob(f"*/{LEGACY_THUMBNAIL_DIR}"):
+        for path in legacy_dir.glob("*.jpg"):
+            content_hash = path.stem
+            category = None
+            if CONTENT_HASH_PATTERN.match(content_hash):
+                category = db.query(File.category).filter(
+                    File.md5_hash == content_hash,
+                    File.category.in_(("image", "video"))
+                ).limit(1).scalar()
+            
+            if category is None:
+                path.unlink(missing_ok=True)
+                stats["legacy_removed"] += 1
+                continue
+            
+            rendition = THUMBNAIL_RENDITION if category == "image" else POSTER_RENDITION
+            target = derivative_cache.path(content_hash, rendition)
+            if target.exists():
+                path.unlink(missing_ok=True)
+                stats["legacy_removed"] += 1
+                continue
+            
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.move(str(path), str(target))
+            derivative_cache.register(content_hash, rendition)
+            stats["legacy_migrated"] += 1
+        
+        try:
+            legacy_dir.rmdir()
+        except OSError:
+            pass
+    
+    return stats
+
+
+def run_derivative_eviction(db: Session) -> dict:
+    """
+    派生文件缓存淘汰任务
+    
+    1. 迁移旧版本按用户存放的缩略图
+    2. 删除源内容已不存在（所有用户都没有该MD5的文件）的派生文件
+    3. 总大小超过预算时，按最后访问时间从旧到新淘汰，直到降到预算的90%
+    
+    Args:
+        db: 数据库会话
+    
+    Returns:
+        统计信息
+    """
+    derivative_cache.flush()
+    stats = _migrate_legacy_thumbnails(db)
+    
+    orphaned = 0
+    while True:
+        hashes = [h for (h,) in db.query(DerivativeEntry.content_hash).filter(
+            ~db.query(File.id).filter(File.md5_hash == DerivativeEntry.content_hash).exists()
+        ).distinct().limit(EVICTION_BATCH_SIZE).all()]
+        if not hashes:
+            break
+        orphaned += derivative_cache.remove(db, hashes)
+        db.commit()
+    stats["orphaned"] = orphaned
+    
+    used_bytes = db.query(func.coalesce(func.sum(DerivativeEntry.size), 0)).scalar()
+    evicted, freed = 0, 0
+    if used_bytes > derivative_cache.max_bytes:
+        target = int(derivative_cache.max_bytes * EVICTION_LOW_WATERMARK)
+        while used_bytes - freed > target:
+            entries = db.query(DerivativeEntry).order_by(
+                DerivativeEntry.last_accessed_at,
+                DerivativeEntry.content_hash
+            ).limit(EVICTION_BATCH_SIZE).all()
+            if not entries:
+                break
+            
+            removed: List[DerivativeEntry] = []
+            for entry in entries:
+                if used_bytes - freed <= target:
+                    break
+                if derivative_cache._remove_entry(entry):
+                    removed.append(entry)
+                    freed += entry.size or 0
+            if not removed:
+                break
+            
+            for entry in removed:
+                db.delete(entry)
+            db.commit()
+            evicted += len(removed)
+    
+    stats.update({
+        "evicted": evicted,
+        "freed_bytes": freed,
+        "used_bytes": used_bytes - freed,
+        **{f"process_{k}": v for k, v in derivative_cache.metrics().items()},
+    })
+    if evicted:
+        print(f"[CACHE] 淘汰派生文件 {evicted} 个，释放 {freed} 字节")
+    return stats
+
+
+scheduler.register("derivative_cache", settings.DERIVATIVE_CACHE_INTERVAL, run_derivative_eviction)
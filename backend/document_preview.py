@@ -0,0 +1,234 @@
+"""
+文档预览模块
+媒体处理后台任务的文档阶段：把PDF和Office文档的前几页渲染为图片，
+文件列表、预览窗口和分享页面直接显示图片，不需要下载整个文档。
+
+- PDF: 使用poppler-utils的pdftoppm渲染（apt install poppler-utils）
+- Office文档: 先用LibreOffice无界面转换为PDF，再按PDF渲染（apt install libreoffice-core，未安装时跳过）
+- 页面图片和列表缩略图存入共享派生文件缓存（见derivative_cache.py），版本名为 page<页码>-<尺寸>.jpg；
+  被淘汰后预览时重新进入处理队列
+
+处理状态与视频共用 files.media_status：
+- NULL: 待处理（对应工具未安装的文档保持待处理，安装后自动处理）
+- rendered: 已生成页面图片
+- skipped: 不处理（超过大小限制）
+- failed: 处理失败
+"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from models import File
+from config import settings
+from chunkstore import open_stored_file
+from file_handler import FileManager
+from derivative_cache import derivative_cache, THUMBNAIL_RENDITION
+
+
+PDF_EXTENSIONS = {".pdf"}
+
+# LibreOffice可以转换的Office文档
+OFFICE_EXTENSIONS = {".doc", ".docx", ".xls", ".xlsx", ".ppt", ".pptx"}
+
+
+def find_tools() -> Dict[str, str]:
+    """
+    查找已安装的转换工具
+    
+    Returns:
+        {"pdftoppm": 路径, "soffice": 路径}，未安装的工具不包含在内
+    """
+    tools = {}
+    pdftoppm = shutil.which(settings.PDFTOPPM_PATH)
+    if pdftoppm:
+        tools["pdftoppm"] = pdftoppm
+        # Office文档先转换为PDF，没有pdftoppm时无法处理
+        soffice = shutil.which(settings.OFFICE_CONVERTER_PATH)
+        if soffice:
+            tools["soffice"] = soffice
+    return tools
+
+
+def supported_extensions(tools: Dict[str, str]) -> set:
+    """当前已安装的工具能处理的扩展名"""
+    extensions = set()
+    if "pdftoppm" in tools:
+        extensions |= PDF_EXTENSIONS
+    if "soffice" in tools:
+        extensions |= OFFICE_EXTENSIONS
+    return extensions
+
+
+def page_rendition(page: int) -> str:
+    """页面图片在派生文件缓存中的版本名"""
+    return f"page{page}-{settings.DOCUMENT_PREVIEW_SIZE}.jpg"
+
+
+def available_pages(file: File) -> List[int]:
+    """
+    已生成（且未被淘汰）的预览页码
+    
+    Args:
+        file: 文档文件对象
+    
+    Returns:
+        页码列表（从1开始）
+    """
+    if not file.md5_hash or file.media_status != "rendered":
+        return []
+    pages = []
+    for page in range(1, settings.DOCUMENT_PREVIEW_PAGES + 1):
+        if not derivative_cache.path(file.md5_hash, page_rendition(page)).exists():
+            break
+        pages.append(page)
+    return pages
+
+
+def get_page(db: Session, file: File, page: int) -> Optional[Path]:
+    """
+    获取预览页面图片
+    
+    第1页已被缓存淘汰时，把相同内容的文档重新标记为待处理，由后台任务重新生成。
+    
+    Args:
+        db: 数据库会话
+        file: 文档文件对象
+        page: 页码（从1开始）
+    
+    Returns:
+        图片路径，尚未生成时返回None
+    """
+    if not file.md5_hash or file.media_status != "rendered" or page > settings.DOCUMENT_PREVIEW_PAGES:
+        return None
+    
+    path = derivative_cache.lookup(file.md5_hash, page_rendition(page))
+    if path is None and not derivative_cache.path(file.md5_hash, page_rendition(1)).exists():
+        db.query(File).filter(
+            File.md5_hash == file.md5_hash,
+            File.media_status == "rendered"
+        ).update({File.media_status: None}, synchronize_session=False)
+        db.commit()
+    return path
+
+
+def run_tool(args: List[str], cwd: Optional[Path] = None, niceness: int = 10):
+    """
+    以较低优先级运行转换工具，失败时抛出RuntimeError
+    
+    Args:
+        args: 命令及参数
+        cwd: 工作目录
+        niceness: 进程优先级调整值
+    """
+    try:
+        subprocess.run(
+            args,
+            check=True,
+            cwd=cwd,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            timeout=settings.DOCUMENT_PREVIEW_TIMEOUT,
+            preexec_fn=(lambda: os.nice(niceness)) if hasattr(os, "nice") else None
+        )
+    except subprocess.CalledProcessError as e:
+        message = (e.stderr or b"").decode(errors="replace").strip()
+        raise RuntimeError(message or f"{Path(args[0]).name}退出码 {e.returncode}")
+
+
+def convert_to_pdf(soffice: str, source: Path, workdir: Path) -> Path:
+    """
+    用LibreOffice把Office文档转换为PDF
+    
+    Args:
+        soffice: LibreOffice路径
+        source: 文档路径
+        workdir: 工作目录（同时作为LibreOffice的配置目录，避免与其他实例冲突）
+    
+    Returns:
+        PDF路径
+    """
+    run_tool([
+        soffice,
+        f"-env:UserInstallation={(workdir / 'profile').as_uri()}",
+        "--headless", "--norestore", "--convert-to", "pdf",
+        "--outdir", str(workdir), str(source)
+    ], cwd=workdir)
+    pdf_path = workdir / f"{source.stem}.pdf"
+    if not pdf_path.exists():
+        raise RuntimeError("LibreOffice未生成PDF")
+    return pdf_path
+
+
+def render_pages(pdftoppm: str, pdf_path: Path, workdir: Path) -> List[Path]:
+    """
+    把PDF的前几页渲染为JPEG（长边缩放到DOCUMENT_PREVIEW_SIZE）
+    
+    Args:
+        pdftoppm: pdftoppm路径
+        pdf_path: PDF路径
+        workdir: 输出目录
+    
+    Returns:
+        按页码排序的图片路径
+    """
+    prefix = workdir / "page"
+    run_tool([
+        pdftoppm, "-jpeg", "-jpegopt", "quality=85",
+        "-f", "1", "-l", str(settings.DOCUMENT_PREVIEW_PAGES),
+        "-scale-to", str(settings.DOCUMENT_PREVIEW_SIZE),
+        str(pdf_path), str(prefix)
+    ])
+    # 输出文件名为 page-1.jpg，页数较多时页码补零（page-01.jpg）
+    return sorted(workdir.glob("page-*.jpg"), key=lambda path: int(path.stem.rsplit("-", 1)[1]))
+
+
+def process_document(tools: Dict[str, str], file: File) -> str:
+    """
+    为一个文档生成页面图片和列表缩略图
+    
+    Args:
+        tools: find_tools()返回的工具
+        file: 文档文件对象
+    
+    Returns:
+        处理后的media_status
+    """
+    if not file.md5_hash or (file.size or 0) > settings.DOCUMENT_PREVIEW_MAX_SIZE:
+        return "skipped"
+    
+    suffix = Path(file.filename).suffix.lower()
+    workdir = Path(tempfile.mkdtemp(prefix="document-", dir=settings.TEMP_PATH))
+    try:
+        # 复制到工作目录再转换：分块存储的文件没有完整的原文件，转换工具也不会接触用户目录
+        source = workdir / f"document{suffix}"
+        with open_stored_file(file) as src, open(source, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        
+        pdf_path = source if suffix in PDF_EXTENSIONS else convert_to_pdf(tools["soffice"], source, workdir)
+        pages = render_pages(tools["pdftoppm"], pdf_path, workdir)
+        if not pages:
+            raise RuntimeError("未渲染出任何页面")
+        
+        for page, image_path in enumerate(pages, start=1):
+            rendition = page_rendition(page)
+            if derivative_cache.write(file.md5_hash, rendition, lambda path: shutil.move(str(image_path), str(path))):
+                derivative_cache.register(file.md5_hash, rendition)
+        
+        derivative_cache.get_or_create(
+            file.md5_hash,
+            THUMBNAIL_RENDITION,
+            lambda path: FileManager.create_thumbnail(
+                derivative_cache.path(file.md5_hash, page_rendition(1)), path, settings.THUMBNAIL_SIZE
+            )
+        )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    
+    return "rendered"
@@ -25,7 +25,7 @@ class EmailVerificationCode(Base):
     email = Column(String(100), index=True, nullable=False)
     code = Column(String(10), nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
-    expires_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
     used = Column(Integer, default=0)  # 0=未使用, 1=已使用
 
 
@@ -7,16 +7,55 @@ import os
 import hashlib
 import shutil
 import mimetypes
+import errno
 from pathlib import Path
-from typing import Optional, List, BinaryIO
+from typing import Optional, List, BinaryIO, Iterator, Sequence, Callable
 from datetime import datetime
 from fastapi import UploadFile, HTTPException, status
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from PIL import Image
 import aiofiles
 
 from models import User, File, UploadSession
 from config import settings
+from volumes import volumes
+from changes import record_change, record_changes
+from derivative_cache import derivative_cache, THUMBNAIL_RENDITION
+from photo_timeline import record_photo_metadata
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+# 单条SQL中IN (...)参数的最大数量（SQLite旧版本限制为999）
+SQL_IN_BATCH_SIZE = 500
+
+# ioctl FICLONE：让目标文件与源文件共享数据块（写时复制）
+FICLONE = 0x40049409
+
+# 内核内复制每次调用的最大字节数（同时决定进度回调的粒度）
+CLONE_SLICE_SIZE = 64 * 1024 * 1024
+
+# 表示文件系统/内核不支持该复制方式的错误码
+KERNEL_COPY_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP}
+
+
+def chunked(items: Sequence, size: int = SQL_IN_BATCH_SIZE) -> Iterator[Sequence]:
+    """
+    将序列按固定大小分块
+    
+    Args:
+        items: 序列
+        size: 每块大小
+    
+    Returns:
+        分块迭代器
+    """
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
 
 
 class FileManager:
@@ -147,18 +186,38 @@ class FileManager:
                     img = background
                 
                 # 创建缩略图
-                img.thumbnail(size, Image.Lanczos)
+                img.thumbnail(size, Image.LANCZOS)
                 
                 # 保存
                 thumbnail_path.parent.mkdir(parents=True, exist_ok=True)
                 img.save(thumbnail_path, 'JPEG', quality=85, optimize=True)
                 
                 return True
-                
+        
         except Exception as e:
             print(f"创建缩略图失败: {e}")
             return False
     
+    @staticmethod
+    def ensure_thumbnail(image_path: Path, md5_hash: str) -> Optional[Path]:
+        """
+        获取图片缩略图（共享缓存中没有时生成，相同内容的图片只生成一次）
+        
+        Args:
+            image_path: 原始图片路径
+            md5_hash: 图片内容MD5
+        
+        Returns:
+            缩略图路径，生成失败时返回None
+        """
+        if not md5_hash:
+            return None
+        return derivative_cache.get_or_create(
+            md5_hash,
+            THUMBNAIL_RENDITION,
+            lambda path: FileManager.create_thumbnail(image_path, path, settings.THUMBNAIL_SIZE)
+        )
+    
     @staticmethod
     def get_file_info(file_path: Path) -> dict:
         """
@@ -200,6 +259,71 @@ class FileManager:
         
         return False
     
+    @staticmethod
+    def clone_file(source: Path, destination: Path,
+                   on_progress: Optional[Callable[[int], None]] = None) -> str:
+        """
+        在服务器端复制文件内容，依次尝试：
+        1. reflink（FICLONE，btrfs/XFS等支持写时复制的文件系统上瞬间完成且不占额外空间）
+        2. copy_file_range（内核内复制，同一文件系统上还可能由存储设备直接完成）
+        3. sendfile（内核内复制，跨文件系统时使用）
+        4. 普通读写复制
+        
+        Args:
+            source: 源文件路径
+            destination: 目标文件路径（不能已存在）
+            on_progress: 进度回调，参数为新复制的字节数
+        
+        Returns:
+            实际使用的复制方式：reflink / copy_file_range / sendfile / copy
+        """
+        report = on_progress or (lambda copied: None)
+        
+        with open(source, "rb") as src, open(destination, "xb") as dst:
+            src_fd, dst_fd = src.fileno(), dst.fileno()
+            size = os.fstat(src_fd).st_size
+            
+            if fcntl is not None:
+                try:
+                    fcntl.ioctl(dst_fd, FICLONE, src_fd)
+                    report(size)
+                    return "reflink"
+                except OSError:
+                    pass
+            
+            kernel_copies = []
+            if hasattr(os, "copy_file_range"):
+                kernel_copies.append(("copy_file_range", lambda offset, count: os.copy_file_range(
+                    src_fd, dst_fd, count, offset, offset
+                )))
+            if hasattr(os, "sendfile"):
+                kernel_copies.append(("sendfile", lambda offset, count: os.sendfile(
+                    dst_fd, src_fd, offset, count
+                )))
+            
+            for method, copy_range in kernel_copies:
+                offset = 0
+                try:
+                    while offset < size:
+                        copied = copy_range(offset, min(CLONE_SLICE_SIZE, size - offset))
+                        if copied == 0:
+                            break
+                        offset += copied
+                        report(copied)
+                    return method
+                except OSError as e:
+                    # 文件系统不支持时换下一种方式，从头重新复制
+                    if e.errno not in KERNEL_COPY_UNSUPPORTED or offset > 0:
+                        raise
+            
+            while True:
+                data = src.read(CLONE_SLICE_SIZE)
+                if not data:
+                    break
+                dst.write(data)
+                report(len(data))
+            return "copy"
+    
     @staticmethod
     def calculate_directory_size(directory: Path) -> int:
         """
@@ -279,10 +403,13 @@ class FileService:
             is_folder=True,
             parent_id=parent_id,
             owner_id=user.id,
-            category="folder"
+            category="folder",
+            volume=volumes.volume_for_path(folder_path).name
         )
         
         self.db.add(folder)
+        self.db.flush()
+        record_change(self.db, user.id, folder.id, "created")
         self.db.commit()
         self.db.refresh(folder)
         
@@ -342,12 +469,16 @@ class FileService:
                     detail="父文件夹不存在"
                 )
             
-            save_dir = Path(parent.file_path)
+            parent_dir = Path(parent.file_path)
         else:
-            save_dir = user_path
+            parent_dir = user_path
+        
+        # 按放置策略选择存储卷，文件夹在该卷上按需镜像创建
+        volume = volumes.choose(user, file_size)
+        save_dir = volumes.path_on(volume, parent_dir)
         
-        # 获取唯一文件名
-        unique_name = self.file_manager.get_unique_filename(save_dir, safe_name)
+        # 获取唯一文件名（所有卷的同一文件夹中都不能重名）
+        unique_name = volumes.get_unique_filename(save_dir, safe_name)
         file_path = save_dir / unique_name
         
         # 保存文件
@@ -362,9 +493,7 @@ class FileService:
         
         # 创建缩略图（如果是图片）
         if category == "image":
-            thumbnail_dir = user_path / ".thumbnails"
-            thumbnail_path = thumbnail_dir / f"{md5_hash}.jpg"
-            self.file_manager.create_thumbnail(file_path, thumbnail_path)
+            self.file_manager.ensure_thumbnail(file_path, md5_hash)
         
         # 创建数据库记录
         file_record = File(
@@ -377,10 +506,17 @@ class FileService:
             md5_hash=md5_hash,
             is_folder=False,
             parent_id=parent_id,
-            owner_id=user.id
+            owner_id=user.id,
+            volume=volume.name
         )
         
         self.db.add(file_record)
+        self.db.flush()
+        record_change(self.db, user.id, file_record.id, "created")
+        
+        # 图片元数据（拍摄时间等）与缩略图一起提取，上传后立即出现在时间线中
+        if category == "image":
+            record_photo_metadata(self.db, file_record)
         
         # 更新用户已用空间
         user.used_space += actual_size
@@ -390,15 +526,15 @@ class FileService:
         
         return file_record
     
-    def list_files(
+    def list_query(
         self,
         user: User,
         parent_id: Optional[int] = None,
         category: Optional[str] = None,
         search: Optional[str] = None
-    ) -> List[File]:
+    ):
         """
-        列出文件
+        文件列表查询（已过滤和排序，调用方可以只选择需要的列）
         
         Args:
             user: 用户对象
@@ -407,7 +543,7 @@ class FileService:
             search: 搜索关键词
         
         Returns:
-            File对象列表
+            File查询
         """
         query = self.db.query(File).filter(
             File.owner_id == user.id,
@@ -425,7 +561,28 @@ class FileService:
         if search:
             query = query.filter(File.filename.contains(search))
         
-        return query.order_by(File.is_folder.desc(), File.created_at.desc()).all()
+        return query.order_by(File.is_folder.desc(), File.created_at.desc())
+    
+    def list_files(
+        self,
+        user: User,
+        parent_id: Optional[int] = None,
+        category: Optional[str] = None,
+        search: Optional[str] = None
+    ) -> List[File]:
+        """
+        列出文件
+        
+        Args:
+            user: 用户对象
+            parent_id: 父文件夹ID
+            category: 文件类别过滤
+            search: 搜索关键词
+        
+        Returns:
+            File对象列表
+        """
+        return self.list_query(user, parent_id, category, search).all()
     
     def get_file(self, user: User, file_id: int) -> File:
         """
@@ -452,9 +609,61 @@ class FileService:
         
         return file
     
+    def get_descendant_ids(self, folder_id: int, *criteria) -> List[int]:
+        """
+        获取文件夹下所有子孙条目的ID（逐层查询）
+        
+        Args:
+            folder_id: 文件夹ID
+            criteria: 额外过滤条件（只沿满足条件的条目向下遍历）
+        
+        Returns:
+            子孙条目ID列表
+        """
+        result = []
+        frontier = [folder_id]
+        
+        while frontier:
+            next_frontier = []
+            for batch in chunked(frontier):
+                rows = self.db.query(File.id, File.is_folder).filter(
+                    File.parent_id.in_(batch),
+                    *criteria
+                ).all()
+                for row_id, is_folder in rows:
+                    result.append(row_id)
+                    if is_folder:
+                        next_frontier.append(row_id)
+            frontier = next_frontier
+        
+        return result
+    
+    def sum_file_sizes(self, file_ids: List[int], *criteria) -> int:
+        """
+        统计一组条目中文件（不含文件夹）的总大小
+        
+        Args:
+            file_ids: 条目ID列表
+            criteria: 额外过滤条件
+        
+        Returns:
+            总大小（字节）
+        """
+        total = 0
+        for batch in chunked(file_ids):
+            total += self.db.query(func.coalesce(func.sum(File.size), 0)).filter(
+                File.id.in_(batch),
+                File.is_folder == False,
+                *criteria
+            ).scalar()
+        return total
+    
     def delete_file(self, user: User, file_id: int) -> bool:
         """
-        删除文件（软删除）
+        删除文件（软删除，移入回收站）
+        
+        删除文件夹时，其下所有未删除的子孙条目使用相同的删除时间一并标记，
+        以便从回收站整体还原。
         
         Args:
             user: 用户对象
@@ -464,13 +673,28 @@ class FileService:
             是否成功
         """
         file = self.get_file(user, file_id)
+        deleted_at = datetime.utcnow()
+        
+        ids = [file.id]
+        if file.is_folder:
+            ids += self.get_descendant_ids(file.id, File.is_deleted == False)
+        
+        freed = self.sum_file_sizes(ids, File.is_deleted == False)
         
         # 标记为已删除
-        file.is_deleted = True
-        file.deleted_at = datetime.utcnow()
+        for batch in chunked(ids):
+            self.db.query(File).filter(
+                File.id.in_(batch),
+                File.is_deleted == False
+            ).update(
+                {File.is_deleted: True, File.deleted_at: deleted_at},
+                synchronize_session=False
+            )
+        
+        record_changes(self.db, user.id, ids, "deleted")
         
         # 更新用户已用空间
-        user.used_space -= file.size
+        user.used_space -= freed
         if user.used_space < 0:
             user.used_space = 0
         
@@ -499,24 +723,48 @@ class FileService:
         old_path = Path(file.file_path)
         new_path = old_path.parent / safe_name
         
-        if new_path.exists() and new_path != old_path:
+        if new_path == old_path:
+            return file
+        
+        if volumes.exists_anywhere(new_path):
             raise HTTPException(
                 status_code=status.HTTP_409_CONFLICT,
                 detail="文件名已存在"
             )
         
-        old_path.rename(new_path)
+        if file.is_folder:
+            # 文件夹在各个卷上的镜像目录一起重命名
+            volumes.move_tree(old_path, new_path)
+            self._rebase_descendants(file, old_path, new_path)
+        else:
+            old_path.rename(new_path)
         
         # 更新数据库
         file.filename = safe_name
         file.file_path = str(new_path)
         file.updated_at = datetime.utcnow()
+        record_change(self.db, user.id, file.id, "updated")
         
         self.db.commit()
         self.db.refresh(file)
         
         return file
     
+    def _rebase_descendants(self, folder: File, old_path: Path, new_path: Path):
+        """
+        文件夹重命名或移动后更新所有子孙条目的路径（不提交事务）
+        
+        Args:
+            folder: 文件夹对象
+            old_path: 文件夹原路径
+            new_path: 文件夹新路径
+        """
+        ids = self.get_descendant_ids(folder.id)
+        
+        for batch in chunked(ids):
+            for child in self.db.query(File).filter(File.id.in_(batch)).all():
+                child.file_path = volumes.rebase_path(child.file_path, old_path, new_path)
+    
     def move_file(self, user: User, file_id: int, new_parent_id: Optional[int]) -> File:
         """
         移动文件
@@ -545,26 +793,42 @@ class FileService:
                     detail="目标文件夹不存在"
                 )
             
+            if file.is_folder and (
+                new_parent.id == file.id
+                or new_parent.id in self.get_descendant_ids(file.id)
+            ):
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="不能将文件夹移动到其自身或子文件夹中"
+                )
+            
             new_dir = Path(new_parent.file_path)
         else:
             new_dir = settings.get_user_storage_path(user.id)
         
-        # 移动物理文件
+        # 移动物理文件（文件保持在原存储卷上，避免跨设备复制）
         old_path = Path(file.file_path)
-        new_path = new_dir / file.filename
+        new_path = volumes.path_on(volumes.volume_for_path(old_path), new_dir) / file.filename
         
-        if new_path.exists():
+        if volumes.exists_anywhere(new_path):
             raise HTTPException(
                 status_code=status.HTTP_409_CONFLICT,
                 detail="目标位置已存在同名文件"
             )
         
-        shutil.move(str(old_path), str(new_path))
+        if file.is_folder:
+            volumes.move_tree(old_path, new_path)
+            self._rebase_descendants(file, old_path, new_path)
+        else:
+            new_path.parent.mkdir(parents=True, exist_ok=True)
+            shutil.move(str(old_path), str(new_path))
         
         # 更新数据库
+        old_parent_id = file.parent_id
         file.parent_id = new_parent_id
         file.file_path = str(new_path)
         file.updated_at = datetime.utcnow()
+        record_change(self.db, user.id, file.id, "moved", from_parent_id=old_parent_id)
         
         self.db.commit()
         self.db.refresh(file)
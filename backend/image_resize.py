@@ -0,0 +1,238 @@
+"""
+图片缩放模块
+按客户端需要的尺寸返回图片（手机端、桌面网格、预览窗口需要的尺寸各不相同）：
+GET /api/files/{id}/resize?w=&h=&fit=&format=&q=
+
+- 请求的宽高向上取整到IMAGE_RESIZE_SIZES中的尺寸、质量取最接近的IMAGE_RESIZE_QUALITIES，
+  任意尺寸的请求只会产生有限几种版本，缓存命中率高
+- 按EXIF方向信息旋转后再缩放（手机竖拍的照片不会横着显示）
+- JPEG使用draft按缩小比例解码，大图不需要完整解码
+- 结果存入共享派生文件缓存（见derivative_cache.py），相同内容、相同参数只解码一次；
+  同一进程中同时到达的相同请求只生成一次，其余请求等待结果
+- 缩放在独立的线程池中执行，线程数为IMAGE_RESIZE_WORKERS，避免大量缩放请求占满请求线程池
+"""
+
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, status
+from PIL import Image, ImageOps
+
+from models import File
+from config import settings
+from chunkstore import open_stored_file
+from derivative_cache import derivative_cache
+
+
+# 缩放方式：contain 等比缩放到框内（不裁剪、不放大），cover 等比缩放后居中裁剪为框的尺寸
+FIT_MODES = ("contain", "cover")
+
+# 输出格式: (Pillow格式, 扩展名, MIME类型)
+OUTPUT_FORMATS = {
+    "jpeg": ("JPEG", "jpg", "image/jpeg"),
+    "webp": ("WEBP", "webp", "image/webp"),
+    "png": ("PNG", "png", "image/png"),
+}
+
+
+def _parse_int_list(value: str) -> List[int]:
+    return sorted({int(item) for item in value.split(",") if item.strip().isdigit() and int(item) > 0})
+
+
+def snap_size(value: Optional[int], sizes: List[int]) -> int:
+    """
+    把请求的尺寸向上取整到允许的尺寸（超过最大尺寸时取最大尺寸）
+    
+    Args:
+        value: 请求的尺寸（None或0表示不限制）
+        sizes: 允许的尺寸（从小到大）
+    
+    Returns:
+        取整后的尺寸，不限制时返回0
+    """
+    if not value:
+        return 0
+    for size in sizes:
+        if size >= value:
+            return size
+    return sizes[-1]
+
+
+def snap_quality(value: int, qualities: List[int]) -> int:
+    """取最接近的允许质量（距离相同时取较高的质量）"""
+    return min(qualities, key=lambda q: (abs(q - value), -q))
+
+
+class ResizeSpec:
+    """规范化后的缩放参数"""
+    
+    __slots__ = ("width", "height", "fit", "format", "quality")
+    
+    def __init__(self, width: int, height: int, fit: str, format: str, quality: int):
+        self.width = width
+        self.height = height
+        self.fit = fit
+        self.format = format
+        self.quality = quality
+    
+    @classmethod
+    def build(cls, width: Optional[int], height: Optional[int], fit: str, format: str, quality: int) -> "ResizeSpec":
+        """
+        按配置规范化客户端请求的参数
+        
+        Args:
+            width: 请求的宽度
+            height: 请求的高度
+            fit: contain / cover
+            format: jpeg / webp / png
+            quality: 1-100（png忽略）
+        
+        Returns:
+            缩放参数
+        """
+        if not width and not height:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="请指定宽度或高度"
+            )
+        if fit not in FIT_MODES or format not in OUTPUT_FORMATS:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="不支持的缩放方式或格式"
+            )
+        
+        sizes = _parse_int_list(settings.IMAGE_RESIZE_SIZES) or [settings.THUMBNAIL_SIZE[0]]
+        qualities = _parse_int_list(settings.IMAGE_RESIZE_QUALITIES) or [85]
+        width, height = snap_size(width, sizes), snap_size(height, sizes)
+        if fit == "cover":
+            # 裁剪需要确定的宽高，只指定一边时裁剪为正方形
+            width, height = width or height, height or width
+        quality = 0 if format == "png" else snap_quality(quality, qualities)
+        return cls(width, height, fit, format, quality)
+    
+    @property
+    def rendition(self) -> str:
+        """派生文件缓存中的版本名，如 img-640x0-contain-q85.jpg"""
+        _, extension, _ = OUTPUT_FORMATS[self.format]
+        quality = f"-q{self.quality}" if self.quality else ""
+        return f"img-{self.width}x{self.height}-{self.fit}{quality}.{extension}"
+    
+    @property
+    def media_type(self) -> str:
+        return OUTPUT_FORMATS[self.format][2]
+
+
+def render(file: File, spec: ResizeSpec, destination: Path) -> bool:
+    """
+    解码、按EXIF方向旋转、缩放并保存
+    
+    Args:
+        file: 图片文件对象
+        spec: 缩放参数
+        destination: 输出路径
+    
+    Returns:
+        是否成功
+    """
+    box = max(spec.width, spec.height)
+    with open_stored_file(file) as stream, Image.open(stream) as img:
+        # JPEG按不小于目标尺寸的最大缩小比例解码（EXIF旋转前宽高可能互换，按较大边计算）
+        img.draft("RGB", (box, box))
+        img = ImageOps.exif_transpose(img)
+        
+        if spec.fit == "cover":
+            img = ImageOps.fit(img, (spec.width, spec.height), Image.LANCZOS)
+        else:
+            img.thumbnail((spec.width or img.width, spec.height or img.height), Image.LANCZOS)
+        
+        pil_format, _, _ = OUTPUT_FORMATS[spec.format]
+        if pil_format == "JPEG" and img.mode != "RGB":
+            # JPEG不支持透明度，透明部分填充白色
+            rgba = img.convert("RGBA")
+            img = Image.new("RGB", rgba.size, (255, 255, 255))
+            img.paste(rgba, mask=rgba.split()[-1])
+        elif img.mode not in ("RGB", "RGBA", "L", "LA"):
+            img = img.convert("RGBA")
+        
+        options = {"optimize": True} if pil_format != "WEBP" else {"method": 4}
+        if spec.quality:
+            options["quality"] = spec.quality
+        img.save(destination, pil_format, **options)
+    return True
+
+
+class ImageResizer:
+    """图片缩放（独立线程池执行，同一进程内相同请求合并）"""
+    
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._inflight: Dict[Tuple[str, str], Future] = {}
+    
+    def _submit(self, file: File, spec: ResizeSpec) -> Future:
+        key = (file.md5_hash, spec.rendition)
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is None:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="image-resize")
+                future = self._executor.submit(self._create, file, spec)
+                self._inflight[key] = future
+                future.add_done_callback(lambda _: self._finish(key))
+        return future
+    
+    def _finish(self, key: Tuple[str, str]):
+        with self._lock:
+            self._inflight.pop(key, None)
+    
+    @staticmethod
+    def _create(file: File, spec: ResizeSpec) -> Optional[Path]:
+        try:
+            created = derivative_cache.write(file.md5_hash, spec.rendition, lambda path: render(file, spec, path))
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            print(f"[THUMBNAIL] 缩放图片失败 {file.file_path}: {e}")
+            return None
+        if not created:
+            return None
+        derivative_cache.register(file.md5_hash, spec.rendition)
+        return derivative_cache.path(file.md5_hash, spec.rendition)
+    
+    async def resize(self, file: File, spec: ResizeSpec) -> Path:
+        """
+        获取缩放后的图片（缓存中没有时生成）
+        
+        Args:
+            file: 图片文件对象
+            spec: 缩放参数
+        
+        Returns:
+            缩放后的图片路径
+        """
+        if file.is_folder or file.category != "image" or not file.md5_hash:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="只能缩放图片文件"
+            )
+        
+        path = derivative_cache.lookup(file.md5_hash, spec.rendition)
+        if path is None:
+            path = await asyncio.wrap_future(self._submit(file, spec))
+        if path is None:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="无法解析该图片"
+            )
+        return path
+    
+    def shutdown(self):
+        """关闭线程池（应用关闭时调用）"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+# 全局图片缩放实例
+image_resizer = ImageResizer(settings.IMAGE_RESIZE_WORKERS)
@@ -0,0 +1,526 @@
+"""
+批量导入模块
+将已有目录树（如从旧NAS迁移到外接硬盘上的数据）直接导入到用户空间，无需通过HTTP重新上传
+可以用--volume指定目标存储卷（源目录与目标卷在同一磁盘时，move模式只需重命名）
+
+流程：
+1. 按目录逐层遍历源目录，为每个子目录创建（或复用）文件夹记录
+2. 文件按批次交给进程池：传输到目标目录下的临时文件、计算MD5、生成缩略图
+3. 每批文件记录批量插入并提交后，再将临时文件重命名为最终文件名
+4. 全部完成后一次性重新计算用户已用空间，并为导入的条目补写变更记录（供客户端增量同步）
+
+导入可以随时中断并重新执行同一命令继续：已导入的文件夹和文件会被复用或跳过。
+
+用法：
+    python importer.py --user alice --source /mnt/usb1/old_nas --mode move --volume usb1
+"""
+
+import hashlib
+import mimetypes
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from models import User, File, SessionLocal
+from config import settings
+from file_handler import FileManager
+from derivative_cache import derivative_cache, THUMBNAIL_RENDITION
+from volumes import volumes
+from changes import backfill_changes
+
+
+# 传输方式
+IMPORT_MODES = ("copy", "move", "link")
+
+# 临时文件前缀（以“.”开头，一致性检查和列表都会忽略）
+TEMP_PREFIX = ".importing-"
+
+
+def _temp_path_for(target: Path) -> Path:
+    """获取目标文件对应的临时文件路径"""
+    return target.parent / f"{TEMP_PREFIX}{target.name}"
+
+
+def _transfer_and_hash(
+    source: str,
+    temp_target: str,
+    mode: str,
+    create_thumbnail: bool
+) -> Tuple[str, int, bool]:
+    """
+    传输单个文件并计算MD5（在工作进程中执行）
+    
+    copy模式在复制的同时计算哈希，源文件只读取一次；
+    如果上次执行在移动之后中断（源文件已不存在而临时文件存在），直接使用临时文件。
+    
+    Args:
+        source: 源文件路径
+        temp_target: 目标临时文件路径
+        mode: 传输方式（copy/move/link）
+        create_thumbnail: 是否生成缩略图（图片）
+    
+    Returns:
+        (MD5哈希, 文件大小, 是否新生成了缩略图)
+    """
+    md5_hash = hashlib.md5()
+    size = 0
+    
+    if not os.path.exists(source) and os.path.exists(temp_target):
+        mode = "existing"
+    
+    if mode == "copy":
+        with open(source, "rb") as src, open(temp_target, "wb") as dst:
+            while chunk := src.read(1024 * 1024):
+                md5_hash.update(chunk)
+                dst.write(chunk)
+                size += len(chunk)
+        shutil.copystat(source, temp_target)
+    else:
+        if mode == "move":
+            shutil.move(source, temp_target)
+        elif mode == "link":
+            if os.path.exists(temp_target):
+                os.unlink(temp_target)
+            os.link(source, temp_target)
+        with open(temp_target, "rb") as f:
+            while chunk := f.read(1024 * 1024):
+                md5_hash.update(chunk)
+                size += len(chunk)
+    
+    digest = md5_hash.hexdigest()
+    
+    # 工作进程只写缩略图文件，索引由主进程写入
+    thumbnail_created = False
+    if create_thumbnail and not derivative_cache.path(digest, THUMBNAIL_RENDITION).exists():
+        thumbnail_created = derivative_cache.write(
+            digest,
+            THUMBNAIL_RENDITION,
+            lambda path: FileManager.create_thumbnail(Path(temp_target), path, settings.THUMBNAIL_SIZE)
+        )
+    
+    return digest, size, thumbnail_created
+
+
+class _PendingFile:
+    """待导入的文件"""
+    
+    __slots__ = ("source", "target", "parent_id", "original_name")
+    
+    def __init__(self, source: str, target: Path, parent_id: Optional[int], original_name: str):
+        self.source = source
+        self.target = target
+        self.parent_id = parent_id
+        self.original_name = original_name
+
+
+class DirectoryImporter:
+    """目录导入器"""
+    
+    def __init__(
+        self,
+        db: Session,
+        user: User,
+        source: str,
+        parent_id: Optional[int] = None,
+        mode: str = "copy",
+        workers: Optional[int] = None,
+        batch_size: int = 200,
+        ignore_quota: bool = False,
+        volume: Optional[str] = None
+    ):
+        if mode not in IMPORT_MODES:
+            raise ValueError(f"不支持的导入方式: {mode}")
+        
+        self.volume = volumes.find(volume)
+        if self.volume is None or not self.volume.online:
+            raise ValueError(f"存储卷不存在或未挂载: {volume}")
+        
+        self.db = db
+        self.user = user
+        self.source = os.path.abspath(source)
+        self.parent_id = parent_id
+        self.mode = mode
+        self.workers = workers or os.cpu_count() or 2
+        self.batch_size = batch_size
+        self.ignore_quota = ignore_quota
+        
+        self.user_path = settings.get_user_storage_path(user.id)
+        
+        self.stats = {
+            "folders_created": 0,
+            "folders_reused": 0,
+            "files_imported": 0,
+            "files_skipped": 0,
+            "bytes_imported": 0,
+        }
+        self._pending_bytes = 0
+        # 各目标目录中已分配给未提交文件的文件名（这些文件还是临时文件名，磁盘上查不到）
+        self._claimed_names: Dict[Path, Set[str]] = {}
+    
+    def run(self) -> dict:
+        """
+        执行导入
+        
+        Returns:
+            统计信息
+        """
+        if not os.path.isdir(self.source):
+            raise ValueError(f"源目录不存在: {self.source}")
+        
+        root_dir = self._resolve_root_dir()
+        
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            batch: List[_PendingFile] = []
+            for pending in self._iter_files(root_dir):
+                batch.append(pending)
+                if len(batch) >= self.batch_size:
+                    self._import_batch(pool, batch)
+                    batch = []
+            if batch:
+                self._import_batch(pool, batch)
+        
+        self._recalculate_used_space()
+        backfill_changes(self.db, self.user.id)
+        return self.stats
+    
+    def _resolve_root_dir(self) -> Path:
+        """获取导入目标根目录"""
+        if self.parent_id is None:
+            return volumes.user_root(self.volume, self.user.id)
+        
+        parent = self.db.query(File).filter(
+            File.id == self.parent_id,
+            File.owner_id == self.user.id,
+            File.is_folder == True,
+            File.is_deleted == False
+        ).first()
+        if not parent:
+            raise ValueError("目标文件夹不存在")
+        return volumes.path_on(self.volume, parent.file_path)
+    
+    def _ensure_folder(self, name: str, parent_id: Optional[int], parent_dir: Path) -> Tuple[int, Path]:
+        """
+        获取或创建文件夹记录（同名文件夹直接复用，便于中断后继续）
+        
+        Returns:
+            (文件夹ID, 文件夹路径)
+        """
+        safe_name = FileManager.get_safe_filename(name)
+        existing = self.db.query(File).filter(
+            File.owner_id == self.user.id,
+            File.parent_id == parent_id,
+            File.filename == safe_name,
+            File.is_folder == True,
+            File.is_deleted == False
+        ).first()
+        
+        if existing:
+            target_dir = volumes.path_on(self.volume, existing.file_path)
+            target_dir.mkdir(parents=True, exist_ok=True)
+            self.stats["folders_reused"] += 1
+            return existing.id, target_dir
+        
+        folder_path = parent_dir / safe_name
+        folder_path.mkdir(parents=True, exist_ok=True)
+        
+        folder = File(
+            filename=safe_name,
+            original_filename=name,
+            file_path=str(folder_path),
+            size=0,
+            is_folder=True,
+            parent_id=parent_id,
+            owner_id=self.user.id,
+            category="folder",
+            volume=self.volume.name
+        )
+        self.db.add(folder)
+        self.db.commit()
+        self.stats["folders_created"] += 1
+        
+        return folder.id, folder_path
+    
+    def _existing_files(self, parent_id: Optional[int]) -> Dict[str, List[File]]:
+        """获取目录下已有的文件（按原始文件名索引，同名的可能有多个，例如上传的文件和改名导入的文件）"""
+        rows = self.db.query(File).filter(
+            File.owner_id == self.user.id,
+            File.parent_id == parent_id,
+            File.is_folder == False,
+            File.is_deleted == False
+        ).all()
+        existing: Dict[str, List[File]] = {}
+        for f in rows:
+            existing.setdefault(f.original_filename or f.filename, []).append(f)
+        return existing
+    
+    def _imported_from(self, record: File, source_file: str) -> bool:
+        """
+        记录是否由上次导入该源文件时写入
+        
+        只按文件名判断会把用户上传的同名文件当作已导入，源文件永远不会被导入；
+        link模式比较是否为同一个inode，copy模式比较大小和修改时间（复制时保留了源文件的修改时间）。
+        移动模式导入后源文件已不存在，源文件仍在说明同名记录是其他文件。
+        """
+        if self.mode == "move":
+            return False
+        
+        target = Path(record.file_path)
+        if not target.exists():
+            target = _temp_path_for(target)
+        try:
+            source_stat = os.stat(source_file)
+            target_stat = target.stat()
+        except OSError:
+            return False
+        
+        if self.mode == "link":
+            return os.path.samestat(source_stat, target_stat)
+        # FAT/exFAT卷上修改时间的精度为2秒
+        return (record.size == source_stat.st_size
+                and abs(target_stat.st_mtime - source_stat.st_mtime) <= 2)
+    
+    def _iter_files(self, root_dir: Path) -> Iterator[_PendingFile]:
+        """
+        遍历源目录，创建文件夹记录并产出待导入的文件
+        
+        已导入的文件会被跳过；记录已提交但临时文件尚未重命名的文件会在这里补完。
+        """
+        folder_map: Dict[str, Tuple[Optional[int], Path]] = {
+            self.source: (self.parent_id, root_dir)
+        }
+        
+        for dir_path, dir_names, file_names in os.walk(self.source):
+            dir_names[:] = sorted(d for d in dir_names if not d.startswith("."))
+            parent_id, target_dir = folder_map.pop(dir_path)
+            
+            for name in dir_names:
+                source_dir = os.path.join(dir_path, name)
+                if os.path.islink(source_dir):
+                    continue
+                folder_map[source_dir] = self._ensure_folder(name, parent_id, target_dir)
+            
+            existing = self._existing_files(parent_id)
+            
+            # 上次移动模式在提交前中断：源文件已移走，只剩临时文件（先分配，避免新文件占用同名）
+            if self.mode == "move":
+                yield from self._iter_leftovers(dir_path, target_dir, parent_id, existing)
+            
+            for name in sorted(file_names):
+                if name.startswith("."):
+                    continue
+                source_file = os.path.join(dir_path, name)
+                if os.path.islink(source_file):
+                    continue
+                
+                record = next(
+                    (f for f in existing.get(name, ()) if self._imported_from(f, source_file)), None
+                )
+                if record is not None:
+                    self._finish_interrupted(record)
+                    self.stats["files_skipped"] += 1
+                    continue
+                
+                safe_name = FileManager.get_safe_filename(name)
+                yield _PendingFile(source_file, self._claim_target(target_dir, safe_name), parent_id, name)
+    
+    def _claim_target(self, target_dir: Path, safe_name: str) -> Path:
+        """
+        为待导入文件分配目标路径
+        
+        不同的源文件名清理后可能相同（如 a..b.jpg 和 a_b.jpg），同一批中先分配的文件
+        在提交前还是临时文件，只检查磁盘会分配到同一个名字，后一个重命名时覆盖前一个。
+        """
+        claimed = self._claimed_names.setdefault(target_dir, set())
+        unique_name = volumes.get_unique_filename(target_dir, safe_name, reserved=claimed)
+        claimed.add(unique_name)
+        return target_dir / unique_name
+    
+    def _iter_leftovers(
+        self,
+        dir_path: str,
+        target_dir: Path,
+        parent_id: Optional[int],
+        existing: Dict[str, List[File]]
+    ) -> Iterator[_PendingFile]:
+        """产出目标目录中没有对应记录、源文件也已不存在的临时文件"""
+        imported_names = {f.filename for records in existing.values() for f in records}
+        with os.scandir(target_dir) as it:
+            leftovers = [e.name for e in it if e.name.startswith(TEMP_PREFIX)]
+        
+        for temp_name in leftovers:
+            name = temp_name[len(TEMP_PREFIX):]
+            source_file = os.path.join(dir_path, name)
+            if name in imported_names or os.path.exists(source_file) or (target_dir / name).exists():
+                continue
+            self._claimed_names.setdefault(target_dir, set()).add(name)
+            yield _PendingFile(source_file, target_dir / name, parent_id, name)
+    
+    def _finish_interrupted(self, record: File):
+        """补完上次中断时已提交记录但尚未重命名的临时文件"""
+        target = Path(record.file_path)
+        temp_target = _temp_path_for(target)
+        if not target.exists() and temp_target.exists():
+            os.replace(temp_target, target)
+    
+    def _import_batch(self, pool: ProcessPoolExecutor, batch: List[_PendingFile]):
+        """
+        导入一批文件
+        
+        先在进程池中并行传输和计算哈希，再批量插入记录并提交，最后重命名临时文件。
+        """
+        create_thumbnails = [settings.is_image(p.original_name) for p in batch]
+        results = list(pool.map(
+            _transfer_and_hash,
+            [p.source for p in batch],
+            [str(_temp_path_for(p.target)) for p in batch],
+            [self.mode] * len(batch),
+            create_thumbnails,
+            chunksize=max(1, len(batch) // (self.workers * 4))
+        ))
+        
+        batch_bytes = sum(size for _, size, _ in results)
+        if not self.ignore_quota and self.user.used_space + self._pending_bytes + batch_bytes > self.user.quota:
+            for p in batch:
+                temp_target = _temp_path_for(p.target)
+                if self.mode == "move":
+                    shutil.move(str(temp_target), p.source)
+                else:
+                    temp_target.unlink(missing_ok=True)
+            raise ValueError("用户存储空间不足，导入已停止（提升配额后重新执行即可继续）")
+        
+        now = datetime.utcnow()
+        rows = []
+        for p, (md5_hash, size, _) in zip(batch, results):
+            mime_type, _ = mimetypes.guess_type(p.target.name)
+            rows.append({
+                "filename": p.target.name,
+                "original_filename": p.original_name,
+                "file_path": str(p.target),
+                "size": size,
+                "mime_type": mime_type or "application/octet-stream",
+                "category": settings.get_file_category(p.target.name),
+                "md5_hash": md5_hash,
+                "is_folder": False,
+                "parent_id": p.parent_id,
+                "owner_id": self.user.id,
+                "volume": self.volume.name,
+                "is_public": False,
+                "is_deleted": False,
+                "created_at": now,
+                "updated_at": now,
+            })
+        
+        self.db.bulk_insert_mappings(File, rows)
+        self.db.commit()
+        
+        for p in batch:
+            os.replace(_temp_path_for(p.target), p.target)
+        # 本批文件已出现在磁盘上，之后按磁盘检查即可
+        self._claimed_names.clear()
+        
+        for md5_hash, _, thumbnail_created in results:
+            if thumbnail_created:
+                derivative_cache.register(md5_hash, THUMBNAIL_RENDITION)
+        
+        self._pending_bytes += batch_bytes
+        self.stats["files_imported"] += len(batch)
+        self.stats["bytes_imported"] += batch_bytes
+        print(f"[IMPORT] 已导入 {self.stats['files_imported']} 个文件，"
+              f"{self.stats['bytes_imported'] / 1024 / 1024:.1f} MB")
+    
+    def _recalculate_used_space(self):
+        """按文件记录重新计算用户已用空间（导入结束时执行一次）"""
+        used = self.db.query(func.coalesce(func.sum(File.size), 0)).filter(
+            File.owner_id == self.user.id,
+            File.is_folder == False,
+            File.is_deleted == False
+        ).scalar()
+        self.user.used_space = used
+        self.db.commit()
+
+
+def import_directory(
+    db: Session,
+    user: User,
+    source: str,
+    parent_id: Optional[int] = None,
+    mode: str = "copy",
+    workers: Optional[int] = None,
+    batch_size: int = 200,
+    ignore_quota: bool = False,
+    volume: Optional[str] = None
+) -> dict:
+    """
+    将目录导入到用户空间
+    
+    Args:
+        db: 数据库会话
+        user: 目标用户
+        source: 源目录
+        parent_id: 目标文件夹ID（None为根目录）
+        mode: 传输方式（copy复制/move移动/link硬链接）
+        workers: 进程池大小
+        batch_size: 每批导入的文件数
+        ignore_quota: 是否忽略配额限制
+        volume: 目标存储卷名称（默认为默认卷）
+    
+    Returns:
+        统计信息
+    """
+    importer = DirectoryImporter(
+        db, user, source,
+        parent_id=parent_id,
+        mode=mode,
+        workers=workers,
+        batch_size=batch_size,
+        ignore_quota=ignore_quota,
+        volume=volume
+    )
+    return importer.run()
+
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="将已有目录批量导入到RaspberryCloud")
+    parser.add_argument("--user", "-u", required=True, help="目标用户名")
+    parser.add_argument("--source", "-s", required=True, help="源目录")
+    parser.add_argument("--parent-id", type=int, help="目标文件夹ID（默认根目录）")
+    parser.add_argument("--mode", choices=IMPORT_MODES, default="copy",
+                        help="copy复制 / move移动（同一磁盘上最快）/ link硬链接")
+    parser.add_argument("--workers", type=int, help="进程数（默认CPU核数）")
+    parser.add_argument("--batch-size", type=int, default=200, help="每批导入的文件数")
+    parser.add_argument("--ignore-quota", action="store_true", help="忽略用户配额限制")
+    parser.add_argument("--volume", help="目标存储卷名称（默认为默认卷）")
+    args = parser.parse_args()
+    
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.username == args.user).first()
+        if not user:
+            print(f"❌ 用户不存在: {args.user}")
+            raise SystemExit(1)
+        
+        try:
+            stats = import_directory(
+                db, user, args.source,
+                parent_id=args.parent_id,
+                mode=args.mode,
+                workers=args.workers,
+                batch_size=args.batch_size,
+                ignore_quota=args.ignore_quota,
+                volume=args.volume
+            )
+        except ValueError as e:
+            print(f"❌ {e}")
+            raise SystemExit(1)
+        
+        print(f"✅ 导入完成: {stats}")
+    finally:
+        db.close()
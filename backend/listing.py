@@ -0,0 +1,231 @@
+"""
+文件列表序列化模块
+/api/files/list 的快速路径：大文件夹的列表请求在树莓派上主要耗时在ORM对象构造和逐行序列化，这里：
+
+- 只查询需要的列，结果直接是元组，不构造File对象
+- 支持 fields= 只返回客户端需要的字段
+- 使用orjson编码（未安装时使用标准库json），时间字段由编码器直接输出ISO格式
+- format=compact 返回 {"fields": [...], "rows": [[...], ...]}，不重复字段名，适合移动端
+- 每个文件夹有版本号（folder_versions表，子条目变化时由数据库触发器递增），
+  列表响应带弱ETag，客户端带If-None-Match且版本未变时直接返回304，不执行列表查询；
+  编码后的列表按（用户, 文件夹, 版本, 参数）缓存在进程内，版本变化后旧条目自然不再命中
+
+性能对比见 scripts/benchmark_listing.py。
+"""
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Optional, Sequence
+
+from fastapi import HTTPException, status
+from fastapi.responses import Response
+from sqlalchemy import text
+from sqlalchemy.orm import Query, Session
+
+from models import User, File, FolderVersion, engine
+from config import settings
+
+try:
+    import orjson
+except ImportError:  # 可选依赖，未安装时使用标准库json
+    orjson = None
+
+
+# 可返回的字段（默认字段与原列表接口一致；新增字段需要同时加入models.FOLDER_VERSION_COLUMNS）
+LISTING_COLUMNS = {
+    "id": File.id,
+    "filename": File.filename,
+    "original_filename": File.original_filename,
+    "size": File.size,
+    "category": File.category,
+    "is_folder": File.is_folder,
+    "mime_type": File.mime_type,
+    "created_at": File.created_at,
+    "updated_at": File.updated_at,
+    "parent_id": File.parent_id,
+    "md5_hash": File.md5_hash,
+    "media_status": File.media_status,
+}
+
+DEFAULT_FIELDS = ("id", "filename", "original_filename", "size", "category",
+                  "is_folder", "mime_type", "created_at", "updated_at")
+
+
+def parse_fields(fields: Optional[str]) -> List[str]:
+    """
+    解析 fields= 参数（逗号分隔，保持顺序并去重）
+    
+    Args:
+        fields: 字段列表，为空时返回默认字段
+    
+    Returns:
+        字段名列表
+    """
+    if not fields:
+        return list(DEFAULT_FIELDS)
+    names = list(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+    unknown = [name for name in names if name not in LISTING_COLUMNS]
+    if unknown or not names:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"不支持的字段: {', '.join(unknown)}" if unknown else "请至少指定一个字段"
+        )
+    return names
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"无法序列化 {type(value).__name__}")
+
+
+def encode_json(data) -> bytes:
+    """编码为JSON（orjson可用时使用orjson，输出与标准库一致：datetime为ISO格式，中文不转义）"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=_default).encode()
+
+
+def select_rows(query: Query, fields: Sequence[str]) -> list:
+    """只查询指定字段的列（结果为元组，不构造File对象）"""
+    return query.with_entities(*(LISTING_COLUMNS[name] for name in fields)).all()
+
+
+def render_listing(query: Query, fields: Sequence[str], format: str = "objects") -> bytes:
+    """
+    执行列表查询并编码
+    
+    Args:
+        query: 已按条件过滤和排序的File查询（见FileService.list_query）
+        fields: 返回的字段
+        format: objects 每个文件一个对象 / compact 字段名只出现一次
+    
+    Returns:
+        JSON字节串
+    """
+    rows = select_rows(query, fields)
+    
+    if format == "compact":
+        return encode_json({"fields": list(fields), "rows": [tuple(row) for row in rows]})
+    return encode_json({"files": [dict(zip(fields, row)) for row in rows]})
+
+
+def json_response(content: bytes, headers: Optional[dict] = None) -> Response:
+    """已编码的JSON响应（跳过FastAPI的jsonable_encoder）"""
+    return Response(content=content, media_type="application/json", headers=headers)
+
+
+class ListingCache:
+    """编码后的文件列表缓存（按总字节数LRU淘汰）"""
+    
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            content = self._entries.get(key)
+            if content is not None:
+                self._entries.move_to_end(key)
+            return content
+    
+    def put(self, key: str, content: bytes):
+        # 单个列表超过预算的一半时不缓存，避免一个大文件夹挤掉所有条目
+        if len(content) > self.max_bytes // 2:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._entries[key] = content
+            self.size += len(content)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+
+# 全局列表缓存
+listing_cache = ListingCache(settings.LISTING_CACHE_MAX_BYTES)
+
+_versions_enabled: Optional[bool] = None
+
+
+def versions_enabled(db: Session) -> bool:
+    """文件夹版本号触发器是否存在（见models.create_folder_version_triggers，进程内只检查一次）"""
+    global _versions_enabled
+    if _versions_enabled is None:
+        _versions_enabled = engine.dialect.name == "sqlite" and db.execute(text(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'files_folder_version_%'"
+        )).scalar() == 3
+    return _versions_enabled
+
+
+def folder_version(db: Session, user: User, parent_id: Optional[int]) -> int:
+    """文件夹当前的版本号（从未变化过的文件夹为0）"""
+    version = db.query(FolderVersion.version).filter(
+        FolderVersion.owner_id == user.id,
+        FolderVersion.folder_id == (parent_id or 0)
+    ).scalar()
+    return version or 0
+
+
+def listing_etag(user: User, parent_id: Optional[int], version: int, *params) -> str:
+    """弱ETag：用户、文件夹、版本号和影响响应内容的参数的摘要"""
+    digest = hashlib.sha1(json.dumps([user.id, parent_id, version, *params]).encode()).hexdigest()
+    return f'W/"{digest[:24]}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match是否包含该ETag（弱比较）"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:]
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+
+def cached_listing(db: Session, query: Query, user: User, parent_id: Optional[int],
+                   params: Sequence, fields: Sequence[str], format: str,
+                   if_none_match: Optional[str] = None) -> Response:
+    """
+    带ETag和缓存的文件列表响应
+    
+    Args:
+        db: 数据库会话
+        query: 列表查询（见FileService.list_query）
+        user: 用户对象
+        parent_id: 文件夹ID（None为根目录）
+        params: 其他影响结果的查询参数（类别、搜索关键词）
+        fields: 返回的字段
+        format: objects / compact
+        if_none_match: 请求的If-None-Match头
+    
+    Returns:
+        200（带ETag）或304响应
+    """
+    if not versions_enabled(db):
+        return json_response(render_listing(query, fields, format))
+    
+    version = folder_version(db, user, parent_id)
+    etag = listing_etag(user, parent_id, version, *params, list(fields), format)
+    # 浏览器每次都向服务器验证缓存（未变化时为304）
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    content = listing_cache.get(etag)
+    if content is None:
+        content = render_listing(query, fields, format)
+        # 查询期间文件夹有变化时，结果可能已是新版本的内容，不能按旧版本缓存或返回旧版本的ETag
+        if folder_version(db, user, parent_id) != version:
+            return json_response(content)
+        listing_cache.put(etag, content)
+    
+    return json_response(content, headers)
@@ -3,25 +3,54 @@ RaspberryCloud 主程序
 FastAPI后端服务入口
 """
 
-from fastapi import FastAPI, Depends, HTTPException, status, File as FastAPIFile, UploadFile, Form, Request
+from fastapi import FastAPI, Depends, HTTPException, status, File as FastAPIFile, UploadFile, Form, Request, Query, BackgroundTasks, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, StreamingResponse, JSONResponse
+from fastapi.responses import FileResponse, StreamingResponse, JSONResponse, Response
+from starlette.background import BackgroundTask
 from fastapi.staticfiles import StaticFiles
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from typing import Optional, List
 from pathlib import Path
 import aiofiles
+import json
 from datetime import datetime
 
 from config import settings
-from models import get_db, init_db, User, File
+from models import get_db, init_db, User, File, SessionLocal
 from auth import (
-    authenticate_user, create_access_token, get_current_user, get_current_admin_user,
+    authenticate_user, create_access_token, get_current_user, get_current_admin_user, verify_token,
     register_user, update_user_password, UserCreate, UserLogin, UserResponse, Token
 )
 from email_verification import send_verification_code, verify_code
-from file_handler import FileService
+from file_handler import FileService, FileManager
 from share import ShareService, ShareCreate, ShareResponse, ShareAccessRequest
+from maintenance import scheduler, get_last_runs, run_task
+from trash import TrashService, trigger_trash_purge
+from consistency import run_consistency_check, REPAIR_ACTIONS
+from backup import BackupEngine
+from volumes import volumes
+from tiering import access_tracker
+from chunkstore import stored_file_response, open_stored_file
+from delta_sync import DeltaSyncService
+from changes import ChangeFeedService
+from manifest_diff import ManifestDiffService
+from batch_ops import BatchService, BatchIdsRequest, BatchTargetRequest, BatchRenameRequest
+from notifications import notifier
+from copy_jobs import CopyJobService, run_copy_job
+from media import playable_variant, trigger_media_processing, get_poster
+from content_index import ContentSearchService, trigger_content_index
+from photo_timeline import TimelineService
+from bootstrap import BootstrapService, BOOTSTRAP_PAGE_SIZE, user_stats
+from listing import parse_fields, cached_listing, encode_json, json_response
+from derivative_cache import derivative_cache
+from image_resize import image_resizer, ResizeSpec
+from document_preview import available_pages, get_page
+from thumbnail_batch import ThumbnailBatchService, ThumbnailBatchRequest
+from transcode import (
+    TranscodeService, trigger_transcode, render_playlist,
+    PLAYLIST_NAME, PLAYLIST_MEDIA_TYPE, SEGMENT_MEDIA_TYPE
+)
 
 # 创建FastAPI应用
 app = FastAPI(
@@ -192,6 +221,7 @@ async def change_password(
 
 @app.post("/api/files/upload")
 async def upload_file(
+    background_tasks: BackgroundTasks,
     file: UploadFile = FastAPIFile(...),
     parent_id: Optional[int] = Form(None),
     current_user: User = Depends(get_current_user),
@@ -206,6 +236,13 @@ async def upload_file(
     file_service = FileService(db)
     uploaded_file = await file_service.upload_file(current_user, file, parent_id)
     
+    # 视频上传后立即生成快速启动副本和封面，文档生成页面预览
+    if uploaded_file.category in ("video", "document"):
+        background_tasks.add_task(trigger_media_processing)
+    # 文档提取文本加入全文索引
+    if uploaded_file.category == "document":
+        background_tasks.add_task(trigger_content_index)
+    
     return {
         "success": True,
         "file": {
@@ -247,43 +284,85 @@ async def create_folder(
 
 @app.get("/api/files/list")
 async def list_files(
+    request: Request,
     parent_id: Optional[int] = None,
     category: Optional[str] = None,
     search: Optional[str] = None,
+    fields: Optional[str] = None,
+    format: str = Query("objects", pattern="^(objects|compact)$"),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """
-    列出文件
+    列出文件（带ETag，文件夹未变化时返回304）
     
     - **parent_id**: 父文件夹ID（可选，默认为根目录）
     - **category**: 文件类别过滤（image/video/audio/document，可选）
     - **search**: 搜索关键词（可选）
+    - **fields**: 返回的字段，逗号分隔（可选，默认为id、文件名、大小、类别、时间等）
+    - **format**: objects 每个文件一个对象 / compact 返回 {"fields": [...], "rows": [[...]]}
     """
     file_service = FileService(db)
-    files = file_service.list_files(current_user, parent_id, category, search)
+    query = file_service.list_query(current_user, parent_id, category, search)
     
-    return {
-        "files": [
-            {
-                "id": f.id,
-                "filename": f.filename,
-                "original_filename": f.original_filename,
-                "size": f.size,
-                "category": f.category,
-                "is_folder": f.is_folder,
-                "mime_type": f.mime_type,
-                "created_at": f.created_at.isoformat(),
-                "updated_at": f.updated_at.isoformat()
-            }
-            for f in files
-        ]
-    }
+    return cached_listing(
+        db, query, current_user, parent_id, [category, search],
+        parse_fields(fields), format, request.headers.get("if-none-match")
+    )
+
+
+@app.get("/api/search/content")
+async def search_content(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    按内容搜索文档（.txt / .pdf / .docx）
+    
+    - **q**: 关键词，空格分隔的多个词需要同时出现
+    - **limit**: 每页结果数
+    - **offset**: 跳过的结果数
+    """
+    search_service = ContentSearchService(db)
+    return await run_in_threadpool(search_service.search, current_user, q, limit, offset)
+
+
+@app.get("/api/photos/timeline")
+async def photo_timeline(
+    month: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}$"),
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=500),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    按拍摄时间倒序列出照片
+    
+    - **month**: 只列出某个月的照片（YYYY-MM，可选）
+    - **cursor**: 上一页返回的next_cursor（可选）
+    - **limit**: 每页数量
+    """
+    timeline_service = TimelineService(db)
+    return timeline_service.timeline(current_user, month, cursor, limit)
+
+
+@app.get("/api/photos/months")
+async def photo_months(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """按月统计照片数量（时间线的月份导航）"""
+    timeline_service = TimelineService(db)
+    return timeline_service.months(current_user)
 
 
 @app.get("/api/files/download/{file_id}")
 async def download_file(
     file_id: int,
+    request: Request,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -309,16 +388,17 @@ async def download_file(
             detail="文件不存在"
         )
     
-    return FileResponse(
-        path=file_path,
-        filename=file.original_filename or file.filename,
-        media_type=file.mime_type or 'application/octet-stream'
-    )
+    access_tracker.record(file.id)
+    
+    return stored_file_response(file, request, filename=file.original_filename or file.filename)
 
 
 @app.get("/api/files/preview/{file_id}")
 async def preview_file(
     file_id: int,
+    request: Request,
+    poster: bool = Query(False),
+    page: Optional[int] = Query(None, ge=1),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -326,36 +406,239 @@ async def preview_file(
     预览文件（返回缩略图或原文件）
     
     - **file_id**: 文件ID
+    - **poster**: 视频返回封面图片（后台处理完成前返回404）
+    - **page**: 文档返回该页的预览图片（后台处理完成前返回404）
     """
     file_service = FileService(db)
     file = file_service.get_file(current_user, file_id)
     
     file_path = Path(file.file_path)
     
-    # 如果是图片，尝试返回缩略图
-    if file.category == "image":
-        thumbnail_dir = settings.get_user_storage_path(current_user.id) / ".thumbnails"
-        thumbnail_path = thumbnail_dir / f"{file.md5_hash}.jpg"
-        
-        if thumbnail_path.exists():
-            return FileResponse(
-                path=thumbnail_path,
-                media_type='image/jpeg'
+    if page is not None:
+        page_path = get_page(db, file, page) if file.category == "document" else None
+        if page_path is None:
+            # 待处理（包括缓存被淘汰后重新排队）的文档在返回后立即处理
+            pending = file.category == "document" and file.media_status is None
+            return JSONResponse(
+                status_code=status.HTTP_404_NOT_FOUND,
+                content={"detail": "预览尚未生成"},
+                background=BackgroundTask(trigger_media_processing) if pending else None
+            )
+        return FileResponse(path=page_path, media_type="image/jpeg")
+    
+    if not file.is_folder and not poster:
+        access_tracker.record(file.id)
+    
+    # 如果是图片或请求视频封面，尝试返回缩略图（共享缓存中没有时重新生成）
+    thumbnail_path = None
+    if file.category == "image" and not file.is_chunked:
+        thumbnail_path = await run_in_threadpool(FileManager.ensure_thumbnail, file_path, file.md5_hash)
+    elif file.category == "video" and poster:
+        thumbnail_path = await run_in_threadpool(get_poster, file)
+        if thumbnail_path is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="封面尚未生成"
             )
     
-    # 返回原文件
-    if file_path.exists():
+    if thumbnail_path is not None:
         return FileResponse(
-            path=file_path,
-            media_type=file.mime_type or 'application/octet-stream'
+            path=thumbnail_path,
+            media_type='image/jpeg'
         )
     
+    # 视频优先返回moov已移到开头的快速启动副本，浏览器无需下载完整文件即可开始播放
+    if file.category == "video":
+        variant = playable_variant(file)
+        if variant is not None:
+            return FileResponse(path=variant, media_type=file.mime_type)
+    
+    # 返回原文件
+    if file_path.exists():
+        return stored_file_response(file, request)
+    
     raise HTTPException(
         status_code=status.HTTP_404_NOT_FOUND,
         detail="文件不存在"
     )
 
 
+@app.post("/api/files/thumbnails")
+async def get_thumbnails(
+    request: ThumbnailBatchRequest,
+    format: str = Query("bundle", pattern="^(bundle|sprite)$"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    批量获取缩略图（网格视图一页一次请求）
+    
+    - **file_ids**: 文件ID列表（最多200个）
+    - **format**: bundle（二进制打包）或 sprite（图集及位置）
+    """
+    thumbnail_service = ThumbnailBatchService(db)
+    if format == "sprite":
+        return await run_in_threadpool(thumbnail_service.sprite, current_user, request.file_ids)
+    
+    data = await run_in_threadpool(thumbnail_service.bundle, current_user, request.file_ids)
+    return Response(content=data, media_type="application/octet-stream")
+
+
+@app.get("/api/files/thumbnails/sprite/{key}")
+async def get_thumbnail_sprite(
+    key: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    缩略图图集图片（地址按内容生成，内容不会变化，可以长期缓存）
+    
+    - **key**: 图集标识
+    """
+    thumbnail_service = ThumbnailBatchService(db)
+    path = thumbnail_service.sprite_image(current_user, key)
+    
+    return FileResponse(
+        path=path,
+        media_type="image/jpeg",
+        headers={"Cache-Control": "private, max-age=31536000, immutable"}
+    )
+
+
+@app.get("/api/files/{file_id}/pages")
+async def get_document_pages(
+    file_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    获取文档已生成的预览页面
+    
+    - **file_id**: 文件ID
+    """
+    file_service = FileService(db)
+    file = file_service.get_file(current_user, file_id)
+    
+    return {
+        "status": file.media_status,
+        "pages": [
+            {"page": page, "url": f"/api/files/preview/{file.id}?page={page}"}
+            for page in available_pages(file)
+        ]
+    }
+
+
+@app.get("/api/files/{file_id}/resize")
+async def resize_image(
+    file_id: int,
+    w: Optional[int] = Query(None, ge=1, le=10000),
+    h: Optional[int] = Query(None, ge=1, le=10000),
+    fit: str = Query("contain", pattern="^(contain|cover)$"),
+    format: str = Query("jpeg", pattern="^(jpeg|webp|png)$"),
+    q: int = Query(85, ge=1, le=100),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    获取缩放后的图片（按EXIF方向旋转，结果缓存）
+    
+    - **w** / **h**: 宽度/高度（至少指定一个，向上取整到配置的尺寸）
+    - **fit**: contain（缩放到框内）或 cover（缩放后居中裁剪）
+    - **format**: jpeg / webp / png
+    - **q**: 质量（取最接近的配置档位，png忽略）
+    """
+    spec = ResizeSpec.build(w, h, fit, format, q)
+    file_service = FileService(db)
+    file = file_service.get_file(current_user, file_id)
+    
+    path = await image_resizer.resize(file, spec)
+    
+    return FileResponse(
+        path=path,
+        media_type=spec.media_type,
+        headers={"Cache-Control": "private, max-age=86400"}
+    )
+
+
+@app.post("/api/files/{file_id}/hls")
+async def request_hls(
+    file_id: int,
+    background_tasks: BackgroundTasks,
+    renditions: Optional[str] = Form(None),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    为视频发起HLS转码（后台排队执行，同一时刻只转码一个版本）
+    
+    - **file_id**: 文件ID
+    - **renditions**: 需要的版本，逗号分隔（默认为配置中的全部版本，如 480p,720p）
+    """
+    transcode_service = TranscodeService(db)
+    wanted = [name.strip() for name in renditions.split(",") if name.strip()] if renditions else None
+    result = transcode_service.request(current_user, file_id, wanted)
+    background_tasks.add_task(trigger_transcode)
+    
+    return result
+
+
+@app.get("/api/files/{file_id}/hls")
+async def get_hls_status(
+    file_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    查询视频的HLS转码状态
+    
+    - **file_id**: 文件ID
+    """
+    transcode_service = TranscodeService(db)
+    return transcode_service.get_status(current_user, file_id)
+
+
+@app.get("/api/files/{file_id}/hls/master.m3u8")
+async def get_hls_master_playlist(
+    file_id: int,
+    token: Optional[str] = Query(None),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    HLS主播放列表（包含已完成的版本）
+    
+    - **file_id**: 文件ID
+    """
+    transcode_service = TranscodeService(db)
+    playlist = transcode_service.master_playlist(current_user, file_id, token)
+    
+    return Response(content=playlist, media_type=PLAYLIST_MEDIA_TYPE)
+
+
+@app.get("/api/files/{file_id}/hls/{rendition}/{filename}")
+async def get_hls_file(
+    file_id: int,
+    rendition: str,
+    filename: str,
+    token: Optional[str] = Query(None),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    HLS版本播放列表和分段文件
+    
+    - **file_id**: 文件ID
+    - **rendition**: 版本名称
+    - **filename**: index.m3u8 或分段文件名
+    """
+    transcode_service = TranscodeService(db)
+    path = transcode_service.rendition_file(current_user, file_id, rendition, filename)
+    
+    if path.name == PLAYLIST_NAME:
+        return Response(content=render_playlist(path, token), media_type=PLAYLIST_MEDIA_TYPE)
+    return FileResponse(path=path, media_type=SEGMENT_MEDIA_TYPE)
+
+
 @app.delete("/api/files/{file_id}")
 async def delete_file(
     file_id: int,
@@ -441,6 +724,8 @@ async def batch_download(
     """
     import zipfile
     import io
+    import shutil
+    from urllib.parse import quote
     from datetime import datetime
     
     file_service = FileService(db)
@@ -460,11 +745,13 @@ async def batch_download(
                 file_path = Path(file.file_path)
                 
                 if file_path.exists():
-                    # 添加文件到ZIP
-                    zip_file.write(
-                        file_path,
-                        arcname=file.original_filename or file.filename
-                    )
+                    # 添加文件到ZIP（已分块的文件按清单拼接）
+                    arcname = file.original_filename or file.filename
+                    if file.is_chunked:
+                        with open_stored_file(file) as src, zip_file.open(arcname, 'w') as dst:
+                            shutil.copyfileobj(src, dst, 1024 * 1024)
+                    else:
+                        zip_file.write(file_path, arcname=arcname)
             except Exception as e:
                 print(f"添加文件 {file_id} 到ZIP失败: {e}")
                 continue
@@ -479,9 +766,359 @@ async def batch_download(
         zip_buffer,
         media_type="application/zip",
         headers={
-            "Content-Disposition": f'attachment; filename="{filename}"'
+            "Content-Disposition": f"attachment; filename*=utf-8''{quote(filename)}"
+        }
+    )
+
+
+@app.post("/api/files/batch/delete")
+async def batch_delete(
+    request: BatchIdsRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    批量删除（移入回收站）
+    
+    - **file_ids**: 文件ID列表
+    """
+    batch_service = BatchService(db)
+    return batch_service.delete(current_user, request.file_ids)
+
+
+@app.post("/api/files/batch/move")
+async def batch_move(
+    request: BatchTargetRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    批量移动
+    
+    - **file_ids**: 文件ID列表
+    - **target_parent_id**: 目标文件夹ID（null表示根目录）
+    """
+    batch_service = BatchService(db)
+    return await run_in_threadpool(batch_service.move, current_user, request.file_ids, request.target_parent_id)
+
+
+@app.post("/api/files/batch/copy")
+async def batch_copy(
+    request: BatchTargetRequest,
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    批量复制（服务器端复制，重名时自动编号）
+    
+    复制量较大时转为后台任务，返回202和任务信息，通过 /api/files/copy-jobs/{job_id} 查询进度
+    
+    - **file_ids**: 文件ID列表
+    - **target_parent_id**: 目标文件夹ID（null表示根目录）
+    """
+    copy_service = CopyJobService(db)
+    job = await run_in_threadpool(copy_service.create_if_large, current_user, request.file_ids, request.target_parent_id)
+    if job is not None:
+        background_tasks.add_task(run_copy_job, job.id)
+        return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content=copy_service.to_dict(job))
+    
+    batch_service = BatchService(db)
+    return await run_in_threadpool(batch_service.copy, current_user, request.file_ids, request.target_parent_id)
+
+
+@app.post("/api/files/{file_id}/copy")
+async def copy_file(
+    file_id: int,
+    background_tasks: BackgroundTasks,
+    target_parent_id: Optional[int] = Form(None),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    复制文件或文件夹（服务器端复制，较大时转为后台任务）
+    
+    - **file_id**: 文件ID
+    - **target_parent_id**: 目标文件夹ID（null表示根目录）
+    """
+    copy_service = CopyJobService(db)
+    job = await run_in_threadpool(copy_service.create_if_large, current_user, [file_id], target_parent_id)
+    if job is not None:
+        background_tasks.add_task(run_copy_job, job.id)
+        return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content=copy_service.to_dict(job))
+    
+    batch_service = BatchService(db)
+    result = await run_in_threadpool(batch_service.copy, current_user, [file_id], target_parent_id)
+    item = result["results"][0]
+    if not item["success"]:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND if item["error"] == "文件不存在" else status.HTTP_400_BAD_REQUEST,
+            detail=item["error"]
+        )
+    
+    return {
+        "success": True,
+        "file": {
+            "id": item["new_id"],
+            "filename": item["filename"],
+            "parent_id": target_parent_id
+        }
+    }
+
+
+@app.get("/api/files/copy-jobs/{job_id}")
+async def get_copy_job(
+    job_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    查询复制任务进度
+    
+    - **status**: pending / running / completed / failed
+    - **progress**: 按字节计算的百分比；完成后result为逐条结果
+    """
+    copy_service = CopyJobService(db)
+    return copy_service.to_dict(copy_service.get_job(current_user, job_id))
+
+
+@app.post("/api/files/batch/rename")
+async def batch_rename(
+    request: BatchRenameRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    批量重命名
+    
+    - **items**: [{"id": 文件ID, "new_name": 新文件名}, ...]
+    """
+    batch_service = BatchService(db)
+    return await run_in_threadpool(
+        batch_service.rename, current_user, [(item.id, item.new_name) for item in request.items]
+    )
+
+
+# ==================== 回收站 ====================
+
+@app.get("/api/trash")
+async def list_trash(
+    page: int = Query(1, ge=1),
+    page_size: int = Query(50, ge=1, le=500),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    列出回收站内容
+    
+    - **page**: 页码（从1开始）
+    - **page_size**: 每页条数（最多500）
+    """
+    trash_service = TrashService(db)
+    return trash_service.list_trash(current_user, page, page_size)
+
+
+@app.post("/api/trash/{file_id}/restore")
+async def restore_file(
+    file_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    从回收站还原文件
+    
+    - **file_id**: 文件ID
+    """
+    trash_service = TrashService(db)
+    file = trash_service.restore(current_user, file_id)
+    
+    return {
+        "success": True,
+        "file": {
+            "id": file.id,
+            "filename": file.filename,
+            "parent_id": file.parent_id
         }
+    }
+
+
+@app.delete("/api/trash/{file_id}")
+async def delete_file_permanently(
+    file_id: int,
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    彻底删除回收站中的文件
+    
+    - **file_id**: 文件ID
+    """
+    trash_service = TrashService(db)
+    queued = trash_service.delete_permanently(current_user, file_id)
+    background_tasks.add_task(trigger_trash_purge)
+    
+    return {"success": True, "queued": queued, "message": "文件已彻底删除"}
+
+
+@app.delete("/api/trash")
+async def empty_trash(
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """清空回收站"""
+    trash_service = TrashService(db)
+    queued = trash_service.empty(current_user)
+    background_tasks.add_task(trigger_trash_purge)
+    
+    return {"success": True, "queued": queued, "message": "回收站已清空"}
+
+
+# ==================== 增量同步 ====================
+
+@app.get("/api/sync/changes")
+async def list_sync_changes(
+    since: str = Query("0"),
+    limit: int = Query(settings.SYNC_CHANGES_PAGE_SIZE, ge=1, le=5000),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    获取游标之后的文件变更（增量同步）
+    
+    - **since**: 上次返回的cursor（0表示全量同步；全量同步中间页的cursor为字符串，原样传回）
+    - **limit**: 每页最多读取的记录数
+    
+    返回的changes为数组，字段顺序见columns；has_more为true时用新的cursor继续请求，
+    reset为true时需要从since=0重新全量同步。
+    """
+    change_service = ChangeFeedService(db)
+    return change_service.list_changes(current_user, since, limit)
+
+
+@app.post("/api/sync/manifest-diff")
+async def diff_sync_manifest(
+    manifest: UploadFile = FastAPIFile(...),
+    folder_id: Optional[int] = Form(None),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    比对本地文件夹清单与服务器文件夹（一次往返完成对账）
+    
+    - **manifest**: 每行一条JSON的清单（可gzip压缩），如 ["a/b.jpg", 大小, 修改时间, "md5"]
+    - **folder_id**: 对账的文件夹ID（为空表示根目录）
+    
+    返回upload / present / deduplicable / delete_candidates / create_folders，格式见manifest_diff.py
+    """
+    diff_service = ManifestDiffService(db)
+    return await run_in_threadpool(diff_service.diff, current_user, folder_id, manifest.file)
+
+
+@app.get("/api/sync/files/{file_id}/signature")
+async def get_sync_signature(
+    file_id: int,
+    block_size: Optional[int] = Query(None),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    获取文件当前版本的分块签名（rsync弱校验和 + MD5）
+    
+    - **file_id**: 文件ID
+    - **block_size**: 分块大小（字节，默认DELTA_BLOCK_SIZE）
+    """
+    delta_service = DeltaSyncService(db)
+    return await run_in_threadpool(delta_service.get_signature, current_user, file_id, block_size)
+
+
+@app.post("/api/sync/files/{file_id}/delta")
+async def upload_sync_delta(
+    file_id: int,
+    base_md5: str = Form(...),
+    block_size: int = Form(...),
+    instructions: str = Form(...),
+    target_md5: Optional[str] = Form(None),
+    device_id: Optional[str] = Form(None),
+    data: Optional[UploadFile] = FastAPIFile(None),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    上传增量数据，生成文件新版本（原子替换，文件ID不变）
+    
+    - **base_md5**: 计算增量时所基于的版本MD5，与当前版本不一致时返回409
+    - **block_size**: 签名分块大小
+    - **instructions**: JSON指令列表，如 [["copy", 0, 10], ["data", 1024], ["copy", 11, 5]]
+    - **data**: 按data指令顺序拼接的新数据
+    - **target_md5**: 新版本MD5（可选，提供时校验）
+    - **device_id**: 客户端设备ID（可选）
+    """
+    try:
+        parsed = json.loads(instructions)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="增量指令格式错误")
+    
+    delta_service = DeltaSyncService(db)
+    file = await run_in_threadpool(
+        delta_service.apply_delta,
+        current_user, file_id, base_md5, block_size, parsed,
+        data.file if data else None, target_md5, device_id
     )
+    
+    return {
+        "success": True,
+        "file": {
+            "id": file.id,
+            "filename": file.filename,
+            "size": file.size,
+            "md5_hash": file.md5_hash,
+            "updated_at": file.updated_at.isoformat() if file.updated_at else None
+        }
+    }
+
+
+@app.websocket("/ws/changes")
+async def changes_websocket(websocket: WebSocket, token: Optional[str] = Query(None)):
+    """
+    文件变更推送（WebSocket）
+    
+    - **token**: JWT token（浏览器无法为WebSocket设置请求头，通过URL参数传递）
+    
+    推送格式见notifications.py；客户端发送"ping"时回复pong。
+    """
+    user_id = None
+    if token:
+        db = SessionLocal()
+        try:
+            token_data = verify_token(token)
+            user = db.query(User).filter(User.id == token_data.user_id).first()
+            if user and user.is_active:
+                user_id = user.id
+        except HTTPException:
+            pass
+        finally:
+            db.close()
+    
+    if user_id is None:
+        await websocket.close(code=4401)
+        return
+    if not notifier.can_accept(user_id):
+        await websocket.close(code=4429)
+        return
+    
+    await websocket.accept()
+    notifier.register(user_id, websocket)
+    try:
+        while True:
+            message = await websocket.receive_text()
+            if message == "ping":
+                await websocket.send_text('{"type": "pong"}')
+    except WebSocketDisconnect:
+        pass
+    finally:
+        notifier.unregister(user_id, websocket)
 
 
 # ==================== 文件分享 ====================
@@ -567,6 +1204,7 @@ async def access_share(
 @app.get("/api/shares/download/{share_code}")
 async def download_shared_file(
     share_code: str,
+    request: Request,
     extract_code: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
@@ -598,12 +1236,43 @@ async def download_shared_file(
     
     # 增加下载次数
     share_service.increment_download_count(share)
+    access_tracker.record(file.id)
     
-    return FileResponse(
-        path=file_path,
-        filename=file.original_filename or file.filename,
-        media_type=file.mime_type or 'application/octet-stream'
-    )
+    return stored_file_response(file, request, filename=file.original_filename or file.filename)
+
+
+@app.get("/api/shares/preview/{share_code}")
+async def preview_shared_file(
+    share_code: str,
+    page: int = Query(1, ge=1),
+    extract_code: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    分享文件的预览图片（文档页面或缩放后的图片，不计入下载次数）
+    
+    - **share_code**: 分享码
+    - **page**: 文档页码
+    - **extract_code**: 提取码（如果需要）
+    """
+    share_service = ShareService(db)
+    share = share_service.verify_share_access(share_code, extract_code)
+    
+    file = db.query(File).filter(File.id == share.file_id).first()
+    
+    path = None
+    if file and file.category == "document":
+        path = get_page(db, file, page)
+    elif file and file.category == "image" and page == 1:
+        path = await image_resizer.resize(file, ResizeSpec.build(1024, 1024, "contain", "jpeg", 85))
+    
+    if path is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="预览尚未生成"
+        )
+    
+    return FileResponse(path=path, media_type="image/jpeg")
 
 
 @app.get("/api/shares/my-shares")
@@ -696,6 +1365,116 @@ async def update_user_quota(
     return {"success": True, "message": "配额已更新"}
 
 
+@app.put("/api/admin/users/{user_id}/volume")
+async def update_user_volume(
+    user_id: int,
+    volume: Optional[str] = Form(None),
+    current_admin: User = Depends(get_current_admin_user),
+    db: Session = Depends(get_db)
+):
+    """
+    固定用户的存储卷（仅管理员，放置策略为pinned时生效）
+    
+    - **volume**: 存储卷名称，为空时取消固定
+    
+    只影响之后上传的文件，已有文件保留在原存储卷上
+    """
+    user = db.query(User).filter(User.id == user_id).first()
+    
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="用户不存在"
+        )
+    
+    user.volume = volumes.get(volume).name if volume else None
+    db.commit()
+    
+    return {"success": True, "message": "存储卷已更新", "volume": user.volume}
+
+
+@app.get("/api/admin/volumes")
+async def list_volumes(
+    current_admin: User = Depends(get_current_admin_user),
+    db: Session = Depends(get_db)
+):
+    """获取各存储卷的容量与占用（仅管理员）"""
+    return {
+        "policy": volumes.policy,
+        "reserved_bytes": settings.VOLUME_RESERVED_BYTES,
+        "volumes": volumes.capacity_report(db)
+    }
+
+
+@app.get("/api/admin/derivative-cache")
+async def get_derivative_cache_status(
+    current_admin: User = Depends(get_current_admin_user),
+    db: Session = Depends(get_db)
+):
+    """获取派生文件缓存（缩略图、封面）的占用与命中统计（仅管理员）"""
+    return derivative_cache.status(db)
+
+
+@app.get("/api/admin/maintenance")
+async def get_maintenance_status(
+    current_admin: User = Depends(get_current_admin_user),
+    db: Session = Depends(get_db)
+):
+    """获取后台维护任务最近一次的执行统计（仅管理员）"""
+    return {
+        "enabled": settings.MAINTENANCE_ENABLED,
+        "interval": settings.MAINTENANCE_INTERVAL,
+        "runs": get_last_runs(db)
+    }
+
+
+@app.post("/api/admin/consistency-check")
+async def start_consistency_check(
+    background_tasks: BackgroundTasks,
+    repair: Optional[str] = None,
+    current_admin: User = Depends(get_current_admin_user)
+):
+    """
+    后台执行存储一致性检查（仅管理员）
+    
+    - **repair**: 修复动作，逗号分隔（paths/sizes/quota/missing，可选）
+    
+    结果可通过 /api/admin/maintenance 查看
+    """
+    repair_actions = {a.strip() for a in (repair or "").split(",") if a.strip()}
+    unknown = repair_actions - REPAIR_ACTIONS
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"未知的修复动作: {', '.join(sorted(unknown))}"
+        )
+    
+    background_tasks.add_task(
+        run_task,
+        "consistency_check",
+        lambda task_db: run_consistency_check(task_db, repair_actions)
+    )
+    
+    return {"success": True, "message": "一致性检查已开始"}
+
+
+@app.get("/api/admin/backups")
+async def list_backups(
+    current_admin: User = Depends(get_current_admin_user)
+):
+    """列出备份快照（仅管理员）"""
+    backup_engine = BackupEngine()
+    try:
+        snapshots = backup_engine.list_snapshots()
+    finally:
+        backup_engine.close()
+    
+    return {
+        "enabled": settings.BACKUP_ENABLED,
+        "snapshots": snapshots
+    }
+
+
 # ==================== 统计信息 ====================
 
 @app.get("/api/stats")
@@ -704,43 +1483,23 @@ async def get_stats(
     db: Session = Depends(get_db)
 ):
     """获取用户统计信息"""
-    # 文件统计
-    total_files = db.query(File).filter(
-        File.owner_id == current_user.id,
-        File.is_deleted == False,
-        File.is_folder == False
-    ).count()
-    
-    total_folders = db.query(File).filter(
-        File.owner_id == current_user.id,
-        File.is_deleted == False,
-        File.is_folder == True
-    ).count()
-    
-    # 分类统计
-    files_by_category = {}
-    for category in ['image', 'video', 'audio', 'document', 'other']:
-        count = db.query(File).filter(
-            File.owner_id == current_user.id,
-            File.is_deleted == False,
-            File.category == category
-        ).count()
-        files_by_category[category] = count
+    return user_stats(db, current_user)
+
+
+@app.get("/api/bootstrap")
+async def bootstrap(
+    limit: int = Query(BOOTSTRAP_PAGE_SIZE, ge=1, le=1000),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    首屏数据：用户信息、统计、根目录第一页和分享数（代替登录后的多个请求）
     
-    return {
-        "user": {
-            "username": current_user.username,
-            "quota": current_user.quota,
-            "used_space": current_user.used_space,
-            "available_space": current_user.quota - current_user.used_space,
-            "usage_percentage": (current_user.used_space / current_user.quota * 100) if current_user.quota > 0 else 0
-        },
-        "files": {
-            "total": total_files,
-            "folders": total_folders,
-            "by_category": files_by_category
-        }
-    }
+    - **limit**: 根目录返回的条目数，files.has_more为true时再请求完整列表
+    """
+    bootstrap_service = BootstrapService(db)
+    data = await run_in_threadpool(bootstrap_service.load, current_user, limit)
+    return json_response(encode_json(data))
 
 
 # ==================== 启动事件 ====================
@@ -761,6 +1520,11 @@ async def startup_event():
     settings.ensure_directories()
     print("✅ 存储目录检查完成")
     
+    # 启动后台维护任务
+    if settings.MAINTENANCE_ENABLED:
+        scheduler.start()
+        print("✅ 后台维护任务已启动")
+    
     print(f"✨ {settings.APP_NAME} 启动成功！")
 
 
@@ -768,6 +1532,17 @@ async def startup_event():
 async def shutdown_event():
     """应用关闭时执行"""
     print(f"👋 {settings.APP_NAME} 正在关闭...")
+    
+    # 停止后台维护任务
+    await scheduler.stop()
+    
+    # 关闭WebSocket连接
+    await notifier.stop()
+    
+    # 写入尚未保存的访问统计
+    access_tracker.flush()
+    derivative_cache.flush()
+    image_resizer.shutdown()
 
 
 if __name__ == "__main__":
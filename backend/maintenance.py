@@ -0,0 +1,423 @@
+"""
+后台维护模块
+定期清理过期分享、过期/已完成的上传会话、已使用的验证码以及临时目录中的孤立文件
+"""
+
+import asyncio
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from config import settings
+from models import SessionLocal, Share, UploadSession, MaintenanceRun
+from email_verification import EmailVerificationCode
+
+try:
+    import fcntl
+except ImportError:  # Windows开发环境没有fcntl，此时不做跨进程互斥
+    fcntl = None
+
+
+# 锁文件目录（位于临时目录下，清理临时文件时会跳过）
+LOCK_DIR_NAME = ".locks"
+
+
+def batched_delete(db: Session, model, *criteria, batch_size: Optional[int] = None) -> int:
+    """
+    分批删除满足条件的记录
+    
+    每批先通过索引列查出主键，再按主键删除并提交，
+    避免一次性大事务长时间锁住SQLite数据库。
+    
+    Args:
+        db: 数据库会话
+        model: ORM模型
+        criteria: 过滤条件
+        batch_size: 每批删除的行数
+    
+    Returns:
+        删除的总行数
+    """
+    batch_size = batch_size or settings.MAINTENANCE_BATCH_SIZE
+    total = 0
+    
+    while True:
+        ids = [row[0] for row in db.query(model.id).filter(*criteria).limit(batch_size).all()]
+        if not ids:
+            break
+        
+        db.query(model).filter(model.id.in_(ids)).delete(synchronize_session=False)
+        db.commit()
+        total += len(ids)
+        
+        if len(ids) < batch_size:
+            break
+    
+    return total
+
+
+def sweep_expired_shares(db: Session, now: datetime) -> int:
+    """
+    清理过期分享
+    
+    Args:
+        db: 数据库会话
+        now: 当前时间
+    
+    Returns:
+        删除的分享数
+    """
+    return batched_delete(db, Share, Share.expire_at != None, Share.expire_at < now)
+
+
+def sweep_verification_codes(db: Session, now: datetime) -> int:
+    """
+    清理已使用或已过期的邮箱验证码
+    
+    Args:
+        db: 数据库会话
+        now: 当前时间
+    
+    Returns:
+        删除的验证码数
+    """
+    return batched_delete(
+        db,
+        EmailVerificationCode,
+        or_(EmailVerificationCode.used == 1, EmailVerificationCode.expires_at < now)
+    )
+
+
+def sweep_upload_sessions(db: Session, now: datetime) -> Dict[str, int]:
+    """
+    清理已完成或长时间未更新的上传会话，并删除其临时文件
+    
+    Args:
+        db: 数据库会话
+        now: 当前时间
+    
+    Returns:
+        统计信息（删除的会话数、删除的临时文件数）
+    """
+    stale_before = now - timedelta(hours=settings.UPLOAD_SESSION_EXPIRE_HOURS)
+    criteria = or_(UploadSession.is_completed == True, UploadSession.updated_at < stale_before)
+    batch_size = settings.MAINTENANCE_BATCH_SIZE
+    
+    sessions_deleted = 0
+    temp_files_deleted = 0
+    
+    while True:
+        rows = db.query(UploadSession.id, UploadSession.temp_path).filter(
+            criteria
+        ).limit(batch_size).all()
+        if not rows:
+            break
+        
+        for _, temp_path in rows:
+            if temp_path and _unlink_quietly(Path(temp_path)):
+                temp_files_deleted += 1
+        
+        ids = [row[0] for row in rows]
+        db.query(UploadSession).filter(UploadSession.id.in_(ids)).delete(synchronize_session=False)
+        db.commit()
+        sessions_deleted += len(ids)
+        
+        if len(rows) < batch_size:
+            break
+    
+    return {
+        "upload_sessions": sessions_deleted,
+        "upload_temp_files": temp_files_deleted,
+    }
+
+
+def sweep_temp_files(db: Session, now: datetime) -> Dict[str, int]:
+    """
+    清理临时目录中的孤立文件
+    
+    超过保留时间且不属于任何未完成上传会话的文件会被删除，随后删除空目录。
+    
+    Args:
+        db: 数据库会话
+        now: 当前时间
+    
+    Returns:
+        统计信息（删除的文件数、释放的字节数）
+    """
+    temp_root = Path(settings.TEMP_PATH)
+    if not temp_root.exists():
+        return {"temp_files": 0, "temp_bytes": 0}
+    
+    # 仍在进行中的上传会话所引用的临时文件
+    active_paths = {
+        os.path.abspath(row[0])
+        for row in db.query(UploadSession.temp_path).filter(
+            UploadSession.is_completed == False,
+            UploadSession.temp_path != None
+        ).all()
+    }
+    
+    expire_before = now.timestamp() - settings.TEMP_FILE_EXPIRE_HOURS * 3600
+    files_deleted = 0
+    bytes_freed = 0
+    
+    for dir_path, dir_names, file_names in os.walk(temp_root, topdown=False):
+        # 跳过维护任务自身的锁目录等隐藏目录
+        if any(part.startswith(".") for part in Path(dir_path).relative_to(temp_root).parts):
+            continue
+        
+        for name in file_names:
+            if name.startswith("."):
+                continue
+            path = os.path.join(dir_path, name)
+            if os.path.abspath(path) in active_paths:
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if stat.st_mtime >= expire_before:
+                continue
+            if _unlink_quietly(Path(path)):
+                files_deleted += 1
+                bytes_freed += stat.st_size
+        
+        # 删除空的子目录（不删除临时根目录本身）
+        if dir_path != str(temp_root):
+            try:
+                os.rmdir(dir_path)
+            except OSError:
+                pass
+    
+    return {"temp_files": files_deleted, "temp_bytes": bytes_freed}
+
+
+def prune_run_history(db: Session) -> int:
+    """
+    清理旧的维护执行记录，每个任务只保留最近的若干条
+    
+    Args:
+        db: 数据库会话
+    
+    Returns:
+        删除的记录数
+    """
+    deleted = 0
+    tasks = [row[0] for row in db.query(MaintenanceRun.task).distinct().all()]
+    
+    for task in tasks:
+        boundary = db.query(MaintenanceRun.id).filter(
+            MaintenanceRun.task == task
+        ).order_by(MaintenanceRun.id.desc()).offset(settings.MAINTENANCE_HISTORY_KEEP).first()
+        
+        if boundary:
+            deleted += batched_delete(
+                db, MaintenanceRun,
+                MaintenanceRun.task == task,
+                MaintenanceRun.id <= boundary[0]
+            )
+    
+    return deleted
+
+
+def run_expiry_sweep(db: Session) -> Dict[str, int]:
+    """
+    执行一次完整的过期数据清理
+    
+    Args:
+        db: 数据库会话
+    
+    Returns:
+        统计信息
+    """
+    now = datetime.utcnow()
+    
+    stats = {
+        "shares": sweep_expired_shares(db, now),
+        "verification_codes": sweep_verification_codes(db, now),
+    }
+    stats.update(sweep_upload_sessions(db, now))
+    stats.update(sweep_temp_files(db, now))
+    stats["run_history"] = prune_run_history(db)
+    
+    return stats
+
+
+def _unlink_quietly(path: Path) -> bool:
+    """删除文件，忽略不存在或权限等错误"""
+    try:
+        path.unlink()
+        return True
+    except FileNotFoundError:
+        return False
+    except OSError as e:
+        print(f"[MAINTENANCE] 删除文件失败 {path}: {e}")
+        return False
+
+
+class _TaskLock:
+    """
+    跨进程任务锁
+    
+    uvicorn以多worker方式运行时，每个进程都会启动调度器，
+    通过非阻塞文件锁保证同一任务同一时刻只在一个进程中执行。
+    """
+    
+    def __init__(self, name: str):
+        lock_dir = Path(settings.TEMP_PATH) / LOCK_DIR_NAME
+        lock_dir.mkdir(parents=True, exist_ok=True)
+        self.path = lock_dir / f"{name}.lock"
+        self._fd = None
+    
+    def acquire(self) -> bool:
+        if fcntl is None:
+            return True
+        self._fd = open(self.path, "w")
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            self._fd.close()
+            self._fd = None
+            return False
+    
+    def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            self._fd.close()
+            self._fd = None
+
+
+def run_task(name: str, func: Callable[[Session], dict]) -> Optional[dict]:
+    """
+    执行一个维护任务并记录结果
+    
+    Args:
+        name: 任务名称
+        func: 任务函数，接收数据库会话，返回统计信息字典
+    
+    Returns:
+        统计信息；如果任务正在其他进程中执行则返回None
+    """
+    lock = _TaskLock(name)
+    if not lock.acquire():
+        return None
+    
+    db = SessionLocal()
+    started_at = datetime.utcnow()
+    start = time.monotonic()
+    try:
+        try:
+            stats = func(db) or {}
+            success, error = True, None
+        except Exception as e:
+            db.rollback()
+            stats, success, error = {}, False, str(e)
+            print(f"[MAINTENANCE] 任务 {name} 执行失败: {e}")
+        
+        stats["duration_ms"] = int((time.monotonic() - start) * 1000)
+        db.add(MaintenanceRun(
+            task=name,
+            success=success,
+            stats=json.dumps(stats),
+            error=error,
+            started_at=started_at,
+            finished_at=datetime.utcnow()
+        ))
+        db.commit()
+        
+        if success:
+            print(f"[MAINTENANCE] 任务 {name} 完成: {stats}")
+        return stats
+    finally:
+        db.close()
+        lock.release()
+
+
+def get_last_runs(db: Session) -> List[dict]:
+    """
+    获取每个维护任务最近一次的执行记录
+    
+    Args:
+        db: 数据库会话
+    
+    Returns:
+        执行记录列表
+    """
+    runs = []
+    tasks = [row[0] for row in db.query(MaintenanceRun.task).distinct().all()]
+    
+    for task in sorted(tasks):
+        run = db.query(MaintenanceRun).filter(
+            MaintenanceRun.task == task
+        ).order_by(MaintenanceRun.id.desc()).first()
+        
+        runs.append({
+            "task": run.task,
+            "success": run.success,
+            "stats": json.loads(run.stats) if run.stats else {},
+            "error": run.error,
+            "started_at": run.started_at.isoformat() if run.started_at else None,
+            "finished_at": run.finished_at.isoformat() if run.finished_at else None,
+        })
+    
+    return runs
+
+
+class MaintenanceScheduler:
+    """
+    维护任务调度器
+    
+    在应用事件循环中按固定间隔调度任务，任务本身在线程池中执行，
+    不会阻塞请求处理。
+    """
+    
+    def __init__(self):
+        self._tasks: List[tuple] = []
+        self._handles: List[asyncio.Task] = []
+    
+    def register(self, name: str, interval: int, func: Callable[[Session], dict]):
+        """
+        注册维护任务
+        
+        Args:
+            name: 任务名称
+            interval: 执行间隔（秒）
+            func: 任务函数
+        """
+        self._tasks.append((name, interval, func))
+    
+    async def _loop(self, name: str, interval: int, func: Callable[[Session], dict]):
+        while True:
+            try:
+                await asyncio.to_thread(run_task, name, func)
+            except Exception as e:
+                print(f"[MAINTENANCE] 调度任务 {name} 异常: {e}")
+            await asyncio.sleep(interval)
+    
+    def start(self):
+        """启动所有已注册任务"""
+        for name, interval, func in self._tasks:
+            self._handles.append(asyncio.create_task(self._loop(name, interval, func)))
+    
+    async def stop(self):
+        """停止所有任务"""
+        for handle in self._handles:
+            handle.cancel()
+        for handle in self._handles:
+            try:
+                await handle
+            except asyncio.CancelledError:
+                pass
+        self._handles.clear()
+
+
+# 全局调度器实例
+scheduler = MaintenanceScheduler()
+scheduler.register("expiry_sweep", settings.MAINTENANCE_INTERVAL, run_expiry_sweep)
@@ -0,0 +1,262 @@
+"""
+清单比对模块
+客户端一次上传整个本地文件夹的清单，服务器与files表比对后返回需要上传、
+已存在（可去重）和可删除的条目，一次往返即可完成整体对账，无需逐个文件探测。
+
+清单格式：每行一条JSON（可用gzip压缩），数组或对象均可：
+    ["photos/2024/a.jpg", 123456, 1700000000, "md5十六进制"]
+    {"path": "photos/2024/a.jpg", "size": 123456, "mtime": 1700000000, "md5": "..."}
+- path: 相对所选文件夹的路径，使用“/”分隔
+- mtime: 本地修改时间（Unix秒），md5 可以省略（省略时按大小和修改时间快速比对）
+"""
+
+import gzip
+import json
+from datetime import datetime
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy.orm import Session
+
+from models import User, File
+from config import settings
+from file_handler import FileService, FileManager, chunked
+
+
+# gzip文件头
+GZIP_MAGIC = b"\x1f\x8b"
+
+# 单行清单的最大长度
+MAX_LINE_LENGTH = 64 * 1024
+
+
+class _ManifestEntry:
+    __slots__ = ("path", "size", "mtime", "md5")
+    
+    def __init__(self, path: str, size: int, mtime: Optional[float], md5: Optional[str]):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.md5 = md5
+
+
+def _bad_manifest(detail: str) -> HTTPException:
+    return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
+
+
+def _normalize_path(path: str) -> str:
+    """规范化相对路径，每一级名称按上传时的规则转换为安全文件名"""
+    parts = [p for p in path.replace("\\", "/").split("/") if p and p != "."]
+    if not parts:
+        raise _bad_manifest(f"清单路径无效: {path}")
+    return "/".join(FileManager.get_safe_filename(p) for p in parts)
+
+
+def parse_manifest(stream: BinaryIO) -> Iterator[_ManifestEntry]:
+    """
+    逐行解析清单（自动识别gzip压缩，解压后的大小和条目数受配置限制）
+    
+    Args:
+        stream: 清单数据流
+    
+    Returns:
+        条目迭代器
+    """
+    head = stream.read(2)
+    stream.seek(0)
+    if head == GZIP_MAGIC:
+        stream = gzip.GzipFile(fileobj=stream, mode="rb")
+    
+    max_bytes = settings.MANIFEST_MAX_BYTES
+    total = 0
+    count = 0
+    
+    while True:
+        line = stream.readline(MAX_LINE_LENGTH + 1)
+        if not line:
+            break
+        if len(line) > MAX_LINE_LENGTH:
+            raise _bad_manifest(f"清单第{count + 1}条过长")
+        total += len(line)
+        if total > max_bytes:
+            raise _bad_manifest(f"清单过大（解压后最大{max_bytes // 1024 // 1024}MB）")
+        line = line.strip()
+        if not line:
+            continue
+        
+        count += 1
+        if count > settings.MANIFEST_MAX_ENTRIES:
+            raise _bad_manifest(f"清单条目过多（最多{settings.MANIFEST_MAX_ENTRIES}条）")
+        
+        try:
+            item = json.loads(line)
+            if isinstance(item, dict):
+                path, size = item["path"], item["size"]
+                mtime, md5 = item.get("mtime"), item.get("md5")
+            else:
+                path, size = item[0], item[1]
+                mtime = item[2] if len(item) > 2 else None
+                md5 = item[3] if len(item) > 3 else None
+            if not isinstance(path, str) or not isinstance(size, int) or size < 0:
+                raise ValueError
+            if md5 is not None and not isinstance(md5, str):
+                raise ValueError
+            if mtime is not None and not isinstance(mtime, (int, float)):
+                raise ValueError
+        except (ValueError, KeyError, IndexError, TypeError):
+            raise _bad_manifest(f"清单第{count}条格式错误")
+        
+        yield _ManifestEntry(_normalize_path(path), size, mtime, md5.lower() if md5 else None)
+
+
+class ManifestDiffService:
+    """清单比对服务"""
+    
+    def __init__(self, db: Session):
+        self.db = db
+        self.file_service = FileService(db)
+    
+    def _load_tree(self, user: User, folder_id: Optional[int]) -> Tuple[Dict[str, tuple], set]:
+        """
+        按parent_id索引逐层读取文件夹下的全部条目
+        
+        Returns:
+            (相对路径 -> (id, size, md5, updated_at) 的文件字典, 已存在的文件夹相对路径集合)
+        """
+        files: Dict[str, tuple] = {}
+        folders = set()
+        level = [(folder_id, "")]
+        
+        while level:
+            prefixes = {parent_id: prefix for parent_id, prefix in level}
+            next_level = []
+            parent_ids = [parent_id for parent_id, _ in level]
+            
+            for batch in chunked(parent_ids):
+                query = self.db.query(
+                    File.id, File.parent_id, File.filename, File.is_folder,
+                    File.size, File.md5_hash, File.updated_at
+                ).filter(
+                    File.owner_id == user.id,
+                    File.is_deleted == False
+                )
+                if batch == [None]:
+                    query = query.filter(File.parent_id == None)
+                else:
+                    query = query.filter(File.parent_id.in_(batch))
+                
+                for file_id, parent_id, filename, is_folder, size, md5_hash, updated_at in query.all():
+                    path = prefixes[parent_id] + filename
+                    if is_folder:
+                        folders.add(path)
+                        next_level.append((file_id, path + "/"))
+                    else:
+                        files[path] = (file_id, size or 0, md5_hash, updated_at)
+            
+            level = next_level
+        
+        return files, folders
+    
+    def diff(self, user: User, folder_id: Optional[int], manifest: BinaryIO) -> dict:
+        """
+        比对客户端清单与服务器上的文件夹
+        
+        - upload: 需要上传的文件 [路径, 服务器上同路径文件ID或null]（有ID时可以用增量同步上传）
+        - present: 内容相同，无需处理 [路径, 文件ID]
+        - deduplicable: 服务器上已有相同内容 [路径, 已有内容的文件ID, 服务器上同路径文件ID或null]
+          （可由服务器端复制，无需上传；第三项不为null时是覆盖该文件，需先删除或替换它，
+          直接复制到同一文件夹会因重名自动编号）
+        - delete_candidates: 服务器上有而清单中没有的文件 [路径, 文件ID]
+        - create_folders: 清单中出现但服务器上不存在的文件夹（按层级排序）
+        
+        Args:
+            user: 用户对象
+            folder_id: 对账的文件夹ID（为空表示根目录）
+            manifest: 清单数据流
+        
+        Returns:
+            比对结果
+        """
+        if folder_id is not None:
+            folder = self.file_service.get_file(user, folder_id)
+            if not folder.is_folder:
+                raise _bad_manifest("只能与文件夹比对")
+        
+        server_files, server_folders = self._load_tree(user, folder_id)
+        
+        upload: List[list] = []
+        present: List[list] = []
+        pending_md5: Dict[str, List[Tuple[str, Optional[int]]]] = {}
+        seen = set()
+        create_folders = set()
+        
+        for entry in parse_manifest(manifest):
+            if entry.path in seen:
+                continue
+            seen.add(entry.path)
+            
+            parent = entry.path.rpartition("/")[0]
+            while parent and parent not in server_folders and parent not in create_folders:
+                create_folders.add(parent)
+                parent = parent.rpartition("/")[0]
+            
+            existing = server_files.get(entry.path)
+            if existing and self._same_content(entry, existing):
+                present.append([entry.path, existing[0]])
+            elif entry.md5 and entry.size > 0:
+                pending_md5.setdefault(entry.md5, []).append((entry.path, existing[0] if existing else None))
+            else:
+                upload.append([entry.path, existing[0] if existing else None])
+        
+        # 按MD5索引查找用户已有的相同内容
+        deduplicable: List[list] = []
+        sources: Dict[str, int] = {}
+        for batch in chunked(list(pending_md5)):
+            for file_id, md5_hash in self.db.query(File.id, File.md5_hash).filter(
+                File.owner_id == user.id,
+                File.md5_hash.in_(batch),
+                File.is_folder == False,
+                File.is_deleted == False
+            ).all():
+                sources.setdefault(md5_hash, file_id)
+        
+        for md5_hash, entries in pending_md5.items():
+            source_id = sources.get(md5_hash)
+            for path, existing_id in entries:
+                if source_id is not None:
+                    deduplicable.append([path, source_id, existing_id])
+                else:
+                    upload.append([path, existing_id])
+        
+        delete_candidates = [
+            [path, values[0]] for path, values in server_files.items() if path not in seen
+        ]
+        
+        return {
+            "folder_id": folder_id,
+            "summary": {
+                "manifest_entries": len(seen),
+                "server_files": len(server_files),
+                "upload": len(upload),
+                "present": len(present),
+                "deduplicable": len(deduplicable),
+                "delete_candidates": len(delete_candidates),
+            },
+            "upload": upload,
+            "present": present,
+            "deduplicable": deduplicable,
+            "delete_candidates": delete_candidates,
+            "create_folders": sorted(create_folders, key=lambda p: (p.count("/"), p)),
+        }
+    
+    @staticmethod
+    def _same_content(entry: _ManifestEntry, existing: tuple) -> bool:
+        """同路径文件是否相同：有MD5时比对MD5，否则比对大小且本地修改时间不晚于服务器版本"""
+        _, size, md5_hash, updated_at = existing
+        if entry.size != size:
+            return False
+        if entry.md5:
+            return entry.md5 == md5_hash
+        if entry.mtime is None or updated_at is None:
+            return False
+        return datetime.utcfromtimestamp(entry.mtime) <= updated_at
@@ -0,0 +1,330 @@
+"""
+媒体处理模块
+后台为视频生成便于在线播放的派生文件（需要本机安装ffmpeg，未安装时跳过）：
+- 快速启动副本：手机录制的MP4/MOV常把moov（索引）放在文件末尾，浏览器要下载完整个文件才能播放；
+  用ffmpeg把moov移到文件开头（只重新封装，不重新编码），预览时返回该副本
+- 封面：截取一帧生成缩略图，作为播放器的poster
+
+快速启动副本按内容MD5命名，存放在用户目录下的 .media/ 中，相同内容只处理一次，
+文件彻底删除且该用户没有其他相同内容的文件时由回收站清理任务一并删除；
+封面存放在共享派生文件缓存中（见derivative_cache.py），被淘汰后预览时重新生成。
+
+同一后台任务的文档阶段为PDF/Office文档生成页面预览图，见document_preview.py。
+
+处理状态记录在 files.media_status：
+- NULL: 待处理
+- optimized: 已生成快速启动副本
+- original: 原文件已可直接边下边播（或格式无需处理），只生成了封面
+- skipped: 不处理（分块存储的文件）
+- failed: 处理失败
+"""
+
+import os
+import shutil
+import struct
+import subprocess
+from pathlib import Path
+from typing import List, Optional
+
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from models import File
+from config import settings
+from file_handler import FileManager
+from derivative_cache import derivative_cache
+from document_preview import find_tools, supported_extensions, process_document
+from maintenance import scheduler, run_task
+
+
+# 可以移动moov的容器格式（ISO基础媒体文件格式）
+FASTSTART_EXTENSIONS = {".mp4", ".m4v", ".mov"}
+
+# 封面截取位置（秒），视频不足该长度时截取第一帧
+POSTER_OFFSET = 1.0
+
+# 封面尺寸（比列表缩略图大，用作播放器poster）
+POSTER_SIZE = (640, 640)
+
+# 封面在派生文件缓存中的版本名
+POSTER_RENDITION = "poster-{}x{}.jpg".format(*POSTER_SIZE)
+
+
+def find_ffmpeg() -> Optional[str]:
+    """返回ffmpeg可执行文件路径，未安装时返回None"""
+    return shutil.which(settings.FFMPEG_PATH)
+
+
+def media_dir(owner_id: int) -> Path:
+    """用户的媒体派生文件目录"""
+    return settings.get_user_storage_path(owner_id) / ".media"
+
+
+def optimized_path(file: File) -> Path:
+    """快速启动副本的路径"""
+    suffix = Path(file.filename).suffix.lower()
+    return media_dir(file.owner_id) / f"{file.md5_hash}{suffix}"
+
+
+def playable_variant(file: File) -> Optional[Path]:
+    """
+    预览时应返回的快速启动副本
+    
+    Args:
+        file: 文件对象
+    
+    Returns:
+        副本路径；没有副本时返回None（返回原文件）
+    """
+    if file.media_status != "optimized" or not file.md5_hash:
+        return None
+    path = optimized_path(file)
+    return path if path.exists() else None
+
+
+def needs_faststart(path: Path) -> bool:
+    """
+    按顶层box顺序判断moov是否位于mdat之后
+    
+    Args:
+        path: MP4/MOV文件路径
+    
+    Returns:
+        moov在mdat之后时返回True
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        offset = 0
+        while offset + 8 <= size:
+            f.seek(offset)
+            header = f.read(16)
+            box_size, box_type = struct.unpack(">I4s", header[:8])
+            if box_size == 1 and len(header) == 16:
+                box_size = struct.unpack(">Q", header[8:16])[0]
+            elif box_size == 0:
+                box_size = size - offset
+            
+            if box_type == b"moov":
+                return False
+            if box_type == b"mdat":
+                return True
+            if box_size < 8:
+                break
+            offset += box_size
+    return False
+
+
+def run_ffmpeg(ffmpeg: str, args: List[str], timeout: Optional[int] = None, niceness: int = 10):
+    """
+    以较低优先级运行ffmpeg，失败时抛出RuntimeError
+    
+    Args:
+        ffmpeg: ffmpeg路径
+        args: 参数（不含通用参数）
+        timeout: 超时时间（秒，默认MEDIA_FFMPEG_TIMEOUT）
+        niceness: 进程优先级调整值
+    """
+    try:
+        subprocess.run(
+            [ffmpeg, "-hide_banner", "-loglevel", "error", "-nostdin", "-y", *args],
+            check=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            timeout=timeout or settings.MEDIA_FFMPEG_TIMEOUT,
+            preexec_fn=(lambda: os.nice(niceness)) if hasattr(os, "nice") else None
+        )
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError((e.stderr or b"").decode(errors="replace").strip() or f"ffmpeg退出码 {e.returncode}")
+
+
+def create_faststart_copy(ffmpeg: str, source: Path, destination: Path):
+    """
+    把moov移到文件开头（-c copy只重新封装，不重新编码）
+    
+    Args:
+        ffmpeg: ffmpeg路径
+        source: 原视频
+        destination: 副本路径
+    """
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = destination.with_name(f".tmp-{destination.name}")
+    muxer = "mov" if source.suffix.lower() == ".mov" else "mp4"
+    try:
+        run_ffmpeg(ffmpeg, [
+            "-i", str(source), "-map", "0", "-c", "copy",
+            "-movflags", "+faststart", "-f", muxer, str(temp_path)
+        ])
+        if needs_faststart(temp_path):
+            raise RuntimeError("重新封装后moov仍在文件末尾")
+        os.replace(temp_path, destination)
+    finally:
+        temp_path.unlink(missing_ok=True)
+
+
+def create_poster(ffmpeg: str, source: Path, destination: Path):
+    """
+    截取一帧并缩放为封面
+    
+    Args:
+        ffmpeg: ffmpeg路径
+        source: 视频路径
+        destination: 封面路径
+    """
+    frame_path = Path(settings.TEMP_PATH) / f"poster-{os.getpid()}-{destination.name}"
+    try:
+        for offset in (POSTER_OFFSET, 0):
+            run_ffmpeg(ffmpeg, [
+                "-ss", str(offset), "-i", str(source), "-frames:v", "1", "-f", "image2", str(frame_path)
+            ])
+            if frame_path.exists() and frame_path.stat().st_size > 0:
+                break
+        else:
+            raise RuntimeError("未能截取视频帧")
+        
+        if not FileManager.create_thumbnail(frame_path, destination, POSTER_SIZE):
+            raise RuntimeError("生成封面失败")
+    finally:
+        frame_path.unlink(missing_ok=True)
+
+
+def process_video(ffmpeg: str, file: File) -> str:
+    """
+    为一个视频生成封面和快速启动副本（已存在的派生文件直接复用）
+    
+    Args:
+        ffmpeg: ffmpeg路径
+        file: 视频文件对象
+    
+    Returns:
+        处理后的media_status
+    """
+    if file.is_chunked or not file.md5_hash:
+        return "skipped"
+    
+    source = Path(file.file_path)
+    if not derivative_cache.path(file.md5_hash, POSTER_RENDITION).exists():
+        try:
+            derivative_cache.get_or_create(
+                file.md5_hash, POSTER_RENDITION, lambda path: create_poster(ffmpeg, source, path)
+            )
+        except (RuntimeError, subprocess.SubprocessError) as e:
+            # 没有封面不影响生成快速启动副本（例如只有音轨的MP4）
+            print(f"[MEDIA] 生成封面失败 {source}: {e}")
+    
+    if Path(file.filename).suffix.lower() not in FASTSTART_EXTENSIONS:
+        return "original"
+    
+    variant = optimized_path(file)
+    if variant.exists():
+        return "optimized"
+    if not needs_faststart(source):
+        return "original"
+    
+    create_faststart_copy(ffmpeg, source, variant)
+    return "optimized"
+
+
+def get_poster(file: File) -> Optional[Path]:
+    """
+    获取视频封面（缓存中没有时用ffmpeg重新生成）
+    
+    Args:
+        file: 视频文件对象
+    
+    Returns:
+        封面路径；无法生成（未安装ffmpeg、分块存储、处理失败过）时返回None
+    """
+    if not file.md5_hash:
+        return None
+    
+    ffmpeg = find_ffmpeg()
+    if ffmpeg is None or file.is_chunked or file.media_status == "failed":
+        return derivative_cache.lookup(file.md5_hash, POSTER_RENDITION)
+    
+    source = Path(file.file_path)
+    try:
+        return derivative_cache.get_or_create(
+            file.md5_hash, POSTER_RENDITION, lambda path: create_poster(ffmpeg, source, path)
+        )
+    except (OSError, RuntimeError, subprocess.SubprocessError) as e:
+        print(f"[MEDIA] 生成封面失败 {source}: {e}")
+        return None
+
+
+def _save_status(db: Session, file: File, media_status: str):
+    """写入处理状态（处理期间文件可能被替换为新版本（MD5变化），此时保留待处理状态）"""
+    db.query(File).filter(
+        File.id == file.id,
+        File.md5_hash == file.md5_hash
+    ).update({File.media_status: media_status}, synchronize_session=False)
+    db.commit()
+
+
+def run_media_processing(db: Session) -> dict:
+    """
+    媒体处理后台任务：逐个处理待处理的视频和文档，每个文件处理后立即提交
+    
+    Args:
+        db: 数据库会话
+    
+    Returns:
+        统计信息
+    """
+    stats = {"optimized": 0, "original": 0, "skipped": 0, "failed": 0}
+    
+    ffmpeg = find_ffmpeg()
+    if ffmpeg is None:
+        stats["videos"] = "ffmpeg不可用"
+    else:
+        videos = db.query(File).filter(
+            File.category == "video",
+            File.is_folder == False,
+            File.is_deleted == False,
+            File.media_status == None
+        ).order_by(File.id).limit(settings.MEDIA_BATCH_SIZE).all()
+        
+        for file in videos:
+            try:
+                media_status = process_video(ffmpeg, file)
+            except (OSError, RuntimeError, subprocess.SubprocessError) as e:
+                media_status = "failed"
+                print(f"[MEDIA] 处理视频失败 {file.file_path}: {e}")
+            _save_status(db, file, media_status)
+            stats[media_status] += 1
+    
+    # 文档阶段：只查询已安装的工具能处理的格式，其余文档保持待处理
+    tools = find_tools()
+    extensions = supported_extensions(tools)
+    if not extensions:
+        stats["documents"] = "pdftoppm不可用"
+        return stats
+    
+    stats["rendered"] = 0
+    documents = db.query(File).filter(
+        File.category == "document",
+        File.is_folder == False,
+        File.is_deleted == False,
+        File.media_status == None,
+        or_(*[File.filename.ilike(f"%{extension}") for extension in sorted(extensions)])
+    ).order_by(File.id).limit(settings.MEDIA_BATCH_SIZE).all()
+    
+    for file in documents:
+        try:
+            media_status = process_document(tools, file)
+        except (OSError, RuntimeError, subprocess.SubprocessError) as e:
+            media_status = "failed"
+            print(f"[MEDIA] 生成文档预览失败 {file.file_path}: {e}")
+        _save_status(db, file, media_status)
+        stats[media_status] += 1
+    
+    return stats
+
+
+def trigger_media_processing():
+    """立即执行一次媒体处理（上传视频或文档后调用，使新文件尽快可以预览）"""
+    if settings.MEDIA_PROCESSING_ENABLED:
+        run_task("media_processing", run_media_processing)
+
+
+if settings.MEDIA_PROCESSING_ENABLED:
+    scheduler.register("media_processing", settings.MEDIA_PROCESSING_INTERVAL, run_media_processing)
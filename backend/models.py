@@ -3,7 +3,7 @@
 使用SQLAlchemy ORM
 """
 
-from sqlalchemy import create_engine, Column, Integer, String, BigInteger, Boolean, DateTime, ForeignKey, Text
+from sqlalchemy import create_engine, inspect, text, Column, Integer, String, BigInteger, Boolean, DateTime, Float, ForeignKey, Text, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime, timedelta
@@ -58,6 +58,12 @@ class User(Base):
     quota = Column(BigInteger, default=settings.DEFAULT_USER_QUOTA)
     used_space = Column(BigInteger, default=0)
     
+    # 固定存储卷（放置策略为pinned时使用）
+    volume = Column(String(50))
+    
+    # 已被清理的变更记录的最大游标（早于该游标的客户端需要全量重新同步）
+    sync_horizon = Column(Integer, default=0)
+    
     # 时间戳
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -131,10 +137,21 @@ class File(Base):
     mime_type = Column(String(100))
     category = Column(String(20))  # image, video, audio, document, other
     md5_hash = Column(String(32), index=True)  # 文件哈希，用于去重
+    volume = Column(String(50), index=True)  # 所在存储卷（为空表示默认卷）
+    
+    # 访问统计（冷热分层使用，访问次数在迁移后清零）
+    access_count = Column(Integer, default=0)
+    last_accessed_at = Column(DateTime, index=True)
+    
+    # 是否已转换为分块清单（file_path处保存的是分块清单，内容在分块存储中）
+    is_chunked = Column(Boolean, default=False)
+    
+    # 媒体处理状态（见media.py，为空表示待处理）
+    media_status = Column(String(20), index=True)
     
     # 元数据
     is_folder = Column(Boolean, default=False)
-    parent_id = Column(Integer, ForeignKey("files.id"), nullable=True)
+    parent_id = Column(Integer, ForeignKey("files.id"), nullable=True, index=True)
     
     # 所有者
     owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -146,7 +163,7 @@ class File(Base):
     # 时间戳
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-    deleted_at = Column(DateTime)
+    deleted_at = Column(DateTime, index=True)
     
     # 关系
     owner = relationship("User", back_populates="files")
@@ -175,7 +192,7 @@ class Share(Base):
     
     # 分享设置
     extract_code = Column(String(10))  # 提取码（可选）
-    expire_at = Column(DateTime)  # 过期时间
+    expire_at = Column(DateTime, index=True)  # 过期时间（维护任务按此列批量清理）
     max_downloads = Column(Integer)  # 最大下载次数（可选）
     download_count = Column(Integer, default=0)
     
@@ -242,7 +259,7 @@ class UploadSession(Base):
     
     # 时间戳
     created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     
     def get_progress(self) -> float:
         """获取上传进度（百分比）"""
@@ -252,19 +269,352 @@ class UploadSession(Base):
 
 
 class SyncRecord(Base):
-    """同步记录"""
+    """同步记录（变更记录，id即同步游标）"""
     __tablename__ = "sync_records"
+    __table_args__ = (
+        Index("idx_sync_records_user_cursor", "user_id", "id"),
+        Index("idx_sync_records_file", "file_id", "id"),
+        {"sqlite_autoincrement": True},  # 游标单调递增，删除的记录ID不会被复用
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     file_id = Column(Integer, ForeignKey("files.id"), nullable=False)
     
     # 同步信息
-    action = Column(String(20))  # created, updated, deleted
+    action = Column(String(20))  # created, updated, moved, deleted, restored
     device_id = Column(String(100))
+    from_parent_id = Column(Integer)  # 移动前的父文件夹ID（仅moved记录，推送时用于刷新原文件夹）
     synced_at = Column(DateTime, default=datetime.utcnow)
 
 
+class PurgeItem(Base):
+    """待物理删除的条目（回收站清空或超过保留期后进入队列）"""
+    __tablename__ = "purge_queue"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    
+    # 物理文件信息
+    file_path = Column(String(500), nullable=False)
+    is_folder = Column(Boolean, default=False)
+    size = Column(BigInteger, default=0)
+    md5_hash = Column(String(32))
+    is_chunked = Column(Boolean, default=False)  # 删除时需要释放分块引用
+    attempts = Column(Integer, default=0)  # 删除失败的次数（失败的条目保留在队列中，下次清理时重试）
+    
+    # 时间戳
+    queued_at = Column(DateTime, default=datetime.utcnow)
+
+
+class MaintenanceRun(Base):
+    """后台维护任务执行记录"""
+    __tablename__ = "maintenance_runs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    task = Column(String(50), index=True, nullable=False)
+    
+    # 执行结果
+    success = Column(Boolean, default=True)
+    stats = Column(Text)  # JSON格式的统计信息
+    error = Column(Text)
+    
+    # 时间戳
+    started_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime)
+
+
+class CopyJob(Base):
+    """服务器端复制任务（大型复制在后台执行，进度写入此表，任意工作进程都能查询）"""
+    __tablename__ = "copy_jobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    
+    # 任务参数
+    file_ids = Column(Text, nullable=False)  # JSON数组
+    target_parent_id = Column(Integer)
+    
+    # 状态与进度
+    status = Column(String(20), default="pending")  # pending, running, completed, failed
+    total_files = Column(Integer, default=0)
+    total_bytes = Column(BigInteger, default=0)
+    copied_files = Column(Integer, default=0)
+    copied_bytes = Column(BigInteger, default=0)
+    result = Column(Text)  # JSON格式的批量操作结果
+    error = Column(Text)
+    worker_pid = Column(Integer)  # 执行任务的进程（进程退出后任务标记为失败）
+    
+    # 时间戳
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    
+    def get_progress(self) -> float:
+        """获取复制进度（百分比，按字节计算，没有文件内容时按条目数计算）"""
+        if self.total_bytes:
+            return min(100.0, (self.copied_bytes or 0) / self.total_bytes * 100)
+        if self.total_files:
+            return min(100.0, (self.copied_files or 0) / self.total_files * 100)
+        return 0.0
+
+
+class TranscodeJob(Base):
+    """HLS转码任务（按用户、内容MD5和版本去重）"""
+    __tablename__ = "transcode_jobs"
+    __table_args__ = (
+        Index("idx_transcode_jobs_content", "owner_id", "md5_hash", "rendition", unique=True),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    file_id = Column(Integer, nullable=False)  # 发起转码的文件（已删除时使用相同内容的其他文件）
+    md5_hash = Column(String(32), nullable=False)
+    rendition = Column(String(20), nullable=False)  # 480p, 720p ...
+    
+    # 状态
+    status = Column(String(20), default="queued", index=True)  # queued, running, completed, failed
+    error = Column(Text)
+    
+    # 时间戳
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+
+class ChunkRecord(Base):
+    """分块存储索引（内容定义分块去重，引用计数为0的分块由后台任务回收）"""
+    __tablename__ = "chunks"
+    
+    hash = Column(String(64), primary_key=True)  # SHA-256
+    size = Column(Integer, nullable=False)
+    ref_count = Column(Integer, default=0, index=True)
+    
+    # 时间戳
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class DerivativeEntry(Base):
+    """共享派生文件缓存索引（缩略图等按内容MD5和版本存放，所有用户共用，按最后访问时间淘汰）"""
+    __tablename__ = "derivatives"
+    
+    content_hash = Column(String(32), primary_key=True)  # 源内容MD5
+    rendition = Column(String(50), primary_key=True)  # 版本名，如 thumb-200x200.jpg
+    size = Column(BigInteger, default=0)
+    
+    # 命中统计
+    hits = Column(Integer, default=0)
+    generations = Column(Integer, default=0)  # 生成次数（大于1表示被淘汰后又重新生成）
+    
+    # 时间戳
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_accessed_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+class ContentDocument(Base):
+    """全文索引中的文档（按内容MD5去重；提取的文本在content_fts虚拟表中，rowid与id相同）"""
+    __tablename__ = "content_documents"
+    __table_args__ = {"sqlite_autoincrement": True}
+    
+    id = Column(Integer, primary_key=True, index=True)
+    content_hash = Column(String(32), unique=True, nullable=False)
+    
+    # 索引结果
+    status = Column(String(20), default="indexed")  # indexed, empty, skipped, failed
+    text_length = Column(Integer, default=0)  # 写入索引的字符数
+    truncated = Column(Boolean, default=False)  # 超过字符上限，只索引了开头部分
+    error = Column(Text)
+    
+    # 时间戳
+    indexed_at = Column(DateTime, default=datetime.utcnow)
+
+
+class MediaMetadata(Base):
+    """照片元数据（每个图片文件一条，按拍摄时间建立索引，用于时间线浏览）"""
+    __tablename__ = "media_metadata"
+    __table_args__ = (
+        # 时间线按用户和拍摄时间倒序分页：一个用户某个月的照片是索引上的一段连续范围
+        Index("idx_media_metadata_owner_taken", "owner_id", "taken_at", "file_id"),
+    )
+    
+    file_id = Column(Integer, ForeignKey("files.id"), primary_key=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    content_hash = Column(String(32), index=True)  # 提取时的内容MD5（文件内容变化后重新提取）
+    
+    # 拍摄时间（EXIF中的本地时间；没有EXIF时间时为上传时间）
+    taken_at = Column(DateTime, nullable=False)
+    time_source = Column(String(10), default="exif")  # exif, upload
+    
+    # 图片信息（宽高为按EXIF方向旋转后的尺寸）
+    width = Column(Integer)
+    height = Column(Integer)
+    camera_make = Column(String(100))
+    camera_model = Column(String(100))
+    latitude = Column(Float)
+    longitude = Column(Float)
+    
+    extracted_at = Column(DateTime, default=datetime.utcnow)
+
+
+class FolderVersion(Base):
+    """文件夹列表版本号（直接子条目有任何变化时递增，由files表上的触发器维护；根目录的folder_id为0）"""
+    __tablename__ = "folder_versions"
+    
+    owner_id = Column(Integer, primary_key=True)
+    folder_id = Column(Integer, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+
+
+# 文件列表中可见的列（listing.LISTING_COLUMNS）和决定条目所在列表的列，这些列变化时父文件夹的版本号递增
+FOLDER_VERSION_COLUMNS = (
+    "owner_id", "parent_id", "is_deleted",
+    "filename", "original_filename", "size", "category", "is_folder", "mime_type",
+    "created_at", "updated_at", "md5_hash", "media_status",
+)
+
+
+def _render_default(column) -> str:
+    """将列的标量默认值渲染为SQL字面量（用于ALTER TABLE）"""
+    default = column.default
+    if default is None or not default.is_scalar:
+        return ""
+    value = default.arg
+    if isinstance(value, bool):
+        return f" DEFAULT {int(value)}"
+    if isinstance(value, (int, float)):
+        return f" DEFAULT {value}"
+    if isinstance(value, str):
+        escaped = value.replace("'", "''")
+        return f" DEFAULT '{escaped}'"
+    return ""
+
+
+def _ensure_sqlite_autoincrement(conn, table):
+    """将没有AUTOINCREMENT的SQLite表按当前模型重建并复制数据"""
+    sql = conn.execute(
+        text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {"name": table.name}
+    ).scalar()
+    if not sql or "AUTOINCREMENT" in sql.upper():
+        return
+    
+    old_name = f"{table.name}_old"
+    conn.execute(text(f"ALTER TABLE {table.name} RENAME TO {old_name}"))
+    
+    # 旧表的索引随表改名，先删除以免与新表索引重名
+    index_names = conn.execute(
+        text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :name AND sql IS NOT NULL"),
+        {"name": old_name}
+    ).scalars().all()
+    for index_name in index_names:
+        conn.execute(text(f"DROP INDEX {index_name}"))
+    
+    table.create(bind=conn)
+    columns = ", ".join(c.name for c in table.columns)
+    conn.execute(text(f"INSERT INTO {table.name} ({columns}) SELECT {columns} FROM {old_name}"))
+    conn.execute(text(f"DROP TABLE {old_name}"))
+    print(f"ℹ️  数据库升级: {table.name} 启用AUTOINCREMENT")
+
+
+def upgrade_schema():
+    """
+    升级已有数据库结构
+    
+    create_all只会创建缺失的表，不会修改已存在的表。
+    这里为已有表补充新增的列和索引，使旧版本数据库可以平滑升级。
+    """
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            
+            existing_columns = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(
+                    f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+                    f"{_render_default(column)}"
+                ))
+                print(f"ℹ️  数据库升级: {table.name}.{column.name}")
+    
+    # SQLite旧表没有AUTOINCREMENT时重建（最大ID被删除后会被复用）
+    if engine.dialect.name == "sqlite":
+        with engine.begin() as conn:
+            for table in Base.metadata.sorted_tables:
+                if table.name in existing_tables and table.kwargs.get("sqlite_autoincrement"):
+                    _ensure_sqlite_autoincrement(conn, table)
+    
+    # 补充缺失的索引
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+
+def create_fulltext_tables():
+    """创建全文索引虚拟表（SQLite FTS5；不支持时跳过，全文搜索不可用）"""
+    if engine.dialect.name != "sqlite":
+        return
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("CREATE VIRTUAL TABLE IF NOT EXISTS content_fts USING fts5(body)"))
+    except Exception as e:
+        print(f"⚠️  全文索引不可用（SQLite未启用FTS5）: {e}")
+
+
+def _bump_folder_version(owner: str, parent: str, where: str = "") -> str:
+    """递增一个文件夹版本号的SQL（版本号取 max(原版本+1, 当前毫秒时间戳)，数据库从备份还原后也不会与之前发出的版本重复）"""
+    now = "CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER)"
+    source = f"SELECT {owner}, COALESCE({parent}, 0), {now} WHERE {where}" if where else \
+        f"VALUES ({owner}, COALESCE({parent}, 0), {now})"
+    return (
+        f"INSERT INTO folder_versions (owner_id, folder_id, version) {source} "
+        f"ON CONFLICT (owner_id, folder_id) DO UPDATE SET version = MAX(version + 1, excluded.version);"
+    )
+
+
+def create_folder_version_triggers():
+    """
+    创建维护文件夹版本号的触发器（SQLite）
+    
+    在数据库中维护而不是在各处修改文件的代码中维护：上传、导入、批量操作、后台任务等
+    所有修改途径都在同一事务中递增版本号，不会遗漏。每次启动时按当前列清单重建。
+    创建失败（非SQLite或SQLite低于3.24）时文件列表不使用ETag和缓存。
+    """
+    if engine.dialect.name != "sqlite":
+        return
+    
+    changed = " OR ".join(f"OLD.{column} IS NOT NEW.{column}" for column in FOLDER_VERSION_COLUMNS)
+    moved = "OLD.owner_id IS NOT NEW.owner_id OR OLD.parent_id IS NOT NEW.parent_id"
+    triggers = {
+        "files_folder_version_insert": f"""
+            CREATE TRIGGER files_folder_version_insert AFTER INSERT ON files
+            BEGIN {_bump_folder_version("NEW.owner_id", "NEW.parent_id")} END""",
+        "files_folder_version_update": f"""
+            CREATE TRIGGER files_folder_version_update
+            AFTER UPDATE OF {", ".join(FOLDER_VERSION_COLUMNS)} ON files
+            WHEN {changed}
+            BEGIN
+                {_bump_folder_version("OLD.owner_id", "OLD.parent_id")}
+                {_bump_folder_version("NEW.owner_id", "NEW.parent_id", moved)}
+            END""",
+        "files_folder_version_delete": f"""
+            CREATE TRIGGER files_folder_version_delete AFTER DELETE ON files
+            BEGIN {_bump_folder_version("OLD.owner_id", "OLD.parent_id")} END""",
+    }
+    try:
+        with engine.begin() as conn:
+            for name, sql in triggers.items():
+                conn.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+                conn.execute(text(sql))
+    except Exception as e:
+        print(f"⚠️  文件夹版本号触发器创建失败，文件列表不使用缓存: {e}")
+
+
 def init_db():
     """初始化数据库"""
     # 创建所有表（包括验证码表）
@@ -279,6 +629,11 @@ def init_db():
     except ImportError:
         pass  # 如果导入失败，忽略（可能在某些情况下）
     
+    # 为旧版本数据库补充新增的列和索引
+    upgrade_schema()
+    create_fulltext_tables()
+    create_folder_version_triggers()
+    
     # 创建默认管理员账户
     db = SessionLocal()
     try:
@@ -0,0 +1,170 @@
+"""
+变更推送模块
+通过WebSocket向在线客户端实时推送该用户的文件变更，客户端无需轮询
+
+跨进程分发：所有文件变更都会在同一事务中写入sync_records（见changes.py），
+每个uvicorn工作进程各自按ID轮询这张表（主键范围查询，只在有连接时执行），
+再推送给连接在本进程上的客户端，因此连接落在哪个工作进程都能收到全部变更。
+
+连接：ws://<host>/ws/changes?token=<JWT>
+推送消息：
+    {"type": "changes", "cursor": 最新游标, "events": [[游标, 文件ID, 操作, 父文件夹ID, 设备ID, 原父文件夹ID], ...]}
+    原父文件夹ID只在moved事件中有值（移出的文件夹也需要刷新），其他事件为null。
+客户端发送 "ping" 时回复 {"type": "pong"}；收到推送后可用 /api/sync/changes?since= 获取详细内容。
+"""
+
+import asyncio
+import json
+from typing import Dict, List, Optional, Set, Tuple
+
+from fastapi import WebSocket
+from sqlalchemy import func
+
+from models import File, SyncRecord, SessionLocal
+from config import settings
+
+
+# 每次轮询最多读取的记录数
+POLL_BATCH_SIZE = 1000
+
+
+class ChangeNotifier:
+    """变更推送（每个工作进程一个实例）"""
+    
+    def __init__(self, poll_interval: float):
+        self.poll_interval = poll_interval
+        self._connections: Dict[int, Set[WebSocket]] = {}
+        self._last_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+    
+    def can_accept(self, user_id: int) -> bool:
+        """是否还能为该用户建立新连接"""
+        return len(self._connections.get(user_id, ())) < settings.WS_MAX_CONNECTIONS_PER_USER
+    
+    def register(self, user_id: int, websocket: WebSocket):
+        """
+        登记连接，首次有连接时启动轮询
+        
+        Args:
+            user_id: 用户ID
+            websocket: WebSocket连接
+        """
+        self._connections.setdefault(user_id, set()).add(websocket)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._poll_loop())
+    
+    def unregister(self, user_id: int, websocket: WebSocket):
+        sockets = self._connections.get(user_id)
+        if sockets is None:
+            return
+        sockets.discard(websocket)
+        if not sockets:
+            del self._connections[user_id]
+    
+    async def stop(self):
+        """停止轮询并关闭所有连接"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        
+        for sockets in list(self._connections.values()):
+            for websocket in list(sockets):
+                try:
+                    await websocket.close(code=1001)
+                except Exception:
+                    pass
+        self._connections.clear()
+    
+    async def _poll_loop(self):
+        # 没有连接时退出，下次有连接时重新从当前最新记录开始
+        while self._connections:
+            try:
+                await self.poll()
+            except Exception as e:
+                print(f"[NOTIFY] 轮询变更失败: {e}")
+            await asyncio.sleep(self.poll_interval)
+        self._last_id = None
+    
+    async def poll(self) -> int:
+        """
+        读取新的变更记录并推送给对应用户
+        
+        Returns:
+            推送的记录数
+        """
+        if self._last_id is None:
+            self._last_id = await asyncio.to_thread(_latest_id)
+            return 0
+        
+        rows = await asyncio.to_thread(_fetch_changes, self._last_id, list(self._connections))
+        if not rows:
+            return 0
+        self._last_id = rows[-1][0]
+        
+        by_user: Dict[int, List[list]] = {}
+        for record_id, user_id, file_id, action, parent_id, device_id, from_parent_id in rows:
+            if user_id is None:
+                continue
+            by_user.setdefault(user_id, []).append(
+                [record_id, file_id, action, parent_id, device_id, from_parent_id]
+            )
+        
+        for user_id, events in by_user.items():
+            message = json.dumps({"type": "changes", "cursor": events[-1][0], "events": events})
+            for websocket in list(self._connections.get(user_id, ())):
+                try:
+                    await websocket.send_text(message)
+                except Exception:
+                    self.unregister(user_id, websocket)
+        
+        return len(rows)
+
+
+def _latest_id() -> int:
+    db = SessionLocal()
+    try:
+        return db.query(func.max(SyncRecord.id)).scalar() or 0
+    finally:
+        db.close()
+
+
+def _fetch_changes(last_id: int, user_ids: List[int]) -> List[Tuple]:
+    """
+    读取游标之后的变更记录
+    
+    只返回有在线连接的用户的记录，但读取范围按全部记录推进，
+    返回的最后一行之后没有遗漏（按ID顺序，最多POLL_BATCH_SIZE条）。
+    """
+    db = SessionLocal()
+    try:
+        ids = [row[0] for row in db.query(SyncRecord.id).filter(
+            SyncRecord.id > last_id
+        ).order_by(SyncRecord.id).limit(POLL_BATCH_SIZE).all()]
+        if not ids:
+            return []
+        
+        rows = db.query(
+            SyncRecord.id, SyncRecord.user_id, SyncRecord.file_id, SyncRecord.action,
+            File.parent_id, SyncRecord.device_id, SyncRecord.from_parent_id
+        ).outerjoin(
+            File, File.id == SyncRecord.file_id
+        ).filter(
+            SyncRecord.id > last_id,
+            SyncRecord.id <= ids[-1],
+            SyncRecord.user_id.in_(user_ids)
+        ).order_by(SyncRecord.id).all()
+        
+        # 保证游标推进到本批最后一条（即使不属于在线用户）
+        if not rows or rows[-1][0] != ids[-1]:
+            rows.append((ids[-1], None, None, None, None, None, None))
+        return rows
+    finally:
+        db.close()
+
+
+# 全局推送实例
+notifier = ChangeNotifier(settings.WS_POLL_INTERVAL)
@@ -0,0 +1,341 @@
+"""
+照片时间线模块
+从EXIF提取拍摄时间、尺寸、相机和GPS位置存入media_metadata表，按拍摄时间浏览照片：
+
+- 上传图片时与缩略图一起提取；导入、增量同步、复制等途径新增或修改的图片由后台任务补充
+- 内容相同（MD5相同）的图片直接复用已提取的元数据，不再读取文件
+- 表上的(owner_id, taken_at)索引使"某个用户某个月的照片"成为一段连续的索引范围，
+  时间线分页和按月统计都不需要读取全部文件再排序
+- 没有EXIF拍摄时间的图片（截图、处理过的图片、无法解析的格式）按上传时间排列
+"""
+
+from datetime import datetime
+from math import isfinite
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, status
+from PIL import Image
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import Session
+
+from models import User, File, MediaMetadata
+from config import settings
+from chunkstore import open_stored_file
+from maintenance import scheduler, run_task
+
+
+# EXIF标签
+TAG_ORIENTATION = 0x0112
+TAG_MAKE = 0x010F
+TAG_MODEL = 0x0110
+TAG_DATETIME = 0x0132
+TAG_DATETIME_ORIGINAL = 0x9003
+TAG_DATETIME_DIGITIZED = 0x9004
+IFD_EXIF = 0x8769
+IFD_GPS = 0x8825
+
+# GPS子目录中的标签
+GPS_LATITUDE_REF, GPS_LATITUDE, GPS_LONGITUDE_REF, GPS_LONGITUDE = 1, 2, 3, 4
+
+EXIF_DATETIME_FORMAT = "%Y:%m:%d %H:%M:%S"
+
+# 时间线单页最多返回的照片数
+MAX_PAGE_SIZE = 500
+
+# 需要从已有记录复制或重新提取的字段
+METADATA_FIELDS = ("taken_at", "time_source", "width", "height",
+                   "camera_make", "camera_model", "latitude", "longitude")
+
+
+def _parse_datetime(value) -> Optional[datetime]:
+    """解析EXIF时间（"2023:05:14 10:22:01"，相机未设置时间时为全0或空格）"""
+    if not isinstance(value, str):
+        return None
+    try:
+        return datetime.strptime(value.strip("\x00 ")[:19], EXIF_DATETIME_FORMAT)
+    except ValueError:
+        return None
+
+
+def _parse_text(value) -> Optional[str]:
+    if not isinstance(value, str):
+        return None
+    value = value.strip("\x00 ")
+    return value[:100] or None
+
+
+def _parse_coordinate(value, ref) -> Optional[float]:
+    """把(度, 分, 秒)转换为十进制度数，南纬和西经为负"""
+    try:
+        degrees, minutes, seconds = (float(part) for part in value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    coordinate = degrees + minutes / 60 + seconds / 3600
+    if not isfinite(coordinate):
+        return None
+    if isinstance(ref, bytes):
+        ref = ref.decode(errors="ignore")
+    if isinstance(ref, str) and ref.strip("\x00 ").upper() in ("S", "W"):
+        coordinate = -coordinate
+    return round(coordinate, 6)
+
+
+def extract_metadata(stream) -> dict:
+    """
+    读取图片头部的尺寸和EXIF信息（不解码像素）
+    
+    Args:
+        stream: 图片文件对象
+    
+    Returns:
+        元数据字典，没有EXIF拍摄时间时不包含taken_at
+    """
+    with Image.open(stream) as img:
+        width, height = img.size
+        exif = img.getexif()
+        
+        # 方向5-8需要旋转90度，显示时宽高互换
+        if exif.get(TAG_ORIENTATION) in (5, 6, 7, 8):
+            width, height = height, width
+        
+        exif_ifd = exif.get_ifd(IFD_EXIF)
+        taken_at = (_parse_datetime(exif_ifd.get(TAG_DATETIME_ORIGINAL))
+                    or _parse_datetime(exif_ifd.get(TAG_DATETIME_DIGITIZED))
+                    or _parse_datetime(exif.get(TAG_DATETIME)))
+        
+        metadata = {
+            "width": width,
+            "height": height,
+            "camera_make": _parse_text(exif.get(TAG_MAKE)),
+            "camera_model": _parse_text(exif.get(TAG_MODEL)),
+        }
+        
+        gps = exif.get_ifd(IFD_GPS)
+        latitude = _parse_coordinate(gps.get(GPS_LATITUDE), gps.get(GPS_LATITUDE_REF))
+        longitude = _parse_coordinate(gps.get(GPS_LONGITUDE), gps.get(GPS_LONGITUDE_REF))
+        if latitude is not None and longitude is not None \
+                and -90 <= latitude <= 90 and -180 <= longitude <= 180 \
+                and (latitude, longitude) != (0, 0):
+            metadata["latitude"], metadata["longitude"] = latitude, longitude
+    
+    if taken_at:
+        metadata["taken_at"] = taken_at
+    return metadata
+
+
+def record_photo_metadata(db: Session, file: File) -> MediaMetadata:
+    """
+    提取并保存一个图片文件的元数据（已有相同内容的记录时直接复制；不提交事务）
+    
+    Args:
+        db: 数据库会话
+        file: 图片文件对象（已有ID）
+    
+    Returns:
+        元数据记录
+    """
+    fallback_time = file.created_at or datetime.utcnow()
+    metadata = {}
+    
+    source = db.query(MediaMetadata).filter(
+        MediaMetadata.content_hash == file.md5_hash,
+        MediaMetadata.file_id != file.id
+    ).first() if file.md5_hash else None
+    
+    if source is not None:
+        metadata = {field: getattr(source, field) for field in METADATA_FIELDS}
+        if source.time_source != "exif":
+            metadata.pop("taken_at")
+    else:
+        try:
+            with open_stored_file(file) as stream:
+                metadata = extract_metadata(stream)
+        except (OSError, ValueError, SyntaxError, Image.DecompressionBombError) as e:
+            # 无法解析的图片也保存记录（按上传时间排列），避免后台任务反复重试
+            print(f"[TIMELINE] 读取图片信息失败 {file.file_path}: {e}")
+    
+    record = db.query(MediaMetadata).filter(MediaMetadata.file_id == file.id).first()
+    if record is None:
+        record = MediaMetadata(file_id=file.id)
+        db.add(record)
+    
+    record.owner_id = file.owner_id
+    record.content_hash = file.md5_hash
+    for field in METADATA_FIELDS:
+        setattr(record, field, metadata.get(field))
+    record.time_source = "exif" if metadata.get("taken_at") else "upload"
+    record.taken_at = metadata.get("taken_at") or fallback_time
+    record.extracted_at = datetime.utcnow()
+    return record
+
+
+def run_photo_metadata(db: Session) -> dict:
+    """
+    照片元数据后台任务
+    
+    1. 删除已不存在的文件的记录
+    2. 为还没有元数据或内容已变化的图片提取元数据
+    
+    Args:
+        db: 数据库会话
+    
+    Returns:
+        统计信息
+    """
+    stats = {"removed": 0, "extracted": 0}
+    
+    stats["removed"] = db.query(MediaMetadata).filter(
+        ~db.query(File.id).filter(File.id == MediaMetadata.file_id).exists()
+    ).delete(synchronize_session=False)
+    db.commit()
+    
+    pending = db.query(File).outerjoin(
+        MediaMetadata, MediaMetadata.file_id == File.id
+    ).filter(
+        File.category == "image",
+        File.is_folder == False,
+        File.is_deleted == False,
+        or_(MediaMetadata.file_id == None, MediaMetadata.content_hash != File.md5_hash)
+    ).order_by(File.id).limit(settings.PHOTO_METADATA_BATCH_SIZE).all()
+    
+    for index, file in enumerate(pending, start=1):
+        record_photo_metadata(db, file)
+        # 复用相同内容的记录需要先写入前面的结果
+        db.flush()
+        if index % 100 == 0:
+            db.commit()
+    db.commit()
+    stats["extracted"] = len(pending)
+    
+    return stats
+
+
+def trigger_photo_metadata():
+    """立即执行一次元数据提取"""
+    run_task("photo_metadata", run_photo_metadata)
+
+
+def _parse_month(month: str) -> Tuple[datetime, datetime]:
+    """把 YYYY-MM 转换为 [当月1日, 下月1日)"""
+    try:
+        start = datetime.strptime(month, "%Y-%m")
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="月份格式应为YYYY-MM"
+        )
+    end = start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+    return start, end
+
+
+def _parse_cursor(cursor: str) -> Tuple[datetime, int]:
+    """游标格式为 拍摄时间_文件ID（上一页最后一张照片）"""
+    try:
+        taken_at, file_id = cursor.rsplit("_", 1)
+        return datetime.fromisoformat(taken_at), int(file_id)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="无效的分页游标"
+        )
+
+
+class TimelineService:
+    """照片时间线服务"""
+    
+    def __init__(self, db: Session):
+        self.db = db
+    
+    def _photos(self, user: User):
+        """用户未删除的照片（按拍摄时间索引范围扫描，再按主键关联文件）"""
+        return self.db.query(MediaMetadata, File).join(
+            File, File.id == MediaMetadata.file_id
+        ).filter(
+            MediaMetadata.owner_id == user.id,
+            File.is_deleted == False,
+            File.category == "image"
+        )
+    
+    def timeline(self, user: User, month: Optional[str] = None,
+                 cursor: Optional[str] = None, limit: int = 100) -> dict:
+        """
+        按拍摄时间倒序列出照片
+        
+        Args:
+            user: 用户对象
+            month: 只列出某个月的照片（YYYY-MM，可选）
+            cursor: 上一页返回的next_cursor（可选）
+            limit: 每页数量
+        
+        Returns:
+            {"photos": [...], "next_cursor": 下一页游标，没有更多时为None}
+        """
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        query = self._photos(user)
+        
+        if month:
+            start, end = _parse_month(month)
+            query = query.filter(MediaMetadata.taken_at >= start, MediaMetadata.taken_at < end)
+        
+        if cursor:
+            taken_at, file_id = _parse_cursor(cursor)
+            query = query.filter(or_(
+                MediaMetadata.taken_at < taken_at,
+                and_(MediaMetadata.taken_at == taken_at, MediaMetadata.file_id < file_id)
+            ))
+        
+        rows = query.order_by(
+            MediaMetadata.taken_at.desc(),
+            MediaMetadata.file_id.desc()
+        ).limit(limit + 1).all()
+        
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1][0]
+            next_cursor = f"{last.taken_at.isoformat()}_{last.file_id}"
+        
+        return {
+            "photos": [
+                {
+                    "id": file.id,
+                    "filename": file.original_filename or file.filename,
+                    "parent_id": file.parent_id,
+                    "size": file.size,
+                    "taken_at": metadata.taken_at.isoformat(),
+                    "time_source": metadata.time_source,
+                    "width": metadata.width,
+                    "height": metadata.height,
+                    "camera_make": metadata.camera_make,
+                    "camera_model": metadata.camera_model,
+                    "latitude": metadata.latitude,
+                    "longitude": metadata.longitude,
+                }
+                for metadata, file in rows
+            ],
+            "next_cursor": next_cursor
+        }
+    
+    def months(self, user: User) -> dict:
+        """
+        按月统计照片数量（倒序）
+        
+        Args:
+            user: 用户对象
+        
+        Returns:
+            {"months": [{"month": "2023-05", "count": 数量}, ...], "total": 总数}
+        """
+        month = func.strftime("%Y-%m", MediaMetadata.taken_at)
+        rows = self._photos(user).with_entities(
+            month.label("month"),
+            func.count(MediaMetadata.file_id)
+        ).group_by(month).order_by(month.desc()).all()
+        
+        return {
+            "months": [{"month": value, "count": count} for value, count in rows],
+            "total": sum(count for _, count in rows)
+        }
+
+
+scheduler.register("photo_metadata", settings.PHOTO_METADATA_INTERVAL, run_photo_metadata)
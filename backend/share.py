@@ -11,6 +11,7 @@ from pydantic import BaseModel
 
 from models import User, File, Share
 from config import settings
+from document_preview import available_pages
 
 
 class ShareCreate(BaseModel):
@@ -294,6 +295,11 @@ class ShareService:
             "expire_at": share.expire_at,
             "is_active": share.is_active and share.is_valid(),
             "is_expired": share.is_expired(),
+            "preview_pages": (
+                len(available_pages(file)) if file.category == "document"
+                else 1 if file.category == "image"
+                else 0
+            ),
             "downloads_remaining": (
                 share.max_downloads - share.download_count
                 if share.max_downloads
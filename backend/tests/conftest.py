@@ -0,0 +1,91 @@
+"""
+测试公共配置
+所有数据（SQLite数据库、存储目录）都放在临时目录中，必须在导入后端模块之前设置环境变量。
+"""
+
+import asyncio
+import io
+import itertools
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+_workdir = Path(tempfile.mkdtemp(prefix="raspberrycloud-test-"))
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{_workdir}/test.db",
+    "STORAGE_PATH": str(_workdir / "storage" / "users"),
+    "SHARE_PATH": str(_workdir / "storage" / "shares"),
+    "TEMP_PATH": str(_workdir / "storage" / "temp"),
+    "BACKUP_PATH": str(_workdir / "storage" / "backups"),
+    "CHUNK_STORE_PATH": str(_workdir / "storage" / "chunks"),
+    "DERIVATIVE_CACHE_PATH": str(_workdir / "storage" / "derivatives"),
+    "MAINTENANCE_ENABLED": "false",
+    "CONTENT_INDEX_ENABLED": "false",
+    "MEDIA_PROCESSING_ENABLED": "false",
+    "TRASH_PURGE_BATCH_PAUSE": "0",
+})
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi import UploadFile
+
+from sqlalchemy import text
+
+from models import init_db, Base, SessionLocal, engine, User, File, FolderVersion
+from file_handler import FileService
+
+init_db()
+
+_usernames = (f"user{i}" for i in itertools.count(1))
+
+
+@pytest.fixture(autouse=True)
+def _clean_state():
+    """每个测试结束后清空所有表和存储目录"""
+    yield
+    with engine.begin() as conn:
+        for table in reversed(Base.metadata.sorted_tables):
+            conn.execute(table.delete())
+        conn.execute(text("DELETE FROM content_fts"))
+        # 删除文件时触发器会写入文件夹版本号
+        conn.execute(FolderVersion.__table__.delete())
+    for directory in (_workdir / "storage").iterdir():
+        shutil.rmtree(directory, ignore_errors=True)
+        directory.mkdir()
+
+
+@pytest.fixture
+def workdir() -> Path:
+    """测试数据所在的临时目录"""
+    return _workdir
+
+
+@pytest.fixture
+def db():
+    """数据库会话"""
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def user(db) -> User:
+    """新用户（每个测试一个，互不影响）"""
+    user = User(username=next(_usernames), hashed_password="-", quota=1 << 40, used_space=0)
+    db.add(user)
+    db.commit()
+    return user
+
+
+@pytest.fixture
+def upload(db, user):
+    """通过FileService.upload_file为当前用户上传文件：upload(文件名, 内容, parent_id=None) -> File"""
+    def _upload(filename: str, content: bytes, parent_id=None) -> File:
+        upload_file = UploadFile(io.BytesIO(content), filename=filename)
+        return asyncio.run(FileService(db).upload_file(user, upload_file, parent_id))
+    return _upload
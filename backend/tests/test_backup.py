@@ -0,0 +1,151 @@
+"""增量备份与还原测试"""
+
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+import backup
+from models import File
+from chunkstore import ChunkStore, convert_file, read_manifest
+from backup import BackupEngine
+from volumes import VolumeRegistry, StorageVolume, DEFAULT_VOLUME
+from config import settings
+
+
+@pytest.fixture
+def backup_engine(tmp_path):
+    engine = BackupEngine(str(tmp_path / "backups"))
+    yield engine
+    engine.close()
+
+
+@pytest.fixture
+def usb_volume(tmp_path, monkeypatch) -> StorageVolume:
+    """额外配置一个存储卷usb1"""
+    root = tmp_path / "usb1"
+    root.mkdir()
+    registry = VolumeRegistry([
+        StorageVolume(DEFAULT_VOLUME, settings.STORAGE_PATH),
+        StorageVolume("usb1", str(root)),
+    ])
+    monkeypatch.setattr(backup, "volumes", registry)
+    return registry.find("usb1")
+
+
+def _add_file_on(db, user, volume: StorageVolume, name: str, content: bytes) -> File:
+    """直接在指定卷上创建文件和记录"""
+    path = volume.root / str(user.id) / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(content)
+    file = File(filename=name, original_filename=name, file_path=str(path), size=len(content),
+                category="other", owner_id=user.id, volume=volume.name)
+    db.add(file)
+    db.commit()
+    return file
+
+
+def test_incremental_backup_and_restore_in_place(db, user, upload, backup_engine):
+    a = upload("a.txt", b"alpha")
+    b = upload("b.txt", b"beta")
+    
+    first = backup_engine.run()
+    assert first["file_count"] == 2
+    assert first["new_blobs"] == 2
+    
+    upload("c.txt", b"alpha")  # 与a内容相同
+    second = backup_engine.run()
+    assert second["file_count"] == 3
+    assert second["new_blobs"] == 0
+    
+    Path(a.file_path).write_bytes(b"corrupted")
+    Path(b.file_path).unlink()
+    stats = backup_engine.restore(first["snapshot_id"], restore_db=False)
+    
+    assert stats["files_restored"] == 2
+    assert Path(a.file_path).read_bytes() == b"alpha"
+    assert Path(b.file_path).read_bytes() == b"beta"
+    
+    stats = backup_engine.restore(first["snapshot_id"], restore_db=False)
+    assert stats["files_unchanged"] == 2
+
+
+def test_restore_database_to_target(db, user, upload, backup_engine, tmp_path):
+    file = upload("a.txt", b"alpha")
+    snapshot_id = backup_engine.run()["snapshot_id"]
+    
+    target = tmp_path / "restored.db"
+    stats = backup_engine.restore(snapshot_id, db_target=str(target), restore_files=False)
+    
+    assert stats["database"] == str(target)
+    conn = sqlite3.connect(str(target))
+    try:
+        assert conn.execute("SELECT file_path FROM files WHERE id = ?", (file.id,)).fetchone()[0] == file.file_path
+    finally:
+        conn.close()
+
+
+def test_restore_with_files_target_keeps_chunked_flags(db, user, upload, backup_engine, tmp_path):
+    content = b"chunked content " * 4096
+    file = upload("a.bin", content)
+    convert_file(db, ChunkStore(), file)
+    db.refresh(file)
+    assert file.is_chunked
+    snapshot_id = backup_engine.run()["snapshot_id"]
+    
+    db_target = tmp_path / "restored.db"
+    target = tmp_path / "restore"
+    backup_engine.restore(snapshot_id, db_target=str(db_target), files_target=str(target))
+    
+    # 完整内容还原到了其他目录，原路径上仍是分块清单，数据库中的标记不能清除
+    assert (target / str(user.id) / "a.bin").read_bytes() == content
+    assert read_manifest(Path(file.file_path)) is not None
+    conn = sqlite3.connect(str(db_target))
+    try:
+        assert conn.execute("SELECT is_chunked FROM files WHERE id = ?", (file.id,)).fetchone()[0] == 1
+    finally:
+        conn.close()
+
+
+def test_restore_to_alternate_location_single_volume(db, user, upload, backup_engine, tmp_path):
+    file = upload("a.txt", b"alpha")
+    snapshot_id = backup_engine.run()["snapshot_id"]
+    Path(file.file_path).write_bytes(b"live")
+    
+    target = tmp_path / "restore"
+    stats = backup_engine.restore(snapshot_id, files_target=str(target), restore_db=False)
+    
+    assert stats["files_restored"] == 1
+    assert (target / str(user.id) / "a.txt").read_bytes() == b"alpha"
+    assert Path(file.file_path).read_bytes() == b"live"
+
+
+def test_restore_to_alternate_location_never_touches_extra_volumes(db, user, upload, backup_engine, usb_volume, tmp_path):
+    on_default = upload("a.txt", b"alpha")
+    on_usb = _add_file_on(db, user, usb_volume, "b.txt", b"beta")
+    snapshot_id = backup_engine.run()["snapshot_id"]
+    
+    Path(on_default.file_path).write_bytes(b"live a")
+    Path(on_usb.file_path).write_bytes(b"live b")
+    
+    target = tmp_path / "restore"
+    stats = backup_engine.restore(snapshot_id, files_target=str(target), restore_db=False)
+    
+    assert stats["files_restored"] == 2
+    assert (target / DEFAULT_VOLUME / str(user.id) / "a.txt").read_bytes() == b"alpha"
+    assert (target / "usb1" / str(user.id) / "b.txt").read_bytes() == b"beta"
+    assert Path(on_default.file_path).read_bytes() == b"live a"
+    assert Path(on_usb.file_path).read_bytes() == b"live b"
+
+
+def test_files_outside_configured_volumes_are_skipped(db, user, backup_engine, tmp_path):
+    removed = StorageVolume("removed", str(tmp_path / "removed"))
+    file = _add_file_on(db, user, removed, "c.txt", b"gamma")
+    snapshot_id = backup_engine.run()["snapshot_id"]
+    Path(file.file_path).write_bytes(b"live")
+    
+    stats = backup_engine.restore(snapshot_id, files_target=str(tmp_path / "restore"), restore_db=False)
+    
+    assert stats["files_outside_volumes"] == 1
+    assert stats["files_restored"] == 0
+    assert Path(file.file_path).read_bytes() == b"live"
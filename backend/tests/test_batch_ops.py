@@ -0,0 +1,142 @@
+"""批量移动/复制测试"""
+
+import random
+from pathlib import Path
+
+import pytest
+
+from models import ChunkRecord, File
+from config import settings
+from batch_ops import BatchService
+from chunkstore import ChunkStore, convert_file, open_stored_file, release_stored_file
+from file_handler import FileService
+
+
+class CommitFailed(Exception):
+    pass
+
+
+def _fail_commit(db, monkeypatch):
+    def commit():
+        raise CommitFailed()
+    monkeypatch.setattr(db, "commit", commit)
+
+
+def _results(result: dict) -> dict:
+    return {r["id"]: r for r in result["results"]}
+
+
+def test_move_files_and_folders(db, user, upload):
+    service = FileService(db)
+    target = service.create_folder(user, "target")
+    folder = service.create_folder(user, "docs")
+    child = upload("child.txt", b"child", folder.id)
+    a = upload("a.txt", b"a")
+    
+    result = BatchService(db).move(user, [a.id, folder.id], target.id)
+    assert result["success"] and result["succeeded"] == 2
+    
+    for file in (a, folder, child):
+        db.refresh(file)
+        assert Path(file.file_path).exists()
+    assert a.parent_id == folder.parent_id == target.id
+    assert Path(child.file_path).parent == Path(folder.file_path)
+    assert Path(folder.file_path).parent == Path(target.file_path)
+    assert Path(child.file_path).read_bytes() == b"child"
+
+
+def test_move_reports_conflicts_per_item(db, user, upload):
+    service = FileService(db)
+    target = service.create_folder(user, "target")
+    upload("a.txt", b"existing", target.id)
+    a = upload("a.txt", b"a")
+    b = upload("b.txt", b"b")
+    
+    result = _results(BatchService(db).move(user, [a.id, b.id, target.id, 999999], target.id))
+    assert not result[a.id]["success"]  # 目标位置已有同名文件
+    assert result[b.id]["success"]
+    assert not result[target.id]["success"]  # 不能移动到自身
+    assert not result[999999]["success"]
+    
+    db.refresh(a)
+    assert a.parent_id is None
+    assert Path(a.file_path).read_bytes() == b"a"
+
+
+def test_move_undoes_physical_moves_when_commit_fails(db, user, upload, monkeypatch):
+    service = FileService(db)
+    target = service.create_folder(user, "target")
+    folder = service.create_folder(user, "docs")
+    child = upload("child.txt", b"child", folder.id)
+    a = upload("a.txt", b"a")
+    paths = {f.id: f.file_path for f in (a, folder, child)}
+    
+    _fail_commit(db, monkeypatch)
+    with pytest.raises(CommitFailed):
+        BatchService(db).move(user, [a.id, folder.id], target.id)
+    monkeypatch.undo()
+    
+    for file_id, path in paths.items():
+        row = db.get(File, file_id)
+        assert row.file_path == path
+        assert Path(path).exists()
+    assert list(Path(target.file_path).iterdir()) == []
+
+
+def test_copy_tree_with_name_conflict(db, user, upload):
+    service = FileService(db)
+    folder = service.create_folder(user, "docs")
+    upload("child.txt", b"child", folder.id)
+    db.refresh(user)
+    used = user.used_space
+    
+    result = BatchService(db).copy(user, [folder.id], None)
+    assert result["success"]
+    copy_id = result["results"][0]["new_id"]
+    assert result["results"][0]["filename"] == "docs_1"
+    
+    copied = db.get(File, copy_id)
+    children = db.query(File).filter(File.parent_id == copy_id).all()
+    assert [c.filename for c in children] == ["child.txt"]
+    assert Path(children[0].file_path).parent == Path(copied.file_path)
+    assert Path(children[0].file_path).read_bytes() == b"child"
+    
+    db.refresh(user)
+    assert user.used_space == used + len(b"child")
+
+
+def test_copy_removes_copied_files_when_commit_fails(db, user, upload, monkeypatch):
+    a = upload("a.txt", b"a")
+    root = Path(a.file_path).parent
+    
+    _fail_commit(db, monkeypatch)
+    with pytest.raises(CommitFailed):
+        BatchService(db).copy(user, [a.id], None)
+    monkeypatch.undo()
+    
+    assert sorted(p.name for p in root.iterdir()) == ["a.txt"]
+    assert db.query(File).filter(File.owner_id == user.id).count() == 1
+
+
+def test_copy_of_chunked_file_adds_chunk_refs(db, user, upload, workdir, monkeypatch):
+    root = workdir / "storage" / "chunks"
+    monkeypatch.setattr(settings, "CHUNK_STORE_PATH", str(root))
+    store = ChunkStore(str(root))
+    content = random.Random(1).randbytes(100_000)
+    a = upload("a.bin", content)
+    convert_file(db, store, a)
+    db.refresh(a)
+    
+    result = BatchService(db).copy(user, [a.id], None)
+    assert result["methods"] == {"dedup": 1}
+    copy = db.get(File, result["results"][0]["new_id"])
+    assert copy.is_chunked
+    assert {r.ref_count for r in db.query(ChunkRecord).all()} == {2}
+    
+    # 删除原文件并回收分块后，副本仍然完整可读
+    release_stored_file(db, Path(a.file_path))
+    db.delete(a)
+    db.commit()
+    store.collect_garbage(db)
+    with open_stored_file(copy) as f:
+        assert f.read() == content
@@ -0,0 +1,174 @@
+"""变更记录（增量同步游标）测试"""
+
+import pytest
+from fastapi import HTTPException
+
+from models import File, SyncRecord
+from changes import ChangeFeedService, CHANGE_COLUMNS, backfill_changes, compact_changes
+from file_handler import FileService
+from trash import TrashService
+
+
+def _changes(db, user, since=0, limit=1000) -> dict:
+    db.refresh(user)
+    return ChangeFeedService(db).list_changes(user, since, limit)
+
+
+def _by_id(result: dict) -> dict:
+    return {row[0]: dict(zip(CHANGE_COLUMNS, row)) for row in result["changes"]}
+
+
+def _full_sync(db, user, limit=1000):
+    """按页完成一次全量同步，返回（条目ID集合, 最终游标, 页数）"""
+    seen, cursor, pages = set(), 0, 0
+    while True:
+        result = _changes(db, user, cursor, limit)
+        assert not result["reset"]
+        seen |= {file_id for file_id, change in _by_id(result).items() if not change["deleted"]}
+        cursor = result["cursor"]
+        pages += 1
+        if not result["has_more"]:
+            return seen, cursor, pages
+        # 中间页的游标为字符串
+        assert isinstance(cursor, str)
+
+
+def test_full_sync_pages_through_all_files(db, user, upload):
+    ids = {upload(f"f{i}.txt", b"x").id for i in range(5)}
+    
+    seen, cursor, pages = _full_sync(db, user, limit=2)
+    assert seen == ids
+    assert pages == 3
+    # 没有新变更时游标不变
+    result = _changes(db, user, cursor)
+    assert result["changes"] == [] and result["cursor"] == cursor
+
+
+def test_incremental_changes_return_current_state(db, user, upload):
+    a = upload("a.txt", b"a")
+    b = upload("b.txt", b"b")
+    cursor = _changes(db, user)["cursor"]
+    
+    service = FileService(db)
+    service.rename_file(user, a.id, "renamed.txt")
+    service.rename_file(user, a.id, "renamed2.txt")
+    service.delete_file(user, b.id)
+    
+    result = _changes(db, user, cursor)
+    changes = _by_id(result)
+    assert set(changes) == {a.id, b.id}
+    assert changes[a.id]["filename"] == "renamed2.txt"
+    assert changes[a.id]["deleted"] is False
+    assert changes[b.id]["deleted"] is True
+    
+    # 全量同步不返回已删除的条目
+    assert set(_by_id(_changes(db, user))) == {a.id}
+
+
+def test_compaction_keeps_cursors_valid(db, user, upload):
+    a = upload("a.txt", b"a")
+    b = upload("b.txt", b"b")
+    cursor = _changes(db, user)["cursor"]
+    
+    service = FileService(db)
+    for i in range(3):
+        service.rename_file(user, a.id, f"a{i}.txt")
+    
+    stats = compact_changes(db)
+    assert stats["compacted"] >= 3
+    assert db.query(SyncRecord).filter(SyncRecord.file_id == a.id).count() == 1
+    
+    changes = _by_id(_changes(db, user, cursor))
+    assert set(changes) == {a.id}
+    assert changes[a.id]["filename"] == "a2.txt"
+    assert set(_by_id(_changes(db, user))) == {a.id, b.id}
+
+
+def test_purge_raises_horizon_and_resets_old_cursors(db, user, upload):
+    a = upload("a.txt", b"a")
+    old_cursor = _changes(db, user)["cursor"]
+    b = upload("b.txt", b"b")
+    
+    FileService(db).delete_file(user, b.id)
+    TrashService(db).delete_permanently(user, b.id)
+    db.refresh(user)
+    assert user.sync_horizon > old_cursor
+    
+    result = _changes(db, user, old_cursor)
+    assert result["reset"] is True
+    assert result["cursor"] == 0
+    
+    # 重新全量同步后，新游标不会再被重置
+    seen, cursor, _ = _full_sync(db, user)
+    assert seen == {a.id}
+    assert cursor >= user.sync_horizon
+    assert _changes(db, user, cursor)["reset"] is False
+
+
+def test_full_sync_after_purge_completes_across_pages(db, user, upload):
+    ids = {upload(f"f{i}.txt", b"x").id for i in range(5)}
+    b = upload("b.txt", b"b")
+    FileService(db).delete_file(user, b.id)
+    TrashService(db).delete_permanently(user, b.id)
+    db.refresh(user)
+    
+    # 中间页的游标早于sync_horizon，不能因此被要求重置
+    seen, cursor, pages = _full_sync(db, user, limit=2)
+    assert seen == ids
+    assert pages == 3
+    
+    c = upload("c.txt", b"c")
+    result = _changes(db, user, cursor)
+    assert result["reset"] is False
+    assert set(_by_id(result)) == {c.id}
+
+
+def test_purge_during_full_sync_resets(db, user, upload):
+    a_id = upload("a.txt", b"a").id
+    upload("b.txt", b"b")
+    upload("c.txt", b"c")
+    
+    first = _changes(db, user, 0, limit=1)
+    assert set(_by_id(first)) == {a_id}
+    
+    # 已返回的条目在同步期间被彻底删除，后续页中不再有它的记录，只能重新全量同步
+    FileService(db).delete_file(user, a_id)
+    TrashService(db).delete_permanently(user, a_id)
+    result = _changes(db, user, first["cursor"])
+    assert result["reset"] is True
+    
+    seen, _, _ = _full_sync(db, user, limit=1)
+    assert a_id not in seen
+
+
+def test_invalid_cursor_is_rejected(db, user):
+    for cursor in ("-1", "abc", "f1", "f1.-2"):
+        with pytest.raises(HTTPException) as exc:
+            _changes(db, user, cursor)
+        assert exc.value.status_code == 400
+
+
+def test_full_sync_returns_deletions_after_first_page(db, user, upload):
+    a = upload("a.txt", b"a")
+    upload("b.txt", b"b")
+    upload("c.txt", b"c")
+    
+    first = _changes(db, user, 0, limit=2)
+    assert first["has_more"]
+    assert a.id in _by_id(first)
+    
+    # 已返回的条目在同步期间被删除，后续页需要返回删除
+    FileService(db).delete_file(user, a.id)
+    rest = _by_id(_changes(db, user, first["cursor"]))
+    assert rest[a.id]["deleted"] is True
+
+
+def test_backfill_adds_records_for_untracked_files(db, user):
+    file = File(filename="imported.txt", file_path="/tmp/imported.txt", size=1, owner_id=user.id)
+    db.add(file)
+    db.commit()
+    assert _changes(db, user)["changes"] == []
+    
+    assert backfill_changes(db, user.id) == 1
+    assert set(_by_id(_changes(db, user))) == {file.id}
+    assert backfill_changes(db, user.id) == 0
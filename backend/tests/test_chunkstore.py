@@ -0,0 +1,126 @@
+"""分块去重存储测试"""
+
+import hashlib
+import io
+import random
+from pathlib import Path
+
+import pytest
+
+import chunkstore
+from config import settings
+from models import ChunkRecord, File
+from chunkstore import (
+    ChunkStore, convert_file, iter_chunks, open_stored_file, release_stored_file, run_chunk_store
+)
+
+MIN_SIZE, AVG_SIZE, MAX_SIZE = 1024, 4096, 16384
+
+
+@pytest.fixture(params=["python", "pyfastcdc"])
+def chunker(request, monkeypatch):
+    """分别使用纯Python实现和pyfastcdc（未安装时跳过）"""
+    if request.param == "python":
+        monkeypatch.setattr(chunkstore, "FastCDC", None)
+    elif chunkstore.FastCDC is None:
+        pytest.skip("未安装pyfastcdc")
+    monkeypatch.setattr(settings, "CHUNK_MIN_SIZE", MIN_SIZE)
+    monkeypatch.setattr(settings, "CHUNK_AVG_SIZE", AVG_SIZE)
+    monkeypatch.setattr(settings, "CHUNK_MAX_SIZE", MAX_SIZE)
+    assert chunkstore.chunker_name() == request.param
+    return request.param
+
+
+@pytest.fixture
+def store(workdir, monkeypatch) -> ChunkStore:
+    root = workdir / "storage" / "chunks"
+    monkeypatch.setattr(settings, "CHUNK_STORE_PATH", str(root))
+    return ChunkStore(str(root))
+
+
+def _random_bytes(size: int, seed: int) -> bytes:
+    return random.Random(seed).randbytes(size)
+
+
+def test_chunks_reassemble_within_bounds(chunker):
+    data = _random_bytes(200_000, 1)
+    chunks = list(iter_chunks(io.BytesIO(data)))
+    
+    assert b"".join(chunks) == data
+    assert all(len(c) <= MAX_SIZE for c in chunks)
+    assert all(len(c) >= MIN_SIZE for c in chunks[:-1])
+
+
+def test_insertion_only_changes_nearby_chunks(chunker):
+    data = _random_bytes(200_000, 2)
+    edited = data[:100_000] + b"inserted" + data[100_000:]
+    
+    before = {hashlib.sha256(c).digest() for c in iter_chunks(io.BytesIO(data))}
+    after = [hashlib.sha256(c).digest() for c in iter_chunks(io.BytesIO(edited))]
+    
+    assert len([c for c in after if c not in before]) <= 2
+
+
+def test_convert_read_release_and_gc(db, user, upload, store, chunker):
+    shared = _random_bytes(60_000, 3)
+    file_a = upload("a.bin", shared + _random_bytes(20_000, 4))
+    file_b = upload("b.bin", shared + _random_bytes(20_000, 5))
+    contents = {file_a.id: Path(file_a.file_path).read_bytes(), file_b.id: Path(file_b.file_path).read_bytes()}
+    
+    stats_a = convert_file(db, store, file_a)
+    stats_b = convert_file(db, store, file_b)
+    assert stats_a["new_chunks"] == stats_a["chunks"]
+    assert stats_b["new_bytes"] < file_b.size  # 共同的前缀已存在
+    
+    for file in (file_a, file_b):
+        db.refresh(file)
+        assert file.is_chunked
+        with open_stored_file(file) as f:
+            assert f.read() == contents[file.id]
+    
+    # 删除a后，只有a独有的分块被回收，b仍然完整可读
+    release_stored_file(db, Path(file_a.file_path))
+    db.delete(file_a)
+    db.commit()
+    gc_stats = store.collect_garbage(db)
+    assert gc_stats["chunks_removed"] > 0
+    with open_stored_file(file_b) as f:
+        assert f.read() == contents[file_b.id]
+    
+    release_stored_file(db, Path(file_b.file_path))
+    db.delete(file_b)
+    db.commit()
+    store.collect_garbage(db)
+    assert db.query(ChunkRecord).count() == 0
+    assert not any(p.is_file() for p in store.root.rglob("*"))
+
+
+def test_run_is_bounded_by_bytes(db, user, upload, store, chunker, monkeypatch):
+    monkeypatch.setattr(settings, "CHUNK_STORE_ENABLED", True)
+    monkeypatch.setattr(settings, "CHUNK_STORE_MIN_FILE_SIZE", 10_000)
+    monkeypatch.setattr(settings, "CHUNK_STORE_MAX_BYTES_PER_RUN", 70_000)
+    small = [upload(f"small{i}.bin", _random_bytes(30_000, 10 + i)) for i in range(3)]
+    too_large = upload("large.bin", _random_bytes(80_000, 20))
+    
+    stats = run_chunk_store(db)
+    assert stats["chunker"] == chunker
+    assert stats["files_converted"] == 2
+    assert stats["deferred"] == 1
+    
+    stats = run_chunk_store(db)
+    assert stats["files_converted"] == 1
+    
+    db.expire_all()
+    assert all(db.get(File, f.id).is_chunked for f in small)
+    assert not db.get(File, too_large.id).is_chunked
+
+
+def test_benchmark_reports_chunking_throughput(workdir, chunker):
+    path = workdir / "bench.bin"
+    path.write_bytes(_random_bytes(100_000, 30))
+    
+    report = chunkstore.benchmark([str(path)])
+    assert report["chunker"] == chunker
+    assert report["chunking_mb_s"] > 0
+    assert report["cdc_mb_s"] > 0
+    assert report["max_run_seconds"] > 0
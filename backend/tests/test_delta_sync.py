@@ -0,0 +1,135 @@
+"""增量同步测试"""
+
+import hashlib
+import io
+import threading
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException
+
+from models import SessionLocal, User, File
+from delta_sync import DeltaSyncService, compute_delta, TEMP_PREFIX
+
+BLOCK_SIZE = 1024
+
+
+def _old_content() -> bytes:
+    return bytes(range(256)) * 64
+
+
+def _leftover_temp_files(file: File) -> list:
+    return [p.name for p in Path(file.file_path).parent.iterdir() if p.name.startswith(TEMP_PREFIX)]
+
+
+def _delta(db, user, file, new_content: bytes):
+    signature = DeltaSyncService(db).get_signature(user, file.id, BLOCK_SIZE)
+    return compute_delta(signature, io.BytesIO(new_content))
+
+
+def test_apply_delta_roundtrip(db, user, upload):
+    old = _old_content()
+    new = old[:5000] + b"inserted" + old[5000:]
+    file = upload("data.bin", old)
+    
+    instructions, literal = _delta(db, user, file, new)
+    assert any(i[0] == "copy" for i in instructions)
+    assert len(literal) < len(new)
+    
+    updated = DeltaSyncService(db).apply_delta(
+        user, file.id, file.md5_hash, BLOCK_SIZE, instructions, io.BytesIO(literal),
+        target_md5=hashlib.md5(new).hexdigest()
+    )
+    
+    assert Path(updated.file_path).read_bytes() == new
+    assert updated.size == len(new)
+    assert updated.md5_hash == hashlib.md5(new).hexdigest()
+    assert user.used_space == len(new)
+    assert _leftover_temp_files(updated) == []
+
+
+def test_stale_base_is_rejected(db, user, upload):
+    file = upload("data.bin", _old_content())
+    instructions, literal = _delta(db, user, file, b"new")
+    
+    with pytest.raises(HTTPException) as exc:
+        DeltaSyncService(db).apply_delta(user, file.id, "0" * 32, BLOCK_SIZE, instructions, io.BytesIO(literal))
+    assert exc.value.status_code == 409
+
+
+class _BlockingStream(io.BytesIO):
+    """读到一半后等待，模拟仍在上传中的请求"""
+    
+    def __init__(self, data: bytes, reading: threading.Event, resume: threading.Event):
+        super().__init__(data)
+        self.reading = reading
+        self.resume = resume
+    
+    def read(self, size=-1):
+        if self.tell() > 0 and not self.resume.is_set():
+            self.reading.set()
+            self.resume.wait(10)
+        return super().read(min(size, 100) if size and size > 0 else 100)
+
+
+def test_concurrent_deltas_to_same_file(db, user, upload):
+    old = _old_content()
+    file = upload("data.bin", old)
+    new_a = b"A" * 3000 + old
+    new_b = old + b"B" * 3000
+    delta_a = _delta(db, user, file, new_a)
+    delta_b = _delta(db, user, file, new_b)
+    
+    reading, resume = threading.Event(), threading.Event()
+    errors = []
+    
+    def slow_upload():
+        session = SessionLocal()
+        try:
+            DeltaSyncService(session).apply_delta(
+                session.get(User, user.id), file.id, file.md5_hash, BLOCK_SIZE,
+                delta_a[0], _BlockingStream(delta_a[1], reading, resume)
+            )
+        except HTTPException as e:
+            errors.append(e.status_code)
+        finally:
+            session.close()
+    
+    thread = threading.Thread(target=slow_upload)
+    thread.start()
+    assert reading.wait(10)
+    
+    # 第一个请求还在写临时文件时，第二个请求完成
+    DeltaSyncService(db).apply_delta(user, file.id, file.md5_hash, BLOCK_SIZE, delta_b[0], io.BytesIO(delta_b[1]))
+    resume.set()
+    thread.join(10)
+    
+    assert errors == [409]
+    db.expire_all()
+    file = db.get(File, file.id)
+    content = Path(file.file_path).read_bytes()
+    assert content == new_b
+    assert file.md5_hash == hashlib.md5(content).hexdigest()
+    assert _leftover_temp_files(file) == []
+
+
+def test_commit_failure_keeps_old_version(db, user, upload, monkeypatch):
+    old = _old_content()
+    file = upload("data.bin", old)
+    old_md5 = file.md5_hash
+    instructions, literal = _delta(db, user, file, old + b"tail")
+    
+    def failing_commit():
+        raise RuntimeError("disk I/O error")
+    
+    monkeypatch.setattr(db, "commit", failing_commit)
+    with pytest.raises(RuntimeError):
+        DeltaSyncService(db).apply_delta(user, file.id, old_md5, BLOCK_SIZE, instructions, io.BytesIO(literal))
+    monkeypatch.undo()
+    
+    db.expire_all()
+    file = db.get(File, file.id)
+    assert file.md5_hash == old_md5
+    assert file.size == len(old)
+    assert Path(file.file_path).read_bytes() == old
+    assert _leftover_temp_files(file) == []
@@ -0,0 +1,125 @@
+"""批量导入测试"""
+
+import hashlib
+import os
+from pathlib import Path
+
+import pytest
+
+import importer
+from models import File
+from importer import import_directory, TEMP_PREFIX
+from volumes import volumes
+
+
+def _md5(data: bytes) -> str:
+    return hashlib.md5(data).hexdigest()
+
+
+def _imported(db, user) -> dict:
+    """按原始文件名索引导入的文件记录"""
+    rows = db.query(File).filter(File.owner_id == user.id, File.is_folder == False).all()
+    return {f.original_filename: f for f in rows}
+
+
+@pytest.fixture
+def source(tmp_path) -> Path:
+    path = tmp_path / "source"
+    path.mkdir()
+    return path
+
+
+def test_sanitized_name_collision_in_one_batch(db, user, source):
+    (source / "a..b.txt").write_bytes(b"first")
+    (source / "a_b.txt").write_bytes(b"second")
+    (source / "sub").mkdir()
+    (source / "sub" / "x..y.txt").write_bytes(b"third")
+    (source / "sub" / "x_y.txt").write_bytes(b"fourth")
+    
+    stats = import_directory(db, user, str(source), workers=1)
+    
+    assert stats["files_imported"] == 4
+    files = _imported(db, user)
+    assert len({f.file_path for f in files.values()}) == 4
+    for name, content in [("a..b.txt", b"first"), ("a_b.txt", b"second"),
+                          ("x..y.txt", b"third"), ("x_y.txt", b"fourth")]:
+        assert Path(files[name].file_path).read_bytes() == content
+        assert files[name].md5_hash == _md5(content)
+    assert user.used_space == len(b"firstsecondthirdfourth")
+
+
+def test_collision_with_existing_file(db, user, source, upload):
+    upload("a_b.txt", b"uploaded")
+    (source / "a..b.txt").write_bytes(b"imported")
+    
+    import_directory(db, user, str(source), workers=1)
+    
+    files = _imported(db, user)
+    assert Path(files["a_b.txt"].file_path).read_bytes() == b"uploaded"
+    assert Path(files["a..b.txt"].file_path).read_bytes() == b"imported"
+    assert files["a..b.txt"].filename == "a_b_1.txt"
+
+
+def test_same_name_file_is_not_mistaken_for_imported(db, user, source, upload):
+    upload("a.txt", b"uploaded")
+    (source / "a.txt").write_bytes(b"different content")
+    
+    stats = import_directory(db, user, str(source), workers=1)
+    assert stats["files_imported"] == 1
+    assert stats["files_skipped"] == 0
+    
+    rows = db.query(File).filter(File.owner_id == user.id, File.original_filename == "a.txt").all()
+    contents = {f.filename: Path(f.file_path).read_bytes() for f in rows}
+    assert contents == {"a.txt": b"uploaded", "a_1.txt": b"different content"}
+    
+    # 再次执行时识别出改名导入的文件，不会重复导入
+    stats = import_directory(db, user, str(source), workers=1)
+    assert stats["files_imported"] == 0
+    assert stats["files_skipped"] == 1
+
+
+def test_resume_after_interrupted_rename(db, user, source, monkeypatch):
+    for i in range(5):
+        (source / f"file{i}.txt").write_bytes(f"content {i}".encode())
+    
+    real_replace = os.replace
+    calls = []
+    
+    def crash_on_second_rename(src, dst):
+        calls.append(dst)
+        if len(calls) == 2:
+            raise OSError("simulated crash")
+        return real_replace(src, dst)
+    
+    # 记录已提交、部分临时文件尚未重命名时中断
+    monkeypatch.setattr(importer.os, "replace", crash_on_second_rename)
+    with pytest.raises(OSError):
+        import_directory(db, user, str(source), workers=1, batch_size=5)
+    monkeypatch.undo()
+    
+    stats = import_directory(db, user, str(source), workers=1, batch_size=5)
+    
+    assert stats["files_imported"] == 0
+    assert stats["files_skipped"] == 5
+    files = _imported(db, user)
+    assert len(files) == 5
+    for i in range(5):
+        assert Path(files[f"file{i}.txt"].file_path).read_bytes() == f"content {i}".encode()
+    root = volumes.user_root(volumes.find(None), user.id)
+    assert not [p for p in os.listdir(root) if p.startswith(TEMP_PREFIX)]
+
+
+def test_move_resume_uses_leftover_temp_files(db, user, source):
+    # 上次移动模式在提交前中断：源文件已移到临时文件，记录尚未写入
+    root = volumes.user_root(volumes.find(None), user.id)
+    root.mkdir(parents=True, exist_ok=True)
+    (root / f"{TEMP_PREFIX}a_b.txt").write_bytes(b"moved earlier")
+    (source / "a..b.txt").write_bytes(b"new file")
+    
+    stats = import_directory(db, user, str(source), mode="move", workers=1)
+    
+    assert stats["files_imported"] == 2
+    files = _imported(db, user)
+    assert Path(files["a_b.txt"].file_path).read_bytes() == b"moved earlier"
+    assert Path(files["a..b.txt"].file_path).read_bytes() == b"new file"
+    assert not (source / "a..b.txt").exists()
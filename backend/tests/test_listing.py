@@ -0,0 +1,98 @@
+"""文件列表ETag/304测试"""
+
+import pytest
+from fastapi.testclient import TestClient
+
+import listing
+from auth import get_current_user
+from file_handler import FileService
+from listing import cached_listing, listing_cache, listing_etag
+
+
+@pytest.fixture
+def client(user):
+    from main import app
+    app.dependency_overrides[get_current_user] = lambda: user
+    yield TestClient(app)
+    app.dependency_overrides.pop(get_current_user, None)
+
+
+def _etag(client, parent_id=None, **params) -> str:
+    if parent_id is not None:
+        params["parent_id"] = parent_id
+    response = client.get("/api/files/list", params=params)
+    assert response.status_code == 200
+    return response.headers["ETag"]
+
+
+def test_unchanged_folder_returns_304(client, upload):
+    upload("a.txt", b"a")
+    response = client.get("/api/files/list")
+    etag = response.headers["ETag"]
+    assert [f["filename"] for f in response.json()["files"]] == ["a.txt"]
+    
+    response = client.get("/api/files/list", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["ETag"] == etag
+    
+    # 影响响应内容的参数不同，ETag也不同
+    assert _etag(client, fields="id") != etag
+    assert _etag(client, format="compact") != etag
+
+
+def test_changes_bump_folder_versions(db, user, client, upload):
+    service = FileService(db)
+    source = service.create_folder(user, "source")
+    target = service.create_folder(user, "target")
+    other = service.create_folder(user, "other")
+    
+    other_etag = _etag(client, other.id)
+    etag = _etag(client, source.id)
+    a = upload("a.txt", b"a", source.id)
+    assert _etag(client, source.id) != etag
+    
+    etags = {f: _etag(client, f) for f in (source.id, target.id)}
+    service.move_file(user, a.id, target.id)
+    assert _etag(client, source.id) != etags[source.id]
+    assert _etag(client, target.id) != etags[target.id]
+    
+    etag = _etag(client, target.id)
+    service.rename_file(user, a.id, "b.txt")
+    assert _etag(client, target.id) != etag
+    
+    etag = _etag(client, target.id)
+    service.delete_file(user, a.id)
+    assert _etag(client, target.id) != etag
+    
+    # 无关的文件夹版本不变
+    assert _etag(client, other.id) == other_etag
+
+
+def test_listing_served_from_cache(db, user, upload, monkeypatch):
+    upload("a.txt", b"a")
+    query = FileService(db).list_query(user)
+    fields = ["id", "filename"]
+    first = cached_listing(db, query, user, None, [None, None], fields, "objects")
+    
+    def render(*args):
+        raise AssertionError("未变化的文件夹应直接使用缓存")
+    monkeypatch.setattr(listing, "render_listing", render)
+    second = cached_listing(db, query, user, None, [None, None], fields, "objects")
+    assert second.body == first.body
+    assert second.headers["ETag"] == first.headers["ETag"]
+
+
+def test_listing_changed_during_query_is_not_cached(db, user, upload, monkeypatch):
+    upload("a.txt", b"a")
+    query = FileService(db).list_query(user)
+    fields = ["id", "filename"]
+    
+    # 查询前后读取到的版本号不同（查询期间有新上传）
+    versions = iter([1, 2])
+    monkeypatch.setattr(listing, "folder_version", lambda db, user, parent_id: next(versions))
+    response = cached_listing(db, query, user, None, [None, None], fields, "objects")
+    
+    assert response.status_code == 200
+    assert "ETag" not in response.headers
+    assert listing_cache.get(listing_etag(user, None, 1, None, None, fields, "objects")) is None
@@ -0,0 +1,44 @@
+"""清单比对测试"""
+
+import gzip
+import hashlib
+import io
+import json
+
+from file_handler import FileService
+from manifest_diff import ManifestDiffService
+
+
+def _manifest(*entries, compress=False) -> io.BytesIO:
+    data = "\n".join(json.dumps(e) for e in entries).encode()
+    return io.BytesIO(gzip.compress(data) if compress else data)
+
+
+def _entry(path: str, content: bytes) -> list:
+    return [path, len(content), 0, hashlib.md5(content).hexdigest()]
+
+
+def test_diff_classifies_entries(db, user, upload):
+    folder = FileService(db).create_folder(user, "docs")
+    same = upload("same.txt", b"same", folder.id)
+    stale = upload("stale.txt", b"old", folder.id)
+    gone = upload("gone.txt", b"gone", folder.id)
+    source = upload("source.txt", b"shared")
+    
+    result = ManifestDiffService(db).diff(user, folder.id, _manifest(
+        _entry("same.txt", b"same"),
+        _entry("copy.txt", b"shared"),
+        _entry("stale.txt", b"shared"),
+        _entry("new/file.txt", b"brand new"),
+        compress=True,
+    ))
+    
+    assert result["present"] == [["same.txt", same.id]]
+    assert result["upload"] == [["new/file.txt", None]]
+    assert result["delete_candidates"] == [["gone.txt", gone.id]]
+    assert result["create_folders"] == ["new"]
+    # 同路径已有不同内容时返回被覆盖的文件ID，客户端据此替换而不是复制出重名文件
+    assert sorted(result["deduplicable"]) == [
+        ["copy.txt", source.id, None],
+        ["stale.txt", source.id, stale.id],
+    ]
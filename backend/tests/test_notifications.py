@@ -0,0 +1,51 @@
+"""变更推送测试"""
+
+import asyncio
+import json
+
+from batch_ops import BatchService
+from file_handler import FileService
+from notifications import ChangeNotifier
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.messages = []
+    
+    async def send_text(self, text: str):
+        self.messages.append(json.loads(text))
+
+
+def _poll_events(notifier: ChangeNotifier, action) -> list:
+    """执行操作前后各轮询一次，返回推送的事件"""
+    async def run():
+        await notifier.poll()
+        action()
+        await notifier.poll()
+    
+    websocket = next(iter(next(iter(notifier._connections.values()))))
+    websocket.messages.clear()
+    asyncio.run(run())
+    return [event for message in websocket.messages for event in message["events"]]
+
+
+def test_move_events_carry_source_parent(db, user, upload):
+    service = FileService(db)
+    source = service.create_folder(user, "source")
+    target = service.create_folder(user, "target")
+    a = upload("a.txt", b"a", source.id)
+    b = upload("b.txt", b"b", source.id)
+    
+    notifier = ChangeNotifier(poll_interval=0)
+    notifier._connections[user.id] = {FakeWebSocket()}
+    
+    events = _poll_events(notifier, lambda: service.move_file(user, a.id, target.id))
+    assert [(e[1], e[2], e[3], e[5]) for e in events] == [(a.id, "moved", target.id, source.id)]
+    
+    # 批量移动同样带原父文件夹（移回根目录）
+    events = _poll_events(notifier, lambda: BatchService(db).move(user, [a.id, b.id], None))
+    assert sorted((e[1], e[3], e[5]) for e in events) == [(a.id, None, target.id), (b.id, None, source.id)]
+    
+    # 其他事件没有原父文件夹
+    events = _poll_events(notifier, lambda: service.rename_file(user, a.id, "c.txt"))
+    assert [(e[2], e[5]) for e in events] == [("updated", None)]
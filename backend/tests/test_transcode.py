@@ -0,0 +1,69 @@
+"""HLS转码队列测试（使用StubHlsEncoder，不需要ffmpeg）"""
+
+import pytest
+
+from models import TranscodeJob
+from config import settings
+from transcode import (
+    PLAYLIST_NAME, StubHlsEncoder, TranscodeService, get_encoder, render_playlist, run_transcode_queue
+)
+
+
+@pytest.fixture(autouse=True)
+def stub_encoder(monkeypatch):
+    monkeypatch.setattr(settings, "HLS_ENABLED", True)
+    monkeypatch.setattr(settings, "HLS_ENCODER", "stub")
+    monkeypatch.setattr(settings, "HLS_RENDITIONS", "720p,480p")
+    monkeypatch.setattr(StubHlsEncoder, "segment_size", 1000)
+
+
+def test_transcode_queue_produces_playlists(db, user, upload):
+    content = bytes(range(256)) * 10
+    video = upload("clip.mp4", content)
+    service = TranscodeService(db)
+    assert isinstance(get_encoder(), StubHlsEncoder)
+    
+    status = service.request(user, video.id)
+    assert [r["rendition"] for r in status["renditions"]] == ["480p", "720p"]
+    assert not status["ready"]
+    
+    stats = run_transcode_queue(db)
+    assert stats["completed"] == 2 and stats["failed"] == 0
+    assert service.get_status(user, video.id)["ready"]
+    
+    master = service.master_playlist(user, video.id, "abc")
+    assert f"480p/{PLAYLIST_NAME}?token=abc" in master
+    assert master.index("480p") < master.index("720p")
+    
+    playlist = service.rendition_file(user, video.id, "480p", PLAYLIST_NAME)
+    segments = [line for line in playlist.read_text().splitlines() if line and not line.startswith("#")]
+    assert len(segments) == 3
+    data = b"".join(service.rendition_file(user, video.id, "480p", name).read_bytes() for name in segments)
+    assert data == content
+    assert all(line.endswith("?token=t") for line in render_playlist(playlist, "t").splitlines()
+               if line and not line.startswith("#"))
+    
+    # 已完成的版本不会重复排队
+    service.request(user, video.id)
+    assert run_transcode_queue(db)["completed"] == 0
+
+
+def test_failed_job_is_requeued_on_request(db, user, upload, monkeypatch):
+    video = upload("clip.mp4", b"video")
+    service = TranscodeService(db)
+    service.request(user, video.id, ["480p"])
+    
+    encode = StubHlsEncoder.encode
+    
+    def fail(self, source, output_dir, rendition):
+        raise RuntimeError("encoder crashed")
+    monkeypatch.setattr(StubHlsEncoder, "encode", fail)
+    assert run_transcode_queue(db)["failed"] == 1
+    job = db.query(TranscodeJob).one()
+    assert job.status == "failed" and "encoder crashed" in job.error
+    
+    monkeypatch.setattr(StubHlsEncoder, "encode", encode)
+    service.request(user, video.id, ["480p"])
+    assert run_transcode_queue(db)["completed"] == 1
+    db.refresh(job)
+    assert job.status == "completed" and job.error is None
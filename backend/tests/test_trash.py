@@ -0,0 +1,64 @@
+"""回收站清理测试"""
+
+import random
+from pathlib import Path
+
+from models import ChunkRecord, PurgeItem
+from config import settings
+from chunkstore import ChunkStore, convert_file
+from file_handler import FileService
+from trash import TrashService, run_trash_purge
+
+
+def _fail_unlink(monkeypatch, path: str):
+    unlink = Path.unlink
+    
+    def fail(self, *args, **kwargs):
+        if str(self) == path:
+            raise PermissionError("file is busy")
+        return unlink(self, *args, **kwargs)
+    monkeypatch.setattr(Path, "unlink", fail)
+
+
+def test_failed_unlink_is_retried(db, user, upload, workdir, monkeypatch):
+    root = workdir / "storage" / "chunks"
+    monkeypatch.setattr(settings, "CHUNK_STORE_PATH", str(root))
+    a = upload("a.bin", random.Random(1).randbytes(100_000))
+    convert_file(db, ChunkStore(str(root)), a)
+    b = upload("b.txt", b"b")
+    for file in (a, b):
+        FileService(db).delete_file(user, file.id)
+    db.refresh(a)
+    path = a.file_path
+    for file in (a, b):
+        TrashService(db).delete_permanently(user, file.id)
+    
+    _fail_unlink(monkeypatch, path)
+    stats = run_trash_purge(db)
+    assert stats["files_removed"] == 1 and stats["files_failed"] == 1
+    item = db.query(PurgeItem).one()
+    assert item.file_path == path and item.attempts == 1
+    assert Path(path).exists()
+    # 分块引用已释放，不等待清单删除成功
+    assert {r.ref_count for r in db.query(ChunkRecord).all()} == {0}
+    
+    monkeypatch.undo()
+    stats = run_trash_purge(db)
+    assert stats["files_removed"] == 1 and stats["files_failed"] == 0
+    assert db.query(PurgeItem).count() == 0
+    assert not Path(path).exists()
+    # 重试时不会重复释放分块引用
+    assert {r.ref_count for r in db.query(ChunkRecord).all()} == {0}
+
+
+def test_missing_file_leaves_queue(db, user, upload):
+    a = upload("a.txt", b"a")
+    FileService(db).delete_file(user, a.id)
+    db.refresh(a)
+    path = Path(a.file_path)
+    TrashService(db).delete_permanently(user, a.id)
+    path.unlink()
+    
+    stats = run_trash_purge(db)
+    assert stats["files_removed"] == 0 and stats["files_failed"] == 0
+    assert db.query(PurgeItem).count() == 0
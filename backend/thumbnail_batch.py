@@ -0,0 +1,239 @@
+"""
+批量缩略图模块
+网格视图一次获取一页的全部缩略图，代替每个文件一次预览请求（每次都要校验token、查询用户和文件）：
+- bundle: 二进制打包，格式为 4字节大端索引长度 + JSON索引 + 依次拼接的JPEG数据，
+  索引为 {"文件ID": [偏移, 长度], ...}（偏移从数据区开始计算）
+- sprite: 所有缩略图拼成一张图集，返回图集地址和每个文件在图集中的位置 [x, y, 宽, 高]
+
+图集按（用户, 所在文件夹, 条目ID和内容MD5）生成内容摘要并缓存在临时目录：
+文件夹中的条目增删或内容变化后摘要随之改变，不会返回过期图集；
+同一文件夹生成新图集时，与其包含相同条目的旧图集已被取代，一并删除。
+缓存命中时更新修改时间，长期未使用的图集由临时文件清理任务删除。
+"""
+
+import hashlib
+import io
+import json
+import math
+import os
+import re
+import struct
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, status
+from PIL import Image
+from pydantic import BaseModel
+from sqlalchemy.orm import Session
+
+from models import User, File
+from config import settings
+from file_handler import FileManager, chunked
+from derivative_cache import derivative_cache, THUMBNAIL_RENDITION
+from media import POSTER_RENDITION
+
+
+# 单次请求的最大文件数
+MAX_BATCH_SIZE = 200
+
+# 图集每行最多的缩略图数
+SPRITE_MAX_COLUMNS = 10
+
+SPRITE_KEY_PATTERN = re.compile(r"^[0-9a-f]{40}$")
+
+
+class ThumbnailBatchRequest(BaseModel):
+    """批量缩略图请求"""
+    file_ids: List[int]
+
+
+def _thumbnail(file: Optional[File]) -> Optional[Path]:
+    """图片缩略图（缺少时重新生成）、视频封面或文档第1页缩略图"""
+    if file is None or not file.md5_hash:
+        return None
+    if file.category == "image" and not file.is_chunked:
+        return FileManager.ensure_thumbnail(Path(file.file_path), file.md5_hash)
+    if file.category == "video":
+        return derivative_cache.lookup(file.md5_hash, POSTER_RENDITION)
+    if file.category == "document" and file.media_status == "rendered":
+        return derivative_cache.lookup(file.md5_hash, THUMBNAIL_RENDITION)
+    return None
+
+
+class ThumbnailBatchService:
+    """批量缩略图服务"""
+    
+    def __init__(self, db: Session):
+        self.db = db
+    
+    def _sprite_dir(self, user: User) -> Path:
+        return Path(settings.TEMP_PATH) / "sprites" / str(user.id)
+    
+    def _load(self, user: User, file_ids: List[int]) -> Tuple[List[Tuple[File, Path]], List[int]]:
+        """
+        批量读取缩略图（图片缺少缩略图时重新生成）
+        
+        Returns:
+            ([(文件, 缩略图路径), ...] 按请求顺序, 没有缩略图的文件ID列表)
+        """
+        ids = list(dict.fromkeys(file_ids))
+        if not ids:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="未选择任何文件"
+            )
+        if len(ids) > MAX_BATCH_SIZE:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"单次最多获取{MAX_BATCH_SIZE}个缩略图"
+            )
+        
+        files: Dict[int, File] = {}
+        for batch in chunked(ids):
+            for file in self.db.query(File).filter(
+                File.id.in_(batch),
+                File.owner_id == user.id,
+                File.is_deleted == False,
+                File.is_folder == False
+            ).all():
+                files[file.id] = file
+        
+        found, missing = [], []
+        for file_id in ids:
+            file = files.get(file_id)
+            path = _thumbnail(file)
+            if path is not None:
+                found.append((file, path))
+            else:
+                missing.append(file_id)
+        
+        return found, missing
+    
+    def bundle(self, user: User, file_ids: List[int]) -> bytes:
+        """
+        把缩略图打包为一个二进制响应
+        
+        Args:
+            user: 用户对象
+            file_ids: 文件ID列表
+        
+        Returns:
+            4字节大端索引长度 + JSON索引 + JPEG数据
+        """
+        found, missing = self._load(user, file_ids)
+        
+        index: Dict[str, list] = {}
+        body = io.BytesIO()
+        for file, path in found:
+            try:
+                data = path.read_bytes()
+            except OSError:
+                # 读取前恰好被缓存淘汰
+                missing.append(file.id)
+                continue
+            index[str(file.id)] = [body.tell(), len(data)]
+            body.write(data)
+        
+        header = json.dumps({"items": index, "missing": missing}).encode()
+        return struct.pack(">I", len(header)) + header + body.getvalue()
+    
+    def sprite(self, user: User, file_ids: List[int]) -> dict:
+        """
+        获取（必要时生成）缩略图图集
+        
+        Args:
+            user: 用户对象
+            file_ids: 文件ID列表（通常为文件夹中的一页）
+        
+        Returns:
+            {"key", "url", "width", "height", "items": {"文件ID": [x, y, 宽, 高]}, "missing"}
+        """
+        found, missing = self._load(user, file_ids)
+        if not found:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="没有可用的缩略图"
+            )
+        
+        folders = {file.parent_id for file, _ in found}
+        folder_id = folders.pop() if len(folders) == 1 else None
+        digest = hashlib.sha1(json.dumps([
+            user.id, folder_id, settings.THUMBNAIL_SIZE,
+            [[file.id, file.md5_hash] for file, _ in found]
+        ]).encode())
+        key = digest.hexdigest()
+        
+        sprite_dir = self._sprite_dir(user)
+        image_path = sprite_dir / f"{key}.jpg"
+        map_path = sprite_dir / f"{key}.json"
+        if image_path.exists() and map_path.exists():
+            os.utime(image_path)
+            os.utime(map_path)
+            return {**json.loads(map_path.read_text()), "missing": missing}
+        
+        layout = self._render(found, image_path)
+        layout = {"key": key, "url": f"/api/files/thumbnails/sprite/{key}", "folder_id": folder_id, **layout}
+        self._remove_superseded(sprite_dir, folder_id, set(layout["items"]), key)
+        map_path.write_text(json.dumps(layout))
+        
+        return {**layout, "missing": missing}
+    
+    def _render(self, found: List[Tuple[File, Path]], image_path: Path) -> dict:
+        """把缩略图按网格拼成图集（每格为缩略图的最大尺寸，缩略图放在格子左上角）"""
+        cell_width, cell_height = settings.THUMBNAIL_SIZE
+        columns = min(SPRITE_MAX_COLUMNS, math.ceil(math.sqrt(len(found))))
+        rows = math.ceil(len(found) / columns)
+        width, height = columns * cell_width, rows * cell_height
+        
+        items: Dict[str, list] = {}
+        with Image.new("RGB", (width, height), (255, 255, 255)) as sprite:
+            for index, (file, path) in enumerate(found):
+                x = (index % columns) * cell_width
+                y = (index // columns) * cell_height
+                try:
+                    with Image.open(path) as thumb:
+                        thumb.thumbnail((cell_width, cell_height))
+                        sprite.paste(thumb.convert("RGB"), (x, y))
+                        items[str(file.id)] = [x, y, thumb.width, thumb.height]
+                except OSError as e:
+                    print(f"[THUMBNAIL] 读取缩略图失败 {path}: {e}")
+            
+            image_path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = image_path.with_name(f".tmp-{image_path.name}")
+            sprite.save(temp_path, "JPEG", quality=80, optimize=True)
+            os.replace(temp_path, image_path)
+        
+        return {"width": width, "height": height, "items": items}
+    
+    @staticmethod
+    def _remove_superseded(sprite_dir: Path, folder_id: Optional[int], item_ids: set, key: str):
+        """删除同一文件夹中与新图集包含相同条目的旧图集"""
+        for map_path in sprite_dir.glob("*.json"):
+            if map_path.stem == key:
+                continue
+            try:
+                layout = json.loads(map_path.read_text())
+            except (OSError, ValueError):
+                continue
+            if layout.get("folder_id") == folder_id and item_ids & set(layout.get("items", {})):
+                map_path.unlink(missing_ok=True)
+                (sprite_dir / f"{map_path.stem}.jpg").unlink(missing_ok=True)
+    
+    def sprite_image(self, user: User, key: str) -> Path:
+        """
+        获取已生成的图集图片
+        
+        Args:
+            user: 用户对象
+            key: 图集标识
+        
+        Returns:
+            图片路径
+        """
+        path = self._sprite_dir(user) / f"{key}.jpg"
+        if not SPRITE_KEY_PATTERN.match(key) or not path.exists():
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="图集不存在或已过期"
+            )
+        return path
@@ -0,0 +1,288 @@
+"""
+冷热分层模块
+根据访问频率在热存储（SD卡/SSD）与冷存储（USB机械硬盘）之间迁移文件
+
+- 下载、预览时记录访问次数与最后访问时间（先在内存中累计，定期批量写入数据库）
+- 长时间未访问的大文件（如旧视频）降级到冷存储卷
+- 近期被频繁访问的较小文件升级到热存储卷
+
+迁移采用“复制-校验-切换”：先复制到目标卷上的临时文件并校验MD5，
+再按原路径条件更新文件记录（期间被移动、重命名或删除的文件放弃迁移），
+原文件进入物理清理队列延后删除，正在读取原文件的请求不受影响。
+"""
+
+import hashlib
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func, or_
+from sqlalchemy.orm import Session
+
+from models import File, PurgeItem, SessionLocal
+from config import settings
+from maintenance import scheduler
+from volumes import volumes, StorageVolume, DEFAULT_VOLUME, TIER_HOT, TIER_COLD
+
+
+# 迁移临时文件前缀（以“.”开头，一致性检查和列表都会忽略）
+TEMP_PREFIX = ".tiering-"
+
+# 复制时的读写块大小
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class AccessTracker:
+    """文件访问统计（内存累计，按间隔批量写入数据库，避免每次访问都写SD卡）"""
+    
+    def __init__(self, flush_interval: int):
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pending: Dict[int, Tuple[int, datetime]] = {}
+        self._last_flush = time.monotonic()
+    
+    def record(self, file_id: int):
+        """
+        记录一次访问
+        
+        Args:
+            file_id: 文件ID
+        """
+        now = datetime.utcnow()
+        with self._lock:
+            count, _ = self._pending.get(file_id, (0, now))
+            self._pending[file_id] = (count + 1, now)
+            due = time.monotonic() - self._last_flush >= self.flush_interval
+            if due:
+                self._last_flush = time.monotonic()
+        
+        if due:
+            self.flush()
+    
+    def flush(self) -> int:
+        """
+        将累计的访问统计写入数据库
+        
+        Returns:
+            更新的文件数
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        
+        if not pending:
+            return 0
+        
+        db = SessionLocal()
+        try:
+            for file_id, (count, last_accessed_at) in pending.items():
+                db.query(File).filter(File.id == file_id).update(
+                    {
+                        File.access_count: func.coalesce(File.access_count, 0) + count,
+                        File.last_accessed_at: last_accessed_at,
+                        File.updated_at: File.updated_at,
+                    },
+                    synchronize_session=False
+                )
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"[TIERING] 写入访问统计失败: {e}")
+            return 0
+        finally:
+            db.close()
+        
+        return len(pending)
+
+
+# 全局访问统计实例
+access_tracker = AccessTracker(settings.ACCESS_FLUSH_INTERVAL)
+
+
+def _volume_filter(tier_volumes: List[StorageVolume]):
+    """按存储卷过滤文件记录（volume为空的历史记录属于默认卷）"""
+    names = [v.name for v in tier_volumes]
+    if DEFAULT_VOLUME in names:
+        return or_(File.volume.in_(names), File.volume == None)
+    return File.volume.in_(names)
+
+
+def _pick_target(candidates: List[StorageVolume], size: int) -> Optional[StorageVolume]:
+    """在同一层级的卷中选择剩余空间最多且能容纳该文件的卷"""
+    usable = [v for v in candidates if v.has_space_for(size)]
+    if not usable:
+        return None
+    return max(usable, key=lambda v: v.free_bytes())
+
+
+def _copy_with_md5(source: Path, destination: Path) -> str:
+    """复制文件并落盘，返回读取源文件时计算的MD5"""
+    md5_hash = hashlib.md5()
+    
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        while chunk := src.read(COPY_CHUNK_SIZE):
+            md5_hash.update(chunk)
+            dst.write(chunk)
+        dst.flush()
+        os.fsync(dst.fileno())
+    
+    shutil.copystat(source, destination)
+    return md5_hash.hexdigest()
+
+
+def _file_md5(path: Path) -> str:
+    md5_hash = hashlib.md5()
+    with open(path, "rb") as f:
+        while chunk := f.read(COPY_CHUNK_SIZE):
+            md5_hash.update(chunk)
+    return md5_hash.hexdigest()
+
+
+def migrate_file(db: Session, file: File, target: StorageVolume) -> bool:
+    """
+    将文件迁移到目标存储卷（复制-校验-切换）
+    
+    Args:
+        db: 数据库会话
+        file: 文件对象
+        target: 目标存储卷
+    
+    Returns:
+        是否迁移成功
+    """
+    source = Path(file.file_path)
+    if not source.is_file():
+        return False
+    
+    target_dir = volumes.path_on(target, source.parent)
+    target_dir.mkdir(parents=True, exist_ok=True)
+    destination = target_dir / source.name
+    
+    # 目标位置只允许是等待清理的旧副本（例如刚降级又被升级回来的文件）
+    pending_purge = db.query(PurgeItem).filter(PurgeItem.file_path == str(destination))
+    if destination.exists() and not pending_purge.first():
+        return False
+    
+    temp_path = target_dir / f"{TEMP_PREFIX}{source.name}"
+    try:
+        source_md5 = _copy_with_md5(source, temp_path)
+        expected = file.md5_hash or source_md5
+        if source_md5 != expected or _file_md5(temp_path) != expected:
+            print(f"[TIERING] 校验失败，放弃迁移: {source}")
+            temp_path.unlink(missing_ok=True)
+            return False
+        os.replace(temp_path, destination)
+    except OSError as e:
+        print(f"[TIERING] 复制失败: {source} -> {target.name}: {e}")
+        temp_path.unlink(missing_ok=True)
+        return False
+    
+    # 只有路径仍是迁移前的路径时才切换，期间被移动/重命名/删除的文件放弃迁移
+    updated = db.query(File).filter(
+        File.id == file.id,
+        File.file_path == str(source),
+        File.is_deleted == False
+    ).update(
+        {
+            File.file_path: str(destination),
+            File.volume: target.name,
+            File.access_count: 0,
+            File.updated_at: File.updated_at,
+        },
+        synchronize_session=False
+    )
+    if not updated:
+        db.rollback()
+        destination.unlink(missing_ok=True)
+        return False
+    
+    # 原文件延后由物理清理任务删除，目标位置的旧副本已被替换，不再清理
+    pending_purge.delete(synchronize_session=False)
+    db.add(PurgeItem(
+        owner_id=file.owner_id,
+        file_path=str(source),
+        is_folder=False,
+        size=file.size or 0,
+        md5_hash=file.md5_hash
+    ))
+    db.commit()
+    
+    return True
+
+
+def run_tiering(db: Session) -> dict:
+    """
+    冷热分层后台任务
+    
+    Args:
+        db: 数据库会话
+    
+    Returns:
+        统计信息
+    """
+    access_tracker.flush()
+    
+    stats = {
+        "demoted": 0,
+        "promoted": 0,
+        "bytes_moved": 0,
+        "failed": 0,
+        "no_space": 0,
+    }
+    
+    hot = [v for v in volumes.volumes if v.tier == TIER_HOT and v.online]
+    cold = [v for v in volumes.volumes if v.tier == TIER_COLD and v.online]
+    if not hot or not cold:
+        return stats
+    
+    budget = settings.TIERING_MAX_BYTES_PER_RUN
+    now = datetime.utcnow()
+    last_used = func.coalesce(File.last_accessed_at, File.created_at)
+    
+    # 降级：长时间未访问的大文件移到冷存储
+    demote = db.query(File).filter(
+        File.is_folder == False,
+        File.is_deleted == False,
+        File.is_chunked == False,
+        _volume_filter(hot),
+        File.size >= settings.TIERING_COLD_MIN_SIZE,
+        last_used < now - timedelta(days=settings.TIERING_COLD_AFTER_DAYS)
+    ).order_by(last_used).limit(settings.TIERING_BATCH_SIZE).all()
+    
+    # 升级：近期频繁访问的较小文件移到热存储
+    promote = db.query(File).filter(
+        File.is_folder == False,
+        File.is_deleted == False,
+        File.is_chunked == False,
+        _volume_filter(cold),
+        File.size <= settings.TIERING_HOT_MAX_SIZE,
+        File.last_accessed_at >= now - timedelta(days=settings.TIERING_HOT_WINDOW_DAYS),
+        File.access_count >= settings.TIERING_PROMOTE_MIN_ACCESSES
+    ).order_by(File.access_count.desc()).limit(settings.TIERING_BATCH_SIZE).all()
+    
+    for files, targets, key in ((demote, cold, "demoted"), (promote, hot, "promoted")):
+        for file in files:
+            size = file.size or 0
+            if size > budget:
+                break
+            
+            target = _pick_target(targets, size)
+            if target is None:
+                stats["no_space"] += 1
+                continue
+            
+            if migrate_file(db, file, target):
+                stats[key] += 1
+                stats["bytes_moved"] += size
+                budget -= size
+            else:
+                stats["failed"] += 1
+    
+    return stats
+
+
+if settings.TIERING_ENABLED:
+    scheduler.register("tiering", settings.TIERING_INTERVAL, run_tiering)
@@ -0,0 +1,399 @@
+"""
+HLS转码模块（需要在配置中开启）
+原视频码率较高时（例如20Mbps的4K手机视频），经5Mbps的内网穿透上行链路播放会不断卡顿。
+用户对单个视频发起转码后，后台按队列生成低码率的HLS版本（480p/720p等），
+播放器按网络情况在各版本之间切换。
+
+- 转码任务记录在transcode_jobs表中，按（用户, 内容MD5, 版本）去重
+- 转码通过维护任务的跨进程锁串行执行：树莓派上同一时刻只有一个转码在运行，
+  ffmpeg以最低优先级和有限的线程数运行，不影响文件访问
+- 输出位于 .media/hls/<MD5>/<版本>/（index.m3u8 + 分段文件），与原文件放在同一用户目录下，
+  文件彻底删除且没有相同内容的文件时由回收站清理任务删除
+- HLS_ENCODER=stub 时使用测试用编码器（不调用ffmpeg，按大小切分原文件），便于在没有ffmpeg的环境中测试
+"""
+
+import re
+import shutil
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+from fastapi import HTTPException, status
+from sqlalchemy.orm import Session
+
+from models import User, File, TranscodeJob
+from config import settings
+from file_handler import FileService
+from media import media_dir, find_ffmpeg, run_ffmpeg
+from maintenance import scheduler, run_task
+
+
+# 可选版本：名称 -> (高度, 视频码率kbps, 音频码率kbps)
+RENDITIONS: Dict[str, Tuple[int, int, int]] = {
+    "360p": (360, 600, 64),
+    "480p": (480, 1000, 96),
+    "720p": (720, 2500, 128),
+    "1080p": (1080, 5000, 128),
+}
+
+# 每个分段的时长（秒）
+SEGMENT_SECONDS = 6
+
+# 播放列表与分段文件名
+PLAYLIST_NAME = "index.m3u8"
+SEGMENT_PATTERN = re.compile(r"^seg_\d{5}\.ts$")
+
+PLAYLIST_MEDIA_TYPE = "application/vnd.apple.mpegurl"
+SEGMENT_MEDIA_TYPE = "video/mp2t"
+
+
+def configured_renditions() -> List[str]:
+    """配置中启用的版本（按清晰度从低到高）"""
+    names = [name.strip() for name in settings.HLS_RENDITIONS.split(",") if name.strip() in RENDITIONS]
+    return sorted(set(names), key=lambda name: RENDITIONS[name][0])
+
+
+def hls_dir(owner_id: int, md5_hash: str, rendition: Optional[str] = None) -> Path:
+    """HLS输出目录"""
+    path = media_dir(owner_id) / "hls" / md5_hash
+    return path / rendition if rendition else path
+
+
+class FfmpegHlsEncoder:
+    """使用ffmpeg转码为H.264/AAC的HLS"""
+    
+    name = "ffmpeg"
+    
+    def __init__(self, ffmpeg: str):
+        self.ffmpeg = ffmpeg
+    
+    def encode(self, source: Path, output_dir: Path, rendition: str):
+        height, video_kbps, audio_kbps = RENDITIONS[rendition]
+        run_ffmpeg(self.ffmpeg, [
+            "-i", str(source),
+            "-map", "0:v:0", "-map", "0:a:0?",
+            # 只缩小不放大，宽度按比例取偶数
+            "-vf", f"scale=-2:'min({height},ih)'",
+            "-c:v", "libx264", "-preset", "veryfast", "-profile:v", "main",
+            "-b:v", f"{video_kbps}k", "-maxrate", f"{int(video_kbps * 1.2)}k",
+            "-bufsize", f"{video_kbps * 2}k",
+            "-g", str(SEGMENT_SECONDS * 30), "-sc_threshold", "0",
+            "-c:a", "aac", "-b:a", f"{audio_kbps}k", "-ac", "2",
+            "-threads", str(settings.HLS_THREADS),
+            "-f", "hls", "-hls_time", str(SEGMENT_SECONDS), "-hls_playlist_type", "vod",
+            "-hls_segment_filename", str(output_dir / "seg_%05d.ts"),
+            str(output_dir / PLAYLIST_NAME)
+        ], timeout=settings.HLS_TIMEOUT, niceness=19)
+
+
+class StubHlsEncoder:
+    """测试用编码器：不转码，把原文件按固定大小切分为分段并生成播放列表（无法实际播放）"""
+    
+    name = "stub"
+    segment_size = 1024 * 1024
+    
+    def encode(self, source: Path, output_dir: Path, rendition: str):
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3", f"#EXT-X-TARGETDURATION:{SEGMENT_SECONDS}",
+                 "#EXT-X-PLAYLIST-TYPE:VOD", "#EXT-X-MEDIA-SEQUENCE:0"]
+        with open(source, "rb") as src:
+            index = 0
+            while True:
+                data = src.read(self.segment_size)
+                if not data and index > 0:
+                    break
+                name = f"seg_{index:05d}.ts"
+                (output_dir / name).write_bytes(data)
+                lines += [f"#EXTINF:{SEGMENT_SECONDS:.1f},", name]
+                index += 1
+                if not data:
+                    break
+        lines.append("#EXT-X-ENDLIST")
+        (output_dir / PLAYLIST_NAME).write_text("\n".join(lines) + "\n")
+
+
+def get_encoder():
+    """按配置返回编码器；ffmpeg不可用时返回None（任务保持排队，安装后继续执行）"""
+    if settings.HLS_ENCODER == "stub":
+        return StubHlsEncoder()
+    ffmpeg = find_ffmpeg()
+    return FfmpegHlsEncoder(ffmpeg) if ffmpeg else None
+
+
+def render_playlist(path: Path, token: Optional[str]) -> str:
+    """
+    读取播放列表，为其中的相对地址附加token参数
+    
+    播放器请求分段时不会带上播放列表地址中的查询参数，
+    通过URL参数认证时需要把token写入每个地址。
+    
+    Args:
+        path: 播放列表路径
+        token: 认证token（为空时原样返回）
+    
+    Returns:
+        播放列表内容
+    """
+    text = path.read_text()
+    if not token:
+        return text
+    suffix = f"?token={quote(token)}"
+    return "\n".join(
+        line if not line or line.startswith("#") else line + suffix
+        for line in text.splitlines()
+    ) + "\n"
+
+
+class TranscodeService:
+    """HLS转码服务"""
+    
+    def __init__(self, db: Session):
+        self.db = db
+        self.file_service = FileService(db)
+    
+    def _get_video(self, user: User, file_id: int) -> File:
+        if not settings.HLS_ENABLED:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="未开启视频转码"
+            )
+        file = self.file_service.get_file(user, file_id)
+        if file.category != "video" or not file.md5_hash:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="只能转码视频文件"
+            )
+        return file
+    
+    def _jobs(self, user: User, md5_hash: str) -> Dict[str, TranscodeJob]:
+        return {
+            job.rendition: job
+            for job in self.db.query(TranscodeJob).filter(
+                TranscodeJob.owner_id == user.id,
+                TranscodeJob.md5_hash == md5_hash
+            ).all()
+        }
+    
+    def request(self, user: User, file_id: int, renditions: Optional[List[str]] = None) -> dict:
+        """
+        为视频发起转码（已完成或正在排队的版本不会重复转码，失败的版本重新排队）
+        
+        Args:
+            user: 用户对象
+            file_id: 文件ID
+            renditions: 需要的版本（默认为配置中的全部版本）
+        
+        Returns:
+            转码状态
+        """
+        file = self._get_video(user, file_id)
+        allowed = configured_renditions()
+        wanted = renditions or allowed
+        invalid = [name for name in wanted if name not in allowed]
+        if invalid:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"不支持的版本: {', '.join(invalid)}（可选: {', '.join(allowed)}）"
+            )
+        
+        jobs = self._jobs(user, file.md5_hash)
+        for rendition in wanted:
+            job = jobs.get(rendition)
+            if job is None:
+                self.db.add(TranscodeJob(
+                    owner_id=user.id,
+                    file_id=file.id,
+                    md5_hash=file.md5_hash,
+                    rendition=rendition
+                ))
+            elif job.status == "failed":
+                job.status = "queued"
+                job.file_id = file.id
+                job.error = None
+        self.db.commit()
+        
+        return self.get_status(user, file_id)
+    
+    def get_status(self, user: User, file_id: int) -> dict:
+        """
+        查询视频各版本的转码状态
+        
+        Args:
+            user: 用户对象
+            file_id: 文件ID
+        
+        Returns:
+            {"file_id", "ready", "encoder_available", "renditions": [...]}
+        """
+        file = self._get_video(user, file_id)
+        jobs = self._jobs(user, file.md5_hash)
+        
+        renditions = []
+        for name in sorted(jobs, key=lambda name: RENDITIONS.get(name, (0,))[0]):
+            job = jobs[name]
+            renditions.append({
+                "rendition": name,
+                "status": job.status,
+                "error": job.error,
+                "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+            })
+        
+        return {
+            "file_id": file.id,
+            "ready": any(r["status"] == "completed" for r in renditions),
+            "encoder_available": get_encoder() is not None,
+            "renditions": renditions,
+        }
+    
+    def master_playlist(self, user: User, file_id: int, token: Optional[str]) -> str:
+        """
+        生成包含已完成版本的主播放列表
+        
+        Args:
+            user: 用户对象
+            file_id: 文件ID
+            token: 认证token（写入各版本的地址）
+        
+        Returns:
+            播放列表内容
+        """
+        file = self._get_video(user, file_id)
+        ready = [
+            name for name, job in self._jobs(user, file.md5_hash).items()
+            if job.status == "completed" and name in RENDITIONS
+        ]
+        if not ready:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="转码尚未完成"
+            )
+        
+        suffix = f"?token={quote(token)}" if token else ""
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3"]
+        for name in sorted(ready, key=lambda name: RENDITIONS[name][0]):
+            height, video_kbps, audio_kbps = RENDITIONS[name]
+            bandwidth = (video_kbps * 1.2 + audio_kbps) * 1000
+            lines.append(f'#EXT-X-STREAM-INF:BANDWIDTH={int(bandwidth)},NAME="{name}"')
+            lines.append(f"{name}/{PLAYLIST_NAME}{suffix}")
+        return "\n".join(lines) + "\n"
+    
+    def rendition_file(self, user: User, file_id: int, rendition: str, filename: str) -> Path:
+        """
+        获取某个版本的播放列表或分段文件路径
+        
+        Args:
+            user: 用户对象
+            file_id: 文件ID
+            rendition: 版本名称
+            filename: index.m3u8 或分段文件名
+        
+        Returns:
+            文件路径
+        """
+        file = self._get_video(user, file_id)
+        if rendition not in RENDITIONS or (filename != PLAYLIST_NAME and not SEGMENT_PATTERN.match(filename)):
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="文件不存在"
+            )
+        
+        path = hls_dir(user.id, file.md5_hash, rendition) / filename
+        if not path.exists():
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="转码尚未完成"
+            )
+        return path
+
+
+def _transcode(encoder, job: TranscodeJob, source: File):
+    """转码到临时目录，完成后整体替换输出目录"""
+    output_dir = hls_dir(job.owner_id, job.md5_hash, job.rendition)
+    temp_dir = output_dir.with_name(f".tmp-{job.rendition}")
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    temp_dir.mkdir(parents=True)
+    try:
+        encoder.encode(Path(source.file_path), temp_dir, job.rendition)
+        if not (temp_dir / PLAYLIST_NAME).exists():
+            raise RuntimeError("转码未生成播放列表")
+        shutil.rmtree(output_dir, ignore_errors=True)
+        temp_dir.rename(output_dir)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def _find_source(db: Session, job: TranscodeJob) -> Optional[File]:
+    """转码的源文件：优先使用发起转码的文件，该文件已删除或内容变化时使用相同内容的其他文件"""
+    criteria = (
+        File.owner_id == job.owner_id,
+        File.md5_hash == job.md5_hash,
+        File.is_deleted == False,
+        File.is_folder == False,
+        File.is_chunked == False
+    )
+    file = db.query(File).filter(File.id == job.file_id, *criteria).first()
+    return file or db.query(File).filter(*criteria).first()
+
+
+def run_transcode_queue(db: Session) -> dict:
+    """
+    转码后台任务：依次执行排队中的转码，直到队列为空
+    
+    Args:
+        db: 数据库会话
+    
+    Returns:
+        统计信息
+    """
+    encoder = get_encoder()
+    if encoder is None:
+        return {"skipped": "ffmpeg不可用"}
+    
+    # 持有任务锁时不会有其他进程在转码，遗留的running任务是服务重启前中断的
+    db.query(TranscodeJob).filter(
+        TranscodeJob.status == "running"
+    ).update({TranscodeJob.status: "queued"}, synchronize_session=False)
+    db.commit()
+    
+    stats = {"completed": 0, "failed": 0, "seconds": 0}
+    while True:
+        job = db.query(TranscodeJob).filter(
+            TranscodeJob.status == "queued"
+        ).order_by(TranscodeJob.id).first()
+        if job is None:
+            break
+        
+        job.status = "running"
+        job.started_at = datetime.utcnow()
+        db.commit()
+        
+        start = time.monotonic()
+        try:
+            source = _find_source(db, job)
+            if source is None:
+                raise RuntimeError("源文件不存在")
+            _transcode(encoder, job, source)
+            job.status, job.error = "completed", None
+            stats["completed"] += 1
+        except Exception as e:
+            job.status, job.error = "failed", str(e)[:1000]
+            stats["failed"] += 1
+            print(f"[TRANSCODE] 转码失败 {job.md5_hash}/{job.rendition}: {e}")
+        
+        elapsed = time.monotonic() - start
+        stats["seconds"] += int(elapsed)
+        job.finished_at = datetime.utcnow()
+        db.commit()
+        print(f"[TRANSCODE] {job.md5_hash}/{job.rendition} {job.status}（{encoder.name}，耗时{elapsed:.1f}秒）")
+    
+    return stats
+
+
+def trigger_transcode():
+    """立即检查转码队列（发起转码后调用；已有转码在执行时直接返回）"""
+    run_task("hls_transcode", run_transcode_queue)
+
+
+if settings.HLS_ENABLED:
+    scheduler.register("hls_transcode", settings.HLS_INTERVAL, run_transcode_queue)
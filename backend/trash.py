@@ -0,0 +1,428 @@
+"""
+回收站模块
+包含回收站列表、还原、彻底删除，以及后台限速物理清理
+"""
+
+import shutil
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List, Dict
+
+from fastapi import HTTPException, status
+from sqlalchemy import func, or_
+from sqlalchemy.orm import Session, aliased
+
+from models import User, File, Share, SyncRecord, PurgeItem, TranscodeJob, MediaMetadata
+from config import settings
+from file_handler import FileService, FileManager, chunked
+from derivative_cache import derivative_cache
+from maintenance import scheduler, run_task
+from volumes import volumes
+from chunkstore import release_stored_file
+from changes import record_changes, raise_sync_horizon
+
+
+class TrashService:
+    """回收站服务"""
+    
+    def __init__(self, db: Session):
+        self.db = db
+        self.file_service = FileService(db)
+    
+    def _trash_root_query(self, user: User):
+        """
+        回收站顶层条目查询
+        
+        父级不存在或父级未被删除的已删除条目才会显示在回收站中，
+        随文件夹一起删除的子孙条目不单独显示。
+        """
+        parent = aliased(File)
+        return self.db.query(File).outerjoin(
+            parent, File.parent_id == parent.id
+        ).filter(
+            File.owner_id == user.id,
+            File.is_deleted == True,
+            or_(File.parent_id == None, parent.id == None, parent.is_deleted == False)
+        )
+    
+    def list_trash(self, user: User, page: int = 1, page_size: int = 50) -> dict:
+        """
+        分页列出回收站内容
+        
+        Args:
+            user: 用户对象
+            page: 页码（从1开始）
+            page_size: 每页条数
+        
+        Returns:
+            包含条目列表和总数的字典
+        """
+        query = self._trash_root_query(user)
+        total = query.count()
+        items = query.order_by(File.deleted_at.desc(), File.id.desc()).offset(
+            (page - 1) * page_size
+        ).limit(page_size).all()
+        
+        retention = timedelta(days=settings.TRASH_RETENTION_DAYS)
+        
+        return {
+            "items": [
+                {
+                    "id": f.id,
+                    "filename": f.filename,
+                    "original_filename": f.original_filename,
+                    "size": f.size,
+                    "category": f.category,
+                    "is_folder": f.is_folder,
+                    "mime_type": f.mime_type,
+                    "deleted_at": f.deleted_at.isoformat() if f.deleted_at else None,
+                    "purge_at": (f.deleted_at + retention).isoformat() if f.deleted_at else None
+                }
+                for f in items
+            ],
+            "total": total,
+            "page": page,
+            "page_size": page_size
+        }
+    
+    def get_trashed_file(self, user: User, file_id: int) -> File:
+        """
+        获取回收站中的条目
+        
+        Args:
+            user: 用户对象
+            file_id: 文件ID
+        
+        Returns:
+            File对象
+        """
+        file = self.db.query(File).filter(
+            File.id == file_id,
+            File.owner_id == user.id,
+            File.is_deleted == True
+        ).first()
+        
+        if not file:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="回收站中不存在该文件"
+            )
+        
+        return file
+    
+    def restore(self, user: User, file_id: int) -> File:
+        """
+        从回收站还原文件或文件夹
+        
+        文件夹会连同与其一起删除的子孙条目一起还原；
+        如果原父文件夹已不存在或仍在回收站中，则还原到根目录。
+        
+        Args:
+            user: 用户对象
+            file_id: 文件ID
+        
+        Returns:
+            还原后的File对象
+        """
+        file = self.get_trashed_file(user, file_id)
+        
+        ids = [file.id]
+        if file.is_folder:
+            ids += self.file_service.get_descendant_ids(
+                file.id,
+                File.is_deleted == True,
+                File.deleted_at == file.deleted_at
+            )
+        
+        restored_size = self.file_service.sum_file_sizes(ids)
+        if not user.has_space_for(restored_size):
+            raise HTTPException(
+                status_code=status.HTTP_507_INSUFFICIENT_STORAGE,
+                detail="存储空间不足，无法还原"
+            )
+        
+        # 原父文件夹不可用时还原到根目录
+        if file.parent_id is not None:
+            parent = self.db.query(File).filter(
+                File.id == file.parent_id,
+                File.owner_id == user.id,
+                File.is_deleted == False
+            ).first()
+            if not parent:
+                self._relocate_to_root(user, file, ids)
+        
+        for batch in chunked(ids):
+            self.db.query(File).filter(File.id.in_(batch)).update(
+                {File.is_deleted: False, File.deleted_at: None},
+                synchronize_session=False
+            )
+        
+        user.used_space += restored_size
+        record_changes(self.db, user.id, ids, "restored")
+        
+        self.db.commit()
+        self.db.refresh(file)
+        
+        return file
+    
+    def _relocate_to_root(self, user: User, file: File, ids: List[int]):
+        """
+        将条目（及其子孙）的物理文件移动到用户根目录并更新路径
+        
+        Args:
+            user: 用户对象
+            file: 顶层条目
+            ids: 顶层条目及子孙条目的ID列表
+        """
+        old_path = Path(file.file_path)
+        root_dir = volumes.user_root(volumes.volume_for_path(old_path), user.id)
+        unique_name = volumes.get_unique_filename(root_dir, file.filename)
+        new_path = root_dir / unique_name
+        
+        if file.is_folder:
+            volumes.move_tree(old_path, new_path)
+        elif old_path.exists():
+            shutil.move(str(old_path), str(new_path))
+        
+        for batch in chunked(ids[1:]):
+            for child in self.db.query(File).filter(File.id.in_(batch)).all():
+                child.file_path = volumes.rebase_path(child.file_path, old_path, new_path)
+        
+        file.filename = unique_name
+        file.file_path = str(new_path)
+        file.parent_id = None
+    
+    def delete_permanently(self, user: User, file_id: int) -> int:
+        """
+        彻底删除回收站中的条目（物理文件由后台任务异步删除）
+        
+        Args:
+            user: 用户对象
+            file_id: 文件ID
+        
+        Returns:
+            进入清理队列的条目数
+        """
+        file = self.get_trashed_file(user, file_id)
+        
+        ids = [file.id]
+        if file.is_folder:
+            ids += self.file_service.get_descendant_ids(file.id)
+        
+        queued = enqueue_purge(self.db, ids)
+        self.db.commit()
+        
+        return queued
+    
+    def empty(self, user: User) -> int:
+        """
+        清空回收站（物理文件由后台任务异步删除）
+        
+        Args:
+            user: 用户对象
+        
+        Returns:
+            进入清理队列的条目数
+        """
+        ids = [
+            row[0] for row in self.db.query(File.id).filter(
+                File.owner_id == user.id,
+                File.is_deleted == True
+            ).all()
+        ]
+        
+        queued = enqueue_purge(self.db, ids)
+        self.db.commit()
+        
+        return queued
+
+
+def enqueue_purge(db: Session, file_ids: List[int]) -> int:
+    """
+    将条目移入物理清理队列并删除其数据库记录
+    
+    数据库记录立即删除（用户不再可见），物理文件由后台任务限速删除。
+    未处于删除状态的条目（例如旧版本删除文件夹时遗留的子条目）会同时扣减已用空间。
+    不提交事务，由调用方提交。
+    
+    Args:
+        db: 数据库会话
+        file_ids: 文件ID列表
+    
+    Returns:
+        进入队列的条目数
+    """
+    queued = 0
+    
+    # 子条目ID通常大于父条目，倒序删除保证先删子条目
+    for batch in chunked(sorted(file_ids, reverse=True)):
+        files = db.query(File).filter(File.id.in_(batch)).all()
+        live_sizes: Dict[int, int] = {}
+        
+        for f in files:
+            db.add(PurgeItem(
+                owner_id=f.owner_id,
+                file_path=f.file_path,
+                is_folder=f.is_folder,
+                size=f.size or 0,
+                md5_hash=f.md5_hash,
+                is_chunked=bool(f.is_chunked)
+            ))
+            if not f.is_deleted and not f.is_folder:
+                live_sizes[f.owner_id] = live_sizes.get(f.owner_id, 0) + (f.size or 0)
+        
+        for owner_id, size in live_sizes.items():
+            owner = db.query(User).filter(User.id == owner_id).first()
+            if owner:
+                owner.used_space = max(0, owner.used_space - size)
+        
+        db.query(Share).filter(Share.file_id.in_(batch)).delete(synchronize_session=False)
+        raise_sync_horizon(db, batch)
+        db.query(SyncRecord).filter(SyncRecord.file_id.in_(batch)).delete(synchronize_session=False)
+        db.query(MediaMetadata).filter(MediaMetadata.file_id.in_(batch)).delete(synchronize_session=False)
+        db.query(File).filter(File.id.in_(batch)).delete(synchronize_session=False)
+        queued += len(files)
+    
+    return queued
+
+
+def _remove_orphan_thumbnail(db: Session, item: PurgeItem):
+    """
+    删除不再使用的派生文件
+    
+    - 所有用户都没有相同内容的文件时，删除共享缓存中的缩略图和封面
+    - 该用户没有相同内容的文件时，删除该用户的视频派生文件
+    """
+    if not item.md5_hash:
+        return
+    
+    if not db.query(File.id).filter(File.md5_hash == item.md5_hash).first():
+        derivative_cache.remove(db, [item.md5_hash])
+    
+    still_used = db.query(File.id).filter(
+        File.owner_id == item.owner_id,
+        File.md5_hash == item.md5_hash
+    ).first()
+    
+    if not still_used:
+        media_dir = Path(settings.STORAGE_PATH) / str(item.owner_id) / ".media"
+        for media_path in media_dir.glob(f"{item.md5_hash}.*"):
+            FileManager.delete_file_safe(media_path)
+        
+        # HLS转码输出和任务记录
+        shutil.rmtree(media_dir / "hls" / item.md5_hash, ignore_errors=True)
+        db.query(TranscodeJob).filter(
+            TranscodeJob.owner_id == item.owner_id,
+            TranscodeJob.md5_hash == item.md5_hash
+        ).delete(synchronize_session=False)
+
+
+def run_trash_purge(db: Session) -> dict:
+    """
+    回收站后台清理任务
+    
+    1. 超过保留期的回收站条目进入清理队列
+    2. 按批次删除队列中的物理文件，批次之间暂停，避免大批量删除占满SD卡I/O
+    
+    删除失败（I/O错误、文件被占用、权限不足）且文件仍存在的条目保留在队列中，
+    记录失败次数，下次执行时重试；文件已不存在的条目直接移出队列。
+    
+    Args:
+        db: 数据库会话
+    
+    Returns:
+        统计信息
+    """
+    stats = {
+        "expired_queued": 0,
+        "files_removed": 0,
+        "folders_removed": 0,
+        "bytes_reclaimed": 0,
+        "skipped_in_use": 0,
+        "files_failed": 0,
+    }
+    batch_size = settings.TRASH_PURGE_BATCH_SIZE
+    
+    # 超过保留期的条目进入队列
+    cutoff = datetime.utcnow() - timedelta(days=settings.TRASH_RETENTION_DAYS)
+    while True:
+        ids = [
+            row[0] for row in db.query(File.id).filter(
+                File.is_deleted == True,
+                File.deleted_at < cutoff
+            ).limit(batch_size).all()
+        ]
+        if not ids:
+            break
+        stats["expired_queued"] += enqueue_purge(db, ids)
+        db.commit()
+    
+    # 先删文件，再由深到浅删除文件夹（本次删除失败的条目不再重复读取）
+    failed_ids: List[int] = []
+    while True:
+        items = db.query(PurgeItem).filter(
+            PurgeItem.id.notin_(failed_ids)
+        ).order_by(
+            PurgeItem.is_folder,
+            func.length(PurgeItem.file_path).desc()
+        ).limit(batch_size).all()
+        if not items:
+            break
+        
+        # 防止误删仍被其他记录引用的物理文件
+        in_use = {
+            row[0] for row in db.query(File.file_path).filter(
+                File.file_path.in_([item.file_path for item in items])
+            ).all()
+        }
+        
+        removed = []
+        for item in items:
+            path = Path(item.file_path)
+            if item.file_path in in_use:
+                stats["skipped_in_use"] += 1
+            elif item.is_folder:
+                # 文件夹在其他存储卷上的镜像目录一并删除
+                for volume in volumes.volumes:
+                    try:
+                        volumes.path_on(volume, path).rmdir()
+                        if volume.contains(item.file_path):
+                            stats["folders_removed"] += 1
+                    except OSError:
+                        pass  # 目录不存在或仍有内容，保留
+            else:
+                if item.is_chunked:
+                    release_stored_file(db, path)
+                    # 分块引用只释放一次，删除清单失败后重试时不能再次释放
+                    item.is_chunked = False
+                if FileManager.delete_file_safe(path):
+                    stats["files_removed"] += 1
+                    stats["bytes_reclaimed"] += item.size or 0
+                elif path.exists():
+                    item.attempts = (item.attempts or 0) + 1
+                    failed_ids.append(item.id)
+                    stats["files_failed"] += 1
+                    print(f"[TRASH] 删除失败（第{item.attempts}次），下次清理时重试: {item.file_path}")
+                    continue
+            db.delete(item)
+            removed.append(item)
+        
+        db.flush()
+        for item in removed:
+            if not item.is_folder:
+                _remove_orphan_thumbnail(db, item)
+        db.commit()
+        
+        if len(items) == batch_size:
+            time.sleep(settings.TRASH_PURGE_BATCH_PAUSE)
+    
+    return stats
+
+
+def trigger_trash_purge():
+    """立即执行一次回收站清理（用于清空回收站后尽快释放空间）"""
+    run_task("trash_purge", run_trash_purge)
+
+
+scheduler.register("trash_purge", settings.TRASH_PURGE_INTERVAL, run_trash_purge)
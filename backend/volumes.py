@@ -0,0 +1,296 @@
+"""
+存储卷管理模块
+支持SD卡与多块外接硬盘同时作为存储卷，按策略为新文件选择存储位置
+
+每个存储卷下的目录结构相同（<卷根目录>/<用户ID>/<文件夹路径>/<文件名>），
+文件夹在各个卷上按需镜像创建，同一文件夹中的文件可以分布在不同的卷上。
+
+配置示例（.env）：
+    STORAGE_PATH=/opt/raspberrycloud/storage/users          # 默认卷（default）
+    STORAGE_VOLUMES=usb1=/mnt/usb1/users,usb2=/mnt/usb2/users
+    STORAGE_PLACEMENT_POLICY=free_space                     # free_space / round_robin / pinned
+    COLD_VOLUMES=usb1,usb2                                  # 冷存储卷（见tiering.py）
+"""
+
+import itertools
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import Collection, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from models import User, File
+from config import settings
+
+
+# 默认卷名称（对应STORAGE_PATH，历史数据的volume为空时也属于该卷）
+DEFAULT_VOLUME = "default"
+
+# 放置策略
+PLACEMENT_POLICIES = ("free_space", "round_robin", "pinned")
+
+# 存储层级
+TIER_HOT = "hot"
+TIER_COLD = "cold"
+
+
+class StorageVolume:
+    """存储卷"""
+    
+    def __init__(self, name: str, root: str, tier: str = TIER_HOT):
+        self.name = name
+        self.root = Path(root)
+        self.tier = tier
+    
+    @property
+    def online(self) -> bool:
+        """卷根目录是否可用（外接硬盘未挂载时不可用）"""
+        return self.root.is_dir()
+    
+    def free_bytes(self) -> int:
+        """可用于存放文件的剩余空间（已扣除保留空间）"""
+        if not self.online:
+            return 0
+        usage = shutil.disk_usage(self.root)
+        return max(0, usage.free - settings.VOLUME_RESERVED_BYTES)
+    
+    def has_space_for(self, size: int) -> bool:
+        return self.free_bytes() >= size
+    
+    def contains(self, path: str) -> bool:
+        root = str(self.root)
+        return path == root or path.startswith(root + os.sep)
+
+
+class VolumeRegistry:
+    """存储卷注册表"""
+    
+    def __init__(self, volumes: List[StorageVolume], policy: str = "free_space"):
+        if policy not in PLACEMENT_POLICIES:
+            raise ValueError(f"未知的存储放置策略: {policy}")
+        self.volumes = volumes
+        self.policy = policy
+        self._by_name: Dict[str, StorageVolume] = {v.name: v for v in volumes}
+        self._round_robin = itertools.count()
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def from_settings(cls) -> "VolumeRegistry":
+        """
+        根据配置创建注册表
+        
+        STORAGE_PATH始终作为默认卷，STORAGE_VOLUMES中的额外卷格式为“名称=路径”，逗号分隔。
+        """
+        cold = {name.strip() for name in settings.COLD_VOLUMES.split(",") if name.strip()}
+        
+        def tier_of(name: str) -> str:
+            return TIER_COLD if name in cold else TIER_HOT
+        
+        volumes = [StorageVolume(DEFAULT_VOLUME, settings.STORAGE_PATH, tier_of(DEFAULT_VOLUME))]
+        for item in settings.STORAGE_VOLUMES.split(","):
+            item = item.strip()
+            if not item:
+                continue
+            name, sep, path = item.partition("=")
+            if not sep or not name.strip() or not path.strip():
+                raise ValueError(f"存储卷配置格式错误: {item}（应为 名称=路径）")
+            volumes.append(StorageVolume(name.strip(), path.strip(), tier_of(name.strip())))
+        return cls(volumes, settings.STORAGE_PLACEMENT_POLICY)
+    
+    @property
+    def default(self) -> StorageVolume:
+        return self.volumes[0]
+    
+    def find(self, name: Optional[str]) -> Optional[StorageVolume]:
+        """按名称查找存储卷（空名称为默认卷，不存在时返回None）"""
+        return self._by_name.get(name or DEFAULT_VOLUME)
+    
+    def get(self, name: Optional[str]) -> StorageVolume:
+        """按名称获取存储卷（空名称为默认卷）"""
+        volume = self.find(name)
+        if volume is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"存储卷不存在: {name}"
+            )
+        return volume
+    
+    def volume_for_path(self, path) -> StorageVolume:
+        """根据路径判断所在的存储卷（取根目录最长匹配）"""
+        path = str(path)
+        matches = [v for v in self.volumes if v.contains(path)]
+        if not matches:
+            return self.default
+        return max(matches, key=lambda v: len(str(v.root)))
+    
+    def relative_path(self, path) -> Tuple[StorageVolume, str]:
+        """获取路径所在的卷以及相对卷根目录的路径"""
+        volume = self.volume_for_path(path)
+        return volume, os.path.relpath(str(path), str(volume.root))
+    
+    def path_on(self, volume: StorageVolume, path) -> Path:
+        """获取某个路径在指定卷上的镜像路径"""
+        _, relative = self.relative_path(path)
+        return volume.root / relative
+    
+    def user_root(self, volume: StorageVolume, user_id: int) -> Path:
+        """获取用户在指定卷上的根目录"""
+        path = volume.root / str(user_id)
+        path.mkdir(parents=True, exist_ok=True)
+        return path
+    
+    def choose(self, user: User, size: int) -> StorageVolume:
+        """
+        按放置策略为新文件选择存储卷
+        
+        - free_space: 选择剩余空间最多的卷
+        - round_robin: 在有足够空间的卷之间轮流放置，分摊I/O
+        - pinned: 使用用户固定的卷；尚未固定时按剩余空间选择并固定（调用方负责提交）
+        
+        Args:
+            user: 用户对象
+            size: 文件大小
+        
+        Returns:
+            StorageVolume对象
+        """
+        candidates = [v for v in self.volumes if v.online and v.has_space_for(size)]
+        if not candidates:
+            raise HTTPException(
+                status_code=status.HTTP_507_INSUFFICIENT_STORAGE,
+                detail="所有存储卷空间不足"
+            )
+        
+        if self.policy == "pinned":
+            pinned = self._by_name.get(user.volume) if user.volume else None
+            if pinned in candidates:
+                return pinned
+            volume = max(candidates, key=lambda v: v.free_bytes())
+            user.volume = volume.name
+            return volume
+        
+        if self.policy == "round_robin":
+            with self._lock:
+                index = next(self._round_robin)
+            return candidates[index % len(candidates)]
+        
+        return max(candidates, key=lambda v: v.free_bytes())
+    
+    def exists_anywhere(self, path) -> bool:
+        """路径在任意卷上的镜像是否存在"""
+        return any(self.path_on(v, path).exists() for v in self.volumes if v.online)
+    
+    def get_unique_filename(self, directory: Path, filename: str,
+                            reserved: Collection[str] = ()) -> str:
+        """
+        获取在所有卷的同一文件夹中都不重复的文件名
+        
+        Args:
+            directory: 目录路径（任意卷上）
+            filename: 原始文件名
+            reserved: 已分配但尚未出现在磁盘上的文件名（视为已存在）
+        
+        Returns:
+            唯一文件名
+        """
+        if filename not in reserved and not self.exists_anywhere(directory / filename):
+            return filename
+        
+        name_parts = filename.rsplit('.', 1)
+        base_name = name_parts[0]
+        extension = f".{name_parts[1]}" if len(name_parts) > 1 else ""
+        
+        counter = 1
+        while True:
+            new_filename = f"{base_name}_{counter}{extension}"
+            if new_filename not in reserved and not self.exists_anywhere(directory / new_filename):
+                return new_filename
+            counter += 1
+    
+    def move_tree(self, old_path, new_path):
+        """
+        在所有卷上移动（重命名）同一文件夹的镜像目录
+        
+        Args:
+            old_path: 原文件夹路径（任意卷上）
+            new_path: 新文件夹路径（任意卷上）
+        """
+        for volume in self.volumes:
+            if not volume.online:
+                continue
+            old_dir = self.path_on(volume, old_path)
+            if old_dir.exists():
+                new_dir = self.path_on(volume, new_path)
+                new_dir.parent.mkdir(parents=True, exist_ok=True)
+                shutil.move(str(old_dir), str(new_dir))
+    
+    def rebase_path(self, path: str, old_folder, new_folder) -> str:
+        """
+        将文件夹移动/重命名后，其子孙条目的路径换算到新位置（保持所在卷不变）
+        
+        Args:
+            path: 子孙条目的原路径
+            old_folder: 文件夹原路径
+            new_folder: 文件夹新路径
+        
+        Returns:
+            新路径（不在该文件夹下时原样返回）
+        """
+        volume = self.volume_for_path(path)
+        old_prefix = str(self.path_on(volume, old_folder)) + os.sep
+        if not path.startswith(old_prefix):
+            return path
+        return str(self.path_on(volume, new_folder)) + os.sep + path[len(old_prefix):]
+    
+    def capacity_report(self, db: Session) -> List[dict]:
+        """
+        各存储卷的容量统计
+        
+        Args:
+            db: 数据库会话
+        
+        Returns:
+            每个卷的磁盘容量、剩余空间以及文件占用
+        """
+        rows = db.query(
+            File.volume,
+            func.count(File.id),
+            func.coalesce(func.sum(File.size), 0)
+        ).filter(
+            File.is_folder == False
+        ).group_by(File.volume).all()
+        
+        usage: Dict[str, Tuple[int, int]] = {}
+        for name, count, size in rows:
+            key = name or DEFAULT_VOLUME
+            prev_count, prev_size = usage.get(key, (0, 0))
+            usage[key] = (prev_count + count, prev_size + size)
+        
+        report = []
+        for volume in self.volumes:
+            file_count, file_bytes = usage.get(volume.name, (0, 0))
+            entry = {
+                "name": volume.name,
+                "path": str(volume.root),
+                "tier": volume.tier,
+                "online": volume.online,
+                "file_count": file_count,
+                "file_bytes": file_bytes,
+                "total_bytes": None,
+                "free_bytes": None,
+            }
+            if volume.online:
+                disk = shutil.disk_usage(volume.root)
+                entry["total_bytes"] = disk.total
+                entry["free_bytes"] = disk.free
+            report.append(entry)
+        
+        return report
+
+
+# 全局存储卷注册表
+volumes = VolumeRegistry.from_settings()
@@ -171,24 +171,27 @@ async function batchDelete() {
         return;
     }
     
-    const fileIds = Array.from(selectedFiles);
-    let successCount = 0;
-    let failCount = 0;
-    
-    for (const fileId of fileIds) {
-        try {
-            await utils.apiRequest(`/files/${fileId}`, {
-                method: 'DELETE'
-            });
-            successCount++;
-        } catch (error) {
-            console.error(`删除文件 ${fileId} 失败:`, error);
-            failCount++;
-        }
+    const fileIds = Array.from(selectedFiles).map(id => parseInt(id));
+    
+    try {
+        // 一次请求删除全部选中条目
+        const data = await utils.apiRequest('/files/batch/delete', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({ file_ids: fileIds })
+        });
+        
+        data.results
+            .filter(result => !result.success)
+            .forEach(result => console.error(`删除文件 ${result.id} 失败:`, result.error));
+        
+        utils.showNotification(`删除完成：成功 ${data.succeeded} 个，失败 ${data.failed} 个`);
+    } catch (error) {
+        utils.showNotification('删除失败: ' + error.message);
     }
     
-    utils.showNotification(`删除完成：成功 ${successCount} 个，失败 ${failCount} 个`);
-    
     // 清空选择并刷新列表
     cancelSelection();
     refreshFiles();
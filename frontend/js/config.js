@@ -22,6 +22,9 @@ const PREVIEW_TYPES = {
     document: ['.pdf', '.txt']
 };
 
+// 后台会生成页面预览图片的文档类型
+const DOCUMENT_PAGE_TYPES = ['.pdf', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx'];
+
 // 文件图标映射
 const FILE_ICONS = {
     folder: 'fa-folder',
@@ -79,6 +79,9 @@ function updateViewButtons() {
     });
 }
 
+// 可能有缩略图的文件类别（视频为封面、文档为第1页，尚未生成时显示图标）
+const THUMBNAIL_CATEGORIES = ['image', 'video', 'document'];
+
 /**
  * 渲染网格视图文件项
  */
@@ -97,8 +100,8 @@ function renderGridItem(file) {
             <div class="grid-item-preview">
                 ${isFolder ? 
                     `<i class="fas ${icon} grid-item-icon"></i>` :
-                    (file.category === 'image' ? 
-                        `<img src="${API_BASE_URL}/files/preview/${file.id}" 
+                    (THUMBNAIL_CATEGORIES.includes(file.category) ? 
+                        `<img data-thumb-id="${file.id}" 
                               alt="${file.filename}" 
                               class="grid-item-image"
                               onerror="this.style.display='none'; this.nextElementSibling.style.display='block';">
@@ -174,6 +177,54 @@ function renderListItem(file) {
     `;
 }
 
+/**
+ * 批量加载网格中的缩略图（每页一次请求，代替每张图片一次预览请求）
+ * 响应格式：4字节大端索引长度 + JSON索引 {"items": {id: [偏移, 长度]}, "missing": [...]} + JPEG数据
+ */
+const THUMBNAIL_PAGE_SIZE = 100;
+let thumbnailUrls = [];
+
+async function loadGridThumbnails() {
+    thumbnailUrls.forEach(url => URL.revokeObjectURL(url));
+    thumbnailUrls = [];
+    
+    const images = Array.from(document.querySelectorAll('img[data-thumb-id]'));
+    for (let start = 0; start < images.length; start += THUMBNAIL_PAGE_SIZE) {
+        const page = images.slice(start, start + THUMBNAIL_PAGE_SIZE);
+        try {
+            const response = await fetch(`${API_BASE_URL}/files/thumbnails?format=bundle`, {
+                method: 'POST',
+                headers: {
+                    'Authorization': `Bearer ${utils.getToken()}`,
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify({ file_ids: page.map(img => parseInt(img.dataset.thumbId)) })
+            });
+            if (!response.ok) throw new Error(`HTTP ${response.status}`);
+            
+            const buffer = await response.arrayBuffer();
+            const headerLength = new DataView(buffer).getUint32(0);
+            const index = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 4, headerLength)));
+            const dataStart = 4 + headerLength;
+            
+            page.forEach(img => {
+                const item = index.items[img.dataset.thumbId];
+                if (!item) {
+                    img.onerror();
+                    return;
+                }
+                const blob = new Blob([new Uint8Array(buffer, dataStart + item[0], item[1])], { type: 'image/jpeg' });
+                const url = URL.createObjectURL(blob);
+                thumbnailUrls.push(url);
+                img.src = url;
+            });
+        } catch (error) {
+            console.error('加载缩略图失败:', error);
+            page.forEach(img => img.onerror());
+        }
+    }
+}
+
 /**
  * 获取当前视图
  */
@@ -190,7 +241,8 @@ window.gridView = {
     switch: switchView,
     getCurrent: getCurrentView,
     renderGridItem: renderGridItem,
-    renderListItem: renderListItem
+    renderListItem: renderListItem,
+    loadThumbnails: loadGridThumbnails
 };
 
 
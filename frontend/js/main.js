@@ -7,7 +7,9 @@ const state = {
     currentView: 'all',
     currentFolder: null,
     files: [],
-    selectedFile: null
+    selectedFile: null,
+    stats: null,
+    shareCount: 0
 };
 
 // 初始化
@@ -18,38 +20,109 @@ document.addEventListener('DOMContentLoaded', () => {
         return;
     }
     
-    // 加载用户信息
-    loadUserInfo();
-    
-    // 加载文件列表
-    loadFiles();
+    // 用户信息和根目录列表一次请求加载
+    loadBootstrap();
     
     // 初始化事件监听
     initEventListeners();
+    
+    // 订阅文件变更推送
+    connectChangeStream();
 });
 
+/**
+ * 订阅文件变更推送（其他设备或标签页的修改实时刷新列表）
+ */
+function connectChangeStream(retryDelay = 1000) {
+    const socket = new WebSocket(`${WS_BASE_URL}/changes?token=${encodeURIComponent(utils.getToken())}`);
+    let refreshTimer = null;
+    
+    socket.onopen = () => {
+        retryDelay = 1000;
+    };
+    
+    socket.onmessage = (event) => {
+        const message = JSON.parse(event.data);
+        if (message.type !== 'changes') return;
+        
+        // 事件格式: [游标, 文件ID, 操作, 父文件夹ID, 设备ID, 原父文件夹ID]
+        // 移出当前文件夹的条目，父文件夹ID已是目标文件夹，需要按原父文件夹判断
+        const affected = message.events.some(([, fileId, action, parentId, , fromParentId]) =>
+            parentId === state.currentFolder || fileId === state.currentFolder
+            || (action === 'moved' && fromParentId === state.currentFolder)
+        );
+        
+        // 分类视图不按文件夹列出，任何变更都可能影响
+        if (affected || state.currentView !== 'all') {
+            clearTimeout(refreshTimer);
+            refreshTimer = setTimeout(() => {
+                refreshFiles();
+                loadUserInfo();
+            }, 300);
+        }
+    };
+    
+    socket.onclose = (event) => {
+        // 4401: 未登录或token已失效，不再重连
+        if (event.code === 4401) return;
+        setTimeout(() => connectChangeStream(Math.min(retryDelay * 2, 30000)), retryDelay);
+    };
+}
+
+/**
+ * 首屏加载：用户信息、统计、根目录第一页和分享数由一个请求返回
+ */
+async function loadBootstrap() {
+    const userInfo = utils.getUserInfo();
+    if (userInfo) {
+        applyUserInfo(userInfo);
+    }
+    
+    let data;
+    try {
+        data = await utils.apiRequest('/bootstrap');
+    } catch (error) {
+        console.error('首屏加载失败，改为分别请求:', error);
+        loadUserInfo();
+        loadFiles();
+        return;
+    }
+    if (!data) return;
+    
+    applyUserInfo(data.user);
+    state.stats = data.stats;
+    state.shareCount = data.shares.active;
+    
+    if (data.files.has_more) {
+        // 根目录条目较多，首屏数据只包含第一页
+        loadFiles();
+        return;
+    }
+    state.files = data.files.files;
+    state.currentFolder = null;
+    renderFiles(data.files.files);
+}
+
+/**
+ * 显示并缓存用户信息
+ */
+function applyUserInfo(data) {
+    document.getElementById('username').textContent = data.username;
+    updateStorageInfo(data.used_space, data.quota);
+    
+    const storage = localStorage.getItem('access_token') ? localStorage : sessionStorage;
+    storage.setItem('user_info', JSON.stringify(data));
+}
+
 /**
  * 加载用户信息
  */
 async function loadUserInfo() {
     try {
-        const userInfo = utils.getUserInfo();
-        
-        if (userInfo) {
-            document.getElementById('username').textContent = userInfo.username;
-            updateStorageInfo(userInfo.used_space, userInfo.quota);
-        }
-        
-        // 从服务器更新用户信息
         const data = await utils.apiRequest('/auth/me');
         
         if (data) {
-            document.getElementById('username').textContent = data.username;
-            updateStorageInfo(data.used_space, data.quota);
-            
-            // 更新本地存储
-            const storage = localStorage.getItem('access_token') ? localStorage : sessionStorage;
-            storage.setItem('user_info', JSON.stringify(data));
+            applyUserInfo(data);
         }
     } catch (error) {
         console.error('加载用户信息失败:', error);
@@ -123,6 +196,7 @@ function renderFiles(files) {
     if (currentView === 'grid') {
         // 网格视图
         fileItems.innerHTML = files.map(file => window.gridView.renderGridItem(file)).join('');
+        window.gridView.loadThumbnails();
     } else {
         // 列表视图
         fileItems.innerHTML = files.map(file => window.gridView ? window.gridView.renderListItem(file) : renderListItemFallback(file)).join('');
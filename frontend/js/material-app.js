@@ -14,8 +14,7 @@ function initMaterialApp() {
     initUserMenu();
     initViewToggle();
     initFileSelection();
-    loadUserInfo();
-    loadFiles();
+    // 用户信息和文件列表由main.js的首屏请求（/api/bootstrap）加载，这里不再重复请求
 }
 
 // ==================== Theme System ====================
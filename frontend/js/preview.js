@@ -2,6 +2,22 @@
  * 文件预览模块
  */
 
+/**
+ * 获取文档已生成的预览页面（失败时返回空列表，按原方式预览）
+ */
+async function loadDocumentPages(fileId) {
+    try {
+        const response = await fetch(`${API_BASE_URL}/files/${fileId}/pages`, {
+            headers: { 'Authorization': `Bearer ${utils.getToken()}` }
+        });
+        if (!response.ok) return [];
+        const data = await response.json();
+        return data.pages;
+    } catch (error) {
+        return [];
+    }
+}
+
 /**
  * 预览文件
  */
@@ -25,11 +41,19 @@ async function previewFile(fileId) {
     const downloadUrl = `${API_BASE_URL}/files/download/${fileId}?token=${token}`;
     
     try {
+        const pages = DOCUMENT_PAGE_TYPES.includes(ext) ? await loadDocumentPages(fileId) : [];
+        
         // 图片预览
         if (PREVIEW_TYPES.image.includes(ext)) {
+            // 按预览区域大小请求缩放后的图片（服务器按EXIF方向旋转并缓存），不下载原图
+            const ratio = window.devicePixelRatio || 1;
+            const width = Math.round(window.innerWidth * ratio);
+            const height = Math.round(window.innerHeight * 0.7 * ratio);
+            const imageUrl = `${API_BASE_URL}/files/${fileId}/resize?w=${width}&h=${height}&token=${token}`;
             content.innerHTML = `
                 <div class="preview-image">
-                    <img src="${previewUrl}" alt="${file.filename}" 
+                    <img src="${imageUrl}" alt="${file.filename}" 
+                         onerror="this.onerror = null; this.src = '${previewUrl}';"
                          style="max-width: 100%; max-height: 70vh; display: block; margin: 0 auto;">
                 </div>
                 <div class="preview-actions" style="margin-top: 20px; text-align: center;">
@@ -43,8 +67,8 @@ async function previewFile(fileId) {
         else if (PREVIEW_TYPES.video.includes(ext)) {
             content.innerHTML = `
                 <div class="preview-video">
-                    <video controls style="max-width: 100%; max-height: 70vh; display: block; margin: 0 auto;">
-                        <source src="${downloadUrl}" type="${file.mime_type}">
+                    <video controls preload="metadata" poster="${previewUrl}&poster=true" style="max-width: 100%; max-height: 70vh; display: block; margin: 0 auto;">
+                        <source src="${previewUrl}" type="${file.mime_type}">
                         您的浏览器不支持视频播放。
                     </video>
                 </div>
@@ -73,6 +97,24 @@ async function previewFile(fileId) {
                 </div>
             `;
         }
+        // 文档页面预览（后台已生成前几页的图片，不需要下载整个文档）
+        else if (pages.length > 0) {
+            const pageImages = pages.map(page => `
+                <img src="${API_BASE_URL}/files/preview/${fileId}?page=${page.page}&token=${token}" 
+                     alt="第${page.page}页" loading="lazy"
+                     style="max-width: 100%; display: block; margin: 0 auto 16px; box-shadow: 0 1px 4px rgba(0,0,0,0.2);">
+            `).join('');
+            content.innerHTML = `
+                <div class="preview-document" style="max-height: 70vh; overflow-y: auto; padding: 10px;">
+                    ${pageImages}
+                </div>
+                <div class="preview-actions" style="margin-top: 20px; text-align: center;">
+                    <button class="btn btn-primary" onclick="window.open('${downloadUrl}', '_blank')">
+                        <i class="fas fa-download"></i> 打开完整文档
+                    </button>
+                </div>
+            `;
+        }
         // PDF预览
         else if (ext === '.pdf') {
             content.innerHTML = `
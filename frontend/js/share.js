@@ -110,6 +110,18 @@ function renderShareInfo() {
     
     html += `</div>`;
     
+    // 预览图片（文档前几页或图片，需要提取码的分享不显示）
+    if (shareInfo.preview_pages > 0 && !shareInfo.need_extract_code) {
+        html += `<div class="share-preview">`;
+        for (let page = 1; page <= shareInfo.preview_pages; page++) {
+            html += `
+                <img src="${API_BASE_URL}/shares/preview/${shareCode}?page=${page}" 
+                     alt="第${page}页" loading="lazy" onerror="this.remove()">
+            `;
+        }
+        html += `</div>`;
+    }
+    
     // 如果需要提取码
     if (shareInfo.need_extract_code) {
         html += `
@@ -1,26 +1,23 @@
 #!/bin/bash
 #
 # RaspberryCloud 备份脚本
-# 备份数据库和用户文件
+# 调用后端增量备份引擎（backend/backup.py）：
+# - 数据库使用SQLite在线备份API生成一致性快照
+# - 用户文件按内容哈希去重存储，每次只复制新增或变化的文件
+# - 快照保留数量由 BACKUP_KEEP_SNAPSHOTS 配置（默认7个）
+#
+# 用法：
+#   ./backup.sh                      # 执行一次备份
+#   ./backup.sh list                 # 列出快照
+#   ./backup.sh restore <快照ID>     # 还原（请先停止服务）
 #
 
 set -e
 
 # 配置
-# 自动检测存储路径（优先SD卡，如果不存在则使用外接硬盘）
-if [ -d "/opt/raspberrycloud/storage" ]; then
-    # SD卡存储方案
-    BACKUP_DIR="/opt/raspberrycloud/storage/backups"
-    DATA_DIR="/opt/raspberrycloud/storage/users"
-else
-    # 外接硬盘存储方案
-    BACKUP_DIR="/mnt/cloud_storage/backups"
-    DATA_DIR="/mnt/cloud_storage/users"
-fi
-
-DB_PATH="/opt/raspberrycloud/backend/raspberrycloud.db"
-DATE=$(date +%Y%m%d_%H%M%S)
-KEEP_DAYS=7  # 保留最近7天的备份
+APP_DIR="/opt/raspberrycloud"
+BACKEND_DIR="$APP_DIR/backend"
+PYTHON="$APP_DIR/venv/bin/python"
 
 # 颜色输出
 GREEN='\033[0;32m'
@@ -30,33 +27,16 @@ print_info() {
     echo -e "${GREEN}[INFO]${NC} $1"
 }
 
-# 创建备份目录
-mkdir -p "$BACKUP_DIR"
-
-print_info "开始备份..."
-
-# 备份数据库
-if [ -f "$DB_PATH" ]; then
-    print_info "备份数据库..."
-    DB_BACKUP="$BACKUP_DIR/database_$DATE.db"
-    cp "$DB_PATH" "$DB_BACKUP"
-    gzip "$DB_BACKUP"
-    print_info "数据库备份完成: ${DB_BACKUP}.gz"
+if [ ! -x "$PYTHON" ]; then
+    PYTHON="python3"
 fi
 
-# 备份用户文件（增量备份）
-if [ -d "$DATA_DIR" ]; then
-    print_info "备份用户文件..."
-    DATA_BACKUP="$BACKUP_DIR/userdata_$DATE.tar.gz"
-    tar -czf "$DATA_BACKUP" -C "$(dirname $DATA_DIR)" "$(basename $DATA_DIR)"
-    print_info "用户文件备份完成: $DATA_BACKUP"
-fi
-
-# 清理旧备份
-print_info "清理${KEEP_DAYS}天前的旧备份..."
-find "$BACKUP_DIR" -name "database_*.gz" -mtime +$KEEP_DAYS -delete
-find "$BACKUP_DIR" -name "userdata_*.tar.gz" -mtime +$KEEP_DAYS -delete
-
-print_info "备份完成！"
-
+cd "$BACKEND_DIR"
 
+if [ $# -eq 0 ]; then
+    print_info "开始增量备份..."
+    "$PYTHON" backup.py run
+    print_info "备份完成！"
+else
+    "$PYTHON" backup.py "$@"
+fi
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+文件列表序列化性能对比
+在临时SQLite数据库中创建一个包含大量文件的文件夹，对比：
+- 旧路径: 查询完整File对象，逐行构造字典并调用isoformat()，再经FastAPI的jsonable_encoder和json编码
+- 新路径: 只查询需要的列（元组），orjson编码（未安装时为标准库json）
+
+用法: python3 scripts/benchmark_listing.py [文件数] [重复次数]
+"""
+
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+# 使用临时数据库，不影响实际数据
+_workdir = tempfile.mkdtemp(prefix="benchmark-listing-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_workdir}/benchmark.db"
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from datetime import datetime, timedelta
+
+from fastapi.encoders import jsonable_encoder
+
+from models import Base, engine, SessionLocal, User, File
+from file_handler import FileService
+from listing import DEFAULT_FIELDS, orjson, render_listing
+
+
+def create_files(db, count: int) -> User:
+    """创建测试用户和一个包含count个文件的根目录"""
+    user = User(username="benchmark", hashed_password="-", quota=1 << 50)
+    db.add(user)
+    db.flush()
+    
+    now = datetime.utcnow()
+    categories = ["image", "video", "audio", "document", "other"]
+    db.bulk_insert_mappings(File, [
+        {
+            "filename": f"照片_{i:06d}.jpg",
+            "original_filename": f"IMG_{i:06d}.JPG",
+            "file_path": f"/storage/benchmark/照片_{i:06d}.jpg",
+            "size": 1024 * (i + 1),
+            "mime_type": "image/jpeg",
+            "category": categories[i % len(categories)],
+            "md5_hash": f"{i:032x}",
+            "is_folder": i < count // 50,
+            "owner_id": user.id,
+            "created_at": now - timedelta(seconds=i),
+            "updated_at": now - timedelta(seconds=i),
+        }
+        for i in range(count)
+    ])
+    db.commit()
+    return user
+
+
+def legacy_listing(db, user) -> bytes:
+    """修改前的 /api/files/list 实现"""
+    files = FileService(db).list_files(user)
+    data = {
+        "files": [
+            {
+                "id": f.id,
+                "filename": f.filename,
+                "original_filename": f.original_filename,
+                "size": f.size,
+                "category": f.category,
+                "is_folder": f.is_folder,
+                "mime_type": f.mime_type,
+                "created_at": f.created_at.isoformat(),
+                "updated_at": f.updated_at.isoformat()
+            }
+            for f in files
+        ]
+    }
+    return json.dumps(jsonable_encoder(data), ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def measure(label: str, func, repeat: int, baseline: float = None) -> float:
+    timings = []
+    size = 0
+    for _ in range(repeat):
+        db = SessionLocal()
+        try:
+            start = time.perf_counter()
+            size = len(func(db))
+            timings.append((time.perf_counter() - start) * 1000)
+        finally:
+            db.close()
+    median = statistics.median(timings)
+    speedup = f"  x{baseline / median:.1f}" if baseline else ""
+    print(f"{label:<36} {median:>9.1f} ms {size / 1024:>9.0f} KB{speedup}")
+    return median
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    user = create_files(db, count)
+    user_id = user.id
+    db.close()
+    
+    def new_listing(fields, format="objects"):
+        def run(db):
+            query = FileService(db).list_query(db.get(User, user_id))
+            return render_listing(query, fields, format)
+        return run
+    
+    print(f"文件数: {count}，重复: {repeat}，JSON编码: {'orjson' if orjson else 'json'}")
+    baseline = measure("旧路径（ORM对象 + 逐行字典）", lambda db: legacy_listing(db, db.get(User, user_id)), repeat)
+    measure("新路径 objects", new_listing(DEFAULT_FIELDS), repeat, baseline)
+    measure("新路径 compact", new_listing(DEFAULT_FIELDS, "compact"), repeat, baseline)
+    measure("新路径 fields=id,filename,size", new_listing(["id", "filename", "size"]), repeat, baseline)
+    
+    shutil.rmtree(_workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()